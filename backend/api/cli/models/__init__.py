@@ -11,4 +11,5 @@ from .models import (
     CliChatMessageInstance,
     ChatMessageRequestBody,
     RunLogRequestBody,
+    RunLogScoreRequestBody,
 )
@@ -105,3 +105,7 @@ class RunLogRequestBody(PMObject):
     inputs: Optional[Dict[str, Any]] = None
     parsed_outputs: Optional[Dict[str, Any]] = None
     metadata: Optional[Dict] = None
+
+class RunLogScoreRequestBody(PMObject):
+    run_log_uuid: str
+    scores: Dict[str, float]
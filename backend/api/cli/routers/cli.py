@@ -1,7 +1,8 @@
 """APIs for package management"""
-from uuid import uuid4
+from uuid import uuid4, UUID as UUIDType
+from datetime import datetime, timedelta, timezone
 
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Set, Union
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import Result, select, asc, desc, update
 from sqlalchemy.dialects.postgresql import insert
@@ -25,7 +26,11 @@ from base.websocket_connection import websocket_manager
 from crud import update_instances, pull_instances, save_instances
 from db_models import *
 from modules.types import InstanceType
-from litellm.utils import completion_cost, token_counter
+from modules.cost_engine import completion_cost
+from modules.tokenizer import tokenizer_service
+from modules.eval_metrics import eval_metric_resolver
+from modules.chat_history import load_chat_history, append_chat_history
+from modules.presence import cli_presence
 from ..models import *
 from .unit import router as unit_router
 
@@ -376,6 +381,8 @@ async def fetch_chat_model_version_with_chat_log(
     chat_model_name: str,
     session_uuid: Optional[str] = None,
     version: Optional[Union[str, int]] = "deploy",
+    history_max_messages: Optional[int] = None,
+    history_max_tokens: Optional[int] = None,
     project: dict = Depends(get_project),
     db_session: AsyncSession = Depends(get_session),
 ):
@@ -387,6 +394,8 @@ async def fetch_chat_model_version_with_chat_log(
         - chat_model_name: name of chat_model
         - session_uuid: uuid of session
         - version
+        - history_max_messages: return only the last N chat logs of the session
+        - history_max_tokens: return only the last chat logs within N tokens
 
     Return:
         - Dict
@@ -425,6 +434,7 @@ async def fetch_chat_model_version_with_chat_log(
             )
         ).scalar_one_or_none()
 
+        model = session_chat_model_version.model
         session_chat_model_version = [
             DeployedChatModelVersionInstance(
                 **session_chat_model_version.model_dump()
@@ -432,24 +442,13 @@ async def fetch_chat_model_version_with_chat_log(
         ]
 
         # find chat logs
-        chat_messages = (
-            (
-                await db_session.execute(
-                    select(
-                        ChatMessage.role,
-                        ChatMessage.name,
-                        ChatMessage.content,
-                        ChatMessage.tool_calls,
-                        ChatMessage.function_call,
-                    )
-                    .where(ChatMessage.session_uuid == session_uuid)
-                    .order_by(asc(ChatMessage.created_at))
-                )
-            )
-            .mappings()
-            .all()
+        chat_messages = await load_chat_history(
+            db_session,
+            session_uuid,
+            model,
+            max_messages=history_max_messages,
+            max_tokens=history_max_tokens,
         )
-        chat_messages = [dict(x) for x in chat_messages]
 
         res = {
             "chat_model_versions": session_chat_model_version,
@@ -581,7 +580,7 @@ async def open_websocket(
         #     )  # This is an arbitrary sleep value, adjust as needed.
     except Exception as error:
         logger.error(f"Error in local server websocket for token {token}: {error}")
-        websocket_manager.disconnect(token)
+        await websocket_manager.disconnect(token, websocket)
 
 
 @router.post("/project/cli_connect")
@@ -603,11 +602,15 @@ async def connect_cli_project(
         .all()
     )
 
-    if project[0]["online"] is True:
+    if cli_presence is not None:
+        online = await cli_presence.is_online(project_uuid)
+    else:
+        online = project[0]["online"]
+    if online is True:
         raise HTTPException(
             status_code=status_code.HTTP_403_FORBIDDEN, detail="Already connected"
         )
-    else:
+    elif project[0]["cli_access_key"] != api_key:
         # update project
         res = await session.execute(
             update(Project)
@@ -615,8 +618,8 @@ async def connect_cli_project(
             .values(cli_access_key=api_key)
         )
         await session.commit()
-        # return true, connected
-        return Response(status_code=status_code.HTTP_200_OK)
+    # return true, connected
+    return Response(status_code=status_code.HTTP_200_OK)
 
 
 @router.post("/save_instances_in_code")
@@ -810,132 +813,137 @@ async def save_instances_in_code(
     return Response(status_code=status_code.HTTP_200_OK)
 
 
-@router.post("/run_log_score")
-async def save_run_log_score(
-    run_log_uuid: str,
-    run_log_scores: Dict,
-    project: dict = Depends(get_project),
-    session: AsyncSession = Depends(get_session),
-):
-    try:
-        run_log_to_update: RunLog = (
-            await session.execute(select(RunLog).where(RunLog.uuid == run_log_uuid))
-        ).scalar_one()
+# run logs per statement when saving scores, keeps bind parameters under Postgres' limit
+SCORE_CHUNK_SIZE = 5000
+
 
-    except:
+async def _save_run_log_scores(
+    session: AsyncSession,
+    project: dict,
+    run_log_scores: Dict[str, Dict[str, float]],
+) -> None:
+    """Upsert scores of run logs of the project, creating missing eval metrics.
+
+    Raises 404 if any run log isn't found in the project.
+    """
+    invalid = []
+    for run_log_uuid in list(run_log_scores.keys()):
+        try:
+            # in the form of uuids returned by the DB
+            normalized = str(UUIDType(run_log_uuid))
+        except ValueError:
+            invalid.append(run_log_uuid)
+            continue
+        if normalized != run_log_uuid:
+            run_log_scores.setdefault(normalized, {}).update(
+                run_log_scores.pop(run_log_uuid)
+            )
+    if invalid:
         raise HTTPException(
             status_code=status_code.HTTP_404_NOT_FOUND,
-            detail=f"RunLog Not found for uuid {run_log_uuid}",
+            detail=f"RunLog Not found for uuid {', '.join(invalid[:10])}",
         )
 
-    # update run_log_score in original_value
-    score_name_list = list(run_log_scores.keys())
-    function_model_of_run_log: FunctionModel = (
-        await session.execute(
-            select(FunctionModel)
-            .join(
-                FunctionModelVersion,
-                FunctionModelVersion.function_model_uuid == FunctionModel.uuid,
-            )
-            .where(FunctionModelVersion.uuid == run_log_to_update.version_uuid)
-        )
-    ).scalar_one()
-    try:
-        score_list_in_db: List[EvalMetric] = (
-            (
-                await session.execute(
-                    select(EvalMetric).where(
-                        EvalMetric.function_model_uuid == function_model_of_run_log.uuid
-                    )
+    function_model_of_run_log: Dict[str, UUIDType] = {}
+    run_log_uuids = list(run_log_scores.keys())
+    for start in range(0, len(run_log_uuids), SCORE_CHUNK_SIZE):
+        rows = (
+            await session.execute(
+                select(RunLog.uuid, FunctionModelVersion.function_model_uuid)
+                .join(
+                    FunctionModelVersion,
+                    FunctionModelVersion.uuid == RunLog.version_uuid,
                 )
-            )
-            .scalars()
-            .all()
-        )
-        score_name_list_in_db = [x.name for x in score_list_in_db]
-        # find score_name_list not in db
-        score_name_list_to_add = list(set(score_name_list) - set(score_name_list_in_db))
-        eval_metric_to_add = [
-            EvalMetric(
-                name=x,
-                project_uuid=project["uuid"],
-                function_model_uuid=function_model_of_run_log.uuid,
-            )
-            for x in score_name_list_to_add
-        ]
-        if len(eval_metric_to_add) > 0:
-            session.add_all(eval_metric_to_add)
-            await session.commit()
-    except:
-        score_list_in_db: List[EvalMetric] = (
-            (
-                await session.execute(
-                    select(EvalMetric).where(
-                        EvalMetric.function_model_uuid == function_model_of_run_log.uuid
-                    )
+                .join(
+                    FunctionModel,
+                    FunctionModel.uuid == FunctionModelVersion.function_model_uuid,
+                )
+                .where(FunctionModel.project_uuid == project["uuid"])
+                .where(
+                    RunLog.uuid.in_(run_log_uuids[start : start + SCORE_CHUNK_SIZE])
                 )
             )
-            .scalars()
-            .all()
-        )
-        score_name_list_in_db = [x.name for x in score_list_in_db]
-        # find score_name_list not in db
-        score_name_list_to_add = list(set(score_name_list) - set(score_name_list_in_db))
-        eval_metric_to_add = [
-            EvalMetric(
-                name=x,
-                project_uuid=project["uuid"],
-                function_model_uuid=function_model_of_run_log.uuid,
-            )
-            for x in score_name_list_to_add
-        ]
-        if len(eval_metric_to_add) > 0:
-            session.add_all(eval_metric_to_add)
-            await session.commit()
-            
-    eval_metric_to_use: List[EvalMetric] = (
-        (
-            await session.execute(
-                select(EvalMetric)
-                .where(EvalMetric.function_model_uuid == function_model_of_run_log.uuid)
-                .where(EvalMetric.name.in_(score_name_list))
-            )
+        ).all()
+        function_model_of_run_log.update(
+            {
+                str(run_log_uuid): function_model_uuid
+                for run_log_uuid, function_model_uuid in rows
+            }
         )
-        .scalars()
-        .all()
-    )
 
-    eval_metric_dict = {x.name: x.uuid for x in eval_metric_to_use}
+    missing = [uuid for uuid in run_log_uuids if uuid not in function_model_of_run_log]
+    if missing:
+        raise HTTPException(
+            status_code=status_code.HTTP_404_NOT_FOUND,
+            detail=f"RunLog Not found for uuid {', '.join(missing[:10])}",
+        )
 
-    scores_to_add: List[RunLogScore] = []
-    for key, value in run_log_scores.items():
-        scores_to_add.append(
-            RunLogScore(
-                run_log_uuid=run_log_uuid,
-                eval_metric_uuid=eval_metric_dict[key],
-                value=value,
-            )
+    metric_names: Dict[UUIDType, Set[str]] = {}
+    for run_log_uuid, scores in run_log_scores.items():
+        metric_names.setdefault(function_model_of_run_log[run_log_uuid], set()).update(
+            scores.keys()
         )
+    eval_metrics = await eval_metric_resolver.resolve(
+        session, project["uuid"], metric_names
+    )
 
-    for score in scores_to_add:
-        (
-            await session.execute(
-                insert(RunLogScore)
-                .values(
-                    run_log_uuid=score.run_log_uuid,
-                    eval_metric_uuid=score.eval_metric_uuid,
-                    value=score.value,
-                )
-                .on_conflict_do_update(  # if conflict, append
-                    index_elements=[
-                        RunLogScore.run_log_uuid,
-                        RunLogScore.eval_metric_uuid,
-                    ],
-                    set_={"value": score.value},
-                )
+    score_rows = [
+        {
+            "run_log_uuid": run_log_uuid,
+            "eval_metric_uuid": eval_metrics[
+                (function_model_of_run_log[run_log_uuid], name)
+            ],
+            "value": value,
+        }
+        for run_log_uuid, scores in run_log_scores.items()
+        for name, value in scores.items()
+    ]
+    for start in range(0, len(score_rows), SCORE_CHUNK_SIZE):
+        statement = insert(RunLogScore).values(
+            score_rows[start : start + SCORE_CHUNK_SIZE]
+        )
+        await session.execute(
+            statement.on_conflict_do_update(  # if conflict, overwrite
+                index_elements=[
+                    RunLogScore.run_log_uuid,
+                    RunLogScore.eval_metric_uuid,
+                ],
+                set_={"value": statement.excluded.value},
             )
         )
 
+
+@router.post("/run_log_score")
+async def save_run_log_score(
+    run_log_uuid: str,
+    run_log_scores: Dict,
+    project: dict = Depends(get_project),
+    session: AsyncSession = Depends(get_session),
+):
+    await _save_run_log_scores(session, project, {run_log_uuid: run_log_scores})
+    await session.commit()
+
+    return Response(status_code=status_code.HTTP_200_OK)
+
+
+@router.post("/run_log_scores")
+async def save_run_log_scores(
+    run_log_scores_body: List[RunLogScoreRequestBody],
+    project: dict = Depends(get_project),
+    session: AsyncSession = Depends(get_session),
+):
+    """Save scores of many run logs at once.
+
+    Input:
+        - run_log_scores_body: List of {run_log_uuid, scores: {metric name: value}}.
+            Scores of a run log listed twice are merged, later values win.
+    """
+    run_log_scores: Dict[str, Dict[str, float]] = {}
+    for run_log_score in run_log_scores_body:
+        run_log_scores.setdefault(run_log_score.run_log_uuid, {}).update(
+            run_log_score.scores
+        )
+    await _save_run_log_scores(session, project, run_log_scores)
     await session.commit()
 
     return Response(status_code=status_code.HTTP_200_OK)
@@ -1014,114 +1022,139 @@ async def save_chat_log(
             status_code=status_code.HTTP_400_BAD_REQUEST, detail="session_uuid or version_uuid required"
         )
 
-    # check session
-    session: Optional[ChatSession] = (
+    # check session & find its model
+    session_version = (
         await db_session.execute(
-            select(ChatSession).where(ChatSession.uuid == session_uuid)
+            select(ChatSession.version_uuid, ChatModelVersion.model)
+            .join(ChatModelVersion, ChatModelVersion.uuid == ChatSession.version_uuid)
+            .where(ChatSession.uuid == session_uuid)
         )
-    ).scalar_one_or_none()
+    ).one_or_none()
 
-    if not session:
-        # create session
-        print("CREATE_NEW_SESSION")
+    if session_version:
+        model: str = session_version.model
+    else:
         if not version_uuid:
             raise HTTPException(
                 status_code=status_code.HTTP_400_BAD_REQUEST,
                 detail="If you want to create session with new UUID, version_uuid required",
             )
-        # create session
-        db_session.add(
-            ChatSession(
+        model: Optional[str] = (
+            await db_session.execute(
+                select(ChatModelVersion.model).where(ChatModelVersion.uuid == version_uuid)
+            )
+        ).scalar_one_or_none()
+        if model is None:
+            raise HTTPException(
+                status_code=status_code.HTTP_404_NOT_FOUND,
+                detail="Chat Model Version not found",
+            )
+        # create session, committed with the messages
+        await db_session.execute(
+            insert(ChatSession).values(
                 uuid=session_uuid,
                 version_uuid=version_uuid,
                 run_from_deployment=True,
             )
         )
-        await db_session.commit()
-        await db_session.refresh(session)
 
-    version_uuid = session.version_uuid
-    model: str = (
-        await db_session.execute(
-            select(ChatModelVersion.model).where(ChatModelVersion.uuid == version_uuid)
-        )
-    ).scalar_one()
+    token_counts = await tokenizer_service.count_tokens_batch(
+        model,
+        [
+            chat_message_request.message.get("content")
+            for chat_message_request in chat_message_requests_body
+        ],
+    )
 
     # make ChatMessage
-    messages: List[ChatMessage] = []
-    for chat_message_request in chat_message_requests_body:
+    messages: List[Dict[str, Any]] = []
+    created_at = datetime.now(timezone.utc)
+    for index, (chat_message_request, token_count) in enumerate(
+        zip(chat_message_requests_body, token_counts)
+    ):
         token_usage = {}
         latency = 0
-        token_count = token_counter(model, chat_message_request.message["content"])
         cost = None
         token_usage = None
         latency = None
 
         if chat_message_request.api_response:
-            cost = completion_cost(chat_message_request.api_response)
-            token_usage = (
-                chat_message_request.api_response["usage"]
-                if "usage" in chat_message_request.api_response
-                else None
-            )
+            api_response = chat_message_request.api_response
+            if not isinstance(api_response, dict):
+                api_response = api_response.model_dump()
+            cost = completion_cost(api_response)
+            token_usage = api_response["usage"] if "usage" in api_response else None
             latency = (
-                chat_message_request.api_response["_response_ms"]
-                if "_response_ms" in chat_message_request.api_response
-                else None
+                api_response["_response_ms"]
+                if "_response_ms" in api_response
+                else api_response.get("response_ms")
             )
 
         messages.append(
-            ChatMessage(
-                **{
-                    "uuid": chat_message_request.uuid,
-                    "session_uuid": session_uuid,
-                    "role": chat_message_request.message["role"],
-                    "content": chat_message_request.message["content"],
-                    "name": chat_message_request.message["name"]
-                    if "name" in chat_message_request.message
-                    else None,
-                    "function_call": chat_message_request.message["function_call"]
-                    if "function_call" in chat_message_request.message
-                    else None,
-                    "tool_calls": chat_message_request.message["tool_calls"]
-                    if "tool_calls" in chat_message_request.message
-                    else None,
-                    "chat_message_metadata": chat_message_request.metadata,
-                    "token_count": token_count,
-                }
-            )
+            {
+                "uuid": chat_message_request.uuid,
+                # keep the order of messages saved in one transaction
+                "created_at": created_at + timedelta(microseconds=index),
+                "session_uuid": session_uuid,
+                "role": chat_message_request.message["role"],
+                "content": chat_message_request.message["content"],
+                "name": chat_message_request.message["name"]
+                if "name" in chat_message_request.message
+                else None,
+                "function_call": chat_message_request.message["function_call"]
+                if "function_call" in chat_message_request.message
+                else None,
+                "tool_calls": chat_message_request.message["tool_calls"]
+                if "tool_calls" in chat_message_request.message
+                else None,
+                "chat_message_metadata": chat_message_request.metadata,
+                "token_count": token_count,
+            }
         )
 
-    db_session.add_all(messages)
+    # all messages in one statement, before the chat log referencing them
+    await db_session.execute(insert(ChatMessage).values(messages))
 
-    # get latest chat_message
+    # get latest user (or function) message, from the request if it has one
     if chat_message_requests_body[-1].message["role"] == "assistant":
-        latest_chat_message = (
-            await db_session.execute(
-                select(ChatMessage)
-                .where(ChatMessage.session_uuid == session_uuid)
-                .where(ChatMessage.role.in_(["user", "function"]))
-                .order_by(desc(ChatMessage.created_at))
-                .limit(1)
-            )
-        ).scalar_one()
+        user_message_uuid = next(
+            (
+                chat_message_request.uuid
+                for chat_message_request in reversed(chat_message_requests_body[:-1])
+                if chat_message_request.message["role"] in ["user", "function"]
+            ),
+            None,
+        )
+        if user_message_uuid is None:
+            user_message_uuid = (
+                await db_session.execute(
+                    select(ChatMessage.uuid)
+                    .where(ChatMessage.session_uuid == session_uuid)
+                    .where(ChatMessage.role.in_(["user", "function"]))
+                    .order_by(desc(ChatMessage.created_at))
+                    .limit(1)
+                )
+            ).scalar_one()
 
         # save log
-        chat_log = ChatLog(
-            user_message_uuid=latest_chat_message.uuid,
-            assistant_message_uuid=chat_message_requests_body[-1].uuid,
-            session_uuid=session_uuid,
-            project_uuid=project["uuid"],
-            prompt_tokens=token_usage["prompt_tokens"],
-            completion_tokens=token_usage["completion_tokens"],
-            total_tokens=token_usage["total_tokens"],
-            latency=latency,
-            cost=cost,
+        await db_session.execute(
+            insert(ChatLog).values(
+                user_message_uuid=user_message_uuid,
+                assistant_message_uuid=chat_message_requests_body[-1].uuid,
+                session_uuid=session_uuid,
+                project_uuid=project["uuid"],
+                prompt_tokens=token_usage["prompt_tokens"] if token_usage else None,
+                completion_tokens=token_usage["completion_tokens"]
+                if token_usage
+                else None,
+                total_tokens=token_usage["total_tokens"] if token_usage else None,
+                latency=latency,
+                cost=cost,
+            )
         )
-        await db_session.flush()
-        db_session.add(chat_log)
 
     await db_session.commit()
+    await append_chat_history(session_uuid, messages)
     return Response(status_code=status_code.HTTP_200_OK)
 
 
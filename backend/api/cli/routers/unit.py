@@ -1,10 +1,11 @@
 """APIs for Unit Logging"""
 from uuid import uuid4
 
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Set, Union
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import Result, select, asc, desc, update
 from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 
 from fastapi import (
     APIRouter,
@@ -25,6 +26,8 @@ from base.websocket_connection import websocket_manager
 from crud import update_instances, pull_instances, save_instances
 from db_models import *
 from modules.types import InstanceType
+from modules.eval_metrics import eval_metric_resolver
+from modules.unit_versions import unit_version_resolver
 from litellm.utils import completion_cost, token_counter
 from ..models import *
 from api.common.models.unit import (
@@ -33,119 +36,238 @@ from api.common.models.unit import (
     CreateUnitLogResponse,
     ConnectUnitLogRunLogBody,
     ScoreUnitLogBody,
+    UnitLogBatchBody,
+    UnitLogBatchResponse,
 )
 
 router = APIRouter()
 
+# rows per statement of batches, keeps bind parameters under Postgres' limit
+BATCH_CHUNK_SIZE = 5000
+
+
+async def _project_unit_logs(
+    session: AsyncSession, project: dict, unit_log_uuids: List[str]
+) -> Set[str]:
+    """Those of unit_log_uuids that are logs of the project's units."""
+    found: Set[str] = set()
+    for start in range(0, len(unit_log_uuids), BATCH_CHUNK_SIZE):
+        found.update(
+            str(unit_log_uuid)
+            for unit_log_uuid in (
+                await session.scalars(
+                    select(UnitLog.uuid)
+                    .join(UnitVersion, UnitVersion.uuid == UnitLog.version_uuid)
+                    .join(Unit, Unit.uuid == UnitVersion.unit_uuid)
+                    .where(Unit.project_uuid == project["uuid"])
+                    .where(
+                        UnitLog.uuid.in_(unit_log_uuids[start : start + BATCH_CHUNK_SIZE])
+                    )
+                )
+            ).all()
+        )
+    return found
+
+
+async def _check_project_unit_logs(
+    session: AsyncSession,
+    project: dict,
+    unit_log_uuids: Set[str],
+    created: Optional[Set[str]],
+) -> None:
+    """Raises 404 if a unit log doesn't exist or isn't of the project. Logs created by the
+    same request (created) aren't looked up."""
+    unit_log_uuids = list(unit_log_uuids - (created or set()))
+    if not unit_log_uuids:
+        return
+    found = await _project_unit_logs(session, project, unit_log_uuids)
+    missing = [uuid for uuid in unit_log_uuids if uuid not in found]
+    if missing:
+        raise HTTPException(
+            status_code=status_code.HTTP_404_NOT_FOUND,
+            detail=f"UnitLog Not found for uuid {', '.join(missing[:10])}",
+        )
+
+
+async def _create_unit_logs(
+    session: AsyncSession, project: dict, logs: List[CreateUnitLogBody]
+) -> List[CreateUnitLogResponse]:
+    """Insert unit logs, creating missing units & versions.
+
+    Logs are inserted ON CONFLICT DO NOTHING, so retrying a log with the same
+    client-generated uuid doesn't duplicate it. Raises 409 if the uuid is of a log of
+    another project.
+    """
+    versions = await unit_version_resolver.resolve(
+        session, project["uuid"], [(log.name, log.version) for log in logs]
+    )
+    rows = [
+        {
+            "uuid": str(log.log_uuid or uuid4()),
+            "version_uuid": versions[(log.name, log.version)],
+        }
+        for log in logs
+    ]
+    inserted: Set[str] = set()
+    for start in range(0, len(rows), BATCH_CHUNK_SIZE):
+        inserted.update(
+            str(unit_log_uuid)
+            for unit_log_uuid in (
+                await session.scalars(
+                    insert(UnitLog)
+                    .values(rows[start : start + BATCH_CHUNK_SIZE])
+                    .on_conflict_do_nothing(index_elements=[UnitLog.uuid])
+                    .returning(UnitLog.uuid)
+                )
+            ).all()
+        )
+    existing = [row["uuid"] for row in rows if row["uuid"] not in inserted]
+    if existing:
+        # retried logs are logs of the project
+        conflicting = set(existing) - await _project_unit_logs(session, project, existing)
+        if conflicting:
+            raise HTTPException(
+                status_code=status_code.HTTP_409_CONFLICT,
+                detail=f"UnitLog uuid already used: {', '.join(list(conflicting)[:10])}",
+            )
+    return [
+        CreateUnitLogResponse(
+            name=log.name,
+            version=log.version,
+            version_uuid=str(row["version_uuid"]),
+            log_uuid=row["uuid"],
+        )
+        for log, row in zip(logs, rows)
+    ]
+
+
+async def _connect_unit_logs_run_logs(
+    session: AsyncSession,
+    project: dict,
+    connections: List[ConnectUnitLogRunLogBody],
+    created: Optional[Set[str]] = None,
+) -> None:
+    """Link unit logs to run logs. Raises 404 if a unit log or run log doesn't exist or
+    isn't of the project."""
+    await _check_project_unit_logs(
+        session,
+        project,
+        {str(connection.unit_log_uuid) for connection in connections},
+        created,
+    )
+    run_log_uuids = list({str(connection.run_log_uuid) for connection in connections})
+    found: Set[str] = set()
+    for start in range(0, len(run_log_uuids), BATCH_CHUNK_SIZE):
+        found.update(
+            str(run_log_uuid)
+            for run_log_uuid in (
+                await session.scalars(
+                    select(RunLog.uuid)
+                    .where(RunLog.project_uuid == project["uuid"])
+                    .where(
+                        RunLog.uuid.in_(run_log_uuids[start : start + BATCH_CHUNK_SIZE])
+                    )
+                )
+            ).all()
+        )
+    missing = [uuid for uuid in run_log_uuids if uuid not in found]
+    if missing:
+        raise HTTPException(
+            status_code=status_code.HTTP_404_NOT_FOUND,
+            detail=f"RunLog Not found for uuid {', '.join(missing[:10])}",
+        )
+
+    rows = [
+        {"unit_log_uuid": connection.unit_log_uuid, "run_log_uuid": connection.run_log_uuid}
+        for connection in connections
+    ]
+    try:
+        for start in range(0, len(rows), BATCH_CHUNK_SIZE):
+            await session.execute(
+                insert(UnitLogRunLog)
+                .values(rows[start : start + BATCH_CHUNK_SIZE])
+                .on_conflict_do_nothing(
+                    index_elements=[UnitLogRunLog.unit_log_uuid, UnitLogRunLog.run_log_uuid]
+                )
+            )
+    except IntegrityError as exception:
+        # deleted since they were looked up
+        raise HTTPException(
+            status_code=status_code.HTTP_404_NOT_FOUND,
+            detail=f"UnitLog or RunLog not found: {exception.orig}",
+        ) from exception
+
+
+async def _save_unit_log_scores(
+    session: AsyncSession,
+    project: dict,
+    scores: List[ScoreUnitLogBody],
+    created: Optional[Set[str]] = None,
+) -> None:
+    """Upsert scores of unit logs, creating missing project-level eval metrics.
+
+    Raises 404 if a unit log doesn't exist or isn't of the project.
+    """
+    await _check_project_unit_logs(
+        session, project, {str(score.unit_log_uuid) for score in scores}, created
+    )
+    names = {name for score in scores for name in score.scores.keys()}
+    eval_metrics = await eval_metric_resolver.resolve(
+        session, project["uuid"], {None: names}
+    )
+    # later scores of the same unit log & metric win
+    values = {
+        (score.unit_log_uuid, eval_metrics[(None, name)]): value
+        for score in scores
+        for name, value in score.scores.items()
+    }
+    rows = [
+        {"unit_log_uuid": unit_log_uuid, "eval_metric_uuid": eval_metric_uuid, "value": value}
+        for (unit_log_uuid, eval_metric_uuid), value in values.items()
+    ]
+    try:
+        for start in range(0, len(rows), BATCH_CHUNK_SIZE):
+            statement = insert(UnitLogScore).values(rows[start : start + BATCH_CHUNK_SIZE])
+            await session.execute(
+                statement.on_conflict_do_update(  # if conflict, overwrite
+                    index_elements=[
+                        UnitLogScore.unit_log_uuid,
+                        UnitLogScore.eval_metric_uuid,
+                    ],
+                    set_={"value": statement.excluded.value},
+                )
+            )
+    except IntegrityError as exception:
+        raise HTTPException(
+            status_code=status_code.HTTP_404_NOT_FOUND,
+            detail=f"UnitLog not found: {exception.orig}",
+        ) from exception
+
+
 @router.post("")
 async def create_unit_version(
     body: CreateUnitVersionBody,
     project: dict = Depends(get_project),
     session: AsyncSession = Depends(get_session),
 ):
-    # check if unit with name exists
-    component: Unit = (
-        await session.execute(
-            select(Unit)
-            .where(
-                Unit.project_uuid == project["uuid"]
-            ).where(Unit.name == body.name)
-        )
-    ).scalar_one_or_none()
-    
-    if not component:
-        # create
-        session.add(
-            Unit(
-                name=body.name,
-                project_uuid=project["uuid"],
-            )
-        )
-        await session.commit()
-        await session.refresh(component)
-    
-    # check version exist
-    version: UnitVersion = (
-        await session.execute(
-            select(UnitVersion)
-            .where(
-                UnitVersion.unit_uuid == component.uuid
-            ).where(UnitVersion.version == body.version)
-        )
-    ).scalar_one_or_none()
-    
-    if not version:
-        # create
-        session.add(
-            UnitVersion(
-                version=body.version,
-                unit_uuid=component.uuid,
-            )
-        )
-        await session.commit()
-        await session.refresh(version)
-    
+    await unit_version_resolver.resolve(
+        session, project["uuid"], [(body.name, body.version)]
+    )
+    await session.commit()
+
     return Response(status_code=status_code.HTTP_200_OK)
 
+
 @router.post("/log", response_model=CreateUnitLogResponse)
 async def create_unit_log(
     body: CreateUnitLogBody,
     project: dict = Depends(get_project),
     session: AsyncSession = Depends(get_session),
 ):
-    # check if unit with name exists
-    component: Unit = (
-        await session.execute(
-            select(Unit)
-            .where(
-                Unit.project_uuid == project["uuid"]
-            ).where(Unit.name == body.name)
-        )
-    ).scalar_one_or_none()
-    if not component:
-        # create
-        component = Unit(
-            name=body.name,
-            project_uuid=project["uuid"],
-        )
-        session.add(component)
-        await session.commit()
-        await session.refresh(component)
-    
-    # check version exist
-    version: UnitVersion = (
-        await session.execute(
-            select(UnitVersion)
-            .where(
-                UnitVersion.unit_uuid == component.uuid
-            ).where(UnitVersion.version == body.version)
-        )
-    ).scalar_one_or_none()
-    
-    if not version:
-        # create
-        version = UnitVersion(
-            version=body.version,
-            unit_uuid=component.uuid,
-        )
-        session.add(version)
-        await session.commit()
-        await session.refresh(version)
-
-    # create log
-    log = UnitLog(
-        version_uuid=version.uuid,
-    )
-    session.add(log)
+    (log,) = await _create_unit_logs(session, project, [body])
     await session.commit()
-    await session.refresh(log)
-    
-    return CreateUnitLogResponse(
-        name=body.name,
-        version=body.version,
-        version_uuid=version.uuid,
-        log_uuid=log.uuid,
-    )
+
+    return log
 
 
 @router.post("/connect")
@@ -154,36 +276,9 @@ async def connect_unit_log_run_log(
     project: dict = Depends(get_project),
     session: AsyncSession = Depends(get_session),
 ):
-    unit_log: UnitLog = (
-        await session.execute(
-            select(UnitLog).where(UnitLog.uuid == body.unit_log_uuid)
-        )
-    ).scalar_one_or_none()
-    if not unit_log:
-        raise HTTPException(
-            status_code=status_code.HTTP_404_NOT_FOUND,
-            detail=f"UnitLog not found for uuid {body.unit_log_uuid}",
-        )
-    
-    run_log: RunLog = (
-        await session.execute(
-            select(RunLog).where(RunLog.uuid == body.run_log_uuid)
-        )
-    ).scalar_one_or_none()
-    
-    if not run_log:
-        raise HTTPException(
-            status_code=status_code.HTTP_404_NOT_FOUND,
-            detail=f"RunLog not found for uuid {body.run_log_uuid}",
-        )
-    
-    relationship = UnitLogRunLog(
-        unit_log_uuid=unit_log.uuid,
-        run_log_uuid=run_log.uuid,
-    )
-    session.add(relationship)
+    await _connect_unit_logs_run_logs(session, project, [body])
     await session.commit()
-    
+
     return Response(status_code=status_code.HTTP_200_OK)
 
 
@@ -193,117 +288,29 @@ async def save_unit_log_score(
     project: dict = Depends(get_project),
     session: AsyncSession = Depends(get_session),
 ):
-    unit_log: UnitLog = (
-        await session.execute(
-            select(UnitLog).where(UnitLog.uuid == body.unit_log_uuid)
-        )
-    ).scalar_one_or_none()
-    
-    if not unit_log:
-        raise HTTPException(
-            status_code=status_code.HTTP_404_NOT_FOUND,
-            detail=f"UnitLog not found for uuid {body.unit_log_uuid}",
-        )
-
-    # update run_log_score in original_value
-    score_name_list = list(body.scores.keys())
-
-    try: # try 2 times with try-except because of eval_metric uniqueness constraint
-        score_list_in_db: List[EvalMetric] = (
-            await session.execute(
-                select(EvalMetric)
-                .where(
-                    EvalMetric.project_uuid == project["uuid"]
-                )
-                .where(EvalMetric.function_model_uuid.is_(None))
-                .where(EvalMetric.chat_model_uuid.is_(None))
-            )
-        ).scalars().all()
-        
-        score_name_list_in_db = [x.name for x in score_list_in_db]
-        # find score_name_list not in db
-        eval_metric_to_add = [
-            EvalMetric(
-                name=x,
-                project_uuid=project["uuid"],
-            )
-            for x in score_name_list
-            if x not in score_name_list_in_db
-        ]
-        if len(eval_metric_to_add) > 0:
-            session.add_all(eval_metric_to_add)
-            await session.commit()
-    except:
-        score_list_in_db: List[EvalMetric] = (
-            await session.execute(
-                select(EvalMetric)
-                .where(
-                    EvalMetric.project_uuid == project["uuid"]
-                )
-                .where(EvalMetric.function_model_uuid.is_(None))
-                .where(EvalMetric.chat_model_uuid.is_(None))
-            )
-        ).scalars().all()
-        
-        score_name_list_in_db = [x.name for x in score_list_in_db]
-        # find score_name_list not in db
-        eval_metric_to_add = [
-            EvalMetric(
-                name=x,
-                project_uuid=project["uuid"],
-            )
-            for x in score_name_list
-            if x not in score_name_list_in_db
-        ]
-        if len(eval_metric_to_add) > 0:
-            session.add_all(eval_metric_to_add)
-            await session.commit()
-        
-    eval_metric_to_use: List[EvalMetric] = (
-        (
-            await session.execute(
-                select(EvalMetric)
-                .where(EvalMetric.project_uuid == project["uuid"])
-                .where(EvalMetric.function_model_uuid.is_(None))
-                .where(EvalMetric.chat_model_uuid.is_(None))
-                .where(EvalMetric.name.in_(score_name_list))
-            )
-        )
-        .scalars()
-        .all()
-    )
+    await _save_unit_log_scores(session, project, [body])
+    await session.commit()
 
-    eval_metric_dict = {x.name: x.uuid for x in eval_metric_to_use}
+    return Response(status_code=status_code.HTTP_200_OK)
 
-    scores_to_add: List[UnitLogScore] = []
-    for key, value in body.scores.items():
-        scores_to_add.append(
-            UnitLogScore(
-                unit_log_uuid=body.unit_log_uuid,
-                eval_metric_uuid=eval_metric_dict[key],
-                value=value,
-            )
-        )
 
-    for score in scores_to_add:
-        (
-            await session.execute(
-                insert(UnitLogScore)
-                .values(
-                    unit_log_uuid=score.unit_log_uuid,
-                    eval_metric_uuid=score.eval_metric_uuid,
-                    value=score.value,
-                )
-                .on_conflict_do_update(  # if conflict, append
-                    index_elements=[
-                        UnitLogScore.unit_log_uuid,
-                        UnitLogScore.eval_metric_uuid,
-                    ],
-                    set_={"value": score.value},
-                )
-            )
-        )
+@router.post("/batch", response_model=UnitLogBatchResponse)
+async def save_unit_log_batch(
+    body: UnitLogBatchBody,
+    project: dict = Depends(get_project),
+    session: AsyncSession = Depends(get_session),
+):
+    """Create unit logs, link them to run logs & score them in one request and transaction.
 
+    Logs are created first, so connections & scores can refer to logs of the same batch
+    by their client-generated log_uuid.
+    """
+    logs = await _create_unit_logs(session, project, body.logs) if body.logs else []
+    created = {log.log_uuid for log in logs}
+    if body.connections:
+        await _connect_unit_logs_run_logs(session, project, body.connections, created)
+    if body.scores:
+        await _save_unit_log_scores(session, project, body.scores, created)
     await session.commit()
 
-    return Response(status_code=status_code.HTTP_200_OK)
+    return UnitLogBatchResponse(logs=logs)
@@ -12,6 +12,8 @@ from .unit import (
     CreateUnitLogResponse,
     ConnectUnitLogRunLogBody,
     ScoreUnitLogBody,
+    UnitLogBatchBody,
+    UnitLogBatchResponse,
     UnitInstance,
     UnitVersionInstance,
     UnitLogInstance,
@@ -20,6 +20,7 @@ class FunctionModelRunConfig(PMObject):
     parsing_type: Optional[str] = None
     output_keys: Optional[List[str]] = None
     functions: Optional[List[str]] = None
+    use_cache: Optional[bool] = True  # only used if LLM_RESPONSE_CACHE is enabled
 
 
 class ChatModelRunConfig(PMObject):
@@ -31,9 +32,13 @@ class ChatModelRunConfig(PMObject):
     session_uuid: Optional[str] = None
     version_uuid: Optional[str] = None
     functions: Optional[List[str]] = None
+    # window of the session history sent to the model (whole history if None)
+    history_max_messages: Optional[int] = None
+    history_max_tokens: Optional[int] = None
 
 
 class FunctionModelBatchRunConfig(PMObject):
     project_uuid: str
     function_model_version_uuid: str
     dataset_uuid: str
+    use_cache: Optional[bool] = True  # only used if LLM_RESPONSE_CACHE is enabled
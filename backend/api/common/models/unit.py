@@ -1,6 +1,7 @@
 """API models for Unit"""
 
 from typing import Optional, List, Dict, Any
+from uuid import UUID
 from modules.types import PMObject
 
 class CreateUnitBody(PMObject):
@@ -15,6 +16,7 @@ class CreateUnitVersionBody(PMObject):
 class CreateUnitLogBody(PMObject):
     name: str
     version: int
+    log_uuid: Optional[UUID] = None  # generated by the client, so it needn't wait for the response
     
 class CreateUnitLogResponse(PMObject):
     name: str
@@ -23,13 +25,21 @@ class CreateUnitLogResponse(PMObject):
     log_uuid: str
     
 class ConnectUnitLogRunLogBody(PMObject):
-    unit_log_uuid: str
-    run_log_uuid: str
+    unit_log_uuid: UUID
+    run_log_uuid: UUID
     
 class ScoreUnitLogBody(PMObject):
-    unit_log_uuid: str
+    unit_log_uuid: UUID
     scores: Dict[str, Any]
 
+class UnitLogBatchBody(PMObject):
+    logs: List[CreateUnitLogBody] = []
+    connections: List[ConnectUnitLogRunLogBody] = []
+    scores: List[ScoreUnitLogBody] = []
+
+class UnitLogBatchResponse(PMObject):
+    logs: List[CreateUnitLogResponse]
+
 class UnitInstance(PMObject):
     uuid: str
     name: str
@@ -15,6 +15,7 @@ from utils.logger import logger
 
 from base.database import get_session
 from base.websocket_connection import websocket_manager, LocalTask
+from modules.code_inventory import get_code_inventory
 from modules.websocket.run_model_generators import run_local_function_model_generator
 from .dev_chat import router as chat_router
 from api.common.models import FunctionModelRunConfig
@@ -112,11 +113,12 @@ async def run_function_model(
 
     cli_access_key = project[0]["cli_access_key"]
 
+    # release the DB connection, the generator opens short sessions before and after streaming
+    await session.close()
+
 
     return StreamingResponse(
-        run_local_function_model_generator(
-            session, project[0], cli_access_key, run_config
-        )
+        run_local_function_model_generator(project[0], cli_access_key, run_config)
     )
 
 
@@ -125,15 +127,18 @@ async def run_function_model(
 async def list_function_models(
     jwt: Annotated[str, Depends(get_jwt)],
     project_uuid: str,
+    refresh: bool = False,
     session: AsyncSession = Depends(get_session),
 ):
     """Get list of prompt models in local Code by websocket
     Input:
         - project_uuid : project uuid
+        - refresh : request the local code even if it was synced
 
     Output:
         Response
-            - correlation_id: str
+            - correlation_id: str (requested from the local)
+            - synced_at: str (served from the last SYNC_CODE of the local)
             - function_models: list
                 - used_in_code
                 - is_deployed
@@ -142,6 +147,10 @@ async def list_function_models(
 
     """
     # If the API key in header is valid, this function will execute.
+    if not refresh:
+        inventory = await get_code_inventory(session, project_uuid, "function_models")
+        if inventory is not None:
+            return JSONResponse(inventory, status_code=status_code.HTTP_200_OK)
 
     # Find local server websocket
     project = (
@@ -172,20 +181,22 @@ async def list_function_models(
         raise HTTPException(status_code=status_code.HTTP_500_INTERNAL_SERVER_ERROR)
     return JSONResponse(response, status_code=status_code.HTTP_200_OK)
 
-
 @router.get("/list_functions")
 async def list_functions(
     jwt: Annotated[str, Depends(get_jwt)],
     project_uuid: str,
+    refresh: bool = False,
     session: AsyncSession = Depends(get_session),
 ):
     """Get list of functions in local Code by websocket
     Input:
         - project_uuid : project uuid
+        - refresh : request the local code even if it was synced
 
     Output:
         Response
-            - correlation_id: str
+            - correlation_id: str (requested from the local)
+            - synced_at: str (served from the last SYNC_CODE of the local)
             - function_models: list
                 - used_in_code
                 - is_deployed
@@ -194,6 +205,11 @@ async def list_functions(
 
     """
     # If the API key in header is valid, this function will execute.
+    if not refresh:
+        inventory = await get_code_inventory(session, project_uuid, "functions")
+        if inventory is not None:
+            return JSONResponse(inventory, status_code=status_code.HTTP_200_OK)
+
     # Find local server websocket
     project = (
         (
@@ -15,6 +15,7 @@ from utils.logger import logger
 
 from base.database import get_session
 from base.websocket_connection import websocket_manager, LocalTask
+from modules.code_inventory import get_code_inventory
 from modules.websocket.run_model_generators import (
     run_local_chat_model_generator,
 )
@@ -47,6 +48,8 @@ async def run_chat_model(
             session_uuid: current session uuid (Optional)
             version_uuid: current version uuid (Optional if from_version is provided)
             functions: List of functions (Optional)
+            history_max_messages: send only the last N messages of the session (Optional)
+            history_max_tokens: send only the last messages within N tokens (Optional)
         </ul>
     </ul>
 
@@ -109,9 +112,11 @@ async def run_chat_model(
 
     cli_access_key = project[0]["cli_access_key"]
 
+    # release the DB connection, the generator opens short sessions before and after streaming
+    await session.close()
+
     return StreamingResponse(
         run_local_chat_model_generator(
-            session,
             project[0],
             start_timestampz_iso,
             cli_access_key,
@@ -126,15 +131,18 @@ async def run_chat_model(
 async def list_chat_models(
     jwt: Annotated[str, Depends(get_jwt)],
     project_uuid: str,
+    refresh: bool = False,
     session: AsyncSession = Depends(get_session),
 ):
     """Get list of chat models in local DB by websocket
     Input:
         - project_uuid : project uuid
+        - refresh : request the local code even if it was synced
 
     Output:
         Response
-            - correlation_id: str
+            - correlation_id: str (requested from the local)
+            - synced_at: str (served from the last SYNC_CODE of the local)
             - chat_models: list
                 - used_in_code
                 - is_deployed
@@ -143,6 +151,10 @@ async def list_chat_models(
 
     """
     # If the API key in header is valid, this function will execute.
+    if not refresh:
+        inventory = await get_code_inventory(session, project_uuid, "chat_models")
+        if inventory is not None:
+            return JSONResponse(inventory, status_code=status_code.HTTP_200_OK)
 
     # Find local server websocket
     project = (
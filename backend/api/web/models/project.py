@@ -27,6 +27,10 @@ class ProjectInstance(PMObject):
     
     is_public: Optional[bool] = None
 
+class ProjectPresenceInstance(PMObject):
+    project_uuid: str
+    online: bool
+
 class ProjectDatasetInstance(PMObject):
     dataset_uuid: str
     dataset_name: str
@@ -11,6 +11,7 @@ from utils.logger import logger
 from base.database import get_session
 from utils.security import get_jwt
 from db_models import *
+from modules.presence import apply_cli_presence
 from ..models.chat_model import ChatModelInstance, CreateChatModelBody
 
 router = APIRouter()
@@ -35,7 +36,7 @@ async def fetch_chat_models(
         .scalars()
         .all()
     ]
-    return chat_models
+    return await apply_cli_presence(chat_models)
     
 
 
@@ -7,6 +7,7 @@ from fastapi import APIRouter, Depends
 from utils.security import get_jwt
 from base.database import get_session
 from db_models import *
+from modules.presence import apply_cli_presence
 from ..models.project import ProjectInstance
 from ..models.function_model import PublicOrganizationInstance, PublicFunctionModelInstance
 
@@ -23,7 +24,7 @@ async def get_public_project(
         for project in (await session.execute(query)).scalars().all()
     ]
     
-    return projects
+    return await apply_cli_presence(projects, project_uuid_attribute="uuid")
 
 @router.get("/function_models", response_model=List[PublicFunctionModelInstance])
 async def get_public_function_models(
@@ -59,4 +60,4 @@ async def get_public_function_models(
 
     ]
     
-    return function_models
\ No newline at end of file
+    return await apply_cli_presence(function_models)
\ No newline at end of file
@@ -12,6 +12,7 @@ from utils.logger import logger
 from base.database import get_session
 from utils.security import get_jwt
 from db_models import *
+from modules.presence import apply_cli_presence
 from ..models.function_model import (
     FunctionModelInstance,
     CreateFunctionModelBody,
@@ -40,7 +41,7 @@ async def fetch_function_models(
         .scalars()
         .all()
     ]
-    return function_models
+    return await apply_cli_presence(function_models)
 
 
 @router.post("", response_model=FunctionModelInstance)
@@ -32,39 +32,22 @@ async def fetch_function_model_versions_with_user(
     function_model_uuid: str,
     session: AsyncSession = Depends(get_session),
 ):
-    function_model_versions: List[FunctionModelVersionInstance] = [
-        FunctionModelVersionInstance(**function_model_version.model_dump())
-        for function_model_version in (
+    # Fetch user email & image_url with the versions, in one query
+    function_model_versions_with_user: List[FunctionModelVersionWithUserInstance] = [
+        FunctionModelVersionWithUserInstance(
+            **FunctionModelVersionInstance(
+                **function_model_version.model_dump()
+            ).model_dump(),
+            user=FunctionModelVersionAuthor(email=email, image_url=image_url),
+        )
+        for function_model_version, email, image_url in (
             await session.execute(
-                select(FunctionModelVersion)
+                select(FunctionModelVersion, User.email, User.image_url)
+                .outerjoin(User, User.user_id == FunctionModelVersion.created_by)
                 .where(FunctionModelVersion.function_model_uuid == function_model_uuid)
                 .order_by(asc(FunctionModelVersion.version))
             )
-        )
-        .scalars()
-        .all()
-    ]
-
-    # Fetch user email & image_url, and append it to corresponding version before returning
-    function_model_versions_with_user: List[FunctionModelVersionWithUserInstance] = [
-        FunctionModelVersionWithUserInstance(
-            **function_model_version.model_dump(),
-            user=FunctionModelVersionAuthor(
-                **(
-                    (
-                        await session.execute(
-                            select(User.email, User.image_url).where(
-                                User.user_id == function_model_version.created_by
-                            )
-                        )
-                    )
-                    .mappings()
-                    .one_or_none()
-                    or {}
-                )
-            ),
-        )
-        for function_model_version in function_model_versions
+        ).all()
     ]
 
     return function_model_versions_with_user
@@ -11,6 +11,7 @@ from utils.logger import logger
 from base.database import get_session
 from utils.security import get_jwt
 from db_models import *
+from modules.presence import apply_cli_presence
 from ..models.function_schema import FunctionSchemaInstance
 
 router = APIRouter()
@@ -35,7 +36,7 @@ async def fetch_function_schemas(
         .scalars()
         .all()
     ]
-    return function_schemas
+    return await apply_cli_presence(function_schemas)
 
 
 
@@ -61,5 +62,5 @@ async def fetch_function_schema(
             status_code=status_code.HTTP_404_NOT_FOUND,
             detail="FunctionSchema with given id not found",
         )
-    return FunctionSchemaInstance(**function_schema)
+    return (await apply_cli_presence([FunctionSchemaInstance(**function_schema)]))[0]
 
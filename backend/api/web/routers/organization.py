@@ -16,6 +16,7 @@ from utils.logger import logger
 from base.database import get_session
 from utils.security import get_jwt
 from db_models import *
+from modules.llm_clients import llm_client_pool
 from ..models.organization import (
     OrganizationInstance,
     CreateOrganizationBody,
@@ -203,6 +204,7 @@ async def save_organization_llm_provider_config(
         session.add(provider_config)
 
     await session.commit()
+    llm_client_pool.invalidate(organization_id, body.provider_name)
 
     return Response(status_code=200)
 
@@ -231,5 +233,6 @@ async def delete_organization_llm_api_key(
 
     await session.delete(config)
     await session.commit()
+    llm_client_pool.invalidate(organization_id, provider_name)
 
     return Response(status_code=200)
@@ -12,7 +12,13 @@ from utils.logger import logger
 from utils.security import get_jwt, get_jwt_public
 from base.database import get_session
 from db_models import *
-from ..models.project import ProjectInstance, CreateProjectBody, ProjectDatasetInstance
+from modules.presence import cli_presence, apply_cli_presence
+from ..models.project import (
+    ProjectInstance,
+    CreateProjectBody,
+    ProjectDatasetInstance,
+    ProjectPresenceInstance,
+)
 
 router = APIRouter()
 
@@ -99,7 +105,7 @@ async def fetch_projects(
         ProjectInstance(**project.model_dump())
         for project in (await session.execute(query)).scalars().all()
     ]
-    return projects
+    return await apply_cli_presence(projects, project_uuid_attribute="uuid")
 
 
 @router.get("/{uuid}", response_model=ProjectInstance)
@@ -120,7 +126,33 @@ async def get_project(
             status_code=status_code.HTTP_404_NOT_FOUND,
             detail="Project with given uuid not found",
         )
-    return ProjectInstance(**project)
+    return (
+        await apply_cli_presence(
+            [ProjectInstance(**project)], project_uuid_attribute="uuid"
+        )
+    )[0]
+
+
+@router.get("/{uuid}/presence", response_model=ProjectPresenceInstance)
+async def get_project_presence(
+    jwt: Annotated[str, Depends(get_jwt)],
+    uuid: str,
+    session: AsyncSession = Depends(get_session),
+):
+    """Whether a CLI is connected to the project. Changes are published to
+    /subscribe/project_presence if CLI presence is enabled."""
+    if cli_presence is not None:
+        online = await cli_presence.is_online(uuid)
+    else:
+        online = (
+            await session.execute(select(Project.online).where(Project.uuid == uuid))
+        ).scalar_one_or_none()
+        if online is None:
+            raise HTTPException(
+                status_code=status_code.HTTP_404_NOT_FOUND,
+                detail="Project with given uuid not found",
+            )
+    return ProjectPresenceInstance(project_uuid=uuid, online=online)
 
 @router.get("/{uuid}/datasets", response_model=List[ProjectDatasetInstance])
 async def get_project_dataset(
@@ -208,4 +240,8 @@ async def set_project_public(
 
     project.is_public = is_public
 
-    return ProjectInstance(**project.model_dump())
+    return (
+        await apply_cli_presence(
+            [ProjectInstance(**project.model_dump())], project_uuid_attribute="uuid"
+        )
+    )[0]
@@ -1,20 +1,31 @@
 """APIs for SampleInput"""
-
+import json
+import asyncio
 from datetime import datetime
-from typing import Annotated, Any, Dict, List
+from typing import Annotated, Any, Dict, List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc, delete, func
 from sqlalchemy.dialects.postgresql import insert
 
 from fastapi import APIRouter, HTTPException, Depends, File, UploadFile
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from starlette import status as status_code
 
 from utils.logger import logger
+from utils.dataset_utils import (
+    detect_sample_input_file_format,
+    iter_sample_input_batches,
+)
 
-from base.database import get_session
+from base.database import get_session, get_session_context
 from utils.security import get_jwt
+from crud import (
+    create_sample_input_staging_table,
+    copy_sample_inputs_to_staging,
+    insert_staged_sample_inputs_in_dataset,
+)
 from db_models import *
+from modules.presence import apply_cli_presence
 from ..models.sample_input import (
     DatasetSampleInputsCountInstance,
     SampleInputInstance,
@@ -49,7 +60,7 @@ async def fetch_project_sample_inputs(
         .scalars()
         .all()
     ]
-    return sample_inputs
+    return await apply_cli_presence(sample_inputs)
 
 
 @router.get("/function_model", response_model=List[SampleInputInstance])
@@ -70,7 +81,7 @@ async def fetch_function_model_sample_inputs(
         .scalars()
         .all()
     ]
-    return sample_inputs
+    return await apply_cli_presence(sample_inputs)
 
 
 @router.post("", response_model=SampleInputInstance)
@@ -165,7 +176,7 @@ async def fetch_sample_inputs_in_dataset(
         .scalars()
         .all()
     ]
-    return sample_inputs
+    return await apply_cli_presence(sample_inputs)
 
 
 @router.get(
@@ -289,37 +300,127 @@ async def save_sample_inputs_in_dataset(
             detail="User Cannot Access Dataset",
         )
 
-    # create sample inputs
-    sample_input_list: List[Dict] = [  # Doesn't contain uuid
-        SampleInput(
-            **sample_input.model_dump(),
-            function_model_uuid=dataset.function_model_uuid,
-            project_uuid=dataset.project_uuid
-        ).model_dump(exclude_none=True)
-        for sample_input in body
-    ]
+    # create sample inputs & connect them to dataset in one statement
+    await create_sample_input_staging_table(session)
+    await copy_sample_inputs_to_staging(
+        session, [sample_input.model_dump() for sample_input in body]
+    )
+    await insert_staged_sample_inputs_in_dataset(
+        session,
+        dataset_uuid=dataset.uuid,
+        project_uuid=dataset.project_uuid,
+        function_model_uuid=dataset.function_model_uuid,
+    )
+    await session.commit()
 
-    # Add sample inputs to db, and get created uuids
-    sample_input_uuid_list: List[str] = [
-        str(
-            (
-                await session.execute(
-                    insert(SampleInput).values(sample_input).returning(SampleInput.uuid)
-                )
-            ).scalar_one()
+    return Response(status_code=200)
+
+
+@router.post("/dataset/{dataset_uuid}/upload")
+async def upload_sample_inputs_in_dataset(
+    jwt: Annotated[str, Depends(get_jwt)],
+    dataset_uuid: str,
+    file: UploadFile = File(...),
+    file_format: Optional[str] = None,
+    batch_size: int = 1000,
+    session: AsyncSession = Depends(get_session),
+):
+    """Bulk import sample inputs into a dataset from a CSV or JSONL file.
+
+    CSV columns (and flat JSONL keys) are used as input variables, except for
+    the reserved `name` and `ground_truth` columns. JSONL rows may also follow
+    the CreateSampleInputForDatasetBody shape.
+
+    Rows are parsed incrementally and COPY-ed into a staging table, then
+    inserted & connected to the dataset in one statement.
+    Streams progress as {"status": "running", "rows": int, "bytes_read": int, "total_bytes": int},
+    and ends with {"status": "completed", "count": int} or {"status": "failed", "log": str}.
+    """
+    file_format = detect_sample_input_file_format(file.filename, file_format)
+    if file_format is None:
+        raise HTTPException(
+            status_code=status_code.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="File format must be one of csv, jsonl",
         )
-        for sample_input in sample_input_list
-    ]
 
-    dataset_sample_input = [
-        DatasetSampleInput(dataset_uuid=dataset.uuid, sample_input_uuid=uuid)
-        for uuid in sample_input_uuid_list
-    ]
+    dataset: Dataset = (
+        await session.execute(select(Dataset).where(Dataset.uuid == dataset_uuid))
+    ).scalar_one_or_none()
 
-    session.add_all(dataset_sample_input)
-    await session.commit()
+    if dataset is None:
+        raise HTTPException(
+            status_code=status_code.HTTP_404_NOT_FOUND,
+            detail="Dataset not found",
+        )
 
-    return Response(status_code=200)
+    # check if user have access to dataset
+    user_id = jwt["user_id"]
+
+    project_check = (
+        await session.execute(
+            select(Project)
+            .join(Organization, Organization.organization_id == Project.organization_id)
+            .join(
+                UsersOrganizations,
+                UsersOrganizations.organization_id == Organization.organization_id,
+            )
+            .where(Project.uuid == dataset.project_uuid)
+            .where(UsersOrganizations.user_id == user_id)
+        )
+    ).scalar_one_or_none()
+
+    if project_check is None:
+        raise HTTPException(
+            status_code=status_code.HTTP_401_UNAUTHORIZED,
+            detail="User Cannot Access Dataset",
+        )
+
+    dataset_config = {
+        "dataset_uuid": dataset.uuid,
+        "project_uuid": dataset.project_uuid,
+        "function_model_uuid": dataset.function_model_uuid,
+    }
+    total_bytes = file.size
+
+    # release the DB connection, the upload uses its own session
+    await session.close()
+
+    async def stream_upload():
+        rows = 0
+        try:
+            async with get_session_context() as upload_session:
+                await create_sample_input_staging_table(upload_session)
+                batches = iter_sample_input_batches(
+                    file.file, file_format, batch_size=max(1, batch_size)
+                )
+                while True:
+                    # read & parse the next batch in a thread, not to block the event loop
+                    batch = await asyncio.to_thread(next, batches, None)
+                    if batch is None:
+                        break
+                    rows += await copy_sample_inputs_to_staging(
+                        upload_session, batch, start_seq=rows
+                    )
+                    data = {
+                        "status": "running",
+                        "rows": rows,
+                        "bytes_read": file.file.tell(),
+                        "total_bytes": total_bytes,
+                    }
+                    yield json.dumps(data)
+
+                count = await insert_staged_sample_inputs_in_dataset(
+                    upload_session, **dataset_config
+                )
+                await upload_session.commit()
+            data = {"status": "completed", "count": count}
+            yield json.dumps(data)
+        except Exception as error:
+            logger.error(f"Error uploading sample inputs to dataset {dataset_uuid}: {error}")
+            data = {"status": "failed", "log": str(error)}
+            yield json.dumps(data)
+
+    return StreamingResponse(stream_upload())
 
 
 @router.post("/dataset/{dataset_uuid}/add")
@@ -3,27 +3,15 @@ import json
 from typing import Annotated, Any, Dict, Optional
 from uuid import uuid4
 from fastapi.responses import JSONResponse
-from redis import asyncio as aioredis
 import asyncio
 import logging
-from dotenv import load_dotenv
 from fastapi import WebSocket, APIRouter, Depends
+from base.redis_connection import redis
 from utils.security import get_jwt
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
-redis_host = os.environ.get("REDIS_HOST", "localhost")
-redis_port = os.environ.get("REDIS_PORT", 6379)
-try:
-    redis_port = int(redis_port)
-except ValueError:
-    redis_port = 6379
-redis_password = os.environ.get("REDIS_PASSWORD", None)
-redis = aioredis.Redis(host=redis_host, port=redis_port, db=0, password=redis_password)
-
 
 async def redis_listener(
     websocket: WebSocket,
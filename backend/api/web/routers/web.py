@@ -1,10 +1,11 @@
 """APIs for promptmodel webpage"""
-import re
 import json
+import time
+from uuid import uuid4
 from datetime import datetime, timezone
 from typing import Annotated, Any, AsyncGenerator, Dict, Optional, Union
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, asc, desc, update
+from sqlalchemy import select, asc, desc, update, insert
 
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import StreamingResponse
@@ -16,8 +17,28 @@ from api.web.models import LLMProviderArgs
 
 from utils.logger import logger
 from utils.prompt_utils import update_dict
-
-from base.database import get_session
+from modules.cost_engine import completion_cost
+from modules.llm_cache import llm_response_cache, make_run_cache_key, use_llm_cache
+from modules.llm_clients import llm_client_pool
+from modules.rate_limiter import (
+    LLMRateLimit,
+    LLMRateLimitTimeout,
+    RateLimitLane,
+    llm_rate_limit,
+    acquire_llm_rate_limit,
+    settle_llm_rate_limit,
+)
+from modules.chat_history import load_chat_history, append_chat_history
+from modules.tokenizer import tokenizer_service
+from utils.prompt_template import (
+    TemplateSyntax,
+    compile_prompt_templates,
+    get_template_variables,
+)
+
+from base.database import get_session, get_session_context
+from crud import delete_unsaved_chat_run
+from base.metrics import observe_llm_request
 from utils.security import get_jwt
 from api.common.models import FunctionModelRunConfig, ChatModelRunConfig
 from db_models import *
@@ -27,6 +48,8 @@ router = APIRouter()
 
 router.include_router(batch_router)
 
+stream_logger = logger.get_child("web.stream")
+
 
 @router.post("/run_function_model")
 async def run_function_model(
@@ -48,47 +71,42 @@ async def run_function_model(
         )
     ).scalar_one_or_none()
 
+    rate_limit = None
+    llm_dev = None
     if not user_auth_check:
         provider_args = LLMProviderArgs()
     else:
-        provider_args = LLMProviderArgs()
         llm_provider = litellm.get_llm_provider(run_config.model)[1]
-        provider_config = (
-            await session.execute(
-                select(OrganizationLLMProviderConfig)
-                .where(
-                    OrganizationLLMProviderConfig.organization_id
-                    == user_auth_check.organization_id
-                )
-                .where(OrganizationLLMProviderConfig.provider_name == llm_provider)
-            )
-        ).scalar_one_or_none()
+        provider_client = await llm_client_pool.get(
+            session, user_auth_check.organization_id, llm_provider
+        )
 
-        if not provider_config:
+        if not provider_client:
             raise HTTPException(
                 status_code=status_code.HTTP_428_PRECONDITION_REQUIRED,
                 detail=f"Organization doesn't have API keys set for {llm_provider}. Please set API keys in project settings.",
             )
 
-        for key, val in provider_config.env_vars.items():
-            if "api_key" in key.lower():
-                provider_args.api_key = val
-            elif "api_base" in key.lower():
-                provider_args.api_base = val
-            elif "api_version" in key.lower():
-                provider_args.api_version = val
-    
+        provider_args = provider_client.provider_args
+        llm_dev = provider_client.llm_dev
+        rate_limit = llm_rate_limit(
+            user_auth_check.organization_id, llm_provider, provider_client.params
+        )
+
+    # release the DB connection, run_cloud_function_model opens short sessions
+    # before and after streaming
+    await session.close()
 
     async def stream_run():
         async for chunk in run_cloud_function_model(
-            session=session,
             project_uuid=project_uuid,
             run_config=run_config,
             provider_args=provider_args,
+            rate_limit=rate_limit,
+            llm_dev=llm_dev,
         ):
-            logger.debug(chunk)
+            stream_logger.debug("run_function_model chunk", chunk=chunk)
             yield json.dumps(chunk)
-        session.close()
 
     return StreamingResponse(
         stream_run(),
@@ -96,10 +114,11 @@ async def run_function_model(
 
 
 async def run_cloud_function_model(
-    session: AsyncSession,
     project_uuid: str,
     run_config: FunctionModelRunConfig,
     provider_args: LLMProviderArgs,
+    rate_limit: Optional[LLMRateLimit] = None,
+    llm_dev: Optional[LLMDev] = None,
 ):
     """Run FunctionModel on the cloud, request from web."""
     sample_input: Dict[str, str] = (
@@ -107,18 +126,10 @@ async def run_cloud_function_model(
     )
 
     # Validate Variable Matching
-    prompt_variables = []
-    for prompt in run_config.prompts:
-        prompt_content = prompt.content
-        
-        # find f-string input variables
-        fstring_input_pattern = r"(?<!\\)\{\{([^}]+)\}\}(?<!\\})"
-        prompt_variables_in_prompt = re.findall(fstring_input_pattern, prompt_content)
-
-        prompt_variables_in_prompt = list(set(prompt_variables_in_prompt))
-        prompt_variables += prompt_variables_in_prompt
-
-    prompt_variables = list(set(prompt_variables))
+    prompt_templates = compile_prompt_templates(
+        [prompt.content for prompt in run_config.prompts], TemplateSyntax.DOUBLE_BRACE
+    )
+    prompt_variables = get_template_variables(prompt_templates)
 
     if len(prompt_variables) != 0:
         if sample_input is None:
@@ -150,8 +161,8 @@ async def run_cloud_function_model(
     latency = 0
     function_call = None
     try:
-        # create function_model_dev_instance
-        function_model_dev = LLMDev()
+        # use the pooled function_model_dev_instance of the provider, if any
+        function_model_dev = llm_dev or LLMDev()
         # find function_model_uuid from local db
         function_model_version_uuid: Optional[str] = run_config.version_uuid
         # If function_model_version_uuid is None, create new version & prompt
@@ -170,15 +181,12 @@ async def run_cloud_function_model(
         
 
         if sample_input:
-            for prompt in prompts:
-                prompt.content = prompt.content.replace("{", "{{").replace("}", "}}")
-                prompt.content = prompt.content.replace("{{{{", "{").replace("}}}}", "}")
             messages = [
                 {
-                    "content": prompt.content.format(**sample_input),
+                    "content": template.render(sample_input),
                     "role": prompt.role,
                 }
-                for prompt in prompts
+                for prompt, template in zip(prompts, prompt_templates)
             ]
         else:
             messages = [
@@ -198,78 +206,147 @@ async def run_cloud_function_model(
             function_schemas = None
         else:
             # add function schemas
-            function_schemas = (
-                (
-                    await session.execute(
-                        select(
-                            FunctionSchema.name,
-                            FunctionSchema.description,
-                            FunctionSchema.parameters,
-                            FunctionSchema.mock_response,
+            async with get_session_context() as session:
+                function_schemas = (
+                    (
+                        await session.execute(
+                            select(
+                                FunctionSchema.name,
+                                FunctionSchema.description,
+                                FunctionSchema.parameters,
+                                FunctionSchema.mock_response,
+                            )
+                            .where(FunctionSchema.project_uuid == project_uuid)
+                            .where(FunctionSchema.name.in_(run_config.functions))
                         )
-                        .where(FunctionSchema.project_uuid == project_uuid)
-                        .where(FunctionSchema.name.in_(run_config.functions))
                     )
+                    .mappings()
+                    .all()
                 )
-                .mappings()
-                .all()
-            )
 
-        res: AsyncGenerator[LLMStreamResponse, None] = function_model_dev.dev_run(
-            messages=messages,
-            parsing_type=parsing_type,
-            functions=function_schemas,
-            model=model,
-            **provider_args.model_dump(),
-        )
-        async for item in res:
-            if (item.api_response is not None) and (
-                item.api_response.choices[0].finish_reason is not None
-            ):
-                model_res = item.api_response
-                model_res.model = model
-                latency = (
-                    item.api_response["response_ms"]
-                    if "response_ms" in item.api_response
-                    else None
-                )
-                latency = (
-                    item.api_response["_response_ms"]
-                    if "_response_ms" in item.api_response
-                    else latency
+        # Check LLM response cache
+        cache_key = None
+        cached_response = None
+        if use_llm_cache(run_config.use_cache):
+            cache_key = make_run_cache_key(
+                project_uuid,
+                kind="cloud_function",
+                model=model,
+                messages=messages,
+                provider_args=provider_args,
+                parsing_type=parsing_type,
+                output_keys=run_config.output_keys,
+                functions=[dict(x) for x in function_schemas]
+                if function_schemas
+                else None,
+            )
+            cached_response = await llm_response_cache.get(cache_key)
+
+        if cached_response is not None:
+            # Replay cached output
+            start_time = time.perf_counter()
+            output["raw_output"] = cached_response["raw_output"]
+            output["parsed_outputs"] = cached_response["parsed_outputs"]
+            function_call = cached_response["function_call"]
+            model_res = litellm.ModelResponse(
+                usage=litellm.Usage(**cached_response["usage"]),
+                model=model,
+            )
+            if output["raw_output"]:
+                yield {"status": "running", "raw_output": output["raw_output"]}
+            for key, value in output["parsed_outputs"].items():
+                yield {"status": "running", "parsed_outputs": {key: value}}
+            if function_call is not None:
+                yield {"status": "running", "function_call": function_call}
+            latency = (time.perf_counter() - start_time) * 1000
+        else:
+            try:
+                estimated_tokens = await acquire_llm_rate_limit(
+                    rate_limit, model, messages, RateLimitLane.INTERACTIVE
                 )
-            if item.raw_output is not None:
-                output["raw_output"] += item.raw_output
-                data = {
-                    "status": "running",
-                    "raw_output": item.raw_output,
-                }
-            if item.parsed_outputs:
-                if list(item.parsed_outputs.keys())[0] not in output["parsed_outputs"]:
-                    output["parsed_outputs"][
-                        list(item.parsed_outputs.keys())[0]
-                    ] = list(item.parsed_outputs.values())[0]
-                else:
-                    output["parsed_outputs"][
-                        list(item.parsed_outputs.keys())[0]
-                    ] += list(item.parsed_outputs.values())[0]
-                data = {
-                    "status": "running",
-                    "parsed_outputs": item.parsed_outputs,
-                }
+            except LLMRateLimitTimeout as error:
+                yield {"status": "failed", "log": str(error)}
+                return
+            llm_start_time = time.perf_counter()
+            res: AsyncGenerator[LLMStreamResponse, None] = function_model_dev.dev_run(
+                messages=messages,
+                parsing_type=parsing_type,
+                functions=function_schemas,
+                model=model,
+                **provider_args.model_dump(),
+            )
+            async for item in res:
+                if (item.api_response is not None) and (
+                    item.api_response.choices[0].finish_reason is not None
+                ):
+                    model_res = item.api_response
+                    model_res.model = model
+                    latency = (
+                        item.api_response["response_ms"]
+                        if "response_ms" in item.api_response
+                        else None
+                    )
+                    latency = (
+                        item.api_response["_response_ms"]
+                        if "_response_ms" in item.api_response
+                        else latency
+                    )
+                if item.raw_output is not None:
+                    output["raw_output"] += item.raw_output
+                    data = {
+                        "status": "running",
+                        "raw_output": item.raw_output,
+                    }
+                if item.parsed_outputs:
+                    if list(item.parsed_outputs.keys())[0] not in output["parsed_outputs"]:
+                        output["parsed_outputs"][
+                            list(item.parsed_outputs.keys())[0]
+                        ] = list(item.parsed_outputs.values())[0]
+                    else:
+                        output["parsed_outputs"][
+                            list(item.parsed_outputs.keys())[0]
+                        ] += list(item.parsed_outputs.values())[0]
+                    data = {
+                        "status": "running",
+                        "parsed_outputs": item.parsed_outputs,
+                    }
 
-            if item.function_call is not None:
-                data = {
-                    "status": "running",
-                    "function_call": item.function_call.model_dump(),
-                }
-                function_call = item.function_call.model_dump()
+                if item.function_call is not None:
+                    data = {
+                        "status": "running",
+                        "function_call": item.function_call.model_dump(),
+                    }
+                    function_call = item.function_call.model_dump()
 
-            if item.error and error_occurs is False:
-                error_occurs = item.error
-                error_log = item.error_log
+                if item.error and error_occurs is False:
+                    error_occurs = item.error
+                    error_log = item.error_log
                 
-            yield data
+                yield data
+
+            observe_llm_request(
+                model, "web", time.perf_counter() - llm_start_time, bool(error_occurs)
+            )
+            await settle_llm_rate_limit(
+                rate_limit, estimated_tokens, model_res.usage.get("total_tokens")
+            )
+
+            if cache_key is not None and not error_occurs and model_res is not None:
+                await llm_response_cache.set(
+                    cache_key,
+                    {
+                        "raw_output": output["raw_output"],
+                        "parsed_outputs": output["parsed_outputs"],
+                        "function_call": function_call,
+                        "usage": {
+                            "prompt_tokens": model_res.usage.get("prompt_tokens"),
+                            "completion_tokens": model_res.usage.get(
+                                "completion_tokens"
+                            ),
+                            "total_tokens": model_res.usage.get("total_tokens"),
+                        },
+                    },
+                )
 
         if (
             function_call is None
@@ -282,34 +359,39 @@ async def run_cloud_function_model(
             data = {"status": "failed", "log": f"parsing failed, {error_log}"}
             yield data
 
-        # Create run log
+        # Create run log with a new session, the connection is not held while streaming
         if function_model_version_uuid is not None:
-            session.add(
-                RunLog(
-                    **{
-                        "project_uuid": project_uuid,
-                        "version_uuid": function_model_version_uuid,
-                        "inputs": sample_input,
-                        "raw_output": output["raw_output"],
-                        "parsed_outputs": output["parsed_outputs"],
-                        "prompt_tokens": model_res.usage.get("prompt_tokens"),
-                        "completion_tokens": model_res.usage.get("completion_tokens"),
-                        "total_tokens": model_res.usage.get("total_tokens"),
-                        "cost": litellm.completion_cost(model_res),
-                        "latency": latency,
-                        "function_call": function_call,
-                        "run_log_metadata": {
-                            "error_log": error_log,
-                            "error": True,
+            async with get_session_context() as session:
+                session.add(
+                    RunLog(
+                        **{
+                            "project_uuid": project_uuid,
+                            "version_uuid": function_model_version_uuid,
+                            "inputs": sample_input,
+                            "raw_output": output["raw_output"],
+                            "parsed_outputs": output["parsed_outputs"],
+                            "prompt_tokens": model_res.usage.get("prompt_tokens"),
+                            "completion_tokens": model_res.usage.get("completion_tokens"),
+                            "total_tokens": model_res.usage.get("total_tokens"),
+                            "cost": 0
+                            if cached_response is not None
+                            else completion_cost(model_res),
+                            "latency": latency,
+                            "function_call": function_call,
+                            "run_log_metadata": {
+                                "error_log": error_log,
+                                "error": True,
+                            }
+                            if error_occurs
+                            else {"cache_hit": True}
+                            if cached_response is not None
+                            else None,
+                            "run_from_deployment": False,
+                            "sample_input_uuid": run_config.sample_input_uuid,
                         }
-                        if error_occurs
-                        else None,
-                        "run_from_deployment": False,
-                        "sample_input_uuid": run_config.sample_input_uuid,
-                    }
+                    )
                 )
-            )
-            await session.commit()
+                await session.commit()
 
         data = {
             "status": "completed",
@@ -352,39 +434,32 @@ async def run_chat_model(
             detail="User don't have access to this project",
         )
 
-    provider_args = LLMProviderArgs()
     llm_provider = litellm.get_llm_provider(chat_config.model)[1]
-    provider_config = (
-        await session.execute(
-            select(OrganizationLLMProviderConfig)
-            .where(
-                OrganizationLLMProviderConfig.organization_id
-                == user_auth_check.organization_id
-            )
-            .where(OrganizationLLMProviderConfig.provider_name == llm_provider)
-        )
-    ).scalar_one_or_none()
+    provider_client = await llm_client_pool.get(
+        session, user_auth_check.organization_id, llm_provider
+    )
 
-    if not provider_config:
+    if not provider_client:
         raise HTTPException(
             status_code=status_code.HTTP_428_PRECONDITION_REQUIRED,
             detail=f"Organization doesn't have API keys set for {llm_provider}. Please set API keys in project settings.",
         )
 
-    for key, val in provider_config.env_vars.items():
-        if "api_key" in key.lower():
-            provider_args.api_key = val
-        elif "api_base" in key.lower():
-            provider_args.api_base = val
-        elif "api_version" in key.lower():
-            provider_args.api_version = val
+    rate_limit = llm_rate_limit(
+        user_auth_check.organization_id, llm_provider, provider_client.params
+    )
+
+    # release the DB connection, run_cloud_chat_model opens short sessions
+    # before and after streaming
+    await session.close()
 
     async def stream_run():
         async for chunk in run_cloud_chat_model(
-            session=session,
             project_uuid=project_uuid,
             chat_config=chat_config,
-            provider_args=provider_args,
+            provider_args=provider_client.provider_args,
+            rate_limit=rate_limit,
+            llm_dev=provider_client.llm_dev,
         ):
             yield json.dumps(chunk)
 
@@ -394,10 +469,11 @@ async def run_chat_model(
 
 
 async def run_cloud_chat_model(
-    session: AsyncSession,
     project_uuid: str,
     chat_config: ChatModelRunConfig,
     provider_args: LLMProviderArgs,
+    rate_limit: Optional[LLMRateLimit] = None,
+    llm_dev: Optional[LLMDev] = None,
 ) -> AsyncGenerator[Dict[str, Any], None]:
     """Run ChatModel from cloud deployment environment.
 
@@ -411,6 +487,10 @@ async def run_cloud_chat_model(
             session_uuid: current session uuid (Optional)
             version_uuid: current version uuid (Optional if from_version is provided)
             functions: List of functions (Optional)
+            history_max_messages: send only the last N messages of the session (Optional)
+            history_max_tokens: send only the last messages within N tokens (Optional)
+        rate_limit (LLMRateLimit): limits of the organization's provider (Optional)
+        llm_dev (LLMDev): pooled client of the organization's provider (Optional)
 
     Returns:
         AsyncGenerator: Dict[str, Any]
@@ -419,124 +499,139 @@ async def run_cloud_chat_model(
             log: Optional[str]
 
     """
+    # version & session created by this run, deleted if it ends before its messages are saved
+    created_version_uuid: Optional[str] = None
+    created_session_uuid: Optional[str] = None
+    saved = False
     try:
         start_timestampz_iso = datetime.now(timezone.utc)
-        chat_model_dev = LLMDev()
+        chat_model_dev = llm_dev or LLMDev()
         chat_model_version_uuid: Union[str, None] = chat_config.version_uuid
         session_uuid: Union[str, None] = chat_config.session_uuid
         messages = [{"role": "system", "content": chat_config.system_prompt}]
         need_project_version_update = False
         changelogs = []
 
-        # If chat_model_version_uuid is None, create new version
-        if chat_model_version_uuid is None:
-            version: int
-            if chat_config.from_version is None:
-                version = 1
-                need_project_version_update = True
-            else:
-                latest_version = (
-                    await session.execute(
-                        select(ChatModelVersion.version)
-                        .where(
-                            ChatModelVersion.chat_model_uuid
-                            == chat_config.chat_model_uuid
+        # pre-stream DB phase: create the version & session the stream needs and commit
+        # them, so the connection is released before streaming. The changelog & project
+        # version are saved with the messages, once the run succeeded
+        pre_stream_chunks = []
+        async with get_session_context() as session:
+            # If chat_model_version_uuid is None, create new version
+            if chat_model_version_uuid is None:
+                version: int
+                if chat_config.from_version is None:
+                    version = 1
+                    need_project_version_update = True
+                else:
+                    latest_version = (
+                        await session.execute(
+                            select(ChatModelVersion.version)
+                            .where(
+                                ChatModelVersion.chat_model_uuid
+                                == chat_config.chat_model_uuid
+                            )
+                            .order_by(desc(ChatModelVersion.version))
+                            .limit(1)
                         )
-                        .order_by(desc(ChatModelVersion.version))
-                        .limit(1)
-                    )
-                ).scalar_one()
+                    ).scalar_one()
 
-                version = latest_version + 1
+                    version = latest_version + 1
 
-            new_chat_model_version_row = ChatModelVersion(
-                **{
-                    "chat_model_uuid": chat_config.chat_model_uuid,
-                    "from_version": chat_config.from_version,
-                    "version": version,
-                    "model": chat_config.model,
-                    "system_prompt": chat_config.system_prompt,
-                    "functions": chat_config.functions,
-                    "is_published": True if version == 1 else False,
-                }
-            )
-            session.add(new_chat_model_version_row)
-            await session.flush()
-            await session.refresh(new_chat_model_version_row)
+                new_chat_model_version_row = ChatModelVersion(
+                    **{
+                        "chat_model_uuid": chat_config.chat_model_uuid,
+                        "from_version": chat_config.from_version,
+                        "version": version,
+                        "model": chat_config.model,
+                        "system_prompt": chat_config.system_prompt,
+                        "functions": chat_config.functions,
+                        "is_published": True if version == 1 else False,
+                    }
+                )
+                session.add(new_chat_model_version_row)
+                await session.flush()
+                await session.refresh(new_chat_model_version_row)
 
-            changelogs.append(
-                {
-                    "subject": "chat_model_version",
-                    "identifier": [str(new_chat_model_version_row.uuid)],
-                    "action": "ADD",
-                }
-            )
-            if need_project_version_update:
                 changelogs.append(
                     {
                         "subject": "chat_model_version",
                         "identifier": [str(new_chat_model_version_row.uuid)],
-                        "action": "PUBLISH",
+                        "action": "ADD",
                     }
                 )
+                if need_project_version_update:
+                    changelogs.append(
+                        {
+                            "subject": "chat_model_version",
+                            "identifier": [str(new_chat_model_version_row.uuid)],
+                            "action": "PUBLISH",
+                        }
+                    )
 
-            chat_model_version_uuid: str = str(new_chat_model_version_row.uuid)
+                chat_model_version_uuid: str = str(new_chat_model_version_row.uuid)
+                created_version_uuid = chat_model_version_uuid
 
-            data = {
-                "chat_model_version_uuid": chat_model_version_uuid,
-                "version": version,
-                "status": "running",
-            }
-            yield data
+                data = {
+                    "chat_model_version_uuid": chat_model_version_uuid,
+                    "version": version,
+                    "status": "running",
+                }
+                pre_stream_chunks.append(data)
 
-        # If session uuid is None, create new session
-        if session_uuid is None:
-            new_session = ChatSession(
-                **{
-                    "version_uuid": chat_model_version_uuid,
-                    "run_from_deployment": False,
+            # If session uuid is None, create new session
+            if session_uuid is None:
+                new_session = ChatSession(
+                    **{
+                        "version_uuid": chat_model_version_uuid,
+                        "run_from_deployment": False,
+                    }
+                )
+                session.add(new_session)
+                await session.flush()
+                await session.refresh(new_session)
+
+                session_uuid: str = str(new_session.uuid)
+                created_session_uuid = session_uuid
+
+                data = {
+                    "chat_session_uuid": session_uuid,
+                    "status": "running",
                 }
-            )
-            session.add(new_session)
-            await session.flush()
-            await session.refresh(new_session)
+                pre_stream_chunks.append(data)
+            else:
+                # If session exists, fetch session chat logs from cloud db
+                session_chat_messages = await load_chat_history(
+                    session,
+                    session_uuid,
+                    chat_config.model,
+                    max_messages=chat_config.history_max_messages,
+                    max_tokens=chat_config.history_max_tokens,
+                )
+                messages += session_chat_messages
+                messages = [
+                    {k: v for k, v in message.items() if v is not None}
+                    for message in messages
+                ]
 
-            session_uuid: str = str(new_session.uuid)
+            await session.commit()
 
-            data = {
-                "chat_session_uuid": session_uuid,
-                "status": "running",
-            }
+        for data in pre_stream_chunks:
             yield data
-        else:
-            # If session exists, fetch session chat logs from cloud db
-            session_chat_messages = (
-                (
-                    await session.execute(
-                        select(
-                            ChatMessage.role,
-                            ChatMessage.name,
-                            ChatMessage.content,
-                            ChatMessage.tool_calls,
-                            ChatMessage.function_call,
-                        )
-                        .where(ChatMessage.session_uuid == session_uuid)
-                        .order_by(asc(ChatMessage.created_at))
-                    )
-                )
-                .mappings()
-                .all()
-            )
-            messages += session_chat_messages
-            messages = [
-                {k: v for k, v in message.items() if v is not None}
-                for message in messages
-            ]
 
         # Append user input to messages
         messages.append({"role": "user", "content": chat_config.user_input})
 
+        try:
+            estimated_tokens = await acquire_llm_rate_limit(
+                rate_limit, chat_config.model, messages, RateLimitLane.INTERACTIVE
+            )
+        except LLMRateLimitTimeout as error:
+            yield {"status": "failed", "log": str(error)}
+            return
+
         # Stream chat
+        llm_start_time = time.perf_counter()
         res: AsyncGenerator[LLMStreamResponse, None] = chat_model_dev.dev_chat(
             messages=messages,
             model=chat_config.model,
@@ -574,26 +669,38 @@ async def run_cloud_chat_model(
 
             yield data
 
-        # Create chat log
+        observe_llm_request(
+            chat_config.model,
+            "web",
+            time.perf_counter() - llm_start_time,
+            bool(error_occurs),
+        )
+        # the stream has no usage, the prompt estimate plus the output is the actual usage
+        if rate_limit is not None and rate_limit.tpm > 0:
+            await settle_llm_rate_limit(
+                rate_limit,
+                estimated_tokens,
+                estimated_tokens
+                + await tokenizer_service.count_tokens(chat_config.model, raw_output),
+            )
+
+        # post-stream DB phase: save messages, chat log & changelog with a new session
+        # message uuids are set here, so the chat log doesn't need to query them back
         user_message_uuid = str(uuid4())
         assistant_message_uuid = str(uuid4())
-        user_chat_message = ChatMessage(
-            **{
+        chat_messages = [
+            {
                 "uuid": user_message_uuid,
                 "created_at": start_timestampz_iso,
                 "session_uuid": session_uuid,
                 "role": "user",
                 "content": chat_config.user_input,
-            }
-        )
-        session.add(user_chat_message)
-        await session.flush()
-
-        assistant_created_at = datetime.now(timezone.utc)
-        assistant_chat_message = ChatMessage(
-            **{
+                "function_call": None,
+                "chat_message_metadata": None,
+            },
+            {
                 "uuid": assistant_message_uuid,
-                "created_at": assistant_created_at,
+                "created_at": datetime.now(timezone.utc),
                 "session_uuid": session_uuid,
                 "role": "assistant",
                 "content": raw_output,
@@ -601,53 +708,45 @@ async def run_cloud_chat_model(
                 "chat_message_metadata": {"error": True, "error_log": error_log}
                 if error_occurs
                 else None,
-            }
-        )
-        session.add(assistant_chat_message)
-        await session.flush()
-
-        session.add(
-            ChatLog(
-                user_message_uuid=user_message_uuid,
-                assistant_message_uuid=assistant_message_uuid,
-                session_uuid=session_uuid,
-                project_uuid=project_uuid,
+            },
+        ]
+        async with get_session_context() as session:
+            # both messages in one statement, before the chat log referencing them
+            await session.execute(insert(ChatMessage).values(chat_messages))
+            await session.execute(
+                insert(ChatLog).values(
+                    user_message_uuid=user_message_uuid,
+                    assistant_message_uuid=assistant_message_uuid,
+                    session_uuid=session_uuid,
+                    project_uuid=project_uuid,
+                )
             )
-        )
+            if len(changelogs) > 0:
+                session.add(
+                    ProjectChangelog(
+                        **{
+                            "logs": changelogs,
+                            "project_uuid": project_uuid,
+                        }
+                    )
+                )
+            if need_project_version_update:
+                await session.execute(
+                    update(Project)
+                    .where(Project.uuid == project_uuid)
+                    .values(version=Project.version + 1)
+                )
 
-        await session.flush()
+            await session.commit()
+        saved = True
+
+        await append_chat_history(session_uuid, chat_messages)
 
         data = {
             "status": "completed",
         }
         yield data
 
-        if len(changelogs) > 0:
-            session.add(
-                ProjectChangelog(
-                    **{
-                        "logs": changelogs,
-                        "project_uuid": project_uuid,
-                    }
-                )
-            )
-            await session.flush()
-        if need_project_version_update:
-            project_version = (
-                await session.execute(
-                    select(Project.version).where(Project.uuid == project_uuid)
-                )
-            ).scalar_one()
-
-            await session.execute(
-                update(Project)
-                .where(Project.uuid == project_uuid)
-                .values(version=project_version + 1)
-            )
-            await session.flush()
-
-        await session.commit()
-
     except Exception as exc:
         logger.error(f"Error running service: {exc}")
         data = {
@@ -656,3 +755,6 @@ async def run_cloud_chat_model(
         }
         yield data
         raise exc
+    finally:
+        if not saved:
+            await delete_unsaved_chat_run(created_session_uuid, created_version_uuid)
@@ -2,28 +2,51 @@
 import re
 import json
 import os
+import time
 import asyncio
 from datetime import datetime, timezone
-from typing import Annotated, Any, AsyncGenerator, Dict, Optional, Union
+from uuid import uuid4
+from typing import Annotated, Any, AsyncGenerator, Dict, List, Optional, Tuple, Union
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, asc, desc, update
+from sqlalchemy import select, asc, desc, update, exists, func
+from sqlalchemy.dialects.postgresql import insert
 
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
 from fastapi.responses import Response
 from fastapi.responses import StreamingResponse
 from starlette import status as status_code
-from litellm import get_llm_provider, Router, ModelResponse, completion_cost
+from litellm import get_llm_provider, Router, ModelResponse
 
 from promptmodel.llms.llm_dev import LLMDev
 from promptmodel.types.response import LLMStreamResponse
 
 from utils.logger import logger
 from utils.prompt_utils import update_dict
+from modules.cost_engine import completion_cost
+from modules.llm_cache import llm_response_cache, make_run_cache_key, use_llm_cache
+from modules.llm_clients import llm_client_pool
+from modules.batch_run_queue import batch_run_queue
+from modules.rate_limiter import (
+    RateLimitLane,
+    llm_rate_limit,
+    acquire_llm_rate_limit,
+    settle_llm_rate_limit,
+)
+from utils.prompt_template import (
+    CompiledPromptTemplate,
+    TemplateSyntax,
+    compile_prompt_template,
+)
 
 from base.database import get_session, get_session_context
+from base.metrics import (
+    batch_run_duration_seconds,
+    batch_run_samples_total,
+    batch_runs_total,
+    observe_llm_request,
+)
 from utils.security import get_jwt
 from api.common.models import FunctionModelBatchRunConfig
-from api.web.models import LLMProviderArgs
 from api.web.models.function_model_version import FunctionModelVersionBatchRunInstance
 from db_models import *
 
@@ -33,15 +56,22 @@ router = APIRouter()
 async def function_model_batch_run_background_task(
     batch_run_config: FunctionModelBatchRunConfig,
     batch_run_uuid: str,
-    router_config: Dict[str, Any],
 ):
+    """Run a batch run, in the web process or in a batch run worker.
+
+    The RunLog & score of every sample input is saved as soon as it is run, and sample
+    inputs with a RunLog of the batch run are skipped, so a batch run interrupted by a
+    crash or a deploy resumes where it stopped when it is run again.
+    """
+    batch_start_time = time.perf_counter()
     try:
         async with get_session_context() as session:
-            dataset_to_run: Dataset = (
-                await session.execute(
-                    select(Dataset).where(Dataset.uuid == batch_run_config.dataset_uuid)
-                )
-            ).scalar_one()
+            # (re)start the batch run
+            await session.execute(
+                update(BatchRun)
+                .where(BatchRun.uuid == batch_run_uuid)
+                .values(status="running", finished_at=None)
+            )
 
             function_model_version_to_run: FunctionModelVersion = (
                 await session.execute(
@@ -67,8 +97,16 @@ async def function_model_batch_run_background_task(
                 .all()
             )
 
-            prompts = [p.model_dump() for p in prompts]
+            # compile prompts once, and render them for every sample input
+            prompt_templates = [
+                (
+                    compile_prompt_template(p.content, TemplateSyntax.DOUBLE_BRACE),
+                    p.role,
+                )
+                for p in prompts
+            ]
 
+            # sample inputs not run yet by this batch run
             sample_inputs_to_run: List[SampleInput] = (
                 (
                     await session.execute(
@@ -81,55 +119,17 @@ async def function_model_batch_run_background_task(
                             DatasetSampleInput.dataset_uuid
                             == batch_run_config.dataset_uuid
                         )
+                        .where(
+                            ~exists()
+                            .where(RunLog.batch_run_uuid == batch_run_uuid)
+                            .where(RunLog.sample_input_uuid == SampleInput.uuid)
+                        )
                     )
                 )
                 .scalars()
                 .all()
             )
 
-            litellm_router = Router(**router_config, num_retries=5, allowed_fails=2)
-
-            async def __async_task__(
-                model: str,
-                sample_input_row: SampleInput,
-                prompts: List[Dict[str, Any]],
-                router: Router,
-            ) -> RunLog:
-                for prompt in prompts:
-                    prompt["content"] = prompt["content"].replace("{{", "{").replace("}}", "}")
-                messages = [
-                    {
-                        "content": prompt["content"].format(**sample_input_row.content),
-                        "role": prompt["role"],
-                    }
-                    for prompt in prompts
-                ]
-
-                res: ModelResponse = await router.acompletion(
-                    model=model, messages=messages
-                )
-
-                print(f"SampleInput {sample_input_row.id} completed")
-
-                return sample_input_row, res
-
-            # run all sample inputs cuncurrently in asyncronous way
-            tasks = [
-                __async_task__(
-                    model=function_model_version_to_run.model,
-                    sample_input_row=sample_input,
-                    prompts=prompts,
-                    router=litellm_router,
-                )
-                for sample_input in sample_inputs_to_run
-            ]
-
-            results: List[Tuple(SampleInput, ModelResponse)] = await asyncio.gather(
-                *tasks
-            )
-
-            # make RunLogs & RunLogScore
-
             # TODO: make this to select metric
             gt_exact_match_metric: EvalMetric = (
                 await session.execute(
@@ -139,85 +139,192 @@ async def function_model_batch_run_background_task(
                 )
             ).scalar_one()
 
-            score = 0
-            for result in results:
-                success = 0
-                sample_input_row, res = result
-                sample_input_row: SampleInput = sample_input_row
-                res: ModelResponse = res
-
-                gt = sample_input_row.ground_truth
-                prediction = res.choices[0].message.content
-                # print(prediction)
-                if not type(prediction) == str:
-                    prediction = str(prediction)
-                if gt == prediction:
-                    score += 1
-                    success = 1
-
-                run_log = RunLog(
-                    run_from_deployment=False,
-                    inputs=sample_input_row.content,
-                    raw_output=res.choices[0].message.content,
-                    version_uuid=batch_run_config.function_model_version_uuid,
-                    prompt_tokens=res.usage["prompt_tokens"],
-                    completion_tokens=res.usage["completion_tokens"],
-                    total_tokens=res.usage["total_tokens"],
-                    latency=getattr(res, "_response_ms", None),
-                    cost=completion_cost(res),
-                    project_uuid=batch_run_config.project_uuid,
-                    batch_run_uuid=batch_run_uuid,
-                    sample_input_uuid=sample_input_row.uuid,
+            organization_id = (
+                await session.execute(
+                    select(Project.organization_id).where(
+                        Project.uuid == batch_run_config.project_uuid
+                    )
                 )
-                session.add(run_log)
-                await session.commit()
-                await session.refresh(run_log)
+            ).scalar_one()
+            llm_provider = get_llm_provider(model=function_model_version_to_run.model)[1]
+            provider_client = await llm_client_pool.get(
+                session, organization_id, llm_provider
+            )
+            if not provider_client:
+                raise ValueError(
+                    f"Organization doesn't have API keys set for {llm_provider}"
+                )
+            litellm_router = provider_client.router(function_model_version_to_run.model)
+            provider_args = provider_client.provider_args
+            rate_limit = llm_rate_limit(
+                organization_id, llm_provider, provider_client.params
+            )
+
+            await session.commit()
+
+        async def __async_task__(
+            model: str,
+            sample_input_row: SampleInput,
+            prompt_templates: List[Tuple[CompiledPromptTemplate, str]],
+            router: Router,
+        ) -> None:
+            messages = [
+                {
+                    "content": template.render(sample_input_row.content),
+                    "role": role,
+                }
+                for template, role in prompt_templates
+            ]
 
-                run_log_score = RunLogScore(
-                    run_log_uuid=run_log.uuid,
-                    eval_metric_uuid=gt_exact_match_metric.uuid,
-                    value=success,
+            cache_key = None
+            res: Optional[ModelResponse] = None
+            if use_llm_cache(batch_run_config.use_cache):
+                cache_key = make_run_cache_key(
+                    batch_run_config.project_uuid,
+                    kind="batch",
+                    model=model,
+                    messages=messages,
+                    provider_args=provider_args,
+                )
+                cached_response = await llm_response_cache.get(cache_key)
+                if cached_response is not None:
+                    res = ModelResponse(**cached_response)
+            cache_hit = res is not None
+
+            if not cache_hit:
+                estimated_tokens = await acquire_llm_rate_limit(
+                    rate_limit, model, messages, RateLimitLane.BATCH
+                )
+                llm_start_time = time.perf_counter()
+                try:
+                    res = await router.acompletion(model=model, messages=messages)
+                except Exception:
+                    observe_llm_request(
+                        model, "batch", time.perf_counter() - llm_start_time, True
+                    )
+                    raise
+                observe_llm_request(
+                    model, "batch", time.perf_counter() - llm_start_time, False
+                )
+                await settle_llm_rate_limit(
+                    rate_limit,
+                    estimated_tokens,
+                    res.usage.total_tokens if res.usage else None,
                 )
-                session.add(run_log_score)
-                await session.commit()
 
-            # save run_log and score
+                if cache_key is not None:
+                    await llm_response_cache.set(cache_key, res.model_dump())
 
-            score = score / len(results)
+            batch_run_samples_total.labels(
+                status="cache_hit" if cache_hit else "success"
+            ).inc()
 
-            # update BatchRun status = "completed"
-            (
-                await session.execute(
-                    update(BatchRun)
-                    .where(
-                        BatchRun.function_model_version_uuid
-                        == function_model_version_to_run.uuid
+            gt = sample_input_row.ground_truth
+            prediction = res.choices[0].message.content
+            if not type(prediction) == str:
+                prediction = str(prediction)
+            success = 1 if gt == prediction else 0
+
+            # save RunLog & RunLogScore of the sample input, the checkpoint of a resume.
+            # Skipped if already saved, by a run of the job that lost its lease
+            async with get_session_context() as session:
+                run_log_uuid = (
+                    await session.execute(
+                        insert(RunLog)
+                        .values(
+                            uuid=uuid4(),
+                            run_from_deployment=False,
+                            inputs=sample_input_row.content,
+                            raw_output=res.choices[0].message.content,
+                            version_uuid=batch_run_config.function_model_version_uuid,
+                            prompt_tokens=res.usage["prompt_tokens"],
+                            completion_tokens=res.usage["completion_tokens"],
+                            total_tokens=res.usage["total_tokens"],
+                            latency=getattr(res, "_response_ms", None),
+                            cost=0 if cache_hit else completion_cost(res),
+                            run_log_metadata={"cache_hit": True} if cache_hit else None,
+                            project_uuid=batch_run_config.project_uuid,
+                            batch_run_uuid=batch_run_uuid,
+                            sample_input_uuid=sample_input_row.uuid,
+                        )
+                        .on_conflict_do_nothing(
+                            index_elements=["batch_run_uuid", "sample_input_uuid"],
+                            index_where=RunLog.batch_run_uuid.isnot(None),
+                        )
+                        .returning(RunLog.uuid)
+                    )
+                ).scalar_one_or_none()
+                if run_log_uuid is not None:
+                    session.add(
+                        RunLogScore(
+                            run_log_uuid=run_log_uuid,
+                            eval_metric_uuid=gt_exact_match_metric.uuid,
+                            value=success,
+                        )
                     )
-                    .where(BatchRun.dataset_uuid == dataset_to_run.uuid)
-                    .values(status="completed", score=score, finished_at=datetime.now())
+                await session.commit()
+
+            logger.debug(f"SampleInput {sample_input_row.id} completed")
+
+        # run all sample inputs cuncurrently in asyncronous way
+        sample_tasks = [
+            asyncio.create_task(
+                __async_task__(
+                    model=function_model_version_to_run.model,
+                    sample_input_row=sample_input,
+                    prompt_templates=prompt_templates,
+                    router=litellm_router,
                 )
             )
-            await session.commit()
-            return
-    except Exception as e:
-        logger.error(e)
-        # set BatchRun status = "failed"
+            for sample_input in sample_inputs_to_run
+        ]
+        try:
+            await asyncio.gather(*sample_tasks)
+        except Exception:
+            # the run failed, its other samples are run again when it is resumed
+            for task in sample_tasks:
+                task.cancel()
+            await asyncio.gather(*sample_tasks, return_exceptions=True)
+            raise
+
         async with get_session_context() as session:
-            (
+            # score of all sample inputs, also of the runs before a resume
+            score = (
                 await session.execute(
-                    update(BatchRun)
-                    .where(
-                        BatchRun.function_model_version_uuid
-                        == function_model_version_to_run.uuid
-                    )
-                    .where(BatchRun.dataset_uuid == dataset_to_run.uuid)
-                    .values(status="failed", finished_at=datetime.now())
+                    select(func.avg(RunLogScore.value))
+                    .join(RunLog, RunLog.uuid == RunLogScore.run_log_uuid)
+                    .where(RunLog.batch_run_uuid == batch_run_uuid)
+                    .where(RunLogScore.eval_metric_uuid == gt_exact_match_metric.uuid)
                 )
+            ).scalar_one()
+
+            # update BatchRun status = "completed"
+            await session.execute(
+                update(BatchRun)
+                .where(BatchRun.uuid == batch_run_uuid)
+                .values(status="completed", score=score, finished_at=datetime.now())
             )
             await session.commit()
+        batch_runs_total.labels(status="completed").inc()
+        batch_run_duration_seconds.observe(time.perf_counter() - batch_start_time)
+    except Exception as e:
+        logger.error(e)
+        batch_runs_total.labels(status="failed").inc()
+        await mark_batch_run_failed(batch_run_uuid)
         raise e
 
 
+async def mark_batch_run_failed(batch_run_uuid: str) -> None:
+    """Set BatchRun status = "failed"."""
+    async with get_session_context() as session:
+        await session.execute(
+            update(BatchRun)
+            .where(BatchRun.uuid == batch_run_uuid)
+            .values(status="failed", finished_at=datetime.now())
+        )
+        await session.commit()
+
+
 @router.post("/run_function_model/batch")
 async def batch_run_function_model(
     jwt: Annotated[str, Depends(get_jwt)],
@@ -261,7 +368,6 @@ async def batch_run_function_model(
             detail="Batch run already exists",
         )
 
-    # make router config
     function_model_version_to_run: FunctionModelVersion = (
         await session.execute(
             select(FunctionModelVersion).where(
@@ -295,75 +401,14 @@ async def batch_run_function_model(
         )
     ).scalar_one()
 
-    organization_provider_config: OrganizationLLMProviderConfig = (
-        await session.execute(
-            select(OrganizationLLMProviderConfig)
-            .where(OrganizationLLMProviderConfig.organization_id == organization_id)
-            .where(OrganizationLLMProviderConfig.provider_name == llm_provider)
-        )
-    ).scalar_one_or_none()
+    provider_client = await llm_client_pool.get(session, organization_id, llm_provider)
 
-    if not organization_provider_config:
+    if not provider_client:
         raise HTTPException(
             status_code=status_code.HTTP_403_FORBIDDEN,
             detail=f"Organization doesn't have API keys set for {llm_provider}. Please set API keys in project settings.",
         )
 
-    provider_args = LLMProviderArgs()
-    # get value for key that includes "API_KEY"
-    for key, val in organization_provider_config.env_vars.items():
-        if "api_key" in key.lower():
-            provider_args.api_key = val
-        elif "api_base" in key.lower():
-            provider_args.api_base = val
-        elif "api_version" in key.lower():
-            provider_args.api_version = val
-
-    # TODO: use params later
-    # provider_env_var = dict(organization_provider_config.env_vars)
-    # api_key_key = list(filter(lambda x: "API_KEY" in x, provider_env_var.keys()))[0]
-    # api_base_key = list(filter(lambda x: "API_BASE" in x, provider_env_var.keys()))
-    # if len(api_base_key) > 0:
-    #     api_base_key = api_base_key[0]
-    # else:
-    #     api_base_key = None
-    # api_version_key = list(
-    #     filter(lambda x: "API_VERSION" in x, provider_env_var.keys())
-    # )
-    # if len(api_version_key) > 0:
-    #     api_version_key = api_version_key[0]
-    # else:
-    #     api_version_key = None
-
-    # llm_api_key = provider_env_var[api_key_key]
-    # llm_api_base = provider_env_var[api_base_key] if api_base_key else None
-    # llm_api_version = provider_env_var[api_version_key] if api_version_key else None
-
-    # provider_params = dict(organization_provider_config.params)
-
-    # if "api_base" in provider_params:
-    #     llm_api_base = provider_params["api_base"]
-    #     del provider_params["api_base"]
-    # if "api_version" in provider_params:
-    #     llm_api_version = provider_params["api_version"]
-    #     del provider_params["api_version"]
-
-    litellm_router_config = {
-        "model_list": [
-            {
-                "model_name": function_model_version_to_run.model,
-                "litellm_params": {
-                    "model": function_model_version_to_run.model,
-                    "api_key": provider_args.api_key,
-                    "api_base": provider_args.api_base,
-                    "api_version": provider_args.api_version,
-                },
-            }
-        ]
-    }
-
-    # litellm_router_config["model_list"][0]["litellm_params"].update(provider_params)
-
     # create BatchRun
     batch_run = BatchRun(
         dataset_uuid=batch_run_config.dataset_uuid,
@@ -374,12 +419,31 @@ async def batch_run_function_model(
     await session.commit()
     await session.refresh(batch_run)
 
-    # create backgroundTask
-    background_tasks.add_task(
-        function_model_batch_run_background_task,
-        batch_run_config,
-        str(batch_run.uuid) if type(batch_run.uuid) != str else batch_run.uuid,
-        litellm_router_config,
+    batch_run_uuid = (
+        str(batch_run.uuid) if type(batch_run.uuid) != str else batch_run.uuid
     )
+    if batch_run_queue is not None:
+        # run by a batch run worker
+        try:
+            await batch_run_queue.enqueue(
+                {
+                    "batch_run_uuid": batch_run_uuid,
+                    "batch_run_config": batch_run_config.model_dump(),
+                }
+            )
+        except Exception as error:
+            logger.error(f"Error enqueueing batch run: {error}")
+            await mark_batch_run_failed(batch_run_uuid)
+            raise HTTPException(
+                status_code=status_code.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Batch run queue is not available",
+            )
+    else:
+        # create backgroundTask
+        background_tasks.add_task(
+            function_model_batch_run_background_task,
+            batch_run_config,
+            batch_run_uuid,
+        )
 
     return Response(status_code=200)
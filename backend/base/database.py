@@ -7,6 +7,8 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 from settings import Settings
+from base.metrics import instrument_engine
+from base.query_profiler import QueryProfiler
 
 settings = Settings()
 
@@ -26,6 +28,17 @@ if test_mode:
 else:
     engine = create_async_engine(SQLALCHEMY_DATABASE_URL, echo=False)
 
+instrument_engine(engine)
+
+# opt-in slow query & N+1 profiler, None if disabled
+query_profiler = None
+if settings.QUERY_PROFILER:
+    query_profiler = QueryProfiler(
+        slow_query_ms=settings.QUERY_PROFILER_SLOW_MS,
+        n_plus_one_threshold=settings.QUERY_PROFILER_N_PLUS_ONE_THRESHOLD,
+    )
+    query_profiler.attach(engine)
+
 async_session = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False, autocommit=False
 )
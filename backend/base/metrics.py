@@ -0,0 +1,240 @@
+"""Prometheus metrics.
+
+Served as text exposition format on /metrics. Route labels use the route template
+(e.g. /api/web/projects/{uuid}), so label cardinality is bounded.
+"""
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# HTTP
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Time until the whole response (including streamed bodies) is sent",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+http_requests_in_progress = Gauge(
+    "http_requests_in_progress", "Requests being handled", ["method"]
+)
+streaming_responses_active = Gauge(
+    "streaming_responses_active", "Responses currently streaming a body", ["route"]
+)
+
+# DB
+db_queries_per_request = Histogram(
+    "db_queries_per_request",
+    "Number of SQL statements executed while handling a request",
+    ["route"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+db_time_per_request_seconds = Histogram(
+    "db_time_per_request_seconds",
+    "Total SQL statement time while handling a request",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+db_query_duration_seconds = Histogram(
+    "db_query_duration_seconds",
+    "SQL statement execution time",
+    buckets=LATENCY_BUCKETS,
+)
+
+# CLI websocket connections
+websocket_connected_clis = Gauge(
+    "websocket_connected_clis", "CLIs connected through websocket"
+)
+websocket_pending_requests = Gauge(
+    "websocket_pending_requests", "Requests sent to CLIs waiting for a response"
+)
+websocket_queued_responses = Gauge(
+    "websocket_queued_responses", "Responses from CLIs queued and not consumed yet"
+)
+websocket_queued_server_tasks = Gauge(
+    "websocket_queued_server_tasks",
+    "Server tasks (e.g. SYNC_CODE) from CLIs queued and not started yet",
+)
+
+# Batch runs
+batch_runs_total = Counter("batch_runs_total", "Finished batch runs", ["status"])
+batch_run_samples_total = Counter(
+    "batch_run_samples_total", "Sample inputs run in batch runs", ["status"]
+)
+batch_run_duration_seconds = Histogram(
+    "batch_run_duration_seconds",
+    "Duration of whole batch runs",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+batch_run_queue_jobs_total = Counter(
+    "batch_run_queue_jobs_total",
+    "Batch run jobs handled by workers by result (completed, failed, dropped, lost)",
+    ["status"],
+)
+batch_run_queue_active_jobs = Gauge(
+    "batch_run_queue_active_jobs", "Batch run jobs running in the worker"
+)
+
+# LLM providers
+llm_request_duration_seconds = Histogram(
+    "llm_request_duration_seconds",
+    "LLM provider call duration, until the last chunk for streams",
+    ["model", "source"],
+    buckets=LATENCY_BUCKETS,
+)
+llm_requests_total = Counter(
+    "llm_requests_total", "LLM provider calls", ["model", "source", "status"]
+)
+llm_rate_limit_wait_seconds = Histogram(
+    "llm_rate_limit_wait_seconds",
+    "Time LLM calls waited for their organization's provider rate limits",
+    ["provider", "lane"],
+    buckets=LATENCY_BUCKETS,
+)
+llm_rate_limit_waiting = Gauge(
+    "llm_rate_limit_waiting", "LLM calls waiting for rate limit capacity", ["lane"]
+)
+llm_client_pool_lookups_total = Counter(
+    "llm_client_pool_lookups_total",
+    "LLM client pool lookups by result (hit, config_miss, miss, not_found)",
+    ["result"],
+)
+llm_client_pool_size = Gauge(
+    "llm_client_pool_size", "Organization LLM provider configs with pooled clients"
+)
+
+
+class RequestDBStats:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# DB stats of the request being handled. Propagates to SQLAlchemy's greenlets & child tasks.
+request_db_stats: ContextVar[Optional[RequestDBStats]] = ContextVar(
+    "request_db_stats", default=None
+)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Count SQL statements and their time, per request."""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times: List[float] = conn.info.get("query_start_time")
+        if not start_times:
+            return
+        elapsed = time.perf_counter() - start_times.pop()
+        db_query_duration_seconds.observe(elapsed)
+        stats = request_db_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+
+
+def instrument_connection_manager(manager: Any) -> None:
+    """Read ConnectionManager state on scrape."""
+    websocket_connected_clis.set_function(lambda: len(manager.connected_locals))
+    websocket_pending_requests.set_function(lambda: len(manager.pending_requests))
+    websocket_queued_responses.set_function(
+        lambda: sum(queue.qsize() for queue in list(manager.responses.values()))
+    )
+    websocket_queued_server_tasks.set_function(
+        lambda: sum(
+            queue.qsize() for queue in list(manager.server_task_queues.values())
+        )
+    )
+
+
+def observe_llm_request(model: Optional[str], source: str, seconds: float, error: bool):
+    model = model or "unknown"
+    llm_request_duration_seconds.labels(model=model, source=source).observe(seconds)
+    llm_requests_total.labels(
+        model=model, source=source, status="error" if error else "success"
+    ).inc()
+
+
+def get_route_template(scope: Dict[str, Any]) -> str:
+    route = scope.get("route")
+    if route is None or not getattr(route, "path", None):
+        # unmatched paths are not used as labels
+        return "unmatched"
+    path = scope.get("path", "")
+    if route.path_regex.match(path):
+        return route.path
+    # route of an included router may only know its path relative to the router prefix
+    try:
+        suffix = route.path_format.format(**scope.get("path_params", {}))
+    except (KeyError, IndexError, ValueError):
+        return route.path
+    if path.endswith(suffix):
+        return path[: len(path) - len(suffix)] + route.path
+    return route.path
+
+
+class PrometheusMiddleware:
+    """ASGI middleware measuring requests until their last body chunk is sent,
+    so StreamingResponses are measured as a whole and background tasks are not."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        start_time = time.perf_counter()
+        stats = RequestDBStats()
+        token = request_db_stats.set(stats)
+        state = {"status": 500, "streaming": False, "done": False}
+        http_requests_in_progress.labels(method=method).inc()
+
+        def finish():
+            if state["done"]:
+                return
+            state["done"] = True
+            route = get_route_template(scope)
+            http_requests_in_progress.labels(method=method).dec()
+            if state["streaming"]:
+                streaming_responses_active.labels(route=route).dec()
+            http_request_duration_seconds.labels(
+                method=method, route=route, status=str(state["status"])
+            ).observe(time.perf_counter() - start_time)
+            db_queries_per_request.labels(route=route).observe(stats.queries)
+            db_time_per_request_seconds.labels(route=route).observe(stats.seconds)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                more_body = message.get("more_body", False)
+                if more_body and not state["streaming"]:
+                    state["streaming"] = True
+                    streaming_responses_active.labels(
+                        route=get_route_template(scope)
+                    ).inc()
+                await send(message)
+                if not more_body:
+                    finish()
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_db_stats.reset(token)
+            finish()
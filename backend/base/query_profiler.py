@@ -0,0 +1,237 @@
+"""Opt-in SQL profiler for finding slow queries and N+1 query patterns.
+
+Enable with QUERY_PROFILER=true. Every statement of a request is recorded with its time.
+Statements are grouped by shape (whitespace collapsed, literals and parameter lists replaced),
+and a shape executed QUERY_PROFILER_N_PLUS_ONE_THRESHOLD or more times in one request
+is flagged as an N+1 candidate. Offending requests are logged, and the worst offenders
+per route are served by GET /debug/query_profile (DELETE resets them).
+
+The report holds SQL statements and code locations, so /debug/query_profile is only served
+if QUERY_PROFILER_TOKEN is set, to requests with "Authorization: Bearer <token>".
+"""
+import re
+import hmac
+import time
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Security
+from fastapi.security.api_key import APIKeyHeader
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette import status as status_code
+
+from base.metrics import get_route_template
+from utils.logger import logger
+
+profiler_logger = logger.get_child("query_profiler")
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMETER = re.compile(r"\$\d+|%\(\w+\)s|:\w+|\?")
+_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def statement_shape(statement: str) -> str:
+    """Normalize a statement, so executions of the same query with different values match."""
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _STRING_LITERAL.sub("?", shape)
+    shape = _PARAMETER.sub("?", shape)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    # IN lists & multi-row VALUES of different lengths
+    return _PARAMETER_LIST.sub("(?)", shape)
+
+
+class RequestQueryLog:
+    __slots__ = ("statements",)
+
+    def __init__(self):
+        # (statement, seconds)
+        self.statements: List[Tuple[str, float]] = []
+
+
+class ShapeStats:
+    __slots__ = (
+        "executions",
+        "total_seconds",
+        "max_seconds",
+        "max_per_request",
+        "n_plus_one_requests",
+        "slow_executions",
+    )
+
+    def __init__(self):
+        self.executions = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.max_per_request = 0
+        self.n_plus_one_requests = 0
+        self.slow_executions = 0
+
+    def model_dump(self) -> Dict[str, Any]:
+        return {
+            "executions": self.executions,
+            "total_ms": round(self.total_seconds * 1000, 3),
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "max_per_request": self.max_per_request,
+            "n_plus_one_requests": self.n_plus_one_requests,
+            "slow_executions": self.slow_executions,
+        }
+
+
+class QueryProfiler:
+    def __init__(
+        self,
+        slow_query_ms: float = 100,
+        n_plus_one_threshold: int = 5,
+        max_statements_per_request: int = 2000,
+        max_shapes_per_route: int = 50,
+    ):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.max_statements_per_request = max_statements_per_request
+        self.max_shapes_per_route = max_shapes_per_route
+        self.current: ContextVar[Optional[RequestQueryLog]] = ContextVar(
+            "request_query_log", default=None
+        )
+        # route -> {"requests": int, "shapes": {shape: ShapeStats}}
+        self.routes: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, engine: AsyncEngine) -> None:
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if self.current.get() is not None:
+                conn.info.setdefault("profiler_start_time", []).append(
+                    time.perf_counter()
+                )
+
+        @event.listens_for(engine.sync_engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            query_log = self.current.get()
+            start_times: List[float] = conn.info.get("profiler_start_time")
+            if query_log is None or not start_times:
+                return
+            elapsed = time.perf_counter() - start_times.pop()
+            if len(query_log.statements) < self.max_statements_per_request:
+                query_log.statements.append((statement, elapsed))
+
+    def record(self, route: str, query_log: RequestQueryLog) -> None:
+        """Aggregate a finished request, and log its slow queries & N+1 candidates."""
+        per_request: Dict[str, List[float]] = {}
+        for statement, seconds in query_log.statements:
+            per_request.setdefault(statement_shape(statement), []).append(seconds)
+
+        n_plus_one = []
+        slow = []
+        with self._lock:
+            route_stats = self.routes.setdefault(route, {"requests": 0, "shapes": {}})
+            route_stats["requests"] += 1
+            shapes: Dict[str, ShapeStats] = route_stats["shapes"]
+            for shape, timings in per_request.items():
+                stats = shapes.get(shape)
+                if stats is None:
+                    stats = shapes[shape] = ShapeStats()
+                stats.executions += len(timings)
+                stats.total_seconds += sum(timings)
+                stats.max_seconds = max(stats.max_seconds, max(timings))
+                stats.max_per_request = max(stats.max_per_request, len(timings))
+                slow_count = sum(
+                    1 for seconds in timings if seconds >= self.slow_query_seconds
+                )
+                stats.slow_executions += slow_count
+                if len(timings) >= self.n_plus_one_threshold:
+                    stats.n_plus_one_requests += 1
+                    n_plus_one.append((shape, len(timings), sum(timings)))
+                if slow_count:
+                    slow.append((shape, max(timings)))
+
+            if len(shapes) > self.max_shapes_per_route:
+                # keep the most expensive shapes
+                for shape, _ in sorted(
+                    shapes.items(), key=lambda item: item[1].total_seconds
+                )[: len(shapes) - self.max_shapes_per_route]:
+                    del shapes[shape]
+
+        if n_plus_one or slow:
+            profiler_logger.info(
+                f"Query profile of {route}",
+                statements=len(query_log.statements),
+                n_plus_one=[
+                    {"shape": shape, "count": count, "total_ms": round(seconds * 1000, 3)}
+                    for shape, count, seconds in n_plus_one
+                ],
+                slow=[
+                    {"shape": shape, "max_ms": round(seconds * 1000, 3)}
+                    for shape, seconds in slow
+                ],
+            )
+
+    def report(self, limit: int = 10) -> Dict[str, Any]:
+        """Worst offenders per route: N+1 candidates first, then by total time."""
+        with self._lock:
+            report = {}
+            for route, route_stats in self.routes.items():
+                shapes = sorted(
+                    route_stats["shapes"].items(),
+                    key=lambda item: (
+                        item[1].n_plus_one_requests,
+                        item[1].total_seconds,
+                    ),
+                    reverse=True,
+                )[:limit]
+                report[route] = {
+                    "requests": route_stats["requests"],
+                    "shapes": [
+                        {"shape": shape, **stats.model_dump()}
+                        for shape, stats in shapes
+                    ],
+                }
+            return report
+
+    def reset(self) -> None:
+        with self._lock:
+            self.routes = {}
+
+
+class QueryProfilerMiddleware:
+    """ASGI middleware collecting the statements of each request (including streamed bodies)."""
+
+    def __init__(self, app, profiler: QueryProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith("/debug/"):
+            await self.app(scope, receive, send)
+            return
+
+        query_log = RequestQueryLog()
+        token = self.profiler.current.set(query_log)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.current.reset(token)
+            try:
+                self.profiler.record(get_route_template(scope), query_log)
+            except Exception as error:
+                profiler_logger.error(f"Error recording query profile: {error}")
+
+
+def query_profiler_auth(token: str):
+    """Dependency of the /debug/query_profile routes, checking the bearer token."""
+    authorization_header = APIKeyHeader(name="Authorization", auto_error=False)
+
+    async def check(authorization: Optional[str] = Security(authorization_header)):
+        given = ""
+        if authorization and authorization.lower().startswith("bearer "):
+            given = authorization[7:]
+        if not given or not hmac.compare_digest(given.encode(), token.encode()):
+            raise HTTPException(
+                status_code=status_code.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+            )
+
+    return check
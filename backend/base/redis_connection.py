@@ -0,0 +1,15 @@
+"""Shared Redis client."""
+import os
+from redis import asyncio as aioredis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+redis_host = os.environ.get("REDIS_HOST", "localhost")
+redis_port = os.environ.get("REDIS_PORT", 6379)
+try:
+    redis_port = int(redis_port)
+except ValueError:
+    redis_port = 6379
+redis_password = os.environ.get("REDIS_PASSWORD", None)
+redis = aioredis.Redis(host=redis_host, port=redis_port, db=0, password=redis_password)
@@ -1,3 +1,4 @@
+import os
 import json
 import asyncio
 from collections import defaultdict
@@ -13,8 +14,20 @@ from fastapi import WebSocket
 
 from base.database import get_session, get_session_context
 from utils.logger import logger
+from base.metrics import instrument_connection_manager
 from db_models import *
 from crud import update_instances, pull_instances, save_instances, disconnect_local
+from modules.presence import cli_presence, CLI_PRESENCE_HEARTBEAT_INTERVAL
+from modules.code_inventory import code_inventory_cache, code_inventory_from_sync
+
+# hot paths, sampled with LOG_SAMPLING="websocket.receive=...,websocket.send=..."
+receive_logger = logger.get_child("websocket.receive")
+send_logger = logger.get_child("websocket.send")
+
+# server tasks (e.g. SYNC_CODE) a local can have queued behind the running one, more are rejected
+WEBSOCKET_SERVER_TASK_QUEUE_SIZE = int(
+    os.environ.get("WEBSOCKET_SERVER_TASK_QUEUE_SIZE", 16)
+)
 
 
 class LocalTask(str, Enum):
@@ -45,6 +58,13 @@ class ConnectionManager:
         self.pending_requests: Dict[str, asyncio.Event] = {}
         # Store for the responses. Maps correlation IDs to message content.
         self.responses: Dict[str, Queue] = defaultdict(Queue)
+        # Store for the server tasks received from locals, handled by one worker per local.
+        self.server_task_queues: Dict[str, Queue] = {}
+        self.server_task_workers: Dict[str, asyncio.Task] = {}
+        # Projects of the connected locals (known on connect with CLI presence, or once synced),
+        # for CLI presence & code inventories. Maps tokens to project uuids.
+        self.connected_projects: Dict[str, str] = {}
+        self.heartbeat_task: Optional[asyncio.Task] = None
 
     async def connect(self, websocket: WebSocket, token: str):
         """Accept a websocket connection from a local server."""
@@ -53,17 +73,22 @@ class ConnectionManager:
         # Create and store a new queue for this local server
         # self.local_queues[token] = asyncio.Queue()
         await self._set_local_online_status(token, True)
+        self._start_server_task_worker(token)
         # Start a dedicated reader task for this local server
         task = asyncio.create_task(self.websocket_reader(websocket, token))
         return task
 
     async def websocket_reader(self, websocket: WebSocket, token: str):
-        """Read messages from the websocket and put them in the appropriate queue/cache."""
+        """Read messages from the websocket and put them in the appropriate queue/cache.
+
+        Only parses and routes messages, so handling a server task doesn't hold up the
+        responses of other requests & streams of the local.
+        """
         while True:
             try:
                 message = await websocket.receive_text()
                 data = json.loads(message)
-                logger.debug(f"Received data : {data}")
+                receive_logger.debug("Received data", data=data)
                 correlation_id = data.get("correlation_id")
 
                 if correlation_id and correlation_id in self.pending_requests:
@@ -73,23 +98,89 @@ class ConnectionManager:
                             correlation_id
                         ].set()  # Signal the event that the response has arrived
                 else:
-                    await self.task_handler(token, data)
+                    await self._queue_server_task(token, data)
                     # await self.agent_queues[token].put(data)
             except Exception as error:
                 logger.error(f"Error reading from websocket for token {token}: {error}")
                 break
         # Cleanup when the reader ends (because the websocket closed or there was an error)
-        await self.disconnect(token)
+        await self.disconnect(token, websocket)
 
-    async def disconnect(self, token: str):
+    async def disconnect(self, token: str, websocket: Optional[WebSocket] = None):
+        """Clean up the connection of a local. If websocket is given and the local has
+        reconnected since (with the same token), the new connection is left as is."""
+        if websocket is not None and self.connected_locals.get(token) is not websocket:
+            return
         if token in self.connected_locals:
             del self.connected_locals[token]
+        self._stop_server_task_worker(token)
+        project_uuid = self.connected_projects.get(token)
+        if project_uuid is not None:
+            await code_inventory_cache.delete(project_uuid)
         # if token in self.agent_queues:
         #     del self.agent_queues[token]
         await self._set_local_online_status(token, False)
+        self.connected_projects.pop(token, None)
+
+    def _start_server_task_worker(self, token: str):
+        self._stop_server_task_worker(token)
+        queue = Queue(maxsize=WEBSOCKET_SERVER_TASK_QUEUE_SIZE)
+        self.server_task_queues[token] = queue
+        self.server_task_workers[token] = asyncio.create_task(
+            self.server_task_worker(token, queue)
+        )
+
+    def _stop_server_task_worker(self, token: str):
+        """Cancel the server tasks of a local. A cancelled task's transaction is rolled back,
+        the local syncs again when it reconnects."""
+        self.server_task_queues.pop(token, None)
+        worker = self.server_task_workers.pop(token, None)
+        if worker is not None:
+            worker.cancel()
+
+    async def _queue_server_task(self, token: str, data: dict):
+        queue = self.server_task_queues.get(token)
+        if queue is None:
+            logger.error(f"No server task worker for token {token}")
+            return
+        try:
+            queue.put_nowait(data)
+        except asyncio.QueueFull:
+            logger.error(
+                f"Too many server tasks queued for token {token}, rejected {data.get('type')}"
+            )
+            ws = self.connected_locals.get(token)
+            if ws and data.get("correlation_id"):
+                # don't leave the local waiting for the response
+                await ws.send_text(
+                    json.dumps(
+                        {
+                            "type": data.get("type"),
+                            "status": "failed",
+                            "correlation_id": data["correlation_id"],
+                            "log": "Too many tasks queued",
+                        }
+                    )
+                )
+
+    async def server_task_worker(self, token: str, queue: Queue):
+        """Handle the server tasks of a local one at a time, in the order they were received,
+        so e.g. two SYNC_CODEs of a local don't race. Tasks of different locals run concurrently.
+        """
+        while True:
+            data = await queue.get()
+            try:
+                await self.task_handler(token, data)
+            except Exception as error:
+                logger.error(f"Error handling server task for token {token}: {error}")
+            finally:
+                queue.task_done()
 
     async def _set_local_online_status(self, token: str, online: bool):
-        """Update agent's online status in the Supabase database."""
+        """Update agent's online status in the Supabase database, or in CLI presence if enabled."""
+        if cli_presence is not None:
+            await self._set_local_presence(token, online)
+            return
         try:
             if not online:
                 await disconnect_local(token=token)
@@ -104,6 +195,54 @@ class ConnectionManager:
         except Exception as error:
             logger.error(f"Error updating online status for token {token}: {error}")
 
+    async def _set_local_presence(self, token: str, online: bool):
+        """Set CLI presence without writing to the DB. The cli_access_key of the project is
+        kept on disconnect, so the CLI can reconnect without /project/cli_connect writing it."""
+        if not online:
+            project_uuid = self.connected_projects.get(token)
+            if project_uuid is not None:
+                await cli_presence.disconnect(project_uuid, token)
+            return
+        try:
+            async with get_session_context() as session:
+                project_uuid = (
+                    await session.execute(
+                        select(Project.uuid).where(Project.cli_access_key == token)
+                    )
+                ).scalar_one_or_none()
+        except Exception as error:
+            logger.error(f"Error reading project for token {token}: {error}")
+            return
+        if project_uuid is None:
+            logger.error(f"Project not found for token {token}")
+            return
+        self.connected_projects[token] = str(project_uuid)
+        await cli_presence.connect(str(project_uuid), token)
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def _heartbeat(self):
+        """Refresh the presence of connected locals until none is left."""
+        while self.connected_projects:
+            await asyncio.sleep(CLI_PRESENCE_HEARTBEAT_INTERVAL)
+            await cli_presence.heartbeat(
+                {
+                    project_uuid: token
+                    for token, project_uuid in list(self.connected_projects.items())
+                }
+            )
+
+    async def shutdown(self):
+        """Remove the presence of connected locals, so they can reconnect to another server
+        right away instead of after the presence TTL."""
+        if cli_presence is None:
+            return
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        for token, project_uuid in list(self.connected_projects.items()):
+            await cli_presence.disconnect(project_uuid, token)
+        self.connected_projects.clear()
+
     async def send_message(
         self,
         token: str,
@@ -116,11 +255,7 @@ class ConnectionManager:
             try:
                 message["type"] = type.value
                 await ws.send_text(json.dumps(message))
-                logger.success(
-                    f"""Sent message to local.
-  - Token: {token}
-  - Message: {message}"""
-                )
+                send_logger.success("Sent message to local.", token=token, payload=message)
             except Exception as error:
                 logger.error(
                     f"""Error sending message to local: {error}
@@ -144,11 +279,7 @@ class ConnectionManager:
             try:
                 message["type"] = type.value
                 await ws.send_text(json.dumps(message))
-                logger.success(
-                    f"""Sent request to local.
-    - Token: {token}
-    - Message: {message}"""
-                )
+                send_logger.success("Sent request to local.", token=token, payload=message)
                 event = asyncio.Event()
                 self.pending_requests[correlation_id] = event
 
@@ -175,7 +306,7 @@ class ConnectionManager:
 
         Stream Dict[str, Any] until done.
         """
-        logger.debug("start stream")
+        send_logger.debug("start stream")
         ws = self.connected_locals.get(token)
         if ws:
             correlation_id = str(uuid4())  # Generate unique correlation ID
@@ -184,10 +315,8 @@ class ConnectionManager:
             try:
                 message["type"] = task_type.value
                 await ws.send_text(json.dumps(message))
-                logger.success(
-                    f"""Sent stream request to local.
-    - Token: {token}
-    - Message: {message}"""
+                send_logger.success(
+                    "Sent stream request to local.", token=token, payload=message
                 )
                 # stream response from local
                 event = asyncio.Event()
@@ -434,6 +563,12 @@ class ConnectionManager:
                         session.add_all(changelogs_rows)
                         await session.commit()
 
+                    # listings of the dev APIs are served from the synced code
+                    self.connected_projects[token] = str(project_uuid)
+                    await code_inventory_cache.set(
+                        project_uuid, code_inventory_from_sync(data)
+                    )
+
                     ws = self.connected_locals.get(token)
                     response_data = {
                         "type": "SYNC_CODE",
@@ -450,3 +585,4 @@ class ConnectionManager:
 
 
 websocket_manager = ConnectionManager()
+instrument_connection_manager(websocket_manager)
@@ -0,0 +1,443 @@
+"""Load test for the SDK-facing /api/cli endpoints.
+
+Drives a fixed number of concurrent clients against /api/cli/run_log, /chat_log,
+/check_update and /function_model_versions of a running server, and reports
+p50/p95/p99 latency and throughput per endpoint, DB connections in use (sampled from
+pg_stat_activity) and SQL statements per request (from /metrics).
+Results are stored as JSON, to compare runs across commits.
+
+Setup (from the repo root):
+    docker compose -f docker-compose.dev.yml up -d db redis
+    cd backend && alembic upgrade head && uvicorn main:app --port 8000
+
+Usage (from backend/):
+    python seed.py --benchmark-project > benchmarks/results/project.json
+    python -m benchmarks.cli_load_test --project benchmarks/results/project.json \\
+        --concurrency 64 --duration 30
+    python -m benchmarks.cli_load_test --project benchmarks/results/project.json \\
+        --compare benchmarks/results/<baseline>.json
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from prometheus_client.parser import text_string_to_metric_families
+
+load_dotenv()
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+ENDPOINT_ROUTES = {
+    "run_log": "/api/cli/run_log",
+    "chat_log": "/api/cli/chat_log",
+    "check_update": "/api/cli/check_update",
+    "function_model_versions": "/api/cli/function_model_versions",
+}
+DEFAULT_MIX = "run_log=4,chat_log=2,check_update=1,function_model_versions=1"
+
+# ~ realistic completion sizes
+WORDS = "the of and to in is you that it he was for on are as with his they at be".split()
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name.strip() not in ENDPOINT_ROUTES:
+            raise ValueError(f"Unknown endpoint {name}")
+        mix[name.strip()] = int(weight)
+    return mix
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def fake_text(words: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(words))
+
+
+def fake_api_response(content: str, model: str = "gpt-3.5-turbo") -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": 120,
+            "completion_tokens": len(content.split()),
+            "total_tokens": 120 + len(content.split()),
+        },
+        "response_ms": random.uniform(300, 3000),
+    }
+
+
+def make_request(name: str, project: Dict[str, Any]) -> Dict[str, Any]:
+    """httpx request kwargs of a call to an endpoint."""
+    if name == "run_log":
+        return {
+            "method": "POST",
+            "url": ENDPOINT_ROUTES[name],
+            "params": {"version_uuid": project["function_model_version_uuid"]},
+            "json": {
+                "uuid": str(uuid.uuid4()),
+                "api_response": fake_api_response(fake_text(random.randint(20, 400))),
+                "inputs": {"question": fake_text(30)},
+                "parsed_outputs": {},
+                "metadata": {"benchmark": True},
+            },
+        }
+    if name == "chat_log":
+        answer = fake_text(random.randint(20, 400))
+        return {
+            "method": "POST",
+            "url": ENDPOINT_ROUTES[name],
+            "params": {"session_uuid": random.choice(project["chat_session_uuids"])},
+            "json": [
+                {
+                    "uuid": str(uuid.uuid4()),
+                    "message": {"role": "user", "content": fake_text(30)},
+                },
+                {
+                    "uuid": str(uuid.uuid4()),
+                    "message": {"role": "assistant", "content": answer},
+                    "api_response": fake_api_response(answer),
+                },
+            ],
+        }
+    if name == "check_update":
+        # an outdated cache, so the whole project status is fetched
+        return {
+            "method": "GET",
+            "url": ENDPOINT_ROUTES[name],
+            "params": {"cached_version": 0},
+        }
+    return {
+        "method": "GET",
+        "url": ENDPOINT_ROUTES[name],
+        "params": {"function_model_name": project["function_model_name"]},
+    }
+
+
+async def worker(
+    client: httpx.AsyncClient,
+    project: Dict[str, Any],
+    pick_endpoint: Callable[[], str],
+    deadline: float,
+    warmup_until: float,
+    latencies: Dict[str, List[float]],
+    errors: Dict[str, List[str]],
+):
+    while time.perf_counter() < deadline:
+        name = pick_endpoint()
+        request = make_request(name, project)
+        start = time.perf_counter()
+        error = None
+        try:
+            response = await client.request(**request)
+            if response.status_code != 200:
+                error = f"status {response.status_code}"
+        except httpx.HTTPError as exc:
+            error = repr(exc)
+        if start < warmup_until:
+            continue
+        if error:
+            errors[name].append(error)
+        else:
+            latencies[name].append((time.perf_counter() - start) * 1000)
+
+
+async def sample_db_connections(
+    stop: asyncio.Event, interval: float, samples: List[Tuple[int, int]]
+):
+    """Sample (total, active) connections to the database from pg_stat_activity."""
+    import asyncpg
+
+    conn = await asyncpg.connect(
+        user=os.environ.get("POSTGRES_USER"),
+        password=os.environ.get("POSTGRES_PASSWORD"),
+        database=os.environ.get("POSTGRES_DB"),
+        host=os.environ.get("POSTGRES_HOST"),
+        port=os.environ.get("POSTGRES_PORT", 5432),
+    )
+    try:
+        while not stop.is_set():
+            row = await conn.fetchrow(
+                "SELECT count(*) AS total, count(*) FILTER (WHERE state = 'active') AS active "
+                "FROM pg_stat_activity "
+                "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+            )
+            samples.append((row["total"], row["active"]))
+            await asyncio.sleep(interval)
+    finally:
+        await conn.close()
+
+
+async def scrape_db_queries(client: httpx.AsyncClient) -> Dict[str, Tuple[float, float]]:
+    """route -> (sum, count) of the db_queries_per_request histogram."""
+    try:
+        response = await client.get("/metrics")
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return {}
+    stats: Dict[str, List[float]] = {}
+    for family in text_string_to_metric_families(response.text):
+        if family.name != "db_queries_per_request":
+            continue
+        for sample in family.samples:
+            route = sample.labels.get("route")
+            if sample.name.endswith("_sum"):
+                stats.setdefault(route, [0.0, 0.0])[0] = sample.value
+            elif sample.name.endswith("_count"):
+                stats.setdefault(route, [0.0, 0.0])[1] = sample.value
+    return {route: (value[0], value[1]) for route, value in stats.items()}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(
+    latencies: List[float], errors: List[str], seconds: float
+) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput": round(len(latencies) / seconds, 2),
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1] if latencies else None,
+        "sample_errors": errors[:5],
+    }
+
+
+async def run(args, project: Dict[str, Any]) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    names = list(mix.keys())
+    weights = [mix[name] for name in names]
+    pick_endpoint = lambda: random.choices(names, weights)[0]
+
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, List[str]] = {name: [] for name in names}
+    connection_samples: List[Tuple[int, int]] = []
+
+    headers = {"Authorization": f"Bearer {project['api_key']}"}
+    limits = httpx.Limits(max_connections=args.concurrency + 5)
+    async with httpx.AsyncClient(
+        base_url=args.base_url,
+        headers=headers,
+        limits=limits,
+        timeout=httpx.Timeout(args.timeout),
+    ) as client:
+        queries_before = await scrape_db_queries(client)
+
+        stop = asyncio.Event()
+        sampler = None
+        if not args.no_db_sampling:
+            sampler = asyncio.create_task(
+                sample_db_connections(stop, args.sample_interval, connection_samples)
+            )
+
+        start = time.perf_counter()
+        warmup_until = start + args.warmup
+        deadline = warmup_until + args.duration
+        await asyncio.gather(
+            *[
+                worker(
+                    client,
+                    project,
+                    pick_endpoint,
+                    deadline,
+                    warmup_until,
+                    latencies,
+                    errors,
+                )
+                for _ in range(args.concurrency)
+            ]
+        )
+        seconds = time.perf_counter() - warmup_until
+        stop.set()
+        if sampler is not None:
+            try:
+                await sampler
+            except Exception as error:
+                print(f"DB connection sampling failed: {error!r}")
+
+        queries_after = await scrape_db_queries(client)
+
+    queries_per_request = {}
+    for name in names:
+        before = queries_before.get(ENDPOINT_ROUTES[name], (0.0, 0.0))
+        after = queries_after.get(ENDPOINT_ROUTES[name])
+        if after and after[1] > before[1]:
+            queries_per_request[name] = round(
+                (after[0] - before[0]) / (after[1] - before[1]), 2
+            )
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    all_errors = [error for values in errors.values() for error in values]
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": mix,
+        },
+        "total": summarize(all_latencies, all_errors, seconds),
+        "endpoints": {
+            name: summarize(latencies[name], errors[name], seconds) for name in names
+        },
+        "db_connections": {
+            "peak": max((total for total, _ in connection_samples), default=None),
+            "peak_active": max(
+                (active for _, active in connection_samples), default=None
+            ),
+            "mean": round(
+                sum(total for total, _ in connection_samples) / len(connection_samples),
+                2,
+            )
+            if connection_samples
+            else None,
+        },
+        "db_queries_per_request": queries_per_request,
+    }
+
+
+def format_ms(value: Optional[float]) -> str:
+    return f"{value:.1f}" if value is not None else "-"
+
+
+def print_result(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    print(
+        f"commit {result['commit']}, concurrency {result['config']['concurrency']}, "
+        f"{result['config']['duration']}s"
+    )
+    print(
+        f"{'endpoint':<26}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}"
+        f"{'errors':>8}{'queries':>9}"
+    )
+    rows = [("total", result["total"])] + list(result["endpoints"].items())
+    for name, stats in rows:
+        queries = result["db_queries_per_request"].get(name)
+        print(
+            f"{name:<26}{stats['throughput']:>10.1f}{format_ms(stats['p50_ms']):>10}"
+            f"{format_ms(stats['p95_ms']):>10}{format_ms(stats['p99_ms']):>10}"
+            f"{stats['errors']:>8}{queries if queries is not None else '-':>9}"
+        )
+        if baseline is None:
+            continue
+        base = (
+            baseline["total"]
+            if name == "total"
+            else baseline.get("endpoints", {}).get(name)
+        )
+        if not base:
+            continue
+        deltas = []
+        for key in ["throughput", "p50_ms", "p95_ms", "p99_ms"]:
+            if stats[key] and base.get(key):
+                deltas.append(f"{(stats[key] / base[key] - 1) * 100:+.1f}%")
+            else:
+                deltas.append("-")
+        print(
+            f"{'  vs ' + str(baseline.get('commit')):<26}"
+            + "".join(f"{delta:>10}" for delta in deltas)
+        )
+    connections = result["db_connections"]
+    print(
+        f"DB connections: peak {connections['peak']}, peak active "
+        f"{connections['peak_active']}, mean {connections['mean']}"
+    )
+
+
+def load_project(args) -> Dict[str, Any]:
+    if args.project:
+        with open(args.project) as file:
+            return json.load(file)
+    import psycopg2
+    from seed import db_params, seed_benchmark_project
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        return seed_benchmark_project(conn)
+    finally:
+        conn.close()
+
+
+def main(args):
+    project = load_project(args)
+    result = asyncio.run(run(args, project))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(result, file, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_result(result, baseline)
+    print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument(
+        "--project",
+        help="JSON printed by `python seed.py --benchmark-project`. "
+        "A new benchmark project is seeded if omitted.",
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument(
+        "--no-db-sampling",
+        action="store_true",
+        help="don't sample pg_stat_activity (e.g. without access to the database)",
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join(
+            RESULTS_DIR,
+            f"cli_load_{git_commit() or 'unknown'}_{datetime.now().strftime('%Y%m%d%H%M%S')}.json",
+        ),
+    )
+    parser.add_argument("--compare", help="previous results JSON to compare with")
+    main(parser.parse_args())
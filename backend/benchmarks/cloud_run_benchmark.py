@@ -0,0 +1,262 @@
+"""Benchmark of batch runs and cloud runs against benchmarks/mock_llm_server.py.
+
+batch: seeds a dataset of N sample inputs, starts /api/web/run_function_model/batch and polls
+    the version's batch runs until it finishes. Reports wall time, the span in which the mock
+    LLM was busy, the max concurrent LLM requests the batch reached, and retries (429s / 500s).
+stream: opens concurrent /api/web/run_function_model streams and reports time to first token
+    and total time, and the server's overhead: the mean time to first token minus the mock's
+    mean sampled first-token latency.
+
+The project's organization must point its "openai" provider at the mock server;
+a project seeded by this script (no --project) does.
+
+Usage (from backend/), with the server and the mock LLM server running:
+    python -m benchmarks.mock_llm_server --port 9000 --latency-ms 500 &
+    python -m benchmarks.cloud_run_benchmark batch --samples 10,100,500
+    python -m benchmarks.cloud_run_benchmark stream --levels 1,10,50
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.cli_load_test import RESULTS_DIR, git_commit
+from benchmarks.dev_stream_benchmark import iter_json_objects, stats_ms, web_token
+
+
+def load_project(args) -> Dict[str, Any]:
+    if args.project:
+        with open(args.project) as file:
+            return json.load(file)
+    import psycopg2
+    from seed import db_params, seed_benchmark_project
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        return seed_benchmark_project(conn, llm_api_base=args.llm_api_base)
+    finally:
+        conn.close()
+
+
+def seed_dataset(project: Dict[str, Any], samples: int) -> str:
+    import psycopg2
+    from seed import db_params, seed_benchmark_dataset
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        return seed_benchmark_dataset(conn, project, samples)
+    finally:
+        conn.close()
+
+
+async def mock_stats(mock: httpx.AsyncClient, reset: bool = False) -> Dict[str, Any]:
+    response = await (mock.post("/stats/reset") if reset else mock.get("/stats"))
+    response.raise_for_status()
+    return response.json()
+
+
+async def run_batch(
+    client: httpx.AsyncClient,
+    mock: httpx.AsyncClient,
+    project: Dict[str, Any],
+    samples: int,
+    args,
+) -> Dict[str, Any]:
+    dataset_uuid = seed_dataset(project, samples)
+    version_uuid = project["function_model_version_uuid"]
+    await mock_stats(mock, reset=True)
+
+    start = time.perf_counter()
+    response = await client.post(
+        "/api/web/run_function_model/batch",
+        json={
+            "project_uuid": project["project_uuid"],
+            "function_model_version_uuid": version_uuid,
+            "dataset_uuid": dataset_uuid,
+            "use_cache": False,
+        },
+    )
+    response.raise_for_status()
+
+    status = "running"
+    while status == "running" and time.perf_counter() - start < args.timeout:
+        await asyncio.sleep(args.poll_interval)
+        batch_runs = (
+            await client.get(f"/api/web/function_model_versions/{version_uuid}/batch_runs")
+        ).json()
+        status = next(
+            batch_run["status"]
+            for batch_run in batch_runs
+            if batch_run["dataset_uuid"] == dataset_uuid
+        )
+    elapsed = time.perf_counter() - start
+
+    stats = await mock_stats(mock)
+    llm_seconds = (
+        stats["last_response_at"] - stats["first_request_at"]
+        if stats["last_response_at"] and stats["first_request_at"]
+        else None
+    )
+    result = {
+        "samples": samples,
+        "status": status,
+        "seconds": round(elapsed, 3),
+        "llm_seconds": round(llm_seconds, 3) if llm_seconds is not None else None,
+        "llm_requests": stats["requests"],
+        "retries": stats["requests"] - stats["completed"],
+        "rate_limited": stats["rate_limited"],
+        "errors": stats["errors"],
+        "max_concurrent_llm_requests": stats["max_active"],
+        "samples_per_second": round(samples / elapsed, 3),
+    }
+    print(
+        f"{samples} samples: {status} in {result['seconds']}s "
+        f"(LLM busy {result['llm_seconds']}s, max {stats['max_active']} concurrent, "
+        f"{result['retries']} retries)"
+    )
+    return result
+
+
+async def run_stream(
+    client: httpx.AsyncClient, project: Dict[str, Any], model: str
+) -> Dict[str, Any]:
+    result = {"ok": False, "ttft": None, "total": None}
+    start = time.perf_counter()
+    buffer = ""
+    try:
+        async with client.stream(
+            "POST",
+            "/api/web/run_function_model",
+            params={"project_uuid": project["project_uuid"]},
+            json={
+                "function_model_uuid": project["function_model_uuid"],
+                "version_uuid": project["function_model_version_uuid"],
+                "prompts": [
+                    {"role": "system", "step": 1, "content": "You are a helpful assistant."},
+                    {"role": "user", "step": 2, "content": "Tell me a story."},
+                ],
+                "model": model,
+                "use_cache": False,
+            },
+        ) as response:
+            if response.status_code != 200:
+                result["error"] = f"status {response.status_code}"
+                return result
+            async for text in response.aiter_text():
+                chunks, buffer = iter_json_objects(buffer + text)
+                for chunk in chunks:
+                    if chunk.get("raw_output") and result["ttft"] is None:
+                        result["ttft"] = time.perf_counter() - start
+                    if chunk.get("status") == "completed":
+                        result["ok"] = True
+                    elif chunk.get("status") == "failed":
+                        result["error"] = chunk.get("log", "failed")
+    except httpx.HTTPError as error:
+        result["error"] = repr(error)
+    result["total"] = time.perf_counter() - start
+    return result
+
+
+async def run_stream_level(
+    client: httpx.AsyncClient,
+    mock: httpx.AsyncClient,
+    project: Dict[str, Any],
+    concurrency: int,
+    args,
+) -> Dict[str, Any]:
+    await mock_stats(mock, reset=True)
+    results = await asyncio.gather(
+        *[run_stream(client, project, args.model) for _ in range(concurrency)]
+    )
+    stats = await mock_stats(mock)
+    failures = [result for result in results if not result["ok"]]
+    ttfts = [result["ttft"] for result in results if result["ttft"] is not None]
+    # latency is only sampled for requests that weren't rejected
+    accepted = stats["requests"] - stats["rate_limited"] - stats["errors"]
+    overhead_ms = None
+    if ttfts and accepted:
+        overhead_ms = round(
+            (sum(ttfts) / len(ttfts) - stats["latency_seconds"] / accepted) * 1000, 3
+        )
+    level = {
+        "concurrency": concurrency,
+        "failures": len(failures),
+        "sample_errors": [result.get("error") for result in failures[:5]],
+        "ttft_ms": stats_ms(ttfts),
+        "total_ms": stats_ms([result["total"] for result in results]),
+        "mean_ttft_overhead_ms": overhead_ms,
+        "max_concurrent_llm_requests": stats["max_active"],
+    }
+    print(
+        f"concurrency {concurrency}: {len(failures)} failed, "
+        f"ttft p95 {level['ttft_ms']['p95']}ms, mean ttft overhead {overhead_ms}ms"
+    )
+    return level
+
+
+async def run(args, project: Dict[str, Any]) -> Dict[str, Any]:
+    mock_url = args.llm_api_base.rstrip("/")
+    headers = {"Authorization": f"Bearer {web_token(args, project)}"}
+    results: List[Dict[str, Any]] = []
+    async with httpx.AsyncClient(
+        base_url=args.base_url,
+        headers=headers,
+        limits=httpx.Limits(max_connections=None),
+        timeout=httpx.Timeout(args.timeout),
+    ) as client, httpx.AsyncClient(base_url=mock_url) as mock:
+        if args.mode == "batch":
+            for samples in args.samples.split(","):
+                results.append(await run_batch(client, mock, project, int(samples), args))
+        else:
+            for concurrency in args.levels.split(","):
+                results.append(
+                    await run_stream_level(client, mock, project, int(concurrency), args)
+                )
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "mode": args.mode,
+        "config": {"base_url": args.base_url, "llm_api_base": args.llm_api_base},
+        "results": results,
+    }
+
+
+def main(args):
+    project = load_project(args)
+    result = asyncio.run(run(args, project))
+    output = args.output or os.path.join(
+        RESULTS_DIR,
+        f"cloud_run_{args.mode}_{git_commit() or 'unknown'}_"
+        f"{datetime.now().strftime('%Y%m%d%H%M%S')}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+    print(f"results saved to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("mode", choices=["batch", "stream"])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--llm-api-base", default="http://localhost:9000/v1")
+    parser.add_argument(
+        "--project",
+        help="JSON printed by `python seed.py --benchmark-project --llm-api-base ...`. "
+        "A new benchmark project is seeded if omitted.",
+    )
+    parser.add_argument("--jwt", help="web JWT of the project's user")
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--samples", default="10,100,500")
+    parser.add_argument("--levels", default="1,10,50")
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output")
+    main(parser.parse_args())
@@ -0,0 +1,269 @@
+"""End-to-end benchmark of the dev streaming path.
+
+/api/dev/run_function_model (or run_chat_model) -> ConnectionManager.stream -> CLI websocket
+-> run_local_*_generator -> StreamingResponse, with benchmarks.fake_cli as the project's CLI,
+running in this process so chunk timestamps share a clock. Reports per concurrency level:
+    dispatch: request sent -> CLI received the task (includes the pre-stream DB phase)
+    ttft overhead: time to first token minus the CLI's simulated first token delay
+    chunk relay: CLI sent a chunk -> HTTP client received it
+and the max concurrent streams per server process whose failure rate and p95 chunk relay
+stay within limits.
+
+Usage (from backend/), against a running server:
+    python -m benchmarks.dev_stream_benchmark --task function \\
+        --levels 1,10,50,100,200 --token-rate 50 --chunk-size 1
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+import jwt as pyjwt
+
+from benchmarks.cli_load_test import RESULTS_DIR, git_commit, load_project, percentile
+from benchmarks.fake_cli import FakeCli
+
+
+def stats_ms(values: List[float]) -> Dict[str, Optional[float]]:
+    values = sorted(value * 1000 for value in values)
+    stats = {
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": values[-1] if values else None,
+    }
+    return {key: None if value is None else round(value, 3) for key, value in stats.items()}
+
+
+def iter_json_objects(buffer: str):
+    """Split concatenated JSON objects (streamed chunks may be merged or split).
+
+    Returns the parsed objects and the unparsed remainder.
+    """
+    decoder = json.JSONDecoder()
+    objects = []
+    index = 0
+    while index < len(buffer):
+        try:
+            obj, end = decoder.raw_decode(buffer, index)
+        except json.JSONDecodeError:
+            break
+        objects.append(obj)
+        index = end
+    return objects, buffer[index:]
+
+
+def make_run_request(task: str, project: Dict[str, Any]) -> Dict[str, Any]:
+    if task == "function":
+        return {
+            "url": "/api/dev/run_function_model",
+            "json": {
+                "function_model_uuid": project["function_model_uuid"],
+                "version_uuid": project["function_model_version_uuid"],
+                "prompts": [
+                    {"role": "system", "step": 1, "content": "You are a helpful assistant."},
+                    {"role": "user", "step": 2, "content": "Tell me a story."},
+                ],
+                "model": "gpt-3.5-turbo",
+            },
+        }
+    # a new chat session per stream
+    return {
+        "url": "/api/dev/run_chat_model",
+        "json": {
+            "chat_model_uuid": project["chat_model_uuid"],
+            "version_uuid": project["chat_model_version_uuid"],
+            "system_prompt": "You are a helpful assistant.",
+            "user_input": "Tell me a story.",
+            "model": "gpt-3.5-turbo",
+        },
+    }
+
+
+async def run_stream(
+    client: httpx.AsyncClient,
+    task: str,
+    project: Dict[str, Any],
+    first_token_delay: float,
+) -> Dict[str, Any]:
+    request = make_run_request(task, project)
+    result = {"ok": False, "dispatch": None, "ttft_overhead": None, "relays": []}
+    start = time.perf_counter()
+    buffer = ""
+    try:
+        async with client.stream(
+            "POST",
+            request["url"],
+            params={"project_uuid": project["project_uuid"]},
+            json=request["json"],
+        ) as response:
+            if response.status_code != 200:
+                result["error"] = f"status {response.status_code}"
+                return result
+            async for text in response.aiter_text():
+                now = time.perf_counter()
+                chunks, buffer = iter_json_objects(buffer + text)
+                for chunk in chunks:
+                    if "received_at" in chunk and result["dispatch"] is None:
+                        result["dispatch"] = chunk["received_at"] - start
+                    if "raw_output" in chunk and "sent_at" in chunk:
+                        result["relays"].append(now - chunk["sent_at"])
+                        if result["ttft_overhead"] is None:
+                            result["ttft_overhead"] = now - start - first_token_delay
+                    if chunk.get("status") == "completed":
+                        result["ok"] = True
+                    elif chunk.get("status") == "failed":
+                        result["error"] = chunk.get("log", "failed")
+    except httpx.HTTPError as error:
+        result["error"] = repr(error)
+    return result
+
+
+async def run_level(
+    client: httpx.AsyncClient, args, project: Dict[str, Any], concurrency: int
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[
+            run_stream(client, args.task, project, args.first_token_delay)
+            for _ in range(concurrency)
+        ]
+    )
+    elapsed = time.perf_counter() - start
+    failures = [result for result in results if not result["ok"]]
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "failures": len(failures),
+        "failure_rate": len(failures) / concurrency,
+        "sample_errors": [result.get("error") for result in failures[:5]],
+        "dispatch_ms": stats_ms(
+            [result["dispatch"] for result in results if result["dispatch"] is not None]
+        ),
+        "ttft_overhead_ms": stats_ms(
+            [
+                result["ttft_overhead"]
+                for result in results
+                if result["ttft_overhead"] is not None
+            ]
+        ),
+        "chunk_relay_ms": stats_ms(
+            [relay for result in results for relay in result["relays"]]
+        ),
+    }
+
+
+def web_token(args, project: Dict[str, Any]) -> str:
+    if args.jwt:
+        return args.jwt
+    secret = os.environ.get("NEXTAUTH_SECRET")
+    if not secret:
+        raise SystemExit("--jwt or NEXTAUTH_SECRET (self-hosted auth) is required")
+    return pyjwt.encode({"user_id": project["user_id"]}, secret, algorithm="HS512")
+
+
+async def run(args, project: Dict[str, Any]) -> Dict[str, Any]:
+    cli = FakeCli(
+        args.base_url.replace("http", "ws", 1),
+        project["cli_access_key"],
+        tokens=args.tokens,
+        token_rate=args.token_rate,
+        chunk_size=args.chunk_size,
+        first_token_delay=args.first_token_delay,
+        function_models=[project["function_model_name"]],
+    )
+    levels = [int(level) for level in args.levels.split(",")]
+    headers = {"Authorization": f"Bearer {web_token(args, project)}"}
+    async with cli, httpx.AsyncClient(
+        base_url=args.base_url,
+        headers=headers,
+        limits=httpx.Limits(max_connections=max(levels) + 5),
+        timeout=httpx.Timeout(args.timeout),
+    ) as client:
+        sync_start = time.perf_counter()
+        sync_response = await cli.sync_code()
+        sync_code_ms = (time.perf_counter() - sync_start) * 1000
+        if sync_response.get("status") != "completed":
+            raise SystemExit(f"SYNC_CODE failed: {sync_response}")
+
+        results = []
+        max_concurrent_streams = 0
+        for concurrency in levels:
+            level = await run_level(client, args, project, concurrency)
+            results.append(level)
+            relay_p95 = level["chunk_relay_ms"]["p95"]
+            print(
+                f"concurrency {concurrency}: {level['failures']} failed, "
+                f"dispatch p95 {level['dispatch_ms']['p95']}ms, "
+                f"ttft overhead p95 {level['ttft_overhead_ms']['p95']}ms, "
+                f"chunk relay p95 {relay_p95}ms"
+            )
+            if level["failure_rate"] > args.max_failure_rate or (
+                relay_p95 is not None and relay_p95 > args.max_chunk_relay_ms
+            ):
+                break
+            max_concurrent_streams = concurrency
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "base_url": args.base_url,
+            "task": args.task,
+            "tokens": args.tokens,
+            "token_rate": args.token_rate,
+            "chunk_size": args.chunk_size,
+            "first_token_delay": args.first_token_delay,
+            "max_failure_rate": args.max_failure_rate,
+            "max_chunk_relay_ms": args.max_chunk_relay_ms,
+        },
+        "sync_code_ms": round(sync_code_ms, 3),
+        "levels": results,
+        "max_concurrent_streams": max_concurrent_streams,
+        "cli_max_active_tasks": cli.max_active_tasks,
+    }
+
+
+def main(args):
+    project = load_project(args)
+    result = asyncio.run(run(args, project))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(result, file, indent=2)
+    print(f"SYNC_CODE: {result['sync_code_ms']:.1f}ms")
+    print(f"max concurrent streams: {result['max_concurrent_streams']}")
+    print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument(
+        "--project",
+        help="JSON printed by `python seed.py --benchmark-project`. "
+        "A new benchmark project is seeded if omitted.",
+    )
+    parser.add_argument("--jwt", help="web JWT of the project's user")
+    parser.add_argument("--task", choices=["function", "chat"], default="function")
+    parser.add_argument("--levels", default="1,10,50,100,200,400")
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-rate", type=float, default=50)
+    parser.add_argument("--chunk-size", type=int, default=1)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--max-failure-rate", type=float, default=0.01)
+    parser.add_argument("--max-chunk-relay-ms", type=float, default=100)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument(
+        "--output",
+        default=os.path.join(
+            RESULTS_DIR,
+            f"dev_stream_{git_commit() or 'unknown'}_{datetime.now().strftime('%Y%m%d%H%M%S')}.json",
+        ),
+    )
+    main(parser.parse_args())
@@ -0,0 +1,227 @@
+"""Simulated promptmodel CLI (`prompt dev`) for benchmarks.
+
+Connects to /api/cli/open_websocket with a project's CLI access key, and answers
+RUN_PROMPT_MODEL / RUN_CHAT_MODEL with generated tokens at a configurable rate
+and chunk size, LIST_* requests with configured names, and sends SYNC_CODE like the
+real CLI does on startup. No LLM is called.
+
+Every streamed chunk carries `received_at` (when the CLI got the task) and `sent_at`
+(when the chunk was sent), as time.perf_counter() values, so a benchmark running in
+the same process can measure how long the server takes to relay each chunk.
+
+Usage (from backend/), to stand in for a developer's CLI:
+    python -m benchmarks.fake_cli --url ws://localhost:8000 --cli-access-key <key>
+"""
+import json
+import time
+import asyncio
+import argparse
+import random
+from uuid import uuid4
+from typing import Any, Dict, List, Optional
+
+try:
+    # websockets >= 13
+    from websockets.asyncio.client import connect
+
+    HEADERS_ARGUMENT = "additional_headers"
+except ImportError:
+    from websockets import connect
+
+    HEADERS_ARGUMENT = "extra_headers"
+
+from base.websocket_connection import LocalTask, ServerTask
+
+WORDS = "the of and to in is you that it he was for on are as with his they at be".split()
+
+
+class FakeCli:
+    def __init__(
+        self,
+        url: str,
+        cli_access_key: str,
+        tokens: int = 200,
+        token_rate: float = 50,
+        chunk_size: int = 1,
+        first_token_delay: float = 0.3,
+        concurrent: bool = True,
+        function_models: Optional[List[str]] = None,
+        chat_models: Optional[List[str]] = None,
+    ):
+        """
+        Args:
+            tokens: tokens per response
+            token_rate: tokens per second (<= 0 to stream as fast as possible)
+            chunk_size: tokens per chunk
+            first_token_delay: seconds before the first token, like an LLM's time to first token
+            concurrent: handle tasks concurrently. The real CLI handles one at a time.
+        """
+        self.url = url.rstrip("/")
+        self.cli_access_key = cli_access_key
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.chunk_size = chunk_size
+        self.first_token_delay = first_token_delay
+        self.concurrent = concurrent
+        self.function_models = function_models or []
+        self.chat_models = chat_models or []
+
+        self.ws = None
+        self.connected = asyncio.Event()
+        self.active_tasks = 0
+        self.max_active_tasks = 0
+        self.handled_tasks: Dict[str, int] = {}
+        self.pending_requests: Dict[str, asyncio.Future] = {}
+        self._reader: Optional[asyncio.Task] = None
+        self._tasks = set()
+
+    async def start(self) -> None:
+        self.ws = await connect(
+            f"{self.url}/api/cli/open_websocket",
+            max_size=None,
+            **{HEADERS_ARGUMENT: {"Authorization": f"Bearer {self.cli_access_key}"}},
+        )
+        self._reader = asyncio.create_task(self._read())
+        self.connected.set()
+
+    async def close(self) -> None:
+        if self.ws is not None:
+            await self.ws.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def __aenter__(self) -> "FakeCli":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def request(self, message: Dict[str, Any], timeout: float = 120) -> Dict:
+        """Send a request to the server (e.g. SYNC_CODE) and wait for its response."""
+        correlation_id = str(uuid4())
+        message["correlation_id"] = correlation_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending_requests[correlation_id] = future
+        try:
+            await self.ws.send(json.dumps(message))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending_requests.pop(correlation_id, None)
+
+    async def sync_code(
+        self,
+        samples: Optional[List[Dict[str, Any]]] = None,
+        function_schemas: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict:
+        return await self.request(
+            {
+                "type": ServerTask.SYNC_CODE.value,
+                "new_function_model": self.function_models,
+                "new_chat_model": self.chat_models,
+                "new_samples": samples or [],
+                "new_schemas": function_schemas or [],
+            }
+        )
+
+    async def _read(self) -> None:
+        async for message in self.ws:
+            data = json.loads(message)
+            correlation_id = data.get("correlation_id")
+            future = self.pending_requests.get(correlation_id)
+            if future is not None:
+                if not future.done():
+                    future.set_result(data)
+                continue
+            if self.concurrent:
+                task = asyncio.create_task(self._handle(data))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            else:
+                await self._handle(data)
+
+    async def _send(self, data: Dict[str, Any]) -> None:
+        data["sent_at"] = time.perf_counter()
+        await self.ws.send(json.dumps(data))
+
+    async def _handle(self, message: Dict[str, Any]) -> None:
+        task_type = message.get("type")
+        self.handled_tasks[task_type] = self.handled_tasks.get(task_type, 0) + 1
+        response = {"correlation_id": message.get("correlation_id")}
+
+        if task_type == LocalTask.LIST_CODE_PROMPT_MODELS.value:
+            await self._send({**response, "function_models": self.function_models})
+        elif task_type == LocalTask.LIST_CODE_CHAT_MODELS.value:
+            await self._send({**response, "chat_models": self.chat_models})
+        elif task_type == LocalTask.LIST_CODE_FUNCTIONS.value:
+            await self._send({**response, "functions": []})
+        elif task_type in (
+            LocalTask.RUN_PROMPT_MODEL.value,
+            LocalTask.RUN_CHAT_MODEL.value,
+        ):
+            result_type = (
+                ServerTask.UPDATE_RESULT_RUN.value
+                if task_type == LocalTask.RUN_PROMPT_MODEL.value
+                else ServerTask.UPDATE_RESULT_CHAT_RUN.value
+            )
+            await self._stream(result_type, response)
+
+    async def _stream(self, result_type: str, response: Dict[str, Any]) -> None:
+        self.active_tasks += 1
+        self.max_active_tasks = max(self.max_active_tasks, self.active_tasks)
+        received_at = time.perf_counter()
+        base = {**response, "type": result_type, "received_at": received_at}
+        try:
+            await self._send({**base, "status": "running"})
+            await asyncio.sleep(self.first_token_delay)
+            interval = (
+                self.chunk_size / self.token_rate if self.token_rate > 0 else 0
+            )
+            for start in range(0, self.tokens, self.chunk_size):
+                text = " ".join(
+                    random.choice(WORDS)
+                    for _ in range(min(self.chunk_size, self.tokens - start))
+                )
+                await self._send({**base, "status": "running", "raw_output": text + " "})
+                await asyncio.sleep(interval)
+            await self._send({**base, "status": "completed"})
+        except Exception as error:
+            await self._send({**base, "status": "failed", "log": str(error)})
+        finally:
+            self.active_tasks -= 1
+
+
+async def main(args):
+    cli = FakeCli(
+        args.url,
+        args.cli_access_key,
+        tokens=args.tokens,
+        token_rate=args.token_rate,
+        chunk_size=args.chunk_size,
+        first_token_delay=args.first_token_delay,
+        concurrent=not args.sequential,
+        function_models=args.function_models,
+        chat_models=args.chat_models,
+    )
+    async with cli:
+        print(f"SYNC_CODE: {await cli.sync_code()}")
+        print("Connected, answering tasks. Ctrl+C to stop.")
+        await cli._reader
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="ws://localhost:8000")
+    parser.add_argument("--cli-access-key", required=True)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-rate", type=float, default=50)
+    parser.add_argument("--chunk-size", type=int, default=1)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--sequential", action="store_true")
+    parser.add_argument("--function-models", nargs="*", default=[])
+    parser.add_argument("--chat-models", nargs="*", default=[])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,760 @@
+"""Generate a large synthetic dataset for performance testing.
+
+Populates the database configured for seed.py (POSTGRES_* env vars) with organizations,
+users, projects, function models & versions with prompts, sample inputs, datasets,
+chat models & versions, and then run logs, chat sessions, chat messages and chat logs
+in the millions, loaded with COPY from parallel worker processes.
+
+Data is shaped like production traffic:
+- a few projects and versions get most of the logs (Zipf-like weights),
+- timestamps spread over --days with growing traffic, a daily cycle and quieter weekends,
+- input / output lengths are lognormal, and tokens, latency and cost follow from them.
+
+The notify triggers (pg_notify for realtime updates) are disabled during the load,
+and tables are ANALYZEd after it. Generated rows aren't marked; use a dedicated database.
+
+Usage (from backend/), against a local migrated database:
+    python -m benchmarks.generate_data --organizations 10 --projects-per-organization 5 \\
+        --run-logs 20000000 --chat-sessions 1000000 --workers 8
+"""
+
+import io
+import os
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import psycopg2
+
+from seed import db_params
+
+VOCABULARY = (
+    "the of and to in is you that it he was for on are as with his they at be this have "
+    "from or one had by word but not what all were we when your can said there use an each "
+    "which she do how their if will up other about out many then them these so some her would "
+    "make like him into time has look two more write go see number no way could people my than "
+    "first water been call who oil its now find long down day did get come made may part "
+    "model prompt answer question summary customer order product price review email report "
+    "data table value result error request response user assistant system function json"
+).split()
+MODELS = [
+    ("gpt-3.5-turbo", 0.5, 1.5),
+    ("gpt-4", 30, 60),
+    ("gpt-4-1106-preview", 10, 30),
+]
+# relative traffic per UTC hour
+HOUR_WEIGHTS = [
+    3,
+    2,
+    2,
+    2,
+    2,
+    3,
+    4,
+    6,
+    8,
+    10,
+    11,
+    12,
+    12,
+    12,
+    12,
+    11,
+    10,
+    9,
+    8,
+    7,
+    6,
+    5,
+    4,
+    3,
+]
+TEXT_POOL_SIZE = 5000
+COPY_BATCH_SIZE = 20000
+NOTIFY_TRIGGER_TABLES = [
+    "project",
+    "function_model",
+    "chat_model",
+    "sample_input",
+    "function_schema",
+    "chat_log",
+    "run_log",
+]
+
+
+class PgArray(list):
+    """A list to COPY as a Postgres array instead of JSON."""
+
+
+def copy_value(value: Any) -> str:
+    """Format a value for COPY ... FROM STDIN (text format)."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, PgArray):
+        value = "{" + ",".join(json.dumps(str(item)) for item in value) + "}"
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(
+    cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]
+) -> int:
+    buffer = io.StringIO()
+    count = 0
+    for row in rows:
+        buffer.write("\t".join(copy_value(value) for value in row))
+        buffer.write("\n")
+        count += 1
+    return copy_buffer(cursor, table, columns, buffer, count)
+
+
+def copy_buffer(
+    cursor, table: str, columns: Sequence[str], buffer: io.StringIO, count: int
+) -> int:
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY "{table}" ({", ".join(columns)}) FROM STDIN', buffer)
+    return count
+
+
+def lognormal_int(rng: random.Random, median: float, sigma: float, low: int = 1) -> int:
+    return max(low, int(median * math.exp(rng.gauss(0, sigma))))
+
+
+class TimeDistribution:
+    """Timestamps over the last `days` days with growing traffic, a daily cycle and quieter weekends."""
+
+    def __init__(self, days: int, now: datetime):
+        self.start = now - timedelta(days=days)
+        self.days = days
+        self.hours = list(range(24))
+        self.hour_cum_weights = []
+        total = 0
+        for weight in HOUR_WEIGHTS:
+            total += weight
+            self.hour_cum_weights.append(total)
+
+    def sample(self, rng: random.Random) -> datetime:
+        while True:
+            # density grows linearly over time
+            day = int(self.days * math.sqrt(rng.random()))
+            date = self.start + timedelta(days=day)
+            if date.weekday() < 5 or rng.random() < 0.4:
+                break
+        hour = rng.choices(self.hours, cum_weights=self.hour_cum_weights)[0]
+        return date.replace(hour=hour, minute=0, second=0, microsecond=0) + timedelta(
+            seconds=rng.random() * 3600
+        )
+
+
+def text_pool(rng: random.Random, median_words: float, sigma: float) -> List[str]:
+    return [
+        " ".join(rng.choices(VOCABULARY, k=lognormal_int(rng, median_words, sigma)))
+        for _ in range(TEXT_POOL_SIZE)
+    ]
+
+
+def generate_entities(
+    args, rng: random.Random, times: TimeDistribution
+) -> Dict[str, Any]:
+    """Organizations, users, projects, models, versions, prompts, sample inputs and datasets."""
+    tables: Dict[str, Tuple[List[str], List[Tuple]]] = {
+        "organization": (["organization_id", "name", "slug", "created_at"], []),
+        "user": (["user_id", "email", "first_name", "is_test", "created_at"], []),
+        "users_organizations": (["user_id", "organization_id", "created_at"], []),
+        "project": (
+            [
+                "uuid",
+                "name",
+                "api_key",
+                "version",
+                "online",
+                "is_public",
+                "organization_id",
+                "created_at",
+            ],
+            [],
+        ),
+        "eval_metric": (
+            ["uuid", "name", "description", "project_uuid", "created_at"],
+            [],
+        ),
+        "function_model": (
+            ["uuid", "name", "online", "project_uuid", "created_at"],
+            [],
+        ),
+        "function_model_version": (
+            [
+                "uuid",
+                "version",
+                "model",
+                "is_published",
+                "from_version",
+                "function_model_uuid",
+                "created_by",
+                "created_at",
+            ],
+            [],
+        ),
+        "prompt": (["role", "step", "content", "version_uuid", "created_at"], []),
+        "sample_input": (
+            [
+                "uuid",
+                "name",
+                "content",
+                "input_keys",
+                "online",
+                "ground_truth",
+                "project_uuid",
+                "function_model_uuid",
+                "created_at",
+            ],
+            [],
+        ),
+        "dataset": (
+            [
+                "uuid",
+                "name",
+                "project_uuid",
+                "eval_metric_uuid",
+                "function_model_uuid",
+                "created_at",
+            ],
+            [],
+        ),
+        "dataset_sample_input": (["dataset_uuid", "sample_input_uuid"], []),
+        "chat_model": (["uuid", "name", "online", "project_uuid", "created_at"], []),
+        "chat_model_version": (
+            [
+                "uuid",
+                "version",
+                "model",
+                "system_prompt",
+                "is_published",
+                "from_version",
+                "chat_model_uuid",
+                "created_at",
+            ],
+            [],
+        ),
+    }
+
+    def add(table: str, *row) -> None:
+        tables[table][1].append(row)
+
+    function_model_versions = (
+        []
+    )  # (version uuid, project uuid, model, sample input uuids)
+    chat_model_versions = []  # (version uuid, project uuid, model)
+    prompts = text_pool(rng, 40, 0.8)
+    suffix = uuid.uuid4().hex[:8]
+    for org_index in range(args.organizations):
+        organization_id = f"org_synthetic_{suffix}_{org_index}"
+        created_at = times.start
+        add(
+            "organization",
+            organization_id,
+            f"synthetic {org_index}",
+            f"synthetic-{suffix}-{org_index}",
+            created_at,
+        )
+        user_ids = []
+        for user_index in range(args.users_per_organization):
+            user_id = f"user_synthetic_{suffix}_{org_index}_{user_index}"
+            user_ids.append(user_id)
+            add(
+                "user",
+                user_id,
+                f"{user_id}@example.com",
+                f"User {user_index}",
+                True,
+                created_at,
+            )
+            add("users_organizations", user_id, organization_id, created_at)
+
+        for project_index in range(args.projects_per_organization):
+            project_uuid = str(uuid.uuid4())
+            add(
+                "project",
+                project_uuid,
+                f"project-{project_index}",
+                f"synthetic_{uuid.uuid4().hex}",
+                args.versions_per_model,
+                True,
+                False,
+                organization_id,
+                created_at,
+            )
+            eval_metric_uuid = str(uuid.uuid4())
+            add(
+                "eval_metric",
+                eval_metric_uuid,
+                "gt_exact_match",
+                "Exact match with ground truth",
+                project_uuid,
+                created_at,
+            )
+
+            for model_index in range(args.function_models_per_project):
+                function_model_uuid = str(uuid.uuid4())
+                add(
+                    "function_model",
+                    function_model_uuid,
+                    f"function_model_{model_index}",
+                    True,
+                    project_uuid,
+                    created_at,
+                )
+
+                sample_input_uuids = []
+                for sample_index in range(args.sample_inputs_per_model):
+                    sample_input_uuid = str(uuid.uuid4())
+                    sample_input_uuids.append(sample_input_uuid)
+                    add(
+                        "sample_input",
+                        sample_input_uuid,
+                        f"sample_{sample_index}",
+                        {"question": rng.choice(prompts)},
+                        PgArray(["question"]),
+                        False,
+                        rng.choice(VOCABULARY),
+                        project_uuid,
+                        function_model_uuid,
+                        created_at,
+                    )
+                for dataset_index in range(args.datasets_per_model):
+                    dataset_uuid = str(uuid.uuid4())
+                    add(
+                        "dataset",
+                        dataset_uuid,
+                        f"dataset_{dataset_index}",
+                        project_uuid,
+                        eval_metric_uuid,
+                        function_model_uuid,
+                        created_at,
+                    )
+                    for sample_input_uuid in rng.sample(
+                        sample_input_uuids,
+                        min(args.samples_per_dataset, len(sample_input_uuids)),
+                    ):
+                        add("dataset_sample_input", dataset_uuid, sample_input_uuid)
+
+                for version in range(1, args.versions_per_model + 1):
+                    version_uuid = str(uuid.uuid4())
+                    model = rng.choice(MODELS)[0]
+                    add(
+                        "function_model_version",
+                        version_uuid,
+                        version,
+                        model,
+                        version == args.versions_per_model,
+                        version - 1 if version > 1 else None,
+                        function_model_uuid,
+                        rng.choice(user_ids),
+                        created_at
+                        + timedelta(
+                            days=times.days * version / (args.versions_per_model + 1)
+                        ),
+                    )
+                    add(
+                        "prompt",
+                        "system",
+                        1,
+                        rng.choice(prompts),
+                        version_uuid,
+                        created_at,
+                    )
+                    add(
+                        "prompt",
+                        "user",
+                        2,
+                        rng.choice(prompts) + " {question}",
+                        version_uuid,
+                        created_at,
+                    )
+                    function_model_versions.append(
+                        (version_uuid, project_uuid, model, sample_input_uuids)
+                    )
+
+            for model_index in range(args.chat_models_per_project):
+                chat_model_uuid = str(uuid.uuid4())
+                add(
+                    "chat_model",
+                    chat_model_uuid,
+                    f"chat_model_{model_index}",
+                    True,
+                    project_uuid,
+                    created_at,
+                )
+                for version in range(1, args.versions_per_model + 1):
+                    version_uuid = str(uuid.uuid4())
+                    model = rng.choice(MODELS)[0]
+                    add(
+                        "chat_model_version",
+                        version_uuid,
+                        version,
+                        model,
+                        rng.choice(prompts),
+                        version == args.versions_per_model,
+                        version - 1 if version > 1 else None,
+                        chat_model_uuid,
+                        created_at
+                        + timedelta(
+                            days=times.days * version / (args.versions_per_model + 1)
+                        ),
+                    )
+                    chat_model_versions.append((version_uuid, project_uuid, model))
+
+    return {
+        "tables": tables,
+        "function_model_versions": function_model_versions,
+        "chat_model_versions": chat_model_versions,
+    }
+
+
+def token_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    for name, prompt_price, completion_price in MODELS:
+        if name == model:
+            return (
+                prompt_tokens * prompt_price + completion_tokens * completion_price
+            ) / 1e6
+    return 0.0
+
+
+def copy_run_logs(job: Dict[str, Any]) -> int:
+    """Worker: COPY job["count"] run logs of the given versions."""
+    rng = random.Random(job["seed"])
+    times = TimeDistribution(job["days"], job["now"])
+    versions = job["versions"]
+    cum_weights = job["cum_weights"]
+    inputs = [copy_value({"question": text}) for text in text_pool(rng, 30, 0.9)]
+    outputs = [
+        (copy_value(text), len(text.split())) for text in text_pool(rng, 60, 1.0)
+    ]
+    columns = [
+        "uuid",
+        "created_at",
+        "run_from_deployment",
+        "inputs",
+        "raw_output",
+        "prompt_tokens",
+        "completion_tokens",
+        "total_tokens",
+        "latency",
+        "cost",
+        "version_uuid",
+        "project_uuid",
+        "sample_input_uuid",
+    ]
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn.cursor() as cursor:
+            remaining = job["count"]
+            while remaining > 0:
+                batch = min(COPY_BATCH_SIZE, remaining)
+                buffer = io.StringIO()
+                for (
+                    version_uuid,
+                    project_uuid,
+                    model,
+                    sample_input_uuids,
+                ) in rng.choices(versions, cum_weights=cum_weights, k=batch):
+                    output, output_words = rng.choice(outputs)
+                    prompt_tokens = lognormal_int(rng, 300, 0.8)
+                    completion_tokens = int(output_words * 1.3) + 1
+                    # latency: time to first token + generation
+                    latency = lognormal_int(
+                        rng, 400, 0.5
+                    ) + completion_tokens * rng.uniform(10, 30)
+                    from_deployment = rng.random() < 0.85
+                    sample_input_uuid = (
+                        rng.choice(sample_input_uuids)
+                        if not from_deployment and sample_input_uuids
+                        else "\\N"
+                    )
+                    buffer.write(
+                        f"{uuid.uuid4()}\t{times.sample(rng).isoformat()}\t"
+                        f"{'t' if from_deployment else 'f'}\t{rng.choice(inputs)}\t{output}\t"
+                        f"{prompt_tokens}\t{completion_tokens}\t{prompt_tokens + completion_tokens}\t"
+                        f"{latency:.1f}\t{token_cost(model, prompt_tokens, completion_tokens):.8f}\t"
+                        f"{version_uuid}\t{project_uuid}\t{sample_input_uuid}\n"
+                    )
+                copy_buffer(cursor, "run_log", columns, buffer, batch)
+                conn.commit()
+                remaining -= batch
+    finally:
+        conn.close()
+    return job["count"]
+
+
+def copy_chat_sessions(job: Dict[str, Any]) -> int:
+    """Worker: COPY job["count"] chat sessions with their messages and chat logs."""
+    rng = random.Random(job["seed"])
+    times = TimeDistribution(job["days"], job["now"])
+    versions = job["versions"]
+    cum_weights = job["cum_weights"]
+    user_messages = [copy_value(text) for text in text_pool(rng, 20, 0.9)]
+    assistant_messages = [
+        (copy_value(text), len(text.split())) for text in text_pool(rng, 80, 0.9)
+    ]
+    session_columns = ["uuid", "created_at", "run_from_deployment", "version_uuid"]
+    message_columns = [
+        "uuid",
+        "created_at",
+        "role",
+        "content",
+        "token_count",
+        "session_uuid",
+    ]
+    log_columns = [
+        "uuid",
+        "created_at",
+        "user_message_uuid",
+        "assistant_message_uuid",
+        "project_uuid",
+        "session_uuid",
+        "prompt_tokens",
+        "completion_tokens",
+        "total_tokens",
+        "latency",
+        "cost",
+    ]
+    batch_sessions = max(1, COPY_BATCH_SIZE // (2 * job["turns_per_session"]))
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn.cursor() as cursor:
+            remaining = job["count"]
+            while remaining > 0:
+                batch = min(batch_sessions, remaining)
+                sessions, messages, logs = io.StringIO(), io.StringIO(), io.StringIO()
+                message_count = log_count = 0
+                for version_uuid, project_uuid, model in rng.choices(
+                    versions, cum_weights=cum_weights, k=batch
+                ):
+                    session_uuid = uuid.uuid4()
+                    created_at = times.sample(rng)
+                    sessions.write(
+                        f"{session_uuid}\t{created_at.isoformat()}\t"
+                        f"{'t' if rng.random() < 0.85 else 'f'}\t{version_uuid}\n"
+                    )
+                    context_tokens = lognormal_int(rng, 100, 0.5)
+                    turns = lognormal_int(rng, job["turns_per_session"], 0.7)
+                    for _ in range(turns):
+                        # user think time, then the assistant's response
+                        created_at += timedelta(seconds=lognormal_int(rng, 30, 1.0))
+                        user_uuid = uuid.uuid4()
+                        user_message = rng.choice(user_messages)
+                        user_tokens = int(len(user_message.split()) * 1.3) + 1
+                        messages.write(
+                            f"{user_uuid}\t{created_at.isoformat()}\tuser\t{user_message}\t"
+                            f"{user_tokens}\t{session_uuid}\n"
+                        )
+                        assistant_message, assistant_words = rng.choice(
+                            assistant_messages
+                        )
+                        completion_tokens = int(assistant_words * 1.3) + 1
+                        latency = lognormal_int(
+                            rng, 400, 0.5
+                        ) + completion_tokens * rng.uniform(10, 30)
+                        created_at += timedelta(milliseconds=latency)
+                        assistant_uuid = uuid.uuid4()
+                        messages.write(
+                            f"{assistant_uuid}\t{created_at.isoformat()}\tassistant\t"
+                            f"{assistant_message}\t{completion_tokens}\t{session_uuid}\n"
+                        )
+                        context_tokens += user_tokens
+                        logs.write(
+                            f"{uuid.uuid4()}\t{created_at.isoformat()}\t{user_uuid}\t"
+                            f"{assistant_uuid}\t{project_uuid}\t{session_uuid}\t"
+                            f"{context_tokens}\t{completion_tokens}\t"
+                            f"{context_tokens + completion_tokens}\t{latency:.1f}\t"
+                            f"{token_cost(model, context_tokens, completion_tokens):.8f}\n"
+                        )
+                        context_tokens += completion_tokens
+                        message_count += 2
+                        log_count += 1
+                copy_buffer(cursor, "chat_session", session_columns, sessions, batch)
+                copy_buffer(
+                    cursor, "chat_message", message_columns, messages, message_count
+                )
+                copy_buffer(cursor, "chat_log", log_columns, logs, log_count)
+                conn.commit()
+                remaining -= batch
+    finally:
+        conn.close()
+    return job["count"]
+
+
+def split_jobs(total: int, workers: int, seed: int, **job: Any) -> List[Dict[str, Any]]:
+    jobs = []
+    for index in range(workers):
+        count = total // workers + (1 if index < total % workers else 0)
+        if count:
+            jobs.append({**job, "count": count, "seed": seed * 1000 + index})
+    return jobs
+
+
+def cumulative(weights: List[float]) -> List[float]:
+    total = 0.0
+    cum_weights = []
+    for weight in weights:
+        total += weight
+        cum_weights.append(total)
+    return cum_weights
+
+
+def skewed_cum_weights(rng: random.Random, versions: List[Tuple]) -> List[float]:
+    """Zipf over projects, times Zipf over versions, in random order."""
+    project_rank = {}
+    for version in versions:
+        project_rank.setdefault(version[1], len(project_rank) + 1)
+    ranks = list(project_rank.values())
+    rng.shuffle(ranks)
+    project_rank = dict(zip(project_rank.keys(), ranks))
+    version_ranks = list(range(1, len(versions) + 1))
+    rng.shuffle(version_ranks)
+    return cumulative(
+        [
+            1 / project_rank[version[1]] ** 1.1 / version_rank**0.8
+            for version, version_rank in zip(versions, version_ranks)
+        ]
+    )
+
+
+def run_jobs(worker, jobs: List[Dict[str, Any]], workers: int) -> int:
+    if workers <= 1:
+        return sum(worker(job) for job in jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(worker, jobs))
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    times = TimeDistribution(args.days, now)
+    workers = args.workers or os.cpu_count() or 1
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn.cursor() as cursor:
+            for table in NOTIFY_TRIGGER_TABLES:
+                cursor.execute(f'ALTER TABLE "{table}" DISABLE TRIGGER USER')
+        conn.commit()
+
+        start = time.perf_counter()
+        entities = generate_entities(args, rng, times)
+        with conn.cursor() as cursor:
+            for table, (columns, rows) in entities["tables"].items():
+                copy_rows(cursor, table, columns, rows)
+                print(f"{table}: {len(rows)} rows")
+        conn.commit()
+        print(f"entities loaded in {time.perf_counter() - start:.1f}s")
+
+        function_model_versions = entities["function_model_versions"]
+        chat_model_versions = entities["chat_model_versions"]
+
+        if args.run_logs and function_model_versions:
+            start = time.perf_counter()
+            count = run_jobs(
+                copy_run_logs,
+                split_jobs(
+                    args.run_logs,
+                    workers,
+                    args.seed,
+                    days=args.days,
+                    now=now,
+                    versions=function_model_versions,
+                    cum_weights=skewed_cum_weights(rng, function_model_versions),
+                ),
+                workers,
+            )
+            elapsed = time.perf_counter() - start
+            print(
+                f"run_log: {count} rows in {elapsed:.1f}s ({count / elapsed:.0f} rows/s)"
+            )
+
+        if args.chat_sessions and chat_model_versions:
+            start = time.perf_counter()
+            count = run_jobs(
+                copy_chat_sessions,
+                split_jobs(
+                    args.chat_sessions,
+                    workers,
+                    args.seed + 1,
+                    days=args.days,
+                    now=now,
+                    versions=chat_model_versions,
+                    cum_weights=skewed_cum_weights(rng, chat_model_versions),
+                    turns_per_session=args.turns_per_session,
+                ),
+                workers,
+            )
+            elapsed = time.perf_counter() - start
+            print(
+                f"chat_session: {count} sessions with messages & logs in {elapsed:.1f}s"
+            )
+
+        start = time.perf_counter()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for table in list(entities["tables"]) + [
+                "run_log",
+                "chat_session",
+                "chat_message",
+                "chat_log",
+            ]:
+                cursor.execute(f'ANALYZE "{table}"')
+        print(f"analyzed in {time.perf_counter() - start:.1f}s")
+    finally:
+        if not conn.autocommit:
+            conn.rollback()
+            conn.autocommit = True
+        with conn.cursor() as cursor:
+            for table in NOTIFY_TRIGGER_TABLES:
+                cursor.execute(f'ALTER TABLE "{table}" ENABLE TRIGGER USER')
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--organizations", type=int, default=10)
+    parser.add_argument("--users-per-organization", type=int, default=5)
+    parser.add_argument("--projects-per-organization", type=int, default=5)
+    parser.add_argument("--function-models-per-project", type=int, default=10)
+    parser.add_argument("--chat-models-per-project", type=int, default=3)
+    parser.add_argument("--versions-per-model", type=int, default=10)
+    parser.add_argument("--sample-inputs-per-model", type=int, default=100)
+    parser.add_argument("--datasets-per-model", type=int, default=2)
+    parser.add_argument("--samples-per-dataset", type=int, default=50)
+    parser.add_argument("--run-logs", type=int, default=1_000_000)
+    parser.add_argument("--chat-sessions", type=int, default=100_000)
+    parser.add_argument(
+        "--turns-per-session",
+        type=int,
+        default=4,
+        help="median user/assistant turns per chat session",
+    )
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--workers", type=int, help="default: number of CPUs")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
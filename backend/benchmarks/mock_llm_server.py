@@ -0,0 +1,336 @@
+"""Local OpenAI-compatible LLM server for offline benchmarks.
+
+Serves /v1/chat/completions (streaming and non-streaming) with generated text, after a
+latency drawn from a configurable distribution and at a configurable token rate, and
+injects server errors (500) and rate limits (429) at given rates, or above a requests
+per minute / concurrency limit. Seeded, so runs are reproducible.
+
+Point an organization's provider config at it, e.g. for "openai":
+    env_vars = {"OPENAI_API_KEY": "mock", "OPENAI_API_BASE": "http://localhost:9000/v1"}
+(`python seed.py --benchmark-project --llm-api-base http://localhost:9000/v1` does this.)
+
+GET /stats returns request counts, the max number of concurrent requests and the sum of
+sampled first-token latencies, POST /stats/reset clears them.
+
+Usage (from backend/):
+    python -m benchmarks.mock_llm_server --port 9000 --latency-ms 500 \\
+        --latency-distribution lognormal --token-rate 50 --rate-limit-rate 0.05
+"""
+import json
+import time
+import uuid
+import math
+import random
+import asyncio
+import argparse
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = "the of and to in is you that it he was for on are as with his they at be".split()
+LATENCY_DISTRIBUTIONS = ["fixed", "uniform", "exponential", "lognormal"]
+
+
+class MockLLM:
+    def __init__(
+        self,
+        latency_ms: float = 300,
+        latency_distribution: str = "fixed",
+        latency_jitter_ms: float = 100,
+        latency_sigma: float = 0.5,
+        tokens: int = 50,
+        token_rate: float = 100,
+        chunk_size: int = 1,
+        response_text: Optional[str] = None,
+        error_rate: float = 0,
+        rate_limit_rate: float = 0,
+        rpm: int = 0,
+        max_concurrency: int = 0,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            latency_ms: time to first token (median for lognormal, mean for exponential)
+            latency_jitter_ms: +- range of the uniform distribution
+            latency_sigma: sigma of the lognormal distribution
+            tokens: completion tokens per response, ignored if response_text is set
+            token_rate: tokens per second after the first token (<= 0 for no delay)
+            chunk_size: tokens per streamed chunk
+            response_text: fixed response content, e.g. a dataset's ground truth
+            error_rate: probability of a 500 response
+            rate_limit_rate: probability of a 429 response
+            rpm: requests per minute before responding 429 (0 for no limit)
+            max_concurrency: concurrent requests before responding 429 (0 for no limit)
+        """
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency_distribution must be one of {LATENCY_DISTRIBUTIONS}")
+        self.latency_ms = latency_ms
+        self.latency_distribution = latency_distribution
+        self.latency_jitter_ms = latency_jitter_ms
+        self.latency_sigma = latency_sigma
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.chunk_size = chunk_size
+        self.response_text = response_text
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.max_concurrency = max_concurrency
+        self.random = random.Random(seed)
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.stats = {
+            "requests": 0,
+            "completed": 0,
+            "streamed": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "active": 0,
+            "max_active": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "latency_seconds": 0,
+            "first_request_at": None,
+            "last_response_at": None,
+        }
+        self._request_times = deque()
+
+    def sample_latency(self) -> float:
+        """Seconds before the first token."""
+        if self.latency_distribution == "uniform":
+            latency_ms = self.random.uniform(
+                self.latency_ms - self.latency_jitter_ms,
+                self.latency_ms + self.latency_jitter_ms,
+            )
+        elif self.latency_distribution == "exponential":
+            latency_ms = self.random.expovariate(1 / self.latency_ms)
+        elif self.latency_distribution == "lognormal":
+            latency_ms = self.latency_ms * math.exp(
+                self.random.gauss(0, self.latency_sigma)
+            )
+        else:
+            latency_ms = self.latency_ms
+        return max(latency_ms, 0) / 1000
+
+    def completion_tokens(self) -> List[str]:
+        if self.response_text is not None:
+            return self.response_text.split(" ")
+        return [self.random.choice(WORDS) for _ in range(self.tokens)]
+
+    def token_delay(self, tokens: int) -> float:
+        return tokens / self.token_rate if self.token_rate > 0 else 0
+
+    def rejection(self) -> Optional[JSONResponse]:
+        """Response for an injected or limit-exceeding request, if any."""
+        now = time.time()
+        if self.rpm > 0:
+            while self._request_times and self._request_times[0] < now - 60:
+                self._request_times.popleft()
+            if len(self._request_times) >= self.rpm:
+                retry_after = max(self._request_times[0] + 60 - now, 0)
+                return self.rate_limit_response("Requests per minute exceeded", retry_after)
+        if self.max_concurrency > 0 and self.stats["active"] >= self.max_concurrency:
+            return self.rate_limit_response("Too many concurrent requests", 1)
+        if self.random.random() < self.rate_limit_rate:
+            return self.rate_limit_response("Rate limit injected", 1)
+        if self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return JSONResponse(
+                status_code=500,
+                content={
+                    "error": {
+                        "message": "Error injected by mock LLM server",
+                        "type": "server_error",
+                        "code": None,
+                    }
+                },
+            )
+        self._request_times.append(now)
+        return None
+
+    def rate_limit_response(self, message: str, retry_after: float) -> JSONResponse:
+        self.stats["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            headers={"retry-after": str(math.ceil(retry_after))},
+            content={
+                "error": {
+                    "message": message,
+                    "type": "requests",
+                    "code": "rate_limit_exceeded",
+                }
+            },
+        )
+
+    def start(self) -> None:
+        self.stats["active"] += 1
+        self.stats["max_active"] = max(self.stats["max_active"], self.stats["active"])
+
+    def finish(self, prompt_tokens: int, completion_tokens: int) -> None:
+        self.stats["active"] -= 1
+        self.stats["completed"] += 1
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["completion_tokens"] += completion_tokens
+        self.stats["last_response_at"] = time.time()
+
+
+def count_prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    # roughly one token per word, plus per-message overhead
+    return sum(
+        len(str(message.get("content") or "").split()) + 4 for message in messages
+    )
+
+
+def create_app(llm: MockLLM) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/stats")
+    @app.get("/v1/stats")
+    async def stats():
+        return llm.stats
+
+    @app.post("/stats/reset")
+    @app.post("/v1/stats/reset")
+    async def reset_stats():
+        llm.reset_stats()
+        return llm.stats
+
+    @app.get("/models")
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": []}
+
+    @app.post("/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        llm.stats["requests"] += 1
+        if llm.stats["first_request_at"] is None:
+            llm.stats["first_request_at"] = time.time()
+        rejection = llm.rejection()
+        if rejection is not None:
+            return rejection
+
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        prompt_tokens = count_prompt_tokens(body.get("messages", []))
+        tokens = llm.completion_tokens()
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        latency = llm.sample_latency()
+        llm.stats["latency_seconds"] += latency
+        llm.start()
+
+        if not body.get("stream"):
+            try:
+                await asyncio.sleep(latency + llm.token_delay(len(tokens)))
+            finally:
+                llm.finish(prompt_tokens, len(tokens))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": " ".join(tokens)},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        llm.stats["streamed"] += 1
+
+        def sse(delta: Dict[str, Any], finish_reason: Optional[str] = None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+            return f"data: {json.dumps(chunk)}\n\n"
+
+        async def stream():
+            try:
+                await asyncio.sleep(latency)
+                yield sse({"role": "assistant", "content": ""})
+                for start in range(0, len(tokens), llm.chunk_size):
+                    chunk_tokens = tokens[start : start + llm.chunk_size]
+                    content = " ".join(chunk_tokens)
+                    yield sse({"content": content if start == 0 else " " + content})
+                    await asyncio.sleep(llm.token_delay(len(chunk_tokens)))
+                yield sse({}, "stop")
+                if include_usage:
+                    usage_chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [],
+                        "usage": usage,
+                    }
+                    yield f"data: {json.dumps(usage_chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                llm.finish(prompt_tokens, len(tokens))
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main(args):
+    llm = MockLLM(
+        latency_ms=args.latency_ms,
+        latency_distribution=args.latency_distribution,
+        latency_jitter_ms=args.latency_jitter_ms,
+        latency_sigma=args.latency_sigma,
+        tokens=args.tokens,
+        token_rate=args.token_rate,
+        chunk_size=args.chunk_size,
+        response_text=args.response_text,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        rpm=args.rpm,
+        max_concurrency=args.max_concurrency,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(llm), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument(
+        "--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="fixed"
+    )
+    parser.add_argument("--latency-jitter-ms", type=float, default=100)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-rate", type=float, default=100)
+    parser.add_argument("--chunk-size", type=int, default=1)
+    parser.add_argument("--response-text")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--max-concurrency", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
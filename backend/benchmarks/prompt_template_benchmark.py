@@ -0,0 +1,87 @@
+"""Micro-benchmark for prompt rendering in batch runs.
+
+Compares the previous per-sample string rewrites + str.format with compiled templates.
+
+Usage (from backend/):
+    python -m benchmarks.prompt_template_benchmark --samples 100000
+"""
+import argparse
+import time
+from typing import Callable, Dict, List
+
+from utils.prompt_template import TemplateSyntax, compile_prompt_template
+
+PROMPTS = [
+    {
+        "role": "system",
+        "content": "You are a helpful assistant. Answer in JSON like "
+        '{"answer": "...", "confidence": 0.0}.',
+    },
+    {
+        "role": "user",
+        "content": "Context: {{context}}\n\nQuestion: {{question}}\n"
+        "Answer the question about {{topic}} using the context.",
+    },
+]
+
+
+def make_samples(count: int) -> List[Dict[str, str]]:
+    return [
+        {
+            "context": f"Context paragraph number {i}. " * 8,
+            "question": f"What is item {i}?",
+            "topic": f"topic-{i % 100}",
+        }
+        for i in range(count)
+    ]
+
+
+def render_legacy(samples: List[Dict[str, str]]) -> int:
+    """Same string handling as run_cloud_function_model did before compiled templates."""
+    rendered = 0
+    for sample in samples:
+        for prompt in PROMPTS:
+            content = prompt["content"].replace("{", "{{").replace("}", "}}")
+            content = content.replace("{{{{", "{").replace("}}}}", "}")
+            content.format(**sample)
+            rendered += 1
+    return rendered
+
+
+def render_compiled(samples: List[Dict[str, str]]) -> int:
+    templates = [
+        compile_prompt_template(prompt["content"], TemplateSyntax.DOUBLE_BRACE)
+        for prompt in PROMPTS
+    ]
+    rendered = 0
+    for sample in samples:
+        for template in templates:
+            template.render(sample)
+            rendered += 1
+    return rendered
+
+
+def measure(name: str, func: Callable[[List[Dict[str, str]]], int], samples) -> float:
+    start = time.perf_counter()
+    rendered = func(samples)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:>10}: {elapsed:.3f}s for {rendered} prompts "
+        f"({rendered / elapsed:,.0f} prompts/s)"
+    )
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=100_000)
+    args = parser.parse_args()
+
+    samples = make_samples(args.samples)
+    legacy = measure("legacy", render_legacy, samples)
+    compiled = measure("compiled", render_compiled, samples)
+    print(f"speedup: {legacy / compiled:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
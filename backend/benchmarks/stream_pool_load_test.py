@@ -0,0 +1,124 @@
+"""Load test for DB connection usage of streaming runs.
+
+Opens many concurrent /api/web/run_function_model streams against a running server,
+and meanwhile probes a DB-backed endpoint. If streams held pooled connections,
+probes would wait for the pool (default 5 + 10 connections) and time out.
+
+Point the organization's LLM provider api_base at a slow (mock) LLM server,
+so streams stay open for a while.
+
+Usage (from backend/):
+    python -m benchmarks.stream_pool_load_test \\
+        --base-url http://localhost:8000 --jwt <token> --project-uuid <uuid> --streams 200
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Dict, List
+
+import httpx
+
+
+async def run_stream(
+    client: httpx.AsyncClient, project_uuid: str, model: str, result: Dict[str, int]
+):
+    body = {
+        "prompts": [
+            {"role": "system", "step": 1, "content": "You are a helpful assistant."},
+            {"role": "user", "step": 2, "content": "Count from 1 to 100."},
+        ],
+        "model": model,
+        "use_cache": False,
+    }
+    try:
+        async with client.stream(
+            "POST",
+            "/api/web/run_function_model",
+            params={"project_uuid": project_uuid},
+            json=body,
+        ) as response:
+            if response.status_code != 200:
+                result["failed"] += 1
+                return
+            last_chunk = ""
+            async for chunk in response.aiter_text():
+                last_chunk = chunk
+        if '"completed"' in last_chunk:
+            result["completed"] += 1
+        else:
+            result["failed"] += 1
+    except httpx.HTTPError:
+        result["failed"] += 1
+
+
+async def probe(
+    client: httpx.AsyncClient,
+    project_uuid: str,
+    latencies: List[float],
+    errors: List[str],
+    stop: asyncio.Event,
+    interval: float,
+):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            response = await client.get(f"/api/web/projects/{project_uuid}")
+            if response.status_code != 200:
+                errors.append(f"status {response.status_code}")
+        except httpx.HTTPError as error:
+            errors.append(repr(error))
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(interval)
+
+
+async def main(args):
+    headers = {"Authorization": f"Bearer {args.jwt}"}
+    limits = httpx.Limits(max_connections=args.streams + 10)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(
+        base_url=args.base_url, headers=headers, limits=limits, timeout=timeout
+    ) as client:
+        result = {"completed": 0, "failed": 0}
+        latencies: List[float] = []
+        errors: List[str] = []
+        stop = asyncio.Event()
+
+        probe_task = asyncio.create_task(
+            probe(client, args.project_uuid, latencies, errors, stop, args.probe_interval)
+        )
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[
+                run_stream(client, args.project_uuid, args.model, result)
+                for _ in range(args.streams)
+            ]
+        )
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe_task
+
+    print(f"streams: {json.dumps(result)} in {elapsed:.1f}s")
+    if latencies:
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(
+            f"probe latency: p50 {statistics.median(latencies):.0f}ms, "
+            f"p99 {p99:.0f}ms, max {latencies[-1]:.0f}ms ({len(latencies)} probes)"
+        )
+    print(f"probe errors: {len(errors)}")
+    for error in errors[:10]:
+        print(f"  {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--jwt", required=True)
+    parser.add_argument("--project-uuid", required=True)
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--probe-interval", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=300)
+    asyncio.run(main(parser.parse_args()))
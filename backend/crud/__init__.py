@@ -1 +1,12 @@
-from .crud import save_instances, update_instances, pull_instances, disconnect_local
+from .crud import (
+    save_instances,
+    update_instances,
+    pull_instances,
+    disconnect_local,
+    delete_unsaved_chat_run,
+    create_sample_input_staging_table,
+    copy_sample_inputs_to_staging,
+    insert_staged_sample_inputs_in_dataset,
+    select_cost_backfill_chunk,
+    update_costs,
+)
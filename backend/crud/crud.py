@@ -4,9 +4,10 @@ import json
 
 from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import Result, select, asc, desc, update
+from sqlalchemy import Result, select, insert, asc, desc, update, delete
 
 
+from utils.logger import logger
 from base.database import get_session, get_session_context
 from db_models import *
 from modules.types import (
@@ -14,6 +15,18 @@ from modules.types import (
 )
 
 
+async def _insert_returning(
+    session: AsyncSession, model: Any, rows: List[Dict]
+) -> List[Dict[str, Any]]:
+    """Insert rows in one statement, and return them with server-generated columns."""
+    if len(rows) == 0:
+        return []
+    result = await session.scalars(
+        insert(model).returning(model), rows
+    )
+    return [r.model_dump() for r in result.all()]
+
+
 async def save_instances(
     session: AsyncSession,
     function_models: List[Dict],
@@ -22,43 +35,17 @@ async def save_instances(
     function_schemas: List[Dict],
 ) -> Dict[str, Any]:
     async with session.begin_nested():
-        # Insert prompt models
-        current_time = datetime.utcnow()
-
-        function_models = [FunctionModel(**data) for data in function_models]
-        session.add_all(function_models)
-
-        # Insert chat models
-        chat_models = [ChatModel(**data) for data in chat_models]
-        session.add_all(chat_models)
-
-        # Insert sample inputs
-        sample_inputs = [SampleInput(**data) for data in sample_inputs]
-        session.add_all(sample_inputs)
-
-        # Insert function schemas
-        function_schemas = [FunctionSchema(**data) for data in function_schemas]
-        session.add_all(function_schemas)
-
-        await session.flush()
-
-        for obj in function_models:
-            await session.refresh(obj)
-
-        for obj in chat_models:
-            await session.refresh(obj)
-
-        for obj in sample_inputs:
-            await session.refresh(obj)
-
-        for obj in function_schemas:
-            await session.refresh(obj)
-
         return {
-            "function_model_rows": [r.model_dump() for r in function_models],
-            "chat_model_rows": [r.model_dump() for r in chat_models],
-            "sample_input_rows": [r.model_dump() for r in sample_inputs],
-            "function_schema_rows": [r.model_dump() for r in function_schemas],
+            "function_model_rows": await _insert_returning(
+                session, FunctionModel, function_models
+            ),
+            "chat_model_rows": await _insert_returning(session, ChatModel, chat_models),
+            "sample_input_rows": await _insert_returning(
+                session, SampleInput, sample_inputs
+            ),
+            "function_schema_rows": await _insert_returning(
+                session, FunctionSchema, function_schemas
+            ),
         }
 
 
@@ -137,6 +124,201 @@ async def update_instances(
     return result.mappings().one()
 
 
+SAMPLE_INPUT_STAGING_TABLE = "sample_input_staging"
+SAMPLE_INPUT_STAGING_COLUMNS = ["seq", "name", "content", "input_keys", "ground_truth"]
+
+
+async def _get_driver_connection(session: AsyncSession):
+    """Return the raw asyncpg connection behind the session's current transaction."""
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    return raw_connection.driver_connection
+
+
+async def create_sample_input_staging_table(session: AsyncSession) -> None:
+    """Create a temporary staging table for bulk sample input loads.
+
+    The table lives until the end of the current transaction.
+    """
+    await session.execute(
+        text(
+            f"""
+            CREATE TEMP TABLE IF NOT EXISTS {SAMPLE_INPUT_STAGING_TABLE} (
+                seq BIGINT NOT NULL,
+                name TEXT,
+                content JSONB NOT NULL,
+                input_keys TEXT[],
+                ground_truth TEXT
+            ) ON COMMIT DROP
+        """
+        )
+    )
+
+
+async def copy_sample_inputs_to_staging(
+    session: AsyncSession,
+    sample_inputs: List[Dict[str, Any]],
+    start_seq: int = 0,
+) -> int:
+    """COPY a batch of sample inputs into the staging table. Returns the number of rows copied."""
+    if len(sample_inputs) == 0:
+        return 0
+    records = [
+        (
+            start_seq + i,
+            sample_input.get("name"),
+            json.dumps(sample_input["content"]),
+            sample_input.get("input_keys"),
+            sample_input.get("ground_truth"),
+        )
+        for i, sample_input in enumerate(sample_inputs)
+    ]
+    driver_connection = await _get_driver_connection(session)
+    await driver_connection.copy_records_to_table(
+        SAMPLE_INPUT_STAGING_TABLE,
+        records=records,
+        columns=SAMPLE_INPUT_STAGING_COLUMNS,
+    )
+    return len(records)
+
+
+async def insert_staged_sample_inputs_in_dataset(
+    session: AsyncSession,
+    dataset_uuid: str,
+    project_uuid: str,
+    function_model_uuid: Optional[str],
+) -> int:
+    """Move staged rows into sample_input and link them to the dataset in one statement.
+
+    Returns the number of sample inputs created.
+    """
+    result = await session.execute(
+        text(
+            f"""
+            WITH inserted AS (
+                INSERT INTO sample_input (
+                    name, content, input_keys, ground_truth, online,
+                    project_uuid, function_model_uuid
+                )
+                SELECT
+                    name, content, input_keys, ground_truth, FALSE,
+                    CAST(:project_uuid AS UUID), CAST(:function_model_uuid AS UUID)
+                FROM {SAMPLE_INPUT_STAGING_TABLE}
+                ORDER BY seq
+                RETURNING uuid
+            ), linked AS (
+                INSERT INTO dataset_sample_input (dataset_uuid, sample_input_uuid)
+                SELECT CAST(:dataset_uuid AS UUID), uuid FROM inserted
+                RETURNING sample_input_uuid
+            )
+            SELECT COUNT(*) FROM linked
+        """
+        ),
+        {
+            "dataset_uuid": str(dataset_uuid),
+            "project_uuid": str(project_uuid),
+            "function_model_uuid": str(function_model_uuid)
+            if function_model_uuid
+            else None,
+        },
+    )
+    return result.scalar_one()
+
+
+# (log table, FROM clause joining the model of each log)
+COST_BACKFILL_SOURCES = {
+    "run_log": """
+        run_log AS log
+        JOIN function_model_version AS version ON version.uuid = log.version_uuid
+    """,
+    "chat_log": """
+        chat_log AS log
+        JOIN chat_session ON chat_session.uuid = log.session_uuid
+        JOIN chat_model_version AS version ON version.uuid = chat_session.version_uuid
+    """,
+}
+
+
+async def select_cost_backfill_chunk(
+    session: AsyncSession,
+    table: str,
+    last_id: int,
+    chunk_size: int,
+    project_uuid: Optional[str] = None,
+    only_missing: bool = False,
+) -> List[Tuple[int, str, Optional[int], Optional[int]]]:
+    """Next chunk of (id, model, prompt_tokens, completion_tokens) of logs, ordered by id."""
+    conditions = ["log.id > :last_id"]
+    if project_uuid:
+        conditions.append("log.project_uuid = CAST(:project_uuid AS UUID)")
+    if only_missing:
+        conditions.append("log.cost IS NULL")
+
+    result = await session.execute(
+        text(
+            f"""
+            SELECT log.id, version.model, log.prompt_tokens, log.completion_tokens
+            FROM {COST_BACKFILL_SOURCES[table]}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY log.id
+            LIMIT :chunk_size
+        """
+        ),
+        {
+            "last_id": last_id,
+            "chunk_size": chunk_size,
+            "project_uuid": str(project_uuid) if project_uuid else None,
+        },
+    )
+    return [tuple(row) for row in result.all()]
+
+
+async def update_costs(
+    session: AsyncSession, table: str, ids: List[int], costs: List[float]
+) -> int:
+    """Set cost of many log rows in one statement. Returns the number of updated rows."""
+    if table not in COST_BACKFILL_SOURCES:
+        raise ValueError(f"Unknown log table {table}")
+    result = await session.execute(
+        text(
+            f"""
+            UPDATE {table}
+            SET cost = new_cost.cost
+            FROM unnest(
+                CAST(:ids AS BIGINT[]), CAST(:costs AS DOUBLE PRECISION[])
+            ) AS new_cost(id, cost)
+            WHERE {table}.id = new_cost.id
+        """
+        ),
+        {"ids": ids, "costs": costs},
+    )
+    return result.rowcount
+
+
+async def delete_unsaved_chat_run(
+    chat_session_uuid: Optional[str], chat_model_version_uuid: Optional[str]
+) -> None:
+    """Delete the chat session and version created by a chat run that ended before its
+    messages were saved (failed or cancelled). None for the ones the run didn't create."""
+    if chat_session_uuid is None and chat_model_version_uuid is None:
+        return
+    try:
+        async with get_session_context() as session:
+            if chat_session_uuid is not None:
+                await session.execute(
+                    delete(ChatSession).where(ChatSession.uuid == chat_session_uuid)
+                )
+            if chat_model_version_uuid is not None:
+                await session.execute(
+                    delete(ChatModelVersion).where(
+                        ChatModelVersion.uuid == chat_model_version_uuid
+                    )
+                )
+            await session.commit()
+    except Exception as error:
+        logger.error(f"Error deleting unsaved chat run: {error}")
+
+
 async def disconnect_local(token: str):
     """Disconnect local instance from Supabase
         SQL:
@@ -10,6 +10,7 @@ from sqlalchemy import (
     BigInteger,
     ARRAY,
     Identity,
+    Index,
 )
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from uuid import UUID as UUIDType
@@ -47,6 +48,10 @@ class ChatModel(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        Index("ix_chat_model_project_uuid_name", "project_uuid", "name"),
+    )
+
     # project: "Project" = Relationship("Project", back_populates="chat_models")
     # project: "Project" = Relationship(back_populates="chat_models")
     # chat_model_versions: List["ChatModelVersion"] = Relationship(
@@ -90,6 +95,14 @@ class ChatModelVersion(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        Index(
+            "ix_chat_model_version_chat_model_uuid_version",
+            "chat_model_uuid",
+            "version",
+        ),
+    )
+
     # chat_model: "ChatModel" = Relationship(back_populates="chat_model_versions")
     # chat_sessions: List["ChatSession"] = Relationship(
     #     back_populates="chat_model_version"
@@ -124,6 +137,10 @@ class ChatSession(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        Index("ix_chat_session_version_uuid", "version_uuid"),
+    )
+
     # chat_model_version: "ChatModelVersion" = Relationship(
     #     back_populates="chat_sessions"
     # )
@@ -164,6 +181,12 @@ class ChatMessage(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        Index(
+            "ix_chat_message_session_uuid_created_at", "session_uuid", "created_at"
+        ),
+    )
+
     # chat_session: "ChatSession" = Relationship(back_populates="chat_messages")
 
 
@@ -226,3 +249,8 @@ class ChatLog(Base):
     total_tokens: Optional[int] = Column(BigInteger, nullable=True)
     latency: Optional[float] = Column(Float, nullable=True)
     cost: Optional[float] = Column(Float, nullable=True)
+
+    __table_args__ = (
+        Index("ix_chat_log_project_uuid", "project_uuid"),
+        Index("ix_chat_log_session_uuid", "session_uuid"),
+    )
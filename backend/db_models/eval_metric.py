@@ -13,6 +13,7 @@ from sqlalchemy import (
     BigInteger,
     ARRAY,
     Identity,
+    Index,
     UniqueConstraint,
 )
 from sqlalchemy.dialects.postgresql import UUID, JSONB
@@ -77,4 +78,20 @@ class EvalMetric(Base):
             "name",
             name="_project_function_model_name_uc",
         ),
+        Index(
+            "ix_eval_metric_function_model_uuid_name",
+            "function_model_uuid",
+            "name",
+            postgresql_where=text("function_model_uuid IS NOT NULL"),
+        ),
+        # project-level metrics, the constraint above doesn't cover them (NULLs are distinct)
+        Index(
+            "ix_eval_metric_project_uuid_name",
+            "project_uuid",
+            "name",
+            unique=True,
+            postgresql_where=text(
+                "function_model_uuid IS NULL AND chat_model_uuid IS NULL"
+            ),
+        ),
     )
@@ -13,6 +13,7 @@ from sqlalchemy import (
     BigInteger,
     ARRAY,
     Identity,
+    Index,
 )
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from uuid import uuid4, UUID as UUIDType
@@ -50,6 +51,10 @@ class FunctionModel(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        Index("ix_function_model_project_uuid_name", "project_uuid", "name"),
+    )
+
     # project: "Project" = Relationship(back_populates="function_models")
     # function_model_versions: List["FunctionModelVersion"] = Relationship(
     #     back_populates="function_model"
@@ -109,6 +114,14 @@ class FunctionModelVersion(Base):
         nullable=True,
     )
 
+    __table_args__ = (
+        Index(
+            "ix_function_model_version_function_model_uuid_version",
+            "function_model_uuid",
+            "version",
+        ),
+    )
+
     # function_model: "FunctionModel" = Relationship(back_populates="function_model_versions")
     # prompts: List["Prompt"] = Relationship(back_populates="function_model_version")
     # run_logs: List["RunLog"] = Relationship(back_populates="function_model_version")
@@ -136,6 +149,10 @@ class Prompt(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        Index("ix_prompt_version_uuid_step", "version_uuid", "step"),
+    )
+
     # function_model_version: "FunctionModelVersion" = Relationship(back_populates="prompts")
 
 
@@ -208,4 +225,17 @@ class RunLog(Base):
         ),
     )
 
+    __table_args__ = (
+        Index("ix_run_log_version_uuid_created_at", "version_uuid", "created_at"),
+        Index("ix_run_log_project_uuid_created_at", "project_uuid", "created_at"),
+        # a sample input is run once per batch run
+        Index(
+            "ix_run_log_batch_run_uuid_sample_input_uuid",
+            "batch_run_uuid",
+            "sample_input_uuid",
+            unique=True,
+            postgresql_where=text("batch_run_uuid IS NOT NULL"),
+        ),
+    )
+
     # function_model_version: "FunctionModelVersion" = Relationship(back_populates="run_logs")
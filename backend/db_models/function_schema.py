@@ -13,6 +13,7 @@ from sqlalchemy import (
     BigInteger,
     ARRAY,
     Identity,
+    Index,
 )
 
 from sqlalchemy.dialects.postgresql import UUID, JSONB
@@ -53,4 +54,8 @@ class FunctionSchema(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        Index("ix_function_schema_project_uuid_name", "project_uuid", "name"),
+    )
+
     # project: "Project" = Relationship(back_populates="function_schemas")
@@ -14,6 +14,7 @@ from sqlalchemy import (
     BigInteger,
     ARRAY,
     Identity,
+    Index,
 )
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.sql import func, text
@@ -154,6 +155,14 @@ class Project(Base):
         nullable=True,
     )
 
+    __table_args__ = (
+        Index(
+            "ix_project_cli_access_key",
+            "cli_access_key",
+            postgresql_where=text("cli_access_key IS NOT NULL"),
+        ),
+    )
+
 
 class ProjectChangelog(Base):
     __tablename__ = "project_changelog"
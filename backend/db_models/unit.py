@@ -13,6 +13,7 @@ from sqlalchemy import (
     BigInteger,
     ARRAY,
     Identity,
+    UniqueConstraint,
 )
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from uuid import uuid4, UUID as UUIDType
@@ -49,6 +50,10 @@ class Unit(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        UniqueConstraint("project_uuid", "name", name="_unit_project_name_uc"),
+    )
+
 
 class UnitVersion(Base):
     __tablename__ = "unit_version"
@@ -76,6 +81,10 @@ class UnitVersion(Base):
         nullable=False,
     )
 
+    __table_args__ = (
+        UniqueConstraint("unit_uuid", "version", name="_unit_version_unit_version_uc"),
+    )
+
 class UnitLog(Base):
     __tablename__ = "unit_log"
     
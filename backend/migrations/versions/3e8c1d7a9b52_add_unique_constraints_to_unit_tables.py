@@ -0,0 +1,143 @@
+"""Add unique constraints to unit, unit_version & project-level eval_metric
+
+Revision ID: 3e8c1d7a9b52
+Revises: f671296cbc81
+Create Date: 2026-10-19 16:42:07.915322
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e8c1d7a9b52'
+down_revision: Union[str, None] = 'f671296cbc81'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# eval metrics of a project, not of a function model or chat model (e.g. of unit logs)
+PROJECT_METRIC = "function_model_uuid IS NULL AND chat_model_uuid IS NULL"
+# score tables -> column of the scored instance
+SCORE_TABLES = {
+    "run_log_score": "run_log_uuid",
+    "chat_session_score": "chat_session_uuid",
+    "unit_log_score": "unit_log_uuid",
+}
+
+
+def upgrade() -> None:
+    # units & versions were created with select-then-insert, so concurrent requests could
+    # duplicate them. Merge duplicates into the oldest row before adding the constraints.
+    op.execute(
+        """
+        WITH duplicate AS (
+            SELECT uuid, first_value(uuid) OVER (
+                PARTITION BY project_uuid, name ORDER BY created_at, id
+            ) AS keep_uuid
+            FROM unit
+        )
+        UPDATE unit_version SET unit_uuid = duplicate.keep_uuid
+        FROM duplicate
+        WHERE unit_version.unit_uuid = duplicate.uuid
+        AND duplicate.uuid <> duplicate.keep_uuid
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM unit USING unit AS kept
+        WHERE unit.project_uuid = kept.project_uuid AND unit.name = kept.name
+        AND (unit.created_at, unit.id) > (kept.created_at, kept.id)
+        """
+    )
+    op.execute(
+        """
+        WITH duplicate AS (
+            SELECT uuid, first_value(uuid) OVER (
+                PARTITION BY unit_uuid, version ORDER BY created_at, id
+            ) AS keep_uuid
+            FROM unit_version
+        )
+        UPDATE unit_log SET version_uuid = duplicate.keep_uuid
+        FROM duplicate
+        WHERE unit_log.version_uuid = duplicate.uuid
+        AND duplicate.uuid <> duplicate.keep_uuid
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM unit_version USING unit_version AS kept
+        WHERE unit_version.unit_uuid = kept.unit_uuid
+        AND unit_version.version = kept.version
+        AND (unit_version.created_at, unit_version.id) > (kept.created_at, kept.id)
+        """
+    )
+    # project-level metrics were created with select-then-insert too. Move the scores of
+    # duplicates to the oldest metric, unless the instance has a score of it already
+    duplicate_metric = f"""
+        SELECT uuid, first_value(uuid) OVER w AS keep_uuid, row_number() OVER w AS rank
+        FROM eval_metric
+        WHERE {PROJECT_METRIC}
+        WINDOW w AS (PARTITION BY project_uuid, name ORDER BY created_at, id)
+    """
+    for table, scored in SCORE_TABLES.items():
+        op.execute(
+            f"""
+            WITH duplicate AS ({duplicate_metric})
+            UPDATE {table} SET eval_metric_uuid = duplicate.keep_uuid
+            FROM duplicate
+            WHERE {table}.eval_metric_uuid = duplicate.uuid
+            AND duplicate.uuid <> duplicate.keep_uuid
+            AND NOT EXISTS (
+                SELECT 1 FROM {table} AS other
+                JOIN duplicate AS other_duplicate
+                ON other_duplicate.uuid = other.eval_metric_uuid
+                WHERE other.{scored} = {table}.{scored}
+                AND other_duplicate.keep_uuid = duplicate.keep_uuid
+                AND other_duplicate.rank < duplicate.rank
+            )
+            """
+        )
+    op.execute(
+        f"""
+        WITH duplicate AS ({duplicate_metric})
+        UPDATE dataset SET eval_metric_uuid = duplicate.keep_uuid
+        FROM duplicate
+        WHERE dataset.eval_metric_uuid = duplicate.uuid
+        AND duplicate.uuid <> duplicate.keep_uuid
+        """
+    )
+    # scores left on duplicates are deleted with them
+    op.execute(
+        f"""
+        DELETE FROM eval_metric USING eval_metric AS kept
+        WHERE eval_metric.project_uuid = kept.project_uuid
+        AND eval_metric.name = kept.name
+        AND eval_metric.function_model_uuid IS NULL
+        AND eval_metric.chat_model_uuid IS NULL
+        AND kept.function_model_uuid IS NULL
+        AND kept.chat_model_uuid IS NULL
+        AND (eval_metric.created_at, eval_metric.id) > (kept.created_at, kept.id)
+        """
+    )
+    op.create_unique_constraint(
+        "_unit_project_name_uc", "unit", ["project_uuid", "name"]
+    )
+    op.create_unique_constraint(
+        "_unit_version_unit_version_uc", "unit_version", ["unit_uuid", "version"]
+    )
+    # the unique constraint of eval_metric doesn't cover them, NULLs are distinct
+    op.create_index(
+        "ix_eval_metric_project_uuid_name",
+        "eval_metric",
+        ["project_uuid", "name"],
+        unique=True,
+        postgresql_where=sa.text(PROJECT_METRIC),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_eval_metric_project_uuid_name", table_name="eval_metric")
+    op.drop_constraint("_unit_version_unit_version_uc", "unit_version", type_="unique")
+    op.drop_constraint("_unit_project_name_uc", "unit", type_="unique")
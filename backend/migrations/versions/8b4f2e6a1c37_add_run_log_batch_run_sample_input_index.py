@@ -0,0 +1,61 @@
+"""Add unique index of run_log batch run & sample input
+
+Revision ID: 8b4f2e6a1c37
+Revises: 3e8c1d7a9b52
+Create Date: 2026-10-19 18:21:44.602518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b4f2e6a1c37'
+down_revision: Union[str, None] = '3e8c1d7a9b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# run logs of sample inputs run more than once in a batch run, all but the oldest one
+DUPLICATES = """
+    FROM run_log WHERE EXISTS (
+        SELECT 1 FROM run_log AS kept
+        WHERE kept.batch_run_uuid = run_log.batch_run_uuid
+        AND kept.sample_input_uuid = run_log.sample_input_uuid
+        AND (kept.created_at, kept.id) < (run_log.created_at, run_log.id)
+    )
+"""
+
+
+def upgrade() -> None:
+    # a sample input is run once per batch run, its run log is the checkpoint of a resume.
+    # Duplicates are not deleted here, the upgrade fails until they are removed
+    duplicates = op.get_bind().execute(sa.text(f"SELECT count(*) {DUPLICATES}")).scalar()
+    if duplicates:
+        raise RuntimeError(
+            f"{duplicates} run logs duplicate a sample input of their batch run, so the "
+            "unique index of run_log (batch_run_uuid, sample_input_uuid) can't be created. "
+            "Review them, then keep the oldest run log of each sample input "
+            f"(their scores are deleted with them) with:\nDELETE {DUPLICATES.strip()}"
+        )
+    # replaces the index of batch_run_uuid, a prefix of the new one
+    op.drop_index("ix_run_log_batch_run_uuid", table_name="run_log")
+    op.create_index(
+        "ix_run_log_batch_run_uuid_sample_input_uuid",
+        "run_log",
+        ["batch_run_uuid", "sample_input_uuid"],
+        unique=True,
+        postgresql_where=sa.text("batch_run_uuid IS NOT NULL"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_run_log_batch_run_uuid_sample_input_uuid", table_name="run_log")
+    op.create_index(
+        "ix_run_log_batch_run_uuid",
+        "run_log",
+        ["batch_run_uuid"],
+        postgresql_where=sa.text("batch_run_uuid IS NOT NULL"),
+    )
@@ -0,0 +1,85 @@
+"""Add indexes for hot queries
+
+Revision ID: f671296cbc81
+Revises: be97f2f2a373
+Create Date: 2026-10-19 14:05:12.381204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f671296cbc81'
+down_revision: Union[str, None] = 'be97f2f2a373'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (name, table, columns, partial index condition)
+INDEXES = [
+    # CLI requests & websocket connections look projects up by cli_access_key
+    ("ix_project_cli_access_key", "project", ["cli_access_key"], "cli_access_key IS NOT NULL"),
+    ("ix_function_model_project_uuid_name", "function_model", ["project_uuid", "name"], None),
+    (
+        "ix_function_model_version_function_model_uuid_version",
+        "function_model_version",
+        ["function_model_uuid", "version"],
+        None,
+    ),
+    ("ix_prompt_version_uuid_step", "prompt", ["version_uuid", "step"], None),
+    # run logs of a version / project, newest first
+    ("ix_run_log_version_uuid_created_at", "run_log", ["version_uuid", "created_at"], None),
+    ("ix_run_log_project_uuid_created_at", "run_log", ["project_uuid", "created_at"], None),
+    # most run logs aren't from batch runs
+    ("ix_run_log_batch_run_uuid", "run_log", ["batch_run_uuid"], "batch_run_uuid IS NOT NULL"),
+    ("ix_chat_model_project_uuid_name", "chat_model", ["project_uuid", "name"], None),
+    (
+        "ix_chat_model_version_chat_model_uuid_version",
+        "chat_model_version",
+        ["chat_model_uuid", "version"],
+        None,
+    ),
+    ("ix_chat_session_version_uuid", "chat_session", ["version_uuid"], None),
+    # chat history of a session, in order
+    (
+        "ix_chat_message_session_uuid_created_at",
+        "chat_message",
+        ["session_uuid", "created_at"],
+        None,
+    ),
+    ("ix_chat_log_project_uuid", "chat_log", ["project_uuid"], None),
+    ("ix_chat_log_session_uuid", "chat_log", ["session_uuid"], None),
+    ("ix_function_schema_project_uuid_name", "function_schema", ["project_uuid", "name"], None),
+    # project-level metrics (function_model_uuid IS NULL) are covered by _project_function_model_name_uc
+    (
+        "ix_eval_metric_function_model_uuid_name",
+        "eval_metric",
+        ["function_model_uuid", "name"],
+        "function_model_uuid IS NOT NULL",
+    ),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY doesn't block writes to run_log / chat_message while building,
+    # but can't run in a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                postgresql_where=sa.text(where) if where else None,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True, if_exists=True
+            )
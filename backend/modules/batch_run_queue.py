@@ -0,0 +1,236 @@
+"""Durable queue of batch runs, in a Redis stream.
+
+The web server enqueues batch runs, and batch run workers (worker.py) run them, so batch
+runs survive deploys & crashes of the web server, and don't share its event loop. Workers
+read jobs as one consumer group, so batch runs are spread over any number of workers.
+
+A job stays pending until its batch run finished. The worker running it renews its lease
+(the idle time of the pending entry) every third of BATCH_RUN_QUEUE_LEASE. A job whose lease
+expired, because its worker died, was stopped or the run failed, is claimed by a worker and
+run again, and resumes from the sample inputs already run. A worker whose job was claimed by
+another one (e.g. its heartbeats were late) stops running it. A job run
+BATCH_RUN_QUEUE_MAX_ATTEMPTS times is dropped, and its batch run marked failed.
+
+Opt-in with BATCH_RUN_QUEUE=redis, batch runs are run in the web process otherwise.
+
+Env vars:
+    BATCH_RUN_QUEUE: "redis" (batch runs are run in the web process if unset)
+    BATCH_RUN_QUEUE_STREAM: stream of jobs (default "batch_run_jobs")
+    BATCH_RUN_QUEUE_LEASE: seconds a job is kept by a worker without heartbeat (default 60)
+    BATCH_RUN_QUEUE_MAX_ATTEMPTS: runs of a job before it is dropped (default 3)
+    BATCH_RUN_WORKER_CONCURRENCY: jobs run at once by a worker (default 2)
+"""
+import os
+import json
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from redis.exceptions import ResponseError
+
+from utils.logger import logger
+from base.metrics import batch_run_queue_active_jobs, batch_run_queue_jobs_total
+
+load_dotenv()
+
+BATCH_RUN_QUEUE = os.environ.get("BATCH_RUN_QUEUE", "").lower()
+BATCH_RUN_QUEUE_STREAM = os.environ.get("BATCH_RUN_QUEUE_STREAM", "batch_run_jobs")
+BATCH_RUN_QUEUE_LEASE = float(os.environ.get("BATCH_RUN_QUEUE_LEASE", 60))
+BATCH_RUN_QUEUE_MAX_ATTEMPTS = int(os.environ.get("BATCH_RUN_QUEUE_MAX_ATTEMPTS", 3))
+BATCH_RUN_WORKER_CONCURRENCY = int(os.environ.get("BATCH_RUN_WORKER_CONCURRENCY", 2))
+
+# seconds a worker blocks reading new jobs, before claiming expired ones again
+READ_BLOCK_SECONDS = 5
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class BatchRunQueue:
+    GROUP = "batch_run_workers"
+    # KEYS[1]: stream, ARGV: group, consumer, entry ids. Claims the entries still pending for
+    # the consumer, resetting their idle time (JUSTID leaves their delivery count), in one
+    # step so an entry claimed by another worker isn't taken back. Returns the renewed ids.
+    RENEW_SCRIPT = """
+    local renewed = {}
+    for i = 3, #ARGV do
+        local id = ARGV[i]
+        local pending = redis.call("XPENDING", KEYS[1], ARGV[1], id, id, 1, ARGV[2])
+        if #pending > 0 then
+            redis.call("XCLAIM", KEYS[1], ARGV[1], ARGV[2], 0, id, "JUSTID")
+            table.insert(renewed, id)
+        end
+    end
+    return renewed
+    """
+
+    def __init__(self, stream: str, lease: float, max_attempts: int, concurrency: int):
+        from base.redis_connection import redis
+
+        self.redis = redis
+        self.stream = stream
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+        # entry id -> task of the jobs run by this worker
+        self.active: Dict[bytes, asyncio.Task] = {}
+
+    async def enqueue(self, job: Dict[str, Any]) -> None:
+        await self.redis.xadd(self.stream, {"job": json.dumps(job)})
+
+    async def run_worker(
+        self, consumer: str, handler: JobHandler, on_dropped: JobHandler
+    ) -> None:
+        """Run jobs with handler, until cancelled. on_dropped is called with the jobs
+        dropped after max_attempts runs. Jobs running when cancelled stay pending, and are
+        claimed by a worker after their lease."""
+        await self._create_group()
+        heartbeat_task = asyncio.create_task(self._heartbeat(consumer))
+        try:
+            while True:
+                free = self.concurrency - len(self.active)
+                if free <= 0:
+                    await asyncio.wait(
+                        list(self.active.values()), return_when=asyncio.FIRST_COMPLETED
+                    )
+                    continue
+                try:
+                    entries = await self._claim_expired(consumer, free)
+                    if not entries:
+                        entries = await self._read_new(consumer, free)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:
+                    logger.error(f"Error reading batch run queue: {error}")
+                    await asyncio.sleep(READ_BLOCK_SECONDS)
+                    continue
+                for entry_id, fields in entries:
+                    self.active[entry_id] = asyncio.create_task(
+                        self._run_job(entry_id, fields, handler, on_dropped)
+                    )
+                    batch_run_queue_active_jobs.set(len(self.active))
+        finally:
+            heartbeat_task.cancel()
+            for task in self.active.values():
+                task.cancel()
+            await asyncio.gather(
+                heartbeat_task, *self.active.values(), return_exceptions=True
+            )
+
+    async def _create_group(self) -> None:
+        try:
+            # from the start of the stream, jobs enqueued before any worker started are run
+            await self.redis.xgroup_create(self.stream, self.GROUP, id="0", mkstream=True)
+        except ResponseError as error:
+            if "BUSYGROUP" not in str(error):
+                raise
+
+    async def _claim_expired(
+        self, consumer: str, count: int
+    ) -> List[Tuple[bytes, Dict[bytes, bytes]]]:
+        result = await self.redis.xautoclaim(
+            self.stream,
+            self.GROUP,
+            consumer,
+            min_idle_time=int(self.lease * 1000),
+            start_id="0-0",
+            count=count,
+        )
+        # deleted entries are returned without fields
+        return [(entry_id, fields) for entry_id, fields in result[1] if fields]
+
+    async def _read_new(
+        self, consumer: str, count: int
+    ) -> List[Tuple[bytes, Dict[bytes, bytes]]]:
+        result = await self.redis.xreadgroup(
+            self.GROUP,
+            consumer,
+            {self.stream: ">"},
+            count=count,
+            block=READ_BLOCK_SECONDS * 1000,
+        )
+        return [entry for _, entries in result for entry in entries]
+
+    async def _attempts(self, entry_id: bytes) -> int:
+        pending = await self.redis.xpending_range(
+            self.stream, self.GROUP, min=entry_id, max=entry_id, count=1
+        )
+        return pending[0]["times_delivered"] if pending else 1
+
+    async def _ack(self, entry_id: bytes) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xack(self.stream, self.GROUP, entry_id)
+            pipe.xdel(self.stream, entry_id)
+            await pipe.execute()
+
+    async def _run_job(
+        self,
+        entry_id: bytes,
+        fields: Dict[bytes, bytes],
+        handler: JobHandler,
+        on_dropped: JobHandler,
+    ) -> None:
+        try:
+            job = json.loads(fields[b"job"])
+            if await self._attempts(entry_id) > self.max_attempts:
+                logger.error(
+                    f"Batch run job {entry_id.decode()} failed {self.max_attempts} times, dropped"
+                )
+                await on_dropped(job)
+                status = "dropped"
+            else:
+                await handler(job)
+                status = "completed"
+            await self._ack(entry_id)
+            batch_run_queue_jobs_total.labels(status=status).inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            # stays pending, claimed again after its lease
+            logger.error(f"Batch run job {entry_id.decode()} failed: {error}")
+            batch_run_queue_jobs_total.labels(status="failed").inc()
+        finally:
+            self.active.pop(entry_id, None)
+            batch_run_queue_active_jobs.set(len(self.active))
+
+    async def _heartbeat(self, consumer: str) -> None:
+        """Renew the leases of the running jobs."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not self.active:
+                continue
+            try:
+                await self._renew(consumer)
+            except Exception as error:
+                logger.error(f"Error renewing batch run job leases: {error}")
+
+    async def _renew(self, consumer: str) -> None:
+        entry_ids = list(self.active)
+        renewed = set(
+            await self.redis.eval(
+                self.RENEW_SCRIPT, 1, self.stream, self.GROUP, consumer, *entry_ids
+            )
+        )
+        for entry_id in entry_ids:
+            task = self.active.get(entry_id)
+            # acked since, or renewed
+            if task is None or entry_id in renewed:
+                continue
+            # claimed by another worker after its lease, which runs it now
+            logger.error(f"Batch run job {entry_id.decode()} lost its lease, stopped")
+            batch_run_queue_jobs_total.labels(status="lost").inc()
+            task.cancel()
+
+
+def _create_batch_run_queue() -> Optional[BatchRunQueue]:
+    if BATCH_RUN_QUEUE == "redis":
+        return BatchRunQueue(
+            stream=BATCH_RUN_QUEUE_STREAM,
+            lease=BATCH_RUN_QUEUE_LEASE,
+            max_attempts=BATCH_RUN_QUEUE_MAX_ATTEMPTS,
+            concurrency=BATCH_RUN_WORKER_CONCURRENCY,
+        )
+    return None
+
+
+# None if batch runs are run in the web process
+batch_run_queue: Optional[BatchRunQueue] = _create_batch_run_queue()
@@ -0,0 +1,324 @@
+"""Chat session history cache and windowing.
+
+Histories of active sessions are cached after they are first loaded, and new messages are
+appended to the cached history when they are saved, so a turn doesn't reload the whole
+session from the DB. Run paths and the SDK can also request a window of the history
+(the last N messages and/or a token budget), so the cost of a turn doesn't grow with the
+length of the session.
+
+Opt-in with the CHAT_HISTORY_CACHE env var ("redis" or "memory").
+The memory cache is per process, use it only if the server runs a single worker.
+
+Env vars:
+    CHAT_HISTORY_CACHE: "redis" | "memory" (disabled if unset)
+    CHAT_HISTORY_CACHE_TTL: seconds an idle session stays cached (default 1 hour)
+    CHAT_HISTORY_CACHE_MAX_SESSIONS: sessions kept by the memory cache (default 1000)
+"""
+import os
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import select, asc, desc
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from utils.store_utils import select_backend, store_errors
+from db_models import ChatMessage
+from modules.tokenizer import tokenizer_service
+
+load_dotenv()
+
+CHAT_HISTORY_CACHE = os.environ.get("CHAT_HISTORY_CACHE", "").lower()
+CHAT_HISTORY_CACHE_TTL = int(os.environ.get("CHAT_HISTORY_CACHE_TTL", 3600))
+CHAT_HISTORY_CACHE_MAX_SESSIONS = int(
+    os.environ.get("CHAT_HISTORY_CACHE_MAX_SESSIONS", 1000)
+)
+
+# fields of a history message, as sent to models & returned to the SDK
+HISTORY_KEYS = ["role", "name", "content", "tool_calls", "function_call"]
+# messages are token-counted this many at a time, newest first, until the budget is spent
+TOKEN_COUNT_CHUNK_SIZE = 32
+
+
+def _history_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    history_message = {key: message.get(key) for key in HISTORY_KEYS}
+    history_message["token_count"] = message.get("token_count")
+    return history_message
+
+
+class ChatHistoryCache(ABC):
+    """Cached messages are dicts of HISTORY_KEYS and token_count, oldest first.
+    Misses on errors (see store_errors)."""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    @store_errors("reading chat history cache")
+    async def get(
+        self, session_uuid: str, last: Optional[int] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Cached history of a session (only the last messages if last is given),
+        or None if it isn't cached."""
+        return await self._get(str(session_uuid), last)
+
+    @store_errors("writing chat history cache")
+    async def set(self, session_uuid: str, messages: List[Dict[str, Any]]) -> None:
+        await self._set(str(session_uuid), messages)
+
+    @store_errors("writing chat history cache")
+    async def append(self, session_uuid: str, messages: List[Dict[str, Any]]) -> None:
+        """Append to the history of a session, if it is cached."""
+        try:
+            await self._append(str(session_uuid), messages)
+        except Exception:
+            # don't leave a history without the new messages cached
+            await self.delete(session_uuid)
+            raise
+
+    @store_errors("deleting chat history cache")
+    async def delete(self, session_uuid: str) -> None:
+        await self._delete(str(session_uuid))
+
+    @abstractmethod
+    async def _get(
+        self, session_uuid: str, last: Optional[int]
+    ) -> Optional[List[Dict[str, Any]]]:
+        ...
+
+    @abstractmethod
+    async def _set(self, session_uuid: str, messages: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    async def _append(self, session_uuid: str, messages: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    async def _delete(self, session_uuid: str) -> None:
+        ...
+
+
+class RedisChatHistoryCache(ChatHistoryCache):
+    """One Redis list of JSON messages per session. Reads and appends refresh the TTL.
+
+    Sessions without messages aren't cached (Redis has no empty lists), loading them is cheap.
+    """
+
+    PREFIX = "chat_history:"
+
+    def __init__(self, ttl: int):
+        super().__init__(ttl)
+        from base.redis_connection import redis
+
+        self.redis = redis
+
+    async def _get(
+        self, session_uuid: str, last: Optional[int]
+    ) -> Optional[List[Dict[str, Any]]]:
+        key = self.PREFIX + session_uuid
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.exists(key)
+            pipe.lrange(key, -last if last else 0, -1)
+            pipe.expire(key, self.ttl)
+            exists, values, _ = await pipe.execute()
+        if not exists:
+            return None
+        if last == 0:
+            return []
+        return [json.loads(value) for value in values]
+
+    async def _set(self, session_uuid: str, messages: List[Dict[str, Any]]) -> None:
+        key = self.PREFIX + session_uuid
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if messages:
+                pipe.rpush(key, *[json.dumps(m, default=str) for m in messages])
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def _append(self, session_uuid: str, messages: List[Dict[str, Any]]) -> None:
+        if not messages:
+            return
+        key = self.PREFIX + session_uuid
+        async with self.redis.pipeline(transaction=True) as pipe:
+            # RPUSHX doesn't create the list, histories are only cached whole
+            pipe.rpushx(key, *[json.dumps(m, default=str) for m in messages])
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def _delete(self, session_uuid: str) -> None:
+        await self.redis.delete(self.PREFIX + session_uuid)
+
+
+class MemoryChatHistoryCache(ChatHistoryCache):
+    """LRU of session histories in this process."""
+
+    def __init__(self, ttl: int, max_sessions: int):
+        super().__init__(ttl)
+        self.max_sessions = max_sessions
+        # session_uuid -> (expires_at, messages)
+        self.sessions: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = (
+            OrderedDict()
+        )
+
+    def _lookup(self, session_uuid: str) -> Optional[List[Dict[str, Any]]]:
+        entry = self.sessions.get(session_uuid)
+        if entry is None:
+            return None
+        expires_at, messages = entry
+        if expires_at < time.monotonic():
+            del self.sessions[session_uuid]
+            return None
+        self.sessions[session_uuid] = (time.monotonic() + self.ttl, messages)
+        self.sessions.move_to_end(session_uuid)
+        return messages
+
+    async def _get(
+        self, session_uuid: str, last: Optional[int]
+    ) -> Optional[List[Dict[str, Any]]]:
+        messages = self._lookup(session_uuid)
+        if messages is None:
+            return None
+        if last is not None:
+            return messages[len(messages) - min(last, len(messages)) :]
+        return list(messages)
+
+    async def _set(self, session_uuid: str, messages: List[Dict[str, Any]]) -> None:
+        self.sessions[session_uuid] = (time.monotonic() + self.ttl, list(messages))
+        self.sessions.move_to_end(session_uuid)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    async def _append(self, session_uuid: str, messages: List[Dict[str, Any]]) -> None:
+        cached = self._lookup(session_uuid)
+        if cached is not None:
+            cached.extend(messages)
+
+    async def _delete(self, session_uuid: str) -> None:
+        self.sessions.pop(session_uuid, None)
+
+
+# None if the cache is disabled
+chat_history_cache: Optional[ChatHistoryCache] = select_backend(
+    CHAT_HISTORY_CACHE,
+    {
+        "redis": lambda: RedisChatHistoryCache(ttl=CHAT_HISTORY_CACHE_TTL),
+        "memory": lambda: MemoryChatHistoryCache(
+            ttl=CHAT_HISTORY_CACHE_TTL, max_sessions=CHAT_HISTORY_CACHE_MAX_SESSIONS
+        ),
+    },
+)
+
+
+async def window_chat_history(
+    messages: List[Dict[str, Any]],
+    model: str,
+    max_messages: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Newest messages of a history that fit in max_messages and max_tokens.
+
+    Messages without a token_count are counted (content only, like saved ChatMessages),
+    newest first and only until the budget is spent, so windowing a long history costs
+    about as much as the window. A window never starts with a function / tool response
+    whose call was cut off.
+    """
+    if max_messages is not None:
+        messages = messages[len(messages) - min(max(max_messages, 0), len(messages)) :]
+
+    if max_tokens is not None:
+        total_tokens = 0
+        start = len(messages)
+        while start > 0:
+            chunk_start = max(start - TOKEN_COUNT_CHUNK_SIZE, 0)
+            chunk = messages[chunk_start:start]
+            missing = [m for m in chunk if m.get("token_count") is None]
+            counts = iter(
+                await tokenizer_service.count_tokens_batch(
+                    model, [m.get("content") for m in missing]
+                )
+            )
+            token_counts = [
+                m["token_count"] if m.get("token_count") is not None else next(counts)
+                for m in chunk
+            ]
+            for index in range(len(chunk) - 1, -1, -1):
+                if total_tokens + token_counts[index] > max_tokens:
+                    break
+                total_tokens += token_counts[index]
+                start = chunk_start + index
+            else:
+                continue
+            break
+        messages = messages[start:]
+
+    start = 0
+    while start < len(messages) and messages[start]["role"] in ["function", "tool"]:
+        start += 1
+    return messages[start:]
+
+
+async def load_chat_history(
+    db_session: AsyncSession,
+    session_uuid: str,
+    model: str,
+    max_messages: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """History of a chat session, oldest first, windowed by max_messages and max_tokens.
+
+    Read from the cache if the session is cached. Otherwise read from the DB,
+    and cached whole for the next turns.
+    """
+    if max_messages is not None:
+        max_messages = max(max_messages, 0)
+    messages: Optional[List[Dict[str, Any]]] = None
+    if chat_history_cache is not None:
+        messages = await chat_history_cache.get(session_uuid, last=max_messages)
+
+    if messages is None:
+        query = select(
+            ChatMessage.role,
+            ChatMessage.name,
+            ChatMessage.content,
+            ChatMessage.tool_calls,
+            ChatMessage.function_call,
+            ChatMessage.token_count,
+        ).where(ChatMessage.session_uuid == session_uuid)
+        if chat_history_cache is None and max_messages is not None:
+            # nothing to cache, read only the window
+            rows = (
+                await db_session.execute(
+                    query.order_by(desc(ChatMessage.created_at)).limit(max_messages)
+                )
+            ).mappings().all()
+            rows = list(reversed(rows))
+        else:
+            rows = (
+                await db_session.execute(query.order_by(asc(ChatMessage.created_at)))
+            ).mappings().all()
+        messages = [_history_message(row) for row in rows]
+        if chat_history_cache is not None:
+            # turns of a session are sequential, so no messages are appended
+            # between the read above and caching the history
+            await chat_history_cache.set(session_uuid, messages)
+
+    messages = await window_chat_history(messages, model, max_messages, max_tokens)
+    return [{key: message[key] for key in HISTORY_KEYS} for message in messages]
+
+
+async def append_chat_history(
+    session_uuid: str, messages: Sequence[Dict[str, Any]]
+) -> None:
+    """Append messages saved to a session to its cached history.
+
+    Call after the messages are committed, in the order they were created.
+    """
+    if chat_history_cache is None:
+        return
+    await chat_history_cache.append(
+        session_uuid, [_history_message(message) for message in messages]
+    )
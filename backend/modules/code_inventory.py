@@ -0,0 +1,191 @@
+"""Last-known inventory of the code of connected CLIs, from SYNC_CODE.
+
+A CLI sends the names of its function models, chat models and functions with every
+SYNC_CODE (on connect and on every reload of its code). The listings of the dev APIs are
+served from that snapshot, with the time it was synced, instead of a request to the CLI
+per page view. Listings have the items of the CLI's responses: the project's deployed
+instances and the ones only in the code, with used_in_code & is_deployed, read with one
+query. The snapshot of a project is removed when its CLI disconnects. Listings without a
+snapshot, or with refresh=true, still request the CLI.
+
+The memory store is per process. With several workers, a listing handled by another worker
+than the CLI's websocket misses and requests the CLI, use "redis" to share snapshots.
+
+Env vars:
+    CODE_INVENTORY_CACHE: "redis" | "memory" (default "memory")
+    CODE_INVENTORY_CACHE_TTL: seconds a snapshot is kept without a new SYNC_CODE (default 1 day)
+"""
+import os
+import json
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import select, asc
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from utils.store_utils import select_backend, store_errors
+from db_models import ChatModel, FunctionModel, FunctionSchema
+
+load_dotenv()
+
+CODE_INVENTORY_CACHE = os.environ.get("CODE_INVENTORY_CACHE", "memory").lower()
+CODE_INVENTORY_CACHE_TTL = int(os.environ.get("CODE_INVENTORY_CACHE_TTL", 86400))
+
+# keys of a snapshot, same as of the CLI's LIST_* responses -> deployed instances
+INVENTORY_MODELS = {
+    "function_models": FunctionModel,
+    "chat_models": ChatModel,
+    "functions": FunctionSchema,
+}
+INVENTORY_KEYS = list(INVENTORY_MODELS)
+
+
+def code_inventory_from_sync(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Snapshot of a SYNC_CODE message."""
+    return {
+        "function_models": list(data.get("new_function_model") or []),
+        "chat_models": list(data.get("new_chat_model") or []),
+        "functions": [schema["name"] for schema in data.get("new_schemas") or []],
+        "synced_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+class CodeInventoryCache(ABC):
+    """Misses on errors (see store_errors), they never fail a sync."""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    @store_errors("reading code inventory cache")
+    async def get(self, project_uuid: str) -> Optional[Dict[str, Any]]:
+        return await self._get(str(project_uuid))
+
+    @store_errors("writing code inventory cache")
+    async def set(self, project_uuid: str, inventory: Dict[str, Any]) -> None:
+        await self._set(str(project_uuid), inventory)
+
+    @store_errors("deleting code inventory cache")
+    async def delete(self, project_uuid: str) -> None:
+        await self._delete(str(project_uuid))
+
+    @abstractmethod
+    async def _get(self, project_uuid: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def _set(self, project_uuid: str, inventory: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def _delete(self, project_uuid: str) -> None:
+        ...
+
+
+class RedisCodeInventoryCache(CodeInventoryCache):
+    """One JSON value per project."""
+
+    PREFIX = "code_inventory:"
+
+    def __init__(self, ttl: int):
+        super().__init__(ttl)
+        from base.redis_connection import redis
+
+        self.redis = redis
+
+    async def _get(self, project_uuid: str) -> Optional[Dict[str, Any]]:
+        value = await self.redis.get(self.PREFIX + project_uuid)
+        return json.loads(value) if value is not None else None
+
+    async def _set(self, project_uuid: str, inventory: Dict[str, Any]) -> None:
+        await self.redis.set(
+            self.PREFIX + project_uuid, json.dumps(inventory), ex=self.ttl
+        )
+
+    async def _delete(self, project_uuid: str) -> None:
+        await self.redis.delete(self.PREFIX + project_uuid)
+
+
+class MemoryCodeInventoryCache(CodeInventoryCache):
+    """Snapshots of the projects whose CLIs synced with this process."""
+
+    def __init__(self, ttl: int):
+        super().__init__(ttl)
+        # project_uuid -> (expires_at, inventory)
+        self.projects: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+    async def _get(self, project_uuid: str) -> Optional[Dict[str, Any]]:
+        entry = self.projects.get(project_uuid)
+        if entry is None:
+            return None
+        expires_at, inventory = entry
+        if expires_at < time.monotonic():
+            del self.projects[project_uuid]
+            return None
+        return inventory
+
+    async def _set(self, project_uuid: str, inventory: Dict[str, Any]) -> None:
+        self.projects[project_uuid] = (time.monotonic() + self.ttl, inventory)
+
+    async def _delete(self, project_uuid: str) -> None:
+        self.projects.pop(project_uuid, None)
+
+
+code_inventory_cache: CodeInventoryCache = select_backend(
+    CODE_INVENTORY_CACHE,
+    {
+        "redis": lambda: RedisCodeInventoryCache(ttl=CODE_INVENTORY_CACHE_TTL),
+        "memory": lambda: MemoryCodeInventoryCache(ttl=CODE_INVENTORY_CACHE_TTL),
+    },
+    default="memory",
+)
+
+
+def code_inventory_items(
+    names: List[str], deployed: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """Items of a LIST_* response: the deployed instances (uuid & name), then the
+    instances only in the code."""
+    names_in_code = set(names)
+    deployed_names = {instance["name"] for instance in deployed}
+    return [
+        {
+            "uuid": str(instance["uuid"]),
+            "name": instance["name"],
+            "used_in_code": instance["name"] in names_in_code,
+            "is_deployed": True,
+        }
+        for instance in deployed
+    ] + [
+        {"uuid": None, "name": name, "used_in_code": True, "is_deployed": False}
+        for name in names
+        if name not in deployed_names
+    ]
+
+
+async def get_code_inventory(
+    session: AsyncSession, project_uuid: str, key: str
+) -> Optional[Dict[str, Any]]:
+    """Listing of one kind of instance (one of INVENTORY_KEYS) in the last-known code of a
+    project, with the time it was synced. None if there is no snapshot."""
+    inventory = await code_inventory_cache.get(project_uuid)
+    if inventory is None:
+        return None
+    model = INVENTORY_MODELS[key]
+    deployed = (
+        (
+            await session.execute(
+                select(model.uuid, model.name)
+                .where(model.project_uuid == project_uuid)
+                .order_by(asc(model.created_at))
+            )
+        )
+        .mappings()
+        .all()
+    )
+    return {
+        key: code_inventory_items(inventory.get(key, []), deployed),
+        "synced_at": inventory["synced_at"],
+    }
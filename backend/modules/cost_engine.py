@@ -0,0 +1,233 @@
+"""Cost engine for LLM usage.
+
+litellm's price map is loaded once into per-model price arrays, so costs can be computed
+for a single response on ingestion, or for whole token-count columns at once with NumPy.
+
+Backfill costs after a price change (from backend/):
+    python -m modules.cost_engine --table run_log --chunk-size 10000
+"""
+import math
+import argparse
+import asyncio
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import litellm
+
+from utils.logger import logger
+
+COST_TABLES = ["run_log", "chat_log"]
+
+
+class PriceTable:
+    """Per-token input/output prices of every model in a litellm-style price map."""
+
+    def __init__(self, model_cost: Dict[str, Dict[str, Any]]):
+        self.models: List[str] = list(model_cost.keys())
+        self.index: Dict[str, int] = {
+            model: i for i, model in enumerate(self.models)
+        }
+        self.input_cost_per_token = np.array(
+            [
+                _to_price(prices.get("input_cost_per_token"))
+                for prices in model_cost.values()
+            ],
+            dtype=np.float64,
+        )
+        self.output_cost_per_token = np.array(
+            [
+                _to_price(prices.get("output_cost_per_token"))
+                for prices in model_cost.values()
+            ],
+            dtype=np.float64,
+        )
+        # model name -> index in the table (-1 if unknown)
+        self._resolved: Dict[str, int] = {}
+
+    def resolve(self, model: Optional[str]) -> int:
+        """Index of the model's prices, -1 if the model is unknown or unpriced.
+
+        Model names with a provider prefix (e.g. "openai/gpt-4") fall back to the bare name.
+        """
+        if not model:
+            return -1
+        if model in self._resolved:
+            return self._resolved[model]
+
+        index = self.index.get(model, -1)
+        if index == -1 and "/" in model:
+            index = self.index.get(model.split("/", 1)[1], -1)
+        if index != -1 and (
+            math.isnan(self.input_cost_per_token[index])
+            or math.isnan(self.output_cost_per_token[index])
+        ):
+            index = -1
+
+        self._resolved[model] = index
+        return index
+
+    def cost(
+        self,
+        model: Optional[str],
+        prompt_tokens: Optional[int],
+        completion_tokens: Optional[int],
+    ) -> Optional[float]:
+        """Cost of one response. None if the model is unknown."""
+        index = self.resolve(model)
+        if index == -1:
+            return None
+        return float(
+            (prompt_tokens or 0) * self.input_cost_per_token[index]
+            + (completion_tokens or 0) * self.output_cost_per_token[index]
+        )
+
+    def costs(
+        self,
+        models: Sequence[Optional[str]],
+        prompt_tokens: Sequence[Optional[int]],
+        completion_tokens: Sequence[Optional[int]],
+    ) -> np.ndarray:
+        """Costs of many responses. NaN where the model is unknown.
+
+        Model names are resolved once per distinct name, then prices are gathered
+        and multiplied over the whole token columns.
+        """
+        if len(models) == 0:
+            return np.zeros(0, dtype=np.float64)
+
+        distinct_models, inverse = np.unique(
+            np.array([model or "" for model in models], dtype=object),
+            return_inverse=True,
+        )
+        indices = np.array(
+            [self.resolve(model) for model in distinct_models], dtype=np.int64
+        )[inverse]
+        known = indices != -1
+        indices = np.where(known, indices, 0)
+
+        # missing token counts count as 0, like in single response costs
+        prompt = np.nan_to_num(np.array(prompt_tokens, dtype=np.float64))
+        completion = np.nan_to_num(np.array(completion_tokens, dtype=np.float64))
+
+        costs = (
+            prompt * self.input_cost_per_token[indices]
+            + completion * self.output_cost_per_token[indices]
+        )
+        return np.where(known, costs, np.nan)
+
+
+def _to_price(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+price_table = PriceTable(litellm.model_cost)
+
+
+def reload_price_table() -> PriceTable:
+    """Rebuild the price table, e.g. after litellm.model_cost was updated."""
+    global price_table
+    price_table = PriceTable(litellm.model_cost)
+    return price_table
+
+
+def completion_cost(response: Union[Dict[str, Any], Any]) -> float:
+    """Drop-in replacement for litellm.completion_cost.
+
+    Uses the price table for known models and falls back to litellm for the rest
+    (custom pricing, per-second or per-character billed models).
+    """
+    if not isinstance(response, dict):
+        response_dict = response.model_dump()
+    else:
+        response_dict = response
+    usage = response_dict.get("usage") or {}
+
+    cost = price_table.cost(
+        response_dict.get("model"),
+        usage.get("prompt_tokens"),
+        usage.get("completion_tokens"),
+    )
+    if cost is not None:
+        return cost
+    return litellm.completion_cost(response)
+
+
+async def backfill_costs(
+    table: str,
+    chunk_size: int = 10000,
+    project_uuid: Optional[str] = None,
+    only_missing: bool = False,
+) -> int:
+    """Recompute `cost` of run_log or chat_log rows with the current price table.
+
+    Rows are processed in chunks by id, and each chunk is updated with a single statement
+    and committed, so the backfill can be stopped and restarted safely.
+    Rows of unknown models are left as they are. Returns the number of updated rows.
+    """
+    # imported here so the price table can be used without a database configured
+    from base.database import get_session_context
+    from crud import select_cost_backfill_chunk, update_costs
+
+    if table not in COST_TABLES:
+        raise ValueError(f"table must be one of {COST_TABLES}")
+
+    last_id = 0
+    updated = 0
+    while True:
+        async with get_session_context() as session:
+            rows = await select_cost_backfill_chunk(
+                session,
+                table,
+                last_id=last_id,
+                chunk_size=chunk_size,
+                project_uuid=project_uuid,
+                only_missing=only_missing,
+            )
+            if not rows:
+                break
+
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            costs = price_table.costs(
+                [row[1] for row in rows],
+                [row[2] for row in rows],
+                [row[3] for row in rows],
+            )
+            known = ~np.isnan(costs)
+            if known.any():
+                updated += await update_costs(
+                    session, table, ids[known].tolist(), costs[known].tolist()
+                )
+                await session.commit()
+
+            last_id = int(ids[-1])
+            logger.info(f"Backfilled {table} cost up to id {last_id} ({updated} rows)")
+
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute LLM costs of saved logs")
+    parser.add_argument("--table", choices=COST_TABLES, required=True)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--project-uuid", default=None)
+    parser.add_argument(
+        "--only-missing", action="store_true", help="only rows where cost is NULL"
+    )
+    args = parser.parse_args()
+
+    updated = asyncio.run(
+        backfill_costs(
+            args.table,
+            chunk_size=args.chunk_size,
+            project_uuid=args.project_uuid,
+            only_missing=args.only_missing,
+        )
+    )
+    print(f"Updated cost of {updated} {args.table} rows")
+
+
+if __name__ == "__main__":
+    main()
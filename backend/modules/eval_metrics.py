@@ -0,0 +1,203 @@
+"""Resolution of eval metric names to EvalMetric uuids, for saving scores.
+
+Metrics are scoped to a function model (or to the project, for unit logs), and created the
+first time a score names them. Name -> uuid maps are cached per function model (or project)
+in this process, so scoring many logs of a function model queries its metrics once.
+Metrics are inserted ON CONFLICT DO NOTHING, so concurrent requests creating the same metric
+don't fail or duplicate it, and metrics created by the other request are read back.
+
+Env vars:
+    EVAL_METRIC_CACHE_MAX_FUNCTION_MODELS: function models (or projects) kept in the cache (default 1000)
+"""
+
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from dotenv import load_dotenv
+from sqlalchemy import and_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db_models import EvalMetric
+
+load_dotenv()
+
+EVAL_METRIC_CACHE_MAX_FUNCTION_MODELS = int(
+    os.environ.get("EVAL_METRIC_CACHE_MAX_FUNCTION_MODELS", 1000)
+)
+
+# metrics of a project, not of a function model or chat model (e.g. of unit logs)
+PROJECT_METRIC = and_(
+    EvalMetric.function_model_uuid.is_(None), EvalMetric.chat_model_uuid.is_(None)
+)
+
+
+# scope of cached metrics: ("function_model", function_model_uuid) or ("project", project_uuid)
+MetricScope = Tuple[str, UUID]
+
+
+def _scope(project_uuid: str, function_model_uuid: Optional[UUID]) -> MetricScope:
+    if function_model_uuid is None:
+        return ("project", UUID(str(project_uuid)))
+    return ("function_model", function_model_uuid)
+
+
+class EvalMetricResolver:
+    def __init__(self, max_function_models: int):
+        self.max_function_models = max_function_models
+        # scope -> {name: uuid}
+        self.metrics: "OrderedDict[MetricScope, Dict[str, UUID]]" = OrderedDict()
+
+    def _cached(self, scope: MetricScope, name: str) -> Optional[UUID]:
+        metrics = self.metrics.get(scope)
+        if metrics is None:
+            return None
+        self.metrics.move_to_end(scope)
+        return metrics.get(name)
+
+    def _cache(self, scope: MetricScope, name: str, metric_uuid: UUID) -> None:
+        self.metrics.setdefault(scope, {})[name] = metric_uuid
+        self.metrics.move_to_end(scope)
+        while len(self.metrics) > self.max_function_models:
+            self.metrics.popitem(last=False)
+
+    async def resolve(
+        self,
+        session: AsyncSession,
+        project_uuid: str,
+        names: Dict[Optional[UUID], Set[str]],
+    ) -> Dict[Tuple[Optional[UUID], str], UUID]:
+        """Uuids of metrics by (function_model_uuid, name), creating missing metrics.
+
+        function_model_uuid None is for project-level metrics (e.g. of unit logs).
+        Uncached metrics are read in one query, and missing ones inserted in one statement.
+        """
+        resolved: Dict[Tuple[Optional[UUID], str], UUID] = {}
+        uncached = []
+        for function_model_uuid, function_model_names in names.items():
+            scope = _scope(project_uuid, function_model_uuid)
+            for name in function_model_names:
+                metric_uuid = self._cached(scope, name)
+                if metric_uuid is None:
+                    uncached.append((function_model_uuid, name))
+                else:
+                    resolved[(function_model_uuid, name)] = metric_uuid
+        if not uncached:
+            return resolved
+
+        function_model_metrics = [key for key in uncached if key[0] is not None]
+        project_metrics = [
+            name
+            for function_model_uuid, name in uncached
+            if function_model_uuid is None
+        ]
+        if function_model_metrics:
+            resolved.update(
+                await self._resolve_function_model_metrics(
+                    session, project_uuid, function_model_metrics
+                )
+            )
+        if project_metrics:
+            resolved.update(
+                await self._resolve_project_metrics(
+                    session, project_uuid, project_metrics
+                )
+            )
+        return resolved
+
+    async def _resolve_function_model_metrics(
+        self, session: AsyncSession, project_uuid: str, keys: List[Tuple[UUID, str]]
+    ) -> Dict[Tuple[Optional[UUID], str], UUID]:
+        def select_metrics(keys):
+            return select(
+                EvalMetric.function_model_uuid, EvalMetric.name, EvalMetric.uuid
+            ).where(tuple_(EvalMetric.function_model_uuid, EvalMetric.name).in_(keys))
+
+        resolved: Dict[Tuple[Optional[UUID], str], UUID] = {}
+        rows = (await session.execute(select_metrics(keys))).all()
+        for function_model_uuid, name, metric_uuid in rows:
+            self._cache(_scope(project_uuid, function_model_uuid), name, metric_uuid)
+            resolved[(function_model_uuid, name)] = metric_uuid
+
+        missing = set(keys) - set(resolved)
+        if missing:
+            # not cached until they are selected by a later request, i.e. committed
+            rows = (
+                await session.execute(
+                    insert(EvalMetric)
+                    .values(
+                        [
+                            {
+                                "project_uuid": project_uuid,
+                                "function_model_uuid": function_model_uuid,
+                                "name": name,
+                            }
+                            for function_model_uuid, name in missing
+                        ]
+                    )
+                    .on_conflict_do_nothing(
+                        constraint="_project_function_model_name_uc"
+                    )
+                    .returning(
+                        EvalMetric.function_model_uuid, EvalMetric.name, EvalMetric.uuid
+                    )
+                )
+            ).all()
+            missing -= {(row[0], row[1]) for row in rows}
+            if missing:
+                # created by a concurrent request
+                rows += (await session.execute(select_metrics(list(missing)))).all()
+            for function_model_uuid, name, metric_uuid in rows:
+                resolved[(function_model_uuid, name)] = metric_uuid
+        return resolved
+
+    async def _resolve_project_metrics(
+        self, session: AsyncSession, project_uuid: str, names: List[str]
+    ) -> Dict[Tuple[Optional[UUID], str], UUID]:
+        def select_metrics(names):
+            return (
+                select(EvalMetric.name, EvalMetric.uuid)
+                .where(EvalMetric.project_uuid == project_uuid)
+                .where(PROJECT_METRIC)
+                .where(EvalMetric.name.in_(names))
+            )
+
+        resolved: Dict[Tuple[Optional[UUID], str], UUID] = {}
+        rows = (await session.execute(select_metrics(names))).all()
+        for name, metric_uuid in rows:
+            self._cache(_scope(project_uuid, None), name, metric_uuid)
+            resolved[(None, name)] = metric_uuid
+
+        missing = [name for name in names if (None, name) not in resolved]
+        if missing:
+            # not cached until they are selected by a later request, i.e. committed
+            rows = (
+                await session.execute(
+                    insert(EvalMetric)
+                    .values(
+                        [
+                            {"project_uuid": project_uuid, "name": name}
+                            for name in missing
+                        ]
+                    )
+                    .on_conflict_do_nothing(
+                        index_elements=[EvalMetric.project_uuid, EvalMetric.name],
+                        index_where=PROJECT_METRIC,
+                    )
+                    .returning(EvalMetric.name, EvalMetric.uuid)
+                )
+            ).all()
+            missing = list(set(missing) - {row[0] for row in rows})
+            if missing:
+                # created by a concurrent request
+                rows += (await session.execute(select_metrics(missing))).all()
+            for name, metric_uuid in rows:
+                resolved[(None, name)] = metric_uuid
+        return resolved
+
+
+eval_metric_resolver = EvalMetricResolver(
+    max_function_models=EVAL_METRIC_CACHE_MAX_FUNCTION_MODELS
+)
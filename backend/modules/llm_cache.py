@@ -0,0 +1,250 @@
+"""Content-addressed cache for LLM responses.
+
+Opt-in with the LLM_RESPONSE_CACHE env var ("redis" or "disk").
+Responses are keyed by a canonical hash of the LLM request, so re-running the same
+FunctionModelVersion over the same inputs doesn't call the provider again.
+
+Env vars:
+    LLM_RESPONSE_CACHE: "redis" | "disk" (disabled if unset)
+    LLM_RESPONSE_CACHE_TTL: seconds until an entry expires (default 7 days)
+    LLM_RESPONSE_CACHE_MAX_BYTES: total size before the oldest entries are evicted (default 512MB)
+    LLM_RESPONSE_CACHE_DIR: directory for the disk cache (default .cache/llm_responses)
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
+
+from dotenv import load_dotenv
+
+from utils.store_utils import select_backend, store_errors
+
+if TYPE_CHECKING:
+    from api.web.models.organization import LLMProviderArgs
+
+load_dotenv()
+
+LLM_RESPONSE_CACHE = os.environ.get("LLM_RESPONSE_CACHE", "").lower()
+LLM_RESPONSE_CACHE_TTL = int(os.environ.get("LLM_RESPONSE_CACHE_TTL", 7 * 24 * 3600))
+LLM_RESPONSE_CACHE_MAX_BYTES = int(
+    os.environ.get("LLM_RESPONSE_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+)
+LLM_RESPONSE_CACHE_DIR = os.environ.get(
+    "LLM_RESPONSE_CACHE_DIR", os.path.join(".cache", "llm_responses")
+)
+
+
+def make_llm_cache_key(namespace: str, model: str, messages: List[Dict], **params) -> str:
+    """Canonical hash of an LLM request.
+
+    namespace scopes the entry (e.g. project uuid), so cached responses are never shared across projects.
+    Params that are None are dropped, so adding an unset param doesn't change the key.
+    """
+    request = {
+        "namespace": str(namespace),
+        "model": model,
+        "messages": messages,
+        "params": {key: value for key, value in params.items() if value is not None},
+    }
+    canonical = json.dumps(
+        request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def make_run_cache_key(
+    project_uuid: str,
+    kind: str,
+    model: str,
+    messages: List[Dict],
+    provider_args: "LLMProviderArgs",
+    **params,
+) -> str:
+    """Cache key of a cloud run (single or batch) of a project.
+
+    kind names the shape of the cached payload ("cloud_function" or "batch"), so runs
+    storing different payloads never read each other's entries for the same request.
+    Includes the provider endpoint of the run, so runs after an organization repoints its
+    provider don't replay responses of the old endpoint.
+    """
+    return make_llm_cache_key(
+        project_uuid,
+        kind=kind,
+        model=model,
+        messages=messages,
+        api_base=provider_args.api_base,
+        api_version=provider_args.api_version,
+        **params,
+    )
+
+
+def use_llm_cache(use_cache: Optional[bool]) -> bool:
+    """Whether a run reads & writes the cache. Runs use it unless use_cache is False."""
+    return llm_response_cache is not None and use_cache is not False
+
+
+class LLMResponseCache(ABC):
+    """Misses on errors (see store_errors)."""
+
+    def __init__(self, ttl: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    @store_errors("reading LLM response cache")
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self._get(key)
+
+    @store_errors("writing LLM response cache")
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        await self._set(key, json.dumps(value, default=str))
+
+    @abstractmethod
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def _set(self, key: str, value: str) -> None:
+        ...
+
+
+class RedisLLMResponseCache(LLMResponseCache):
+    """Entries expire with Redis TTLs. A sorted set of keys by insertion time and a
+    hash of entry sizes are used to evict the oldest entries over max_bytes."""
+
+    PREFIX = "llm_cache:"
+    INDEX_KEY = "llm_cache_index"
+    SIZES_KEY = "llm_cache_sizes"
+    TOTAL_BYTES_KEY = "llm_cache_total_bytes"
+
+    def __init__(self, ttl: int, max_bytes: int):
+        super().__init__(ttl, max_bytes)
+        from base.redis_connection import redis
+
+        self.redis = redis
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = await self.redis.get(self.PREFIX + key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    async def _set(self, key: str, value: str) -> None:
+        size = len(value.encode())
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self.PREFIX + key, value, ex=self.ttl)
+            pipe.zadd(self.INDEX_KEY, {key: now})
+            pipe.hset(self.SIZES_KEY, key, size)
+            pipe.incrby(self.TOTAL_BYTES_KEY, size)
+            await pipe.execute()
+
+        # forget entries that already expired
+        expired = await self.redis.zrangebyscore(self.INDEX_KEY, "-inf", now - self.ttl)
+        await self._remove([k.decode() for k in expired])
+
+        # evict oldest entries until the cache fits in max_bytes
+        total_bytes = int(await self.redis.get(self.TOTAL_BYTES_KEY) or 0)
+        while total_bytes > self.max_bytes:
+            oldest = await self.redis.zrange(self.INDEX_KEY, 0, 99)
+            if not oldest:
+                break
+            total_bytes -= await self._remove([k.decode() for k in oldest])
+
+    async def _remove(self, keys: List[str]) -> int:
+        if not keys:
+            return 0
+        sizes = await self.redis.hmget(self.SIZES_KEY, keys)
+        removed_bytes = sum(int(size or 0) for size in sizes)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*[self.PREFIX + key for key in keys])
+            pipe.zrem(self.INDEX_KEY, *keys)
+            pipe.hdel(self.SIZES_KEY, *keys)
+            pipe.decrby(self.TOTAL_BYTES_KEY, removed_bytes)
+            await pipe.execute()
+        return removed_bytes
+
+
+class DiskLLMResponseCache(LLMResponseCache):
+    """One JSON file per entry. File mtime is used for TTL and for evicting the oldest entries."""
+
+    def __init__(self, ttl: int, max_bytes: int, directory: str):
+        super().__init__(ttl, max_bytes)
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.total_bytes: Optional[int] = None
+        self.lock = asyncio.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "r") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key: str, value: str) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(value)
+        os.replace(tmp_path, path)
+
+        if self.total_bytes is None:
+            self.total_bytes = sum(
+                entry.stat().st_size for entry in os.scandir(self.directory)
+            )
+        else:
+            self.total_bytes += len(value.encode())
+
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        now = time.time()
+        entries = sorted(os.scandir(self.directory), key=lambda e: e.stat().st_mtime)
+        total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            stat = entry.stat()
+            if total_bytes <= self.max_bytes and now - stat.st_mtime <= self.ttl:
+                break
+            try:
+                os.remove(entry.path)
+                total_bytes -= stat.st_size
+            except FileNotFoundError:
+                pass
+        self.total_bytes = total_bytes
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = await asyncio.to_thread(self._read, key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    async def _set(self, key: str, value: str) -> None:
+        async with self.lock:
+            await asyncio.to_thread(self._write, key, value)
+
+
+# None if the cache is disabled
+llm_response_cache: Optional[LLMResponseCache] = select_backend(
+    LLM_RESPONSE_CACHE,
+    {
+        "redis": lambda: RedisLLMResponseCache(
+            ttl=LLM_RESPONSE_CACHE_TTL, max_bytes=LLM_RESPONSE_CACHE_MAX_BYTES
+        ),
+        "disk": lambda: DiskLLMResponseCache(
+            ttl=LLM_RESPONSE_CACHE_TTL,
+            max_bytes=LLM_RESPONSE_CACHE_MAX_BYTES,
+            directory=LLM_RESPONSE_CACHE_DIR,
+        ),
+    },
+)
@@ -0,0 +1,186 @@
+"""Pool of LLM clients per organization's LLM provider config.
+
+Cloud runs and batch runs call providers with the API key, base & version of the
+organization's LLM provider config. The pool keeps, per (organization, provider, config
+hash), the provider args read from the config and the clients using them: an LLMDev for
+cloud runs, and a litellm Router per model for batch runs. Routers keep their HTTP clients,
+so the connections to the provider are reused by later batch runs instead of opened by
+every run.
+
+Configs are cached for LLM_CLIENT_POOL_CONFIG_TTL seconds, so runs don't query the config.
+Saving or deleting a config invalidates it in the process handling the request. Other
+processes read the new config when their cached one expires: a new config hash gets new
+clients, and the old clients are evicted.
+
+Env vars:
+    LLM_CLIENT_POOL_SIZE: provider configs kept, least recently used evicted (default 256)
+    LLM_CLIENT_POOL_CONFIG_TTL: seconds a config is cached (default 60, 0 to always query)
+"""
+import os
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, TYPE_CHECKING
+
+from dotenv import load_dotenv
+from litellm import Router
+from promptmodel.llms.llm_dev import LLMDev
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from base.metrics import llm_client_pool_lookups_total, llm_client_pool_size
+from db_models import OrganizationLLMProviderConfig
+
+if TYPE_CHECKING:
+    from api.web.models.organization import LLMProviderArgs
+
+load_dotenv()
+
+LLM_CLIENT_POOL_SIZE = int(os.environ.get("LLM_CLIENT_POOL_SIZE", 256))
+LLM_CLIENT_POOL_CONFIG_TTL = float(os.environ.get("LLM_CLIENT_POOL_CONFIG_TTL", 60))
+
+
+def provider_args_from_env_vars(env_vars: Dict[str, Any]) -> "LLMProviderArgs":
+    """API key, base & version of a provider config's env vars."""
+    # imported here, the api package imports this module
+    from api.web.models.organization import LLMProviderArgs
+
+    provider_args = LLMProviderArgs()
+    for key, val in env_vars.items():
+        if "api_key" in key.lower():
+            provider_args.api_key = val
+        elif "api_base" in key.lower():
+            provider_args.api_base = val
+        elif "api_version" in key.lower():
+            provider_args.api_version = val
+    return provider_args
+
+
+def provider_config_hash(env_vars: Dict[str, Any], params: Optional[Dict[str, Any]]) -> str:
+    return hashlib.sha256(
+        json.dumps([env_vars, params or {}], sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class LLMProviderClient:
+    """Provider args & clients of an organization's LLM provider config."""
+
+    def __init__(
+        self,
+        organization_id: str,
+        provider: str,
+        env_vars: Dict[str, Any],
+        params: Optional[Dict[str, Any]],
+    ):
+        self.organization_id = organization_id
+        self.provider = provider
+        self.params: Dict[str, Any] = dict(params or {})
+        self.provider_args = provider_args_from_env_vars(env_vars)
+        self.llm_dev = LLMDev()
+        # model -> Router
+        self.routers: Dict[str, Router] = {}
+
+    def router(self, model: str) -> Router:
+        """Router of batch runs of a model, created on first use."""
+        # TODO: use params later
+        if model not in self.routers:
+            self.routers[model] = Router(
+                model_list=[
+                    {
+                        "model_name": model,
+                        "litellm_params": {
+                            "model": model,
+                            "api_key": self.provider_args.api_key,
+                            "api_base": self.provider_args.api_base,
+                            "api_version": self.provider_args.api_version,
+                        },
+                    }
+                ],
+                num_retries=5,
+                allowed_fails=2,
+            )
+        return self.routers[model]
+
+
+class LLMClientPool:
+    def __init__(self, max_size: int, config_ttl: float):
+        self.max_size = max_size
+        self.config_ttl = config_ttl
+        # (organization_id, provider) -> (expires_at, config hash)
+        self.configs: Dict[Tuple[str, str], Tuple[float, str]] = {}
+        # (organization_id, provider, config hash) -> client, least recently used first
+        self.clients: "OrderedDict[Tuple[str, str, str], LLMProviderClient]" = OrderedDict()
+
+    async def get(
+        self, session: AsyncSession, organization_id: str, provider: str
+    ) -> Optional[LLMProviderClient]:
+        """Client of an organization's provider config. None if the organization has no
+        config for the provider."""
+        organization_id = str(organization_id)
+        cached_config = self.configs.get((organization_id, provider))
+        if cached_config is not None and cached_config[0] > time.monotonic():
+            client = self.clients.get((organization_id, provider, cached_config[1]))
+            if client is not None:
+                self.clients.move_to_end((organization_id, provider, cached_config[1]))
+                llm_client_pool_lookups_total.labels(result="hit").inc()
+                return client
+
+        provider_config: Optional[OrganizationLLMProviderConfig] = (
+            await session.execute(
+                select(OrganizationLLMProviderConfig)
+                .where(OrganizationLLMProviderConfig.organization_id == organization_id)
+                .where(OrganizationLLMProviderConfig.provider_name == provider)
+            )
+        ).scalar_one_or_none()
+        if provider_config is None:
+            self.invalidate(organization_id, provider)
+            llm_client_pool_lookups_total.labels(result="not_found").inc()
+            return None
+
+        config_hash = provider_config_hash(
+            provider_config.env_vars, provider_config.params
+        )
+        if self.config_ttl > 0:
+            self.configs[(organization_id, provider)] = (
+                time.monotonic() + self.config_ttl,
+                config_hash,
+            )
+        key = (organization_id, provider, config_hash)
+        client = self.clients.get(key)
+        if client is not None:
+            # config unchanged, only read again
+            self.clients.move_to_end(key)
+            llm_client_pool_lookups_total.labels(result="config_miss").inc()
+            return client
+
+        # clients of previous configs of the provider are not used anymore
+        self._evict(organization_id, provider)
+        client = LLMProviderClient(
+            organization_id, provider, provider_config.env_vars, provider_config.params
+        )
+        self.clients[key] = client
+        while len(self.clients) > self.max_size:
+            evicted_key, _ = self.clients.popitem(last=False)
+            self.configs.pop(evicted_key[:2], None)
+        llm_client_pool_size.set(len(self.clients))
+        llm_client_pool_lookups_total.labels(result="miss").inc()
+        return client
+
+    def invalidate(self, organization_id: str, provider: str) -> None:
+        """Drop an organization's provider config & clients, after it is saved or deleted."""
+        organization_id = str(organization_id)
+        self.configs.pop((organization_id, provider), None)
+        self._evict(organization_id, provider)
+        llm_client_pool_size.set(len(self.clients))
+
+    def _evict(self, organization_id: str, provider: str) -> None:
+        for key in [
+            key for key in self.clients if key[:2] == (organization_id, provider)
+        ]:
+            del self.clients[key]
+
+
+llm_client_pool = LLMClientPool(
+    max_size=LLM_CLIENT_POOL_SIZE, config_ttl=LLM_CLIENT_POOL_CONFIG_TTL
+)
@@ -0,0 +1,250 @@
+"""Presence of connected CLIs, kept out of the DB.
+
+By default a CLI connecting sets `project.online`, and disconnecting runs the
+`disconnect_local` function, which updates the project and all of its function models,
+chat models, sample inputs and function schemas. Every updated row fires a NOTIFY. When
+hundreds of CLIs reconnect after a server restart, that is a write storm.
+
+With presence enabled, a connected CLI is a key with a TTL instead, refreshed by heartbeats
+of the server holding its websocket. A server that dies without disconnecting its CLIs
+leaves them present until the TTL expires. Each change publishes one event to
+`project_presence_channel_p_{project_uuid}`, which dashboards subscribe to through
+/subscribe/project_presence. Web APIs overlay presence on the `online` fields they return
+(see apply_cli_presence), so the `online` columns aren't written on connect & disconnect.
+
+Opt-in with the CLI_PRESENCE env var ("redis" or "memory").
+The memory store is per process, use it only if the server runs a single worker.
+
+Env vars:
+    CLI_PRESENCE: "redis" | "memory" (DB `online` columns if unset)
+    CLI_PRESENCE_TTL: seconds a CLI stays present without a heartbeat (default 60)
+    CLI_PRESENCE_HEARTBEAT_INTERVAL: seconds between heartbeats (default 20)
+"""
+import os
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from utils.store_utils import select_backend, store_errors
+
+load_dotenv()
+
+CLI_PRESENCE = os.environ.get("CLI_PRESENCE", "").lower()
+CLI_PRESENCE_TTL = int(os.environ.get("CLI_PRESENCE_TTL", 60))
+CLI_PRESENCE_HEARTBEAT_INTERVAL = int(
+    os.environ.get("CLI_PRESENCE_HEARTBEAT_INTERVAL", 20)
+)
+
+PRESENCE_CHANNEL = "project_presence_channel"
+
+
+class CliPresence(ABC):
+    """Presence is keyed by project uuid, with the cli_access_key of the connection as value,
+    so a CLI disconnecting doesn't remove a newer connection of the project. Errors don't
+    fail connections or requests (see store_errors), projects read as offline.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    @store_errors("setting CLI presence")
+    async def connect(self, project_uuid: str, token: str) -> None:
+        if await self._connect(str(project_uuid), token):
+            await self._publish(str(project_uuid), True)
+
+    @store_errors("removing CLI presence")
+    async def disconnect(self, project_uuid: str, token: str) -> None:
+        if await self._disconnect(str(project_uuid), token):
+            await self._publish(str(project_uuid), False)
+
+    async def heartbeat(self, connections: Dict[str, str]) -> None:
+        """Refresh the TTL of connected CLIs (project_uuid -> token).
+
+        CLIs whose presence expired anyway (e.g. the store was unreachable) are present again.
+        """
+        if not connections:
+            return
+        for project_uuid in await self._refresh(connections):
+            await self.connect(project_uuid, connections[project_uuid])
+
+    @store_errors("refreshing CLI presence", default=list)
+    async def _refresh(self, connections: Dict[str, str]) -> List[str]:
+        return await self._heartbeat(connections)
+
+    async def online(self, project_uuids: Iterable[str]) -> Set[str]:
+        """Uuids of the given projects with a connected CLI."""
+        project_uuids = [str(project_uuid) for project_uuid in project_uuids]
+        if not project_uuids:
+            return set()
+        return await self._read_online(project_uuids)
+
+    @store_errors("reading CLI presence", default=set)
+    async def _read_online(self, project_uuids: List[str]) -> Set[str]:
+        return await self._online(project_uuids)
+
+    async def is_online(self, project_uuid: str) -> bool:
+        return str(project_uuid) in await self.online([project_uuid])
+
+    @abstractmethod
+    async def _connect(self, project_uuid: str, token: str) -> bool:
+        """Returns True if the project wasn't present before."""
+
+    @abstractmethod
+    async def _disconnect(self, project_uuid: str, token: str) -> bool:
+        """Returns True if the presence of this connection was removed."""
+
+    @abstractmethod
+    async def _heartbeat(self, connections: Dict[str, str]) -> List[str]:
+        """Returns the projects whose presence had expired."""
+
+    @abstractmethod
+    async def _online(self, project_uuids: List[str]) -> Set[str]:
+        ...
+
+    async def _publish(self, project_uuid: str, online: bool) -> None:
+        pass
+
+
+class RedisCliPresence(CliPresence):
+    """One key with a TTL per project, shared by all servers."""
+
+    PREFIX = "cli_presence:"
+    # delete the key only if it is still held by the disconnecting connection
+    DISCONNECT_SCRIPT = """
+    if redis.call("GET", KEYS[1]) == ARGV[1] then
+        return redis.call("DEL", KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, ttl: int):
+        super().__init__(ttl)
+        from base.redis_connection import redis
+
+        self.redis = redis
+
+    async def _connect(self, project_uuid: str, token: str) -> bool:
+        key = self.PREFIX + project_uuid
+        if await self.redis.set(key, token, ex=self.ttl, nx=True):
+            return True
+        # reconnected, possibly with another token
+        await self.redis.set(key, token, ex=self.ttl)
+        return False
+
+    async def _disconnect(self, project_uuid: str, token: str) -> bool:
+        deleted = await self.redis.eval(
+            self.DISCONNECT_SCRIPT, 1, self.PREFIX + project_uuid, token
+        )
+        return bool(deleted)
+
+    async def _heartbeat(self, connections: Dict[str, str]) -> List[str]:
+        project_uuids = list(connections.keys())
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for project_uuid in project_uuids:
+                pipe.expire(self.PREFIX + project_uuid, self.ttl)
+            refreshed = await pipe.execute()
+        return [
+            project_uuid
+            for project_uuid, exists in zip(project_uuids, refreshed)
+            if not exists
+        ]
+
+    async def _online(self, project_uuids: List[str]) -> Set[str]:
+        values = await self.redis.mget(
+            [self.PREFIX + project_uuid for project_uuid in project_uuids]
+        )
+        return {
+            project_uuid
+            for project_uuid, value in zip(project_uuids, values)
+            if value is not None
+        }
+
+    async def _publish(self, project_uuid: str, online: bool) -> None:
+        await self.redis.publish(
+            f"{PRESENCE_CHANNEL}_p_{project_uuid}",
+            json.dumps({"project_uuid": project_uuid, "online": online}),
+        )
+
+
+class MemoryCliPresence(CliPresence):
+    """Presence of the CLIs connected to this process. Changes aren't published."""
+
+    def __init__(self, ttl: int):
+        super().__init__(ttl)
+        # project_uuid -> (expires_at, token)
+        self.projects: Dict[str, Tuple[float, str]] = {}
+
+    def _lookup(self, project_uuid: str) -> Optional[str]:
+        entry = self.projects.get(project_uuid)
+        if entry is None:
+            return None
+        expires_at, token = entry
+        if expires_at < time.monotonic():
+            del self.projects[project_uuid]
+            return None
+        return token
+
+    async def _connect(self, project_uuid: str, token: str) -> bool:
+        created = self._lookup(project_uuid) is None
+        self.projects[project_uuid] = (time.monotonic() + self.ttl, token)
+        return created
+
+    async def _disconnect(self, project_uuid: str, token: str) -> bool:
+        if self._lookup(project_uuid) != token:
+            return False
+        del self.projects[project_uuid]
+        return True
+
+    async def _heartbeat(self, connections: Dict[str, str]) -> List[str]:
+        expired = []
+        for project_uuid in connections.keys():
+            token = self._lookup(project_uuid)
+            if token is None:
+                expired.append(project_uuid)
+            else:
+                self.projects[project_uuid] = (time.monotonic() + self.ttl, token)
+        return expired
+
+    async def _online(self, project_uuids: List[str]) -> Set[str]:
+        return {
+            project_uuid
+            for project_uuid in project_uuids
+            if self._lookup(project_uuid) is not None
+        }
+
+
+# None if presence is disabled
+cli_presence: Optional[CliPresence] = select_backend(
+    CLI_PRESENCE,
+    {
+        "redis": lambda: RedisCliPresence(ttl=CLI_PRESENCE_TTL),
+        "memory": lambda: MemoryCliPresence(ttl=CLI_PRESENCE_TTL),
+    },
+)
+
+
+async def apply_cli_presence(
+    instances: List[Any], project_uuid_attribute: str = "project_uuid"
+) -> List[Any]:
+    """Overlay CLI presence on the `online` of API instances, if presence is enabled.
+
+    Projects (project_uuid_attribute="uuid") are online if their CLI is present. Function
+    models, chat models etc. are online if they are in the code of a present CLI, i.e. their
+    own `online` (set when the CLI syncs its code) and their project's presence.
+    """
+    if cli_presence is None or not instances:
+        return instances
+    online = await cli_presence.online(
+        {str(getattr(instance, project_uuid_attribute)) for instance in instances}
+    )
+    for instance in instances:
+        present = str(getattr(instance, project_uuid_attribute)) in online
+        if project_uuid_attribute == "uuid":
+            # not written while presence is enabled
+            instance.online = present
+        else:
+            instance.online = bool(instance.online) and present
+    return instances
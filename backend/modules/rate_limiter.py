@@ -0,0 +1,341 @@
+"""Rate limiting of cloud LLM calls per organization & provider.
+
+Interactive runs and batch runs of an organization call a provider with the same API key
+(the organization's LLM provider config), so they share that key's rate limits. Each
+(organization, provider) has token buckets of requests & tokens per minute, shared by all
+runs, and by all processes with the Redis limiter. Calls wait for capacity before calling
+the provider, instead of competing for it and getting 429s.
+
+Interactive calls have priority over batch calls: batch calls leave a share of each bucket
+(LLM_RATE_LIMIT_INTERACTIVE_RESERVE) to interactive calls, and in a process, wait while
+interactive calls of the same organization & provider are waiting.
+
+Token usage is estimated from the prompt before a call, and the estimate corrected with the
+actual usage after it (see settle_llm_rate_limit).
+
+Limits are the `rpm` & `tpm` params of the organization's LLM provider config, or
+LLM_RATE_LIMIT_RPM & LLM_RATE_LIMIT_TPM. A limit of 0 is unlimited.
+
+Opt-in with the LLM_RATE_LIMITER env var ("redis" or "memory").
+The memory limiter is per process, use it only if the server runs a single worker.
+
+Env vars:
+    LLM_RATE_LIMITER: "redis" | "memory" (disabled if unset)
+    LLM_RATE_LIMIT_RPM: default requests per minute (default 0)
+    LLM_RATE_LIMIT_TPM: default tokens per minute (default 0)
+    LLM_RATE_LIMIT_INTERACTIVE_RESERVE: share of the limits batch calls leave (default 0.2)
+    LLM_RATE_LIMIT_MAX_WAIT: seconds an interactive call waits before failing (default 60)
+"""
+import os
+import time
+import random
+import asyncio
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from utils.logger import logger
+from utils.store_utils import select_backend, store_errors
+from base.metrics import llm_rate_limit_wait_seconds, llm_rate_limit_waiting
+from modules.tokenizer import tokenizer_service
+
+load_dotenv()
+
+LLM_RATE_LIMITER = os.environ.get("LLM_RATE_LIMITER", "").lower()
+LLM_RATE_LIMIT_RPM = float(os.environ.get("LLM_RATE_LIMIT_RPM", 0))
+LLM_RATE_LIMIT_TPM = float(os.environ.get("LLM_RATE_LIMIT_TPM", 0))
+LLM_RATE_LIMIT_INTERACTIVE_RESERVE = float(
+    os.environ.get("LLM_RATE_LIMIT_INTERACTIVE_RESERVE", 0.2)
+)
+LLM_RATE_LIMIT_MAX_WAIT = float(os.environ.get("LLM_RATE_LIMIT_MAX_WAIT", 60))
+
+# longest sleep between attempts, so waiters notice capacity freed by settled estimates
+MAX_POLL_INTERVAL = 1.0
+
+
+class RateLimitLane(str, Enum):
+    INTERACTIVE = "interactive"
+    BATCH = "batch"
+
+
+class LLMRateLimitTimeout(Exception):
+    pass
+
+
+class LLMRateLimit:
+    """Limits of an organization's LLM provider."""
+
+    def __init__(self, organization_id: str, provider: str, rpm: float, tpm: float):
+        self.organization_id = organization_id
+        self.provider = provider
+        self.rpm = rpm
+        self.tpm = tpm
+
+    @property
+    def key(self) -> str:
+        return f"{self.organization_id}:{self.provider}"
+
+
+def take_from_buckets(
+    state: Dict[str, float],
+    now: float,
+    rpm: float,
+    tpm: float,
+    tokens: float,
+    reserve: float,
+) -> float:
+    """Refill the buckets in state (requests, tokens, ts) and take a request & tokens from
+    them, leaving `reserve` of each limit. Returns 0 if taken, else the seconds until the
+    buckets have enough. Same as RedisLLMRateLimiter.TAKE_SCRIPT."""
+    elapsed = max(0.0, now - state.get("ts", now))
+    requests = min(rpm, state.get("requests", rpm) + elapsed * rpm / 60)
+    available_tokens = min(tpm, state.get("tokens", tpm) + elapsed * tpm / 60)
+    wait = 0.0
+    if rpm > 0:
+        floor = rpm * reserve
+        if requests - 1 < floor:
+            wait = max(wait, (1 + floor - requests) * 60 / rpm)
+    if tpm > 0:
+        floor = tpm * reserve
+        # a call larger than the limit can still run once the bucket is full
+        tokens = min(tokens, tpm - floor)
+        if available_tokens - tokens < floor:
+            wait = max(wait, (tokens + floor - available_tokens) * 60 / tpm)
+    if wait == 0:
+        requests -= 1
+        available_tokens -= tokens
+    state.update(requests=requests, tokens=available_tokens, ts=now)
+    return wait
+
+
+class LLMRateLimiter(ABC):
+    """Lets calls through on errors (see store_errors)."""
+
+    def __init__(self, interactive_reserve: float, max_wait: float):
+        self.interactive_reserve = interactive_reserve
+        self.max_wait = max_wait
+        # limit key -> interactive calls waiting in this process
+        self.interactive_waiting: Dict[str, int] = defaultdict(int)
+
+    async def acquire(
+        self, limit: LLMRateLimit, tokens: int, lane: RateLimitLane
+    ) -> None:
+        """Wait until a call with `tokens` tokens fits the limits.
+
+        Raises LLMRateLimitTimeout if an interactive call waits longer than max_wait.
+        Batch calls wait until they fit.
+        """
+        start_time = time.perf_counter()
+        reserve = (
+            self.interactive_reserve if lane == RateLimitLane.BATCH else 0.0
+        )
+        llm_rate_limit_waiting.labels(lane=lane.value).inc()
+        if lane == RateLimitLane.INTERACTIVE:
+            self.interactive_waiting[limit.key] += 1
+        try:
+            while True:
+                if lane == RateLimitLane.BATCH and self.interactive_waiting[limit.key]:
+                    wait = MAX_POLL_INTERVAL / 10
+                else:
+                    wait = await self._try_take(limit, tokens, reserve)
+                    if wait == 0:
+                        return
+                waited = time.perf_counter() - start_time
+                if lane == RateLimitLane.INTERACTIVE and waited + wait > self.max_wait:
+                    raise LLMRateLimitTimeout(
+                        f"Rate limit of {limit.provider} reached, retry in {wait:.0f}s"
+                    )
+                # jitter, so waiters of all processes don't retry at once
+                await asyncio.sleep(min(wait, MAX_POLL_INTERVAL) * random.uniform(0.8, 1.2))
+        finally:
+            llm_rate_limit_waiting.labels(lane=lane.value).dec()
+            if lane == RateLimitLane.INTERACTIVE:
+                self.interactive_waiting[limit.key] -= 1
+                if not self.interactive_waiting[limit.key]:
+                    del self.interactive_waiting[limit.key]
+            llm_rate_limit_wait_seconds.labels(
+                provider=limit.provider, lane=lane.value
+            ).observe(time.perf_counter() - start_time)
+
+    async def settle(self, limit: LLMRateLimit, estimated: int, actual: int) -> None:
+        """Correct the tokens taken for a call with its actual usage."""
+        if limit.tpm <= 0 or actual == estimated:
+            return
+        await self._try_settle(limit, actual - estimated)
+
+    @store_errors("reading LLM rate limit", default=0)
+    async def _try_take(self, limit: LLMRateLimit, tokens: int, reserve: float) -> float:
+        return await self._take(limit, tokens, reserve)
+
+    @store_errors("settling LLM rate limit")
+    async def _try_settle(self, limit: LLMRateLimit, extra_tokens: int) -> None:
+        await self._settle(limit, extra_tokens)
+
+    @abstractmethod
+    async def _take(self, limit: LLMRateLimit, tokens: int, reserve: float) -> float:
+        ...
+
+    @abstractmethod
+    async def _settle(self, limit: LLMRateLimit, extra_tokens: int) -> None:
+        ...
+
+
+class RedisLLMRateLimiter(LLMRateLimiter):
+    """One hash of bucket levels per organization & provider, updated by a script, so all
+    processes share the buckets. Uses the Redis server's clock."""
+
+    PREFIX = "llm_rate_limit:"
+    # KEYS[1]: buckets, ARGV: rpm, tpm, tokens, reserve. Same as take_from_buckets.
+    TAKE_SCRIPT = """
+    local rpm = tonumber(ARGV[1])
+    local tpm = tonumber(ARGV[2])
+    local tokens = tonumber(ARGV[3])
+    local reserve = tonumber(ARGV[4])
+    local time = redis.call("TIME")
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local state = redis.call("HMGET", KEYS[1], "requests", "tokens", "ts")
+    local ts = tonumber(state[3]) or now
+    local elapsed = math.max(0, now - ts)
+    local requests = math.min(rpm, (tonumber(state[1]) or rpm) + elapsed * rpm / 60)
+    local available = math.min(tpm, (tonumber(state[2]) or tpm) + elapsed * tpm / 60)
+    local wait = 0
+    if rpm > 0 then
+        local floor = rpm * reserve
+        if requests - 1 < floor then
+            wait = math.max(wait, (1 + floor - requests) * 60 / rpm)
+        end
+    end
+    if tpm > 0 then
+        local floor = tpm * reserve
+        tokens = math.min(tokens, tpm - floor)
+        if available - tokens < floor then
+            wait = math.max(wait, (tokens + floor - available) * 60 / tpm)
+        end
+    end
+    if wait == 0 then
+        requests = requests - 1
+        available = available - tokens
+    end
+    redis.call("HSET", KEYS[1], "requests", requests, "tokens", available, "ts", now)
+    redis.call("EXPIRE", KEYS[1], 120)
+    return tostring(wait)
+    """
+    # KEYS[1]: buckets, ARGV: extra tokens, tpm. Debt is limited to a minute of tokens.
+    SETTLE_SCRIPT = """
+    local available = tonumber(redis.call("HGET", KEYS[1], "tokens"))
+    if available then
+        available = math.max(available - tonumber(ARGV[1]), -tonumber(ARGV[2]))
+        redis.call("HSET", KEYS[1], "tokens", available)
+    end
+    return 0
+    """
+
+    def __init__(self, interactive_reserve: float, max_wait: float):
+        super().__init__(interactive_reserve, max_wait)
+        from base.redis_connection import redis
+
+        self.redis = redis
+
+    async def _take(self, limit: LLMRateLimit, tokens: int, reserve: float) -> float:
+        wait = await self.redis.eval(
+            self.TAKE_SCRIPT,
+            1,
+            self.PREFIX + limit.key,
+            limit.rpm,
+            limit.tpm,
+            tokens,
+            reserve,
+        )
+        return float(wait)
+
+    async def _settle(self, limit: LLMRateLimit, extra_tokens: int) -> None:
+        await self.redis.eval(
+            self.SETTLE_SCRIPT, 1, self.PREFIX + limit.key, extra_tokens, limit.tpm
+        )
+
+
+class MemoryLLMRateLimiter(LLMRateLimiter):
+    """Buckets of the calls of this process."""
+
+    def __init__(self, interactive_reserve: float, max_wait: float):
+        super().__init__(interactive_reserve, max_wait)
+        # limit key -> {requests, tokens, ts}
+        self.buckets: Dict[str, Dict[str, float]] = {}
+
+    async def _take(self, limit: LLMRateLimit, tokens: int, reserve: float) -> float:
+        state = self.buckets.setdefault(limit.key, {})
+        return take_from_buckets(
+            state, time.monotonic(), limit.rpm, limit.tpm, tokens, reserve
+        )
+
+    async def _settle(self, limit: LLMRateLimit, extra_tokens: int) -> None:
+        state = self.buckets.get(limit.key)
+        if state is not None and "tokens" in state:
+            state["tokens"] = max(state["tokens"] - extra_tokens, -limit.tpm)
+
+
+# None if rate limiting is disabled
+llm_rate_limiter: Optional[LLMRateLimiter] = select_backend(
+    LLM_RATE_LIMITER,
+    {
+        "redis": lambda: RedisLLMRateLimiter(
+            interactive_reserve=LLM_RATE_LIMIT_INTERACTIVE_RESERVE,
+            max_wait=LLM_RATE_LIMIT_MAX_WAIT,
+        ),
+        "memory": lambda: MemoryLLMRateLimiter(
+            interactive_reserve=LLM_RATE_LIMIT_INTERACTIVE_RESERVE,
+            max_wait=LLM_RATE_LIMIT_MAX_WAIT,
+        ),
+    },
+)
+
+
+def llm_rate_limit(
+    organization_id: Optional[str], provider: str, params: Optional[Dict[str, Any]]
+) -> Optional[LLMRateLimit]:
+    """Limits of an organization's provider, from its config params. None if rate limiting
+    is disabled or the provider has no limits."""
+    if llm_rate_limiter is None or organization_id is None:
+        return None
+    params = params or {}
+    try:
+        rpm = float(params.get("rpm") or LLM_RATE_LIMIT_RPM)
+        tpm = float(params.get("tpm") or LLM_RATE_LIMIT_TPM)
+    except (TypeError, ValueError):
+        logger.error(f"Invalid rate limit params of {provider}: {params}")
+        rpm, tpm = LLM_RATE_LIMIT_RPM, LLM_RATE_LIMIT_TPM
+    if rpm <= 0 and tpm <= 0:
+        return None
+    return LLMRateLimit(organization_id, provider, rpm=rpm, tpm=tpm)
+
+
+async def acquire_llm_rate_limit(
+    limit: Optional[LLMRateLimit],
+    model: str,
+    messages: List[Dict[str, Any]],
+    lane: RateLimitLane,
+) -> int:
+    """Wait until a call with messages fits the limit. Returns the estimated tokens to
+    settle after the call."""
+    if limit is None or llm_rate_limiter is None:
+        return 0
+    tokens = 0
+    if limit.tpm > 0:
+        tokens = sum(
+            await tokenizer_service.count_tokens_batch(
+                model, [message.get("content") for message in messages]
+            )
+        )
+    await llm_rate_limiter.acquire(limit, tokens, lane)
+    return tokens
+
+
+async def settle_llm_rate_limit(
+    limit: Optional[LLMRateLimit], estimated: int, actual: Optional[int]
+) -> None:
+    if limit is None or llm_rate_limiter is None or actual is None:
+        return
+    await llm_rate_limiter.settle(limit, estimated, actual)
@@ -0,0 +1,117 @@
+"""Tokenizer service.
+
+Tokenizers are loaded once per model and kept warm, and token counting runs in a thread pool
+(tiktoken and HF tokenizers release the GIL while encoding), so it never blocks the event loop.
+
+Env vars:
+    TOKENIZER_PRELOAD_MODELS: comma separated models whose tokenizers are loaded on startup
+    TOKENIZER_WORKERS: number of tokenizer threads (default 2)
+"""
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from litellm import token_counter
+
+from utils.logger import logger
+
+try:
+    # private, picks the tokenizer token_counter would use, so it's loaded once per model
+    from litellm.utils import _select_tokenizer
+except ImportError:
+    _select_tokenizer = None
+    logger.info(
+        "litellm has no _select_tokenizer, tokenizers are selected by token_counter per count"
+    )
+
+load_dotenv()
+
+TOKENIZER_PRELOAD_MODELS = [
+    model.strip()
+    for model in os.environ.get(
+        "TOKENIZER_PRELOAD_MODELS", "gpt-3.5-turbo,gpt-4,gpt-4o"
+    ).split(",")
+    if model.strip()
+]
+TOKENIZER_WORKERS = int(os.environ.get("TOKENIZER_WORKERS", 2))
+
+
+class TokenizerService:
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # model -> litellm tokenizer ({"type": ..., "tokenizer": ...})
+        self._tokenizers: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="tokenizer"
+            )
+        return self._executor
+
+    def get_tokenizer(self, model: str) -> Any:
+        """Tokenizer of a model, passed to token_counter. None if litellm can't select it
+        ahead (token_counter selects it then)."""
+        if _select_tokenizer is None:
+            return None
+        tokenizer = self._tokenizers.get(model)
+        if tokenizer is not None:
+            return tokenizer
+        # load each tokenizer only once, even if requested from several threads
+        with self._lock:
+            if model not in self._tokenizers:
+                self._tokenizers[model] = _select_tokenizer(model)
+            return self._tokenizers[model]
+
+    def count_tokens_sync(self, model: str, text: Optional[Any]) -> int:
+        if text is None:
+            return 0
+        if not isinstance(text, str):
+            text = str(text)
+        return token_counter(
+            model=model, custom_tokenizer=self.get_tokenizer(model), text=text
+        )
+
+    def count_tokens_batch_sync(
+        self, model: str, texts: Sequence[Optional[Any]]
+    ) -> List[int]:
+        return [self.count_tokens_sync(model, text) for text in texts]
+
+    async def count_tokens(self, model: str, text: Optional[Any]) -> int:
+        """Count tokens of a text in the tokenizer thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.count_tokens_sync, model, text
+        )
+
+    async def count_tokens_batch(
+        self, model: str, texts: Sequence[Optional[Any]]
+    ) -> List[int]:
+        """Count tokens of many texts (e.g. all messages of a request) in one pool task."""
+        if len(texts) == 0:
+            return []
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.count_tokens_batch_sync, model, list(texts)
+        )
+
+    async def preload(self, models: Sequence[str]) -> None:
+        """Load tokenizers of models ahead of the first request."""
+        loop = asyncio.get_running_loop()
+        for model in models:
+            try:
+                await loop.run_in_executor(self.executor, self.get_tokenizer, model)
+            except Exception as error:
+                logger.error(f"Failed to preload tokenizer for {model}: {error}")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+tokenizer_service = TokenizerService(max_workers=TOKENIZER_WORKERS)
@@ -0,0 +1,134 @@
+"""Resolution of (unit name, version) of a project to UnitVersion uuids, for unit logging.
+
+Units and their versions are created the first time a log names them. Resolved versions are
+cached in this process, so logging to a known unit version doesn't query them at all.
+
+Env vars:
+    UNIT_VERSION_CACHE_MAX_SIZE: unit versions kept in the cache (default 10000)
+"""
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from dotenv import load_dotenv
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db_models import Unit, UnitVersion
+
+load_dotenv()
+
+UNIT_VERSION_CACHE_MAX_SIZE = int(os.environ.get("UNIT_VERSION_CACHE_MAX_SIZE", 10000))
+
+
+class UnitVersionResolver:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # (project_uuid, unit name, version) -> unit version uuid
+        self.versions: "OrderedDict[Tuple[str, str, int], UUID]" = OrderedDict()
+
+    def _cached(self, key: Tuple[str, str, int]) -> Optional[UUID]:
+        version_uuid = self.versions.get(key)
+        if version_uuid is not None:
+            self.versions.move_to_end(key)
+        return version_uuid
+
+    def _cache(self, key: Tuple[str, str, int], version_uuid: UUID) -> None:
+        self.versions[key] = version_uuid
+        self.versions.move_to_end(key)
+        while len(self.versions) > self.max_size:
+            self.versions.popitem(last=False)
+
+    async def resolve(
+        self,
+        session: AsyncSession,
+        project_uuid: str,
+        keys: Iterable[Tuple[str, int]],
+    ) -> Dict[Tuple[str, int], UUID]:
+        """Uuids of unit versions by (unit name, version), creating missing units & versions.
+
+        Units & versions are inserted ON CONFLICT DO NOTHING, so concurrent requests creating
+        the same version don't fail, and rows created by the other request are read back.
+        Versions are cached only once read by a query, i.e. committed.
+        """
+        project_uuid = str(project_uuid)
+        resolved: Dict[Tuple[str, int], UUID] = {}
+        uncached: List[Tuple[str, int]] = []
+        for name, version in set(keys):
+            version_uuid = self._cached((project_uuid, name, version))
+            if version_uuid is None:
+                uncached.append((name, version))
+            else:
+                resolved[(name, version)] = version_uuid
+        if not uncached:
+            return resolved
+
+        def select_versions(keys):
+            return (
+                select(Unit.name, UnitVersion.version, UnitVersion.uuid)
+                .join(Unit, Unit.uuid == UnitVersion.unit_uuid)
+                .where(Unit.project_uuid == project_uuid)
+                .where(tuple_(Unit.name, UnitVersion.version).in_(keys))
+            )
+
+        for name, version, version_uuid in (
+            await session.execute(select_versions(uncached))
+        ).all():
+            self._cache((project_uuid, name, version), version_uuid)
+            resolved[(name, version)] = version_uuid
+
+        missing = [key for key in uncached if key not in resolved]
+        if not missing:
+            return resolved
+
+        names = {name for name, _ in missing}
+        units = dict(
+            (
+                await session.execute(
+                    insert(Unit)
+                    .values([{"name": name, "project_uuid": project_uuid} for name in names])
+                    .on_conflict_do_nothing(constraint="_unit_project_name_uc")
+                    .returning(Unit.name, Unit.uuid)
+                )
+            ).all()
+        )
+        if len(units) < len(names):
+            units.update(
+                (
+                    await session.execute(
+                        select(Unit.name, Unit.uuid)
+                        .where(Unit.project_uuid == project_uuid)
+                        .where(Unit.name.in_(names - set(units)))
+                    )
+                ).all()
+            )
+
+        unit_names = {unit_uuid: name for name, unit_uuid in units.items()}
+        for unit_uuid, version, version_uuid in (
+            await session.execute(
+                insert(UnitVersion)
+                .values(
+                    [
+                        {"unit_uuid": units[name], "version": version}
+                        for name, version in missing
+                    ]
+                )
+                .on_conflict_do_nothing(constraint="_unit_version_unit_version_uc")
+                .returning(UnitVersion.unit_uuid, UnitVersion.version, UnitVersion.uuid)
+            )
+        ).all():
+            resolved[(unit_names[unit_uuid], version)] = version_uuid
+
+        missing = [key for key in missing if key not in resolved]
+        if missing:
+            # created by a concurrent request
+            for name, version, version_uuid in (
+                await session.execute(select_versions(missing))
+            ).all():
+                resolved[(name, version)] = version_uuid
+        return resolved
+
+
+unit_version_resolver = UnitVersionResolver(max_size=UNIT_VERSION_CACHE_MAX_SIZE)
@@ -1,16 +1,24 @@
-import re
 import json
+from uuid import uuid4
+from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 from enum import Enum
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import Result, select, asc, desc, update
+from sqlalchemy import Result, select, asc, desc, update, insert
 
 from utils.logger import logger
 from utils.prompt_utils import update_dict
+from utils.prompt_template import (
+    TemplateSyntax,
+    compile_prompt_templates,
+    get_template_variables,
+)
 from modules.types import (
     LocalTaskErrorType,
 )
-from base.database import get_session
+from modules.chat_history import load_chat_history, append_chat_history
+from base.database import get_session_context
+from crud import delete_unsaved_chat_run
 from base.websocket_connection import websocket_manager, LocalTask
 from api.common.models import (
     ChatModelRunConfig,
@@ -21,7 +29,6 @@ from db_models import *
 
 
 async def run_local_function_model_generator(
-    session: AsyncSession,
     project: Dict,
     cli_access_key: str,
     run_config: FunctionModelRunConfig,
@@ -30,25 +37,20 @@ async def run_local_function_model_generator(
     sample_input: Dict[str, str] = (
         run_config.sample_input if run_config.sample_input else {}
     )
-    prompt_variables = []
-
-    for prompt in run_config.prompts:
-        prompt_content: str = prompt.content
-        # Replace
-        escaped_patterns = re.findall(r"\{\{.*?\}\}", prompt_content)
-        for i, pattern in enumerate(escaped_patterns):
-            prompt_content = prompt_content.replace(pattern, f"__ESCAPED{i}__")
-
-        # find f-string input variables
-        fstring_input_pattern = r"(?<!\\)\{([^}]+)\}(?<!\\})"
-        prompt_variables_in_prompt = re.findall(fstring_input_pattern, prompt_content)
-
-        # Replace back
-        for i, pattern in enumerate(escaped_patterns):
-            prompt_content = prompt_content.replace(f"__ESCAPED{i}__", pattern)
+    try:
+        prompt_templates = compile_prompt_templates(
+            [prompt.content for prompt in run_config.prompts], TemplateSyntax.FSTRING
+        )
+    except ValueError as error:
+        data = {
+            "status": "failed",
+            "log": f"Invalid prompt template: {error}",
+        }
+        yield json.dumps(data)
+        return
 
-        prompt_variables_in_prompt = list(set(prompt_variables_in_prompt))
-        prompt_variables += prompt_variables_in_prompt
+    # find f-string input variables
+    prompt_variables = get_template_variables(prompt_templates)
 
     if len(prompt_variables) != 0:
         if sample_input is None:
@@ -78,10 +80,10 @@ async def run_local_function_model_generator(
     if sample_input:
         messages_for_run = [
             {
-                "content": prompt.content.format(**sample_input),
+                "content": template.render(sample_input),
                 "role": prompt.role,
             }
-            for prompt in prompts
+            for prompt, template in zip(prompts, prompt_templates)
         ]
     else:
         messages_for_run = [p.model_dump() for p in prompts]
@@ -90,22 +92,24 @@ async def run_local_function_model_generator(
     if run_config.functions is None:
         function_schemas = None
     else:
-        function_schemas = (
-            (
-                await session.execute(
-                    select(
-                        FunctionSchema.name,
-                        FunctionSchema.description,
-                        FunctionSchema.parameters,
-                        FunctionSchema.mock_response,
+        async with get_session_context() as session:
+            function_schemas = (
+                (
+                    await session.execute(
+                        select(
+                            FunctionSchema.name,
+                            FunctionSchema.description,
+                            FunctionSchema.parameters,
+                            FunctionSchema.mock_response,
+                        )
+                        .where(FunctionSchema.project_uuid == project["uuid"])
+                        .where(FunctionSchema.name.in_(run_config.functions))
                     )
-                    .where(FunctionSchema.project_uuid == project["uuid"])
-                    .where(FunctionSchema.name.in_(run_config.functions))
                 )
-            )
-            .mappings()
-            .all()
-        )  # function_schemas includes mock_response
+                .mappings()
+                .all()
+            )  # function_schemas includes mock_response
+            function_schemas = [dict(x) for x in function_schemas]
         
     function_model_version_uuid: Optional[str] = run_config.version_uuid
 
@@ -173,6 +177,7 @@ async def run_local_function_model_generator(
     ):
         return
     
+    # save run log with a new session, the connection is not held while streaming
     if function_model_version_uuid is not None:
         new_run_log = RunLog(
             **{
@@ -193,14 +198,12 @@ async def run_local_function_model_generator(
             }
         )
 
-        session.add(new_run_log)
-        await session.flush()
-
-    await session.commit()
+        async with get_session_context() as session:
+            session.add(new_run_log)
+            await session.commit()
 
 
 async def run_local_chat_model_generator(
-    session: AsyncSession,
     project: Dict,
     start_timestampz_iso,
     cli_access_key: str,
@@ -218,270 +221,296 @@ async def run_local_chat_model_generator(
         "system_prompt": run_config.system_prompt,
     }
     session_uuid = run_config.session_uuid
+    # version & session created by this run, deleted if it ends before its messages are saved
+    created_version_uuid: Optional[str] = None
+    created_session_uuid: Optional[str] = None
+
+    # pre-stream DB phase: create the version & session the stream needs and commit them,
+    # so the connection is released before streaming. The changelog & project version
+    # are saved with the messages, once the run succeeded
+    pre_stream_chunks = []
+    async with get_session_context() as session:
+        old_messages = [{"role": "system", "content": run_config.system_prompt}]
+        if session_uuid:
+            chat_messages: List[Dict] = await load_chat_history(
+                session,
+                session_uuid,
+                run_config.model,
+                max_messages=run_config.history_max_messages,
+                max_tokens=run_config.history_max_tokens,
+            )
+            old_messages += chat_messages
+            # delete None values
+            old_messages = [
+                {k: v for k, v in message.items() if v is not None}
+                for message in old_messages
+            ]
 
-    old_messages = [{"role": "system", "content": run_config.system_prompt}]
-    if session_uuid:
-        chat_messages: List[Dict] = (
-            (
-                await session.execute(
-                    select(
-                        ChatMessage.role,
-                        ChatMessage.name,
-                        ChatMessage.content,
-                        ChatMessage.tool_calls,
-                        ChatMessage.function_call,
+        # add function schemas
+        if run_config.functions is None:
+            function_schemas = []
+        else:
+            function_schemas = (
+                (
+                    await session.execute(
+                        select(
+                            FunctionSchema.name,
+                            FunctionSchema.description,
+                            FunctionSchema.parameters,
+                            FunctionSchema.mock_response,
+                        )
+                        .where(FunctionSchema.project_uuid == project["uuid"])
+                        .where(FunctionSchema.name.in_(run_config.functions))
                     )
-                    .where(ChatMessage.session_uuid == session_uuid)
-                    .order_by(asc(ChatMessage.created_at))
                 )
+                .mappings()
+                .all()
             )
-            .mappings()
-            .all()
-        )
-        old_messages += chat_messages
-        # delete None values
-        old_messages = [
-            {k: v for k, v in message.items() if v is not None}
-            for message in old_messages
-        ]
 
-    # add function schemas
-    function_schemas = (
-        (
-            await session.execute(
-                select(
-                    FunctionSchema.name,
-                    FunctionSchema.description,
-                    FunctionSchema.parameters,
-                    FunctionSchema.mock_response,
-                )
-                .where(FunctionSchema.project_uuid == project["uuid"])
-                .where(FunctionSchema.name.in_(run_config.functions))
-            )
-        )
-        .mappings()
-        .all()
-    )
+        user_input = run_config.user_input
+
+        if chat_model_version_config["uuid"] is None:
+            del chat_model_version_config["uuid"]
+            # find latest version
+            if run_config.from_version is None:
+                chat_model_version_config["is_published"] = True
+                chat_model_version_config["version"] = 1
+                new_chat_model_version_row = ChatModelVersion(**chat_model_version_config)
+                session.add(new_chat_model_version_row)
+                await session.flush()
+                await session.refresh(new_chat_model_version_row)
+                # update project version
+                need_project_version_update = True
+                changelogs += [
+                    {
+                        "subject": "chat_model_version",
+                        "identifier": [str(new_chat_model_version_row.uuid)],
+                        "action": "ADD",
+                    },
+                    {
+                        "subject": "chat_model_version",
+                        "identifier": [str(new_chat_model_version_row.uuid)],
+                        "action": "PUBLISH",
+                    },
+                ]
+            else:
+                latest_version = (
+                    await session.execute(
+                        select(ChatModelVersion.version)
+                        .where(
+                            ChatModelVersion.chat_model_uuid == run_config.chat_model_uuid
+                        )
+                        .order_by(desc(ChatModelVersion.version))
+                        .limit(1)
+                    )
+                ).scalar_one()
 
-    user_input = run_config.user_input
+                chat_model_version_config["version"] = latest_version + 1
+                new_chat_model_version_row = ChatModelVersion(**chat_model_version_config)
 
-    if chat_model_version_config["uuid"] is None:
-        del chat_model_version_config["uuid"]
-        # find latest version
-        if run_config.from_version is None:
-            chat_model_version_config["is_published"] = True
-            chat_model_version_config["version"] = 1
-            new_chat_model_version_row = ChatModelVersion(**chat_model_version_config)
-            session.add(new_chat_model_version_row)
-            await session.flush()
-            await session.refresh(new_chat_model_version_row)
-            # update project version
-            need_project_version_update = True
-            changelogs += [
-                {
-                    "subject": "chat_model_version",
-                    "identifier": [str(new_chat_model_version_row.uuid)],
-                    "action": "ADD",
-                },
-                {
-                    "subject": "chat_model_version",
-                    "identifier": [str(new_chat_model_version_row.uuid)],
-                    "action": "PUBLISH",
-                },
-            ]
-        else:
-            latest_version = (
-                await session.execute(
-                    select(ChatModelVersion.version)
-                    .where(
-                        ChatModelVersion.chat_model_uuid == run_config.chat_model_uuid
-                    )
-                    .order_by(desc(ChatModelVersion.version))
-                    .limit(1)
+                session.add(new_chat_model_version_row)
+                await session.flush()
+                await session.refresh(new_chat_model_version_row)
+
+                changelogs.append(
+                    {
+                        "subject": "chat_model_version",
+                        "identifier": [str(new_chat_model_version_row.uuid)],
+                        "action": "ADD",
+                    }
                 )
-            ).scalar_one()
 
-            chat_model_version_config["version"] = latest_version + 1
-            new_chat_model_version_row = ChatModelVersion(**chat_model_version_config)
+            chat_model_version_config["uuid"] = str(new_chat_model_version_row.uuid)
+            created_version_uuid = chat_model_version_config["uuid"]
 
-            session.add(new_chat_model_version_row)
-            await session.flush()
-            await session.refresh(new_chat_model_version_row)
+            data = {
+                "chat_model_version_uuid": chat_model_version_config["uuid"],
+                "version": chat_model_version_config["version"],
+                "status": "running",
+            }
+            pre_stream_chunks.append(data)
 
-            changelogs.append(
-                {
-                    "subject": "chat_model_version",
-                    "identifier": [str(new_chat_model_version_row.uuid)],
-                    "action": "ADD",
+        # make session
+        if session_uuid is None:
+            new_session = ChatSession(
+                **{
+                    "version_uuid": chat_model_version_config["uuid"],
+                    "run_from_deployment": False,
                 }
             )
+            session.add(new_session)
+            await session.flush()
+            await session.refresh(new_session)
 
-        chat_model_version_config["uuid"] = str(new_chat_model_version_row.uuid)
-
-        data = {
-            "chat_model_version_uuid": chat_model_version_config["uuid"],
-            "version": chat_model_version_config["version"],
-            "status": "running",
-        }
-        yield json.dumps(data)
+            session_uuid: str = str(new_session.uuid)
+            created_session_uuid = session_uuid
 
-    # make session
-    if session_uuid is None:
-        new_session = ChatSession(
-            **{
-                "version_uuid": chat_model_version_config["uuid"],
-                "run_from_deployment": False,
+            data = {
+                "chat_session_uuid": session_uuid,
+                "status": "running",
             }
-        )
-        session.add(new_session)
-        await session.flush()
-        await session.refresh(new_session)
-
-        session_uuid: str = str(new_session.uuid)
-
-        data = {
-            "chat_session_uuid": session_uuid,
-            "status": "running",
-        }
-        yield json.dumps(data)
+            pre_stream_chunks.append(data)
 
-    new_messages = [
-        {
-            "role": "user",
-            "content": user_input,
-            "created_at": start_timestampz_iso,
-            "session_uuid": session_uuid,
-        }
-    ]
+        await session.commit()
 
-    response_messages = []
-    current_message = {
-        "role": "assistant",
-        "content": "",
-        "function_call": None,
-    }
+    saved = False
+    try:
+        for data in pre_stream_chunks:
+            yield json.dumps(data)
 
-    websocket_message = {
-        "old_messages": old_messages,
-        "new_messages": [
-            {"role": message["role"], "content": message["content"]}
-            for message in new_messages
-        ],
-        "function_schemas": [dict(x) for x in function_schemas],
-        "model": run_config.model,
-    }
+        new_messages = [
+            {
+                "role": "user",
+                "content": user_input,
+                "created_at": start_timestampz_iso,
+                "session_uuid": session_uuid,
+            }
+        ]
 
-    res = websocket_manager.stream(
-        cli_access_key, LocalTask.RUN_CHAT_MODEL, websocket_message
-    )
-    error_type = None
-    error_log = None
-    async for chunk in res:
-        if "status" in chunk:
-            if "raw_output" in chunk:
-                current_message["content"] += chunk["raw_output"]
-            if "function_call" in chunk:
-                if current_message["function_call"] is None:
-                    current_message["function_call"] = chunk["function_call"]
-                else:
-                    current_message["function_call"] = update_dict(
-                        current_message["function_call"], chunk["function_call"]
-                    )
+        response_messages = []
+        current_message = {
+            "role": "assistant",
+            "content": "",
+            "function_call": None,
+        }
 
-            if "function_response" in chunk:
-                response_messages.append(current_message)
-                current_message = {
-                    "role": "assistant",
-                    "content": "",
-                    "function_call": None,
-                }
-                response_messages.append(
-                    {
-                        "role": "function",
-                        "name": chunk["function_response"]["name"],
-                        "content": chunk["function_response"]["response"],
-                    }
-                )
+        websocket_message = {
+            "old_messages": old_messages,
+            "new_messages": [
+                {"role": message["role"], "content": message["content"]}
+                for message in new_messages
+            ],
+            "function_schemas": [dict(x) for x in function_schemas],
+            "model": run_config.model,
+        }
 
-            if chunk["status"] in ["completed", "failed"]:
-                if (
-                    current_message["content"] != ""
-                    or current_message["function_call"] is not None
-                ):
-                    error_type = chunk["error_type"] if "error_type" in chunk else None
-                    error_log = chunk["log"] if "log" in chunk else None
+        res = websocket_manager.stream(
+            cli_access_key, LocalTask.RUN_CHAT_MODEL, websocket_message
+        )
+        error_type = None
+        error_log = None
+        async for chunk in res:
+            if "status" in chunk:
+                if "raw_output" in chunk:
+                    current_message["content"] += chunk["raw_output"]
+                if "function_call" in chunk:
+                    if current_message["function_call"] is None:
+                        current_message["function_call"] = chunk["function_call"]
+                    else:
+                        current_message["function_call"] = update_dict(
+                            current_message["function_call"], chunk["function_call"]
+                        )
+
+                if "function_response" in chunk:
                     response_messages.append(current_message)
+                    current_message = {
+                        "role": "assistant",
+                        "content": "",
+                        "function_call": None,
+                    }
+                    response_messages.append(
+                        {
+                            "role": "function",
+                            "name": chunk["function_response"]["name"],
+                            "content": chunk["function_response"]["response"],
+                        }
+                    )
 
-        yield json.dumps(chunk)
-
-    if error_type and (
-        error_type == LocalTaskErrorType.NO_FUNCTION_NAMED_ERROR.value
-        or error_type == LocalTaskErrorType.SERVICE_ERROR.value
-    ):
-        return
-
-    # save new messages
-    new_chat_message_rows = [ChatMessage(**message) for message in new_messages]
-    session.add_all(new_chat_message_rows)
-    await session.flush()
+                if chunk["status"] in ["completed", "failed"]:
+                    if (
+                        current_message["content"] != ""
+                        or current_message["function_call"] is not None
+                    ):
+                        error_type = chunk["error_type"] if "error_type" in chunk else None
+                        error_log = chunk["log"] if "log" in chunk else None
+                        response_messages.append(current_message)
+
+            yield json.dumps(chunk)
+
+        if error_type and (
+            error_type == LocalTaskErrorType.NO_FUNCTION_NAMED_ERROR.value
+            or error_type == LocalTaskErrorType.SERVICE_ERROR.value
+        ):
+            return
 
-    # save response messages
-    for message in response_messages:
-        message["name"] = None if "name" not in message else message["name"]
-        message["session_uuid"] = session_uuid
+        # post-stream DB phase: save messages, chat log & changelog with a new session
+        # message uuids & timestamps are set here, so the chat log doesn't need to query them back
+        response_created_at = datetime.now(timezone.utc)
+        for index, message in enumerate(response_messages):
+            message["name"] = None if "name" not in message else message["name"]
+            message["session_uuid"] = session_uuid
+            # keep the order of messages saved in one transaction
+            message["created_at"] = response_created_at + timedelta(microseconds=index)
+
+        if error_type:
+            response_messages[-1]["chat_message_metadata"] = {
+                "error_occurs": True,
+                "error_log": error_log,
+            }
 
-    if error_type:
-        response_messages[-1]["chat_message_metadata"] = {
-            "error_occurs": True,
-            "error_log": error_log,
-        }
+        for message in new_messages + response_messages:
+            message["uuid"] = uuid4()
 
-    response_chat_message_rows = [
-        ChatMessage(**message) for message in response_messages
-    ]
-    session.add_all(response_chat_message_rows)
-    await session.flush()
-    # get last 2 messages
-    last_two_messages = (
-        (
+        async with get_session_context() as session:
+            # all messages in one statement, before the chat log referencing them
             await session.execute(
-                select(ChatMessage)
-                .where(ChatMessage.session_uuid == session_uuid)
-                .order_by(desc(ChatMessage.created_at))
-                .limit(2)
+                insert(ChatMessage).values(
+                    [
+                        {
+                            key: message.get(key)
+                            for key in [
+                                "uuid",
+                                "created_at",
+                                "session_uuid",
+                                "role",
+                                "name",
+                                "content",
+                                "function_call",
+                                "chat_message_metadata",
+                            ]
+                        }
+                        for message in new_messages + response_messages
+                    ]
+                )
             )
-        )
-        .scalars()
-        .all()
-    )
 
-    # make ChatLog
-    chat_log = ChatLog(
-        user_message_uuid=last_two_messages[1].uuid,
-        assistant_message_uuid=last_two_messages[0].uuid,
-        session_uuid=session_uuid,
-        project_uuid=project["uuid"],
-    )
-    session.add(chat_log)
+            # make ChatLog of the latest user (or function) message and the answer to it
+            if response_messages and response_messages[-1]["role"] == "assistant":
+                user_message = next(
+                    message
+                    for message in reversed(new_messages + response_messages[:-1])
+                    if message["role"] in ["user", "function"]
+                )
+                await session.execute(
+                    insert(ChatLog).values(
+                        user_message_uuid=user_message["uuid"],
+                        assistant_message_uuid=response_messages[-1]["uuid"],
+                        session_uuid=session_uuid,
+                        project_uuid=project["uuid"],
+                    )
+                )
 
-    await session.flush()
+            if need_project_version_update:
+                await session.execute(
+                    update(Project)
+                    .where(Project.uuid == project["uuid"])
+                    .values(version=project["version"] + 1)
+                )
 
-    if need_project_version_update:
-        await session.execute(
-            update(Project)
-            .where(Project.uuid == project["uuid"])
-            .values(version=project["version"] + 1)
-        )
-        await session.flush()
+            if len(changelogs) > 0:
+                session.add(
+                    ProjectChangelog(
+                        **{
+                            "logs": changelogs,
+                            "project_uuid": project["uuid"],
+                        }
+                    )
+                )
 
-    if len(changelogs) > 0:
-        session.add(
-            ProjectChangelog(
-                **{
-                    "logs": changelogs,
-                    "project_uuid": project["uuid"],
-                }
-            )
-        )
+            await session.commit()
+        saved = True
 
-    await session.commit()
+        await append_chat_history(session_uuid, new_messages + response_messages)
+    finally:
+        if not saved:
+            await delete_unsaved_chat_run(created_session_uuid, created_version_uuid)
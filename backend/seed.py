@@ -1,4 +1,19 @@
+"""Seed the database.
+
+Usage (from backend/):
+    python seed.py                      # run seed.sql, if present
+    python seed.py --benchmark-project  # seed a synthetic project for benchmarks, print its keys as JSON
+    python seed.py --benchmark-project --llm-api-base http://localhost:9000/v1
+                                        # ... calling benchmarks/mock_llm_server.py for "openai" models
+
+For large synthetic datasets (millions of run logs & chat messages), see benchmarks/generate_data.py.
+"""
 import os
+import json
+import uuid
+import argparse
+from typing import Any, Dict, Optional
+
 import psycopg2
 from dotenv import load_dotenv
 
@@ -13,23 +28,209 @@ db_params = {
     "port": os.environ.get("POSTGRES_PORT"),
 }
 
-# Read the contents of the seed.sql file
-with open("seed.sql", "r") as file:
-    seed_sql = file.read()
+SEED_SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "seed.sql")
 
-try:
-    # Connect to the database
-    conn = psycopg2.connect(**db_params)
-    cursor = conn.cursor()
 
-    # Execute the seed SQL script
-    cursor.execute(seed_sql)
+def seed_sql(conn, path: str = SEED_SQL_PATH) -> None:
+    """Execute the seed.sql script."""
+    # Read the contents of the seed.sql file
+    with open(path, "r") as file:
+        seed_sql = file.read()
 
-    # Commit the changes and close the connection
+    with conn.cursor() as cursor:
+        # Execute the seed SQL script
+        cursor.execute(seed_sql)
     conn.commit()
 
-except Exception as e:
-    print(f"Error: {e}")
-finally:
-    cursor.close()
-    conn.close()
+
+def seed_benchmark_project(
+    conn,
+    chat_sessions: int = 100,
+    model: str = "gpt-3.5-turbo",
+    llm_api_base: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Seed an organization, user and project with a published function model & chat model version.
+
+    If llm_api_base is given, the organization's "openai" provider config points at it
+    (e.g. benchmarks/mock_llm_server.py), so cloud & batch runs work offline.
+
+    Returns the keys benchmarks need to call /api/cli endpoints, and to connect as the project's CLI.
+    """
+    suffix = uuid.uuid4().hex[:12]
+    organization_id = f"org_benchmark_{suffix}"
+    user_id = f"user_benchmark_{suffix}"
+    api_key = f"benchmark_{uuid.uuid4().hex}"
+    cli_access_key = f"benchmark_cli_{uuid.uuid4().hex}"
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO organization (organization_id, name, slug) VALUES (%s, %s, %s)",
+            (organization_id, f"benchmark {suffix}", f"benchmark-{suffix}"),
+        )
+        cursor.execute(
+            'INSERT INTO "user" (user_id, email, is_test) VALUES (%s, %s, true)',
+            (user_id, f"{user_id}@example.com"),
+        )
+        cursor.execute(
+            "INSERT INTO users_organizations (user_id, organization_id) VALUES (%s, %s)",
+            (user_id, organization_id),
+        )
+        cursor.execute(
+            "INSERT INTO cli_access (user_id, api_key, expires_at) "
+            "VALUES (%s, %s, now() + interval '365 days')",
+            (user_id, cli_access_key),
+        )
+        cursor.execute(
+            "INSERT INTO project "
+            "(name, api_key, cli_access_key, version, online, is_public, organization_id) "
+            "VALUES (%s, %s, %s, 1, false, false, %s) RETURNING uuid",
+            (f"benchmark-{suffix}", api_key, cli_access_key, organization_id),
+        )
+        project_uuid = cursor.fetchone()[0]
+        cursor.execute(
+            "INSERT INTO eval_metric (name, description, project_uuid) VALUES (%s, %s, %s)",
+            ("gt_exact_match", "Exact match with ground truth", project_uuid),
+        )
+        if llm_api_base:
+            cursor.execute(
+                "INSERT INTO organization_llm_provider_config "
+                "(organization_id, provider_name, env_vars) VALUES (%s, 'openai', %s)",
+                (
+                    organization_id,
+                    json.dumps(
+                        {"OPENAI_API_KEY": "mock", "OPENAI_API_BASE": llm_api_base}
+                    ),
+                ),
+            )
+
+        cursor.execute(
+            "INSERT INTO function_model (name, online, project_uuid) "
+            "VALUES (%s, false, %s) RETURNING uuid",
+            ("benchmark_function_model", project_uuid),
+        )
+        function_model_uuid = cursor.fetchone()[0]
+        cursor.execute(
+            "INSERT INTO function_model_version "
+            "(version, model, is_published, function_model_uuid, created_by) "
+            "VALUES (1, %s, true, %s, %s) RETURNING uuid",
+            (model, function_model_uuid, user_id),
+        )
+        function_model_version_uuid = cursor.fetchone()[0]
+        cursor.executemany(
+            "INSERT INTO prompt (role, step, content, version_uuid) VALUES (%s, %s, %s, %s)",
+            [
+                ("system", 1, "You are a helpful assistant.", function_model_version_uuid),
+                ("user", 2, "Answer the question: {question}", function_model_version_uuid),
+            ],
+        )
+
+        cursor.execute(
+            "INSERT INTO chat_model (name, online, project_uuid) "
+            "VALUES (%s, false, %s) RETURNING uuid",
+            ("benchmark_chat_model", project_uuid),
+        )
+        chat_model_uuid = cursor.fetchone()[0]
+        cursor.execute(
+            "INSERT INTO chat_model_version "
+            "(version, model, system_prompt, is_published, chat_model_uuid) "
+            "VALUES (1, %s, %s, true, %s) RETURNING uuid",
+            (model, "You are a helpful assistant.", chat_model_uuid),
+        )
+        chat_model_version_uuid = cursor.fetchone()[0]
+        cursor.execute(
+            "INSERT INTO chat_session (version_uuid, run_from_deployment) "
+            "SELECT %s, true FROM generate_series(1, %s) RETURNING uuid",
+            (chat_model_version_uuid, chat_sessions),
+        )
+        chat_session_uuids = [str(row[0]) for row in cursor.fetchall()]
+    conn.commit()
+
+    return {
+        "user_id": user_id,
+        "api_key": api_key,
+        "cli_access_key": cli_access_key,
+        "project_uuid": str(project_uuid),
+        "function_model_name": "benchmark_function_model",
+        "function_model_uuid": str(function_model_uuid),
+        "function_model_version_uuid": str(function_model_version_uuid),
+        "chat_model_uuid": str(chat_model_uuid),
+        "chat_model_version_uuid": str(chat_model_version_uuid),
+        "chat_session_uuids": chat_session_uuids,
+    }
+
+
+def seed_benchmark_dataset(
+    conn, project: Dict[str, Any], samples: int = 100, ground_truth: str = ""
+) -> str:
+    """Seed a dataset of `samples` sample inputs for batch runs of the benchmark function model.
+
+    A dataset can be batch run once per version, so seed one per run. Returns the dataset uuid.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT uuid FROM eval_metric WHERE project_uuid = %s AND name = 'gt_exact_match'",
+            (project["project_uuid"],),
+        )
+        eval_metric_uuid = cursor.fetchone()[0]
+        cursor.execute(
+            "INSERT INTO dataset (name, project_uuid, eval_metric_uuid, function_model_uuid) "
+            "VALUES (%s, %s, %s, %s) RETURNING uuid",
+            (
+                f"benchmark-{uuid.uuid4().hex[:12]}",
+                project["project_uuid"],
+                eval_metric_uuid,
+                project["function_model_uuid"],
+            ),
+        )
+        dataset_uuid = cursor.fetchone()[0]
+        cursor.execute(
+            "WITH sample AS ("
+            "  INSERT INTO sample_input "
+            "  (name, content, input_keys, online, ground_truth, project_uuid, function_model_uuid) "
+            "  SELECT NULL, jsonb_build_object('question', 'question ' || i), "
+            "  ARRAY['question'], false, %s, %s, %s FROM generate_series(1, %s) AS i "
+            "  RETURNING uuid"
+            ") "
+            "INSERT INTO dataset_sample_input (dataset_uuid, sample_input_uuid) "
+            "SELECT %s, uuid FROM sample",
+            (
+                ground_truth,
+                project["project_uuid"],
+                project["function_model_uuid"],
+                samples,
+                dataset_uuid,
+            ),
+        )
+    conn.commit()
+    return str(dataset_uuid)
+
+
+def main(args):
+    conn = psycopg2.connect(**db_params)
+    try:
+        if args.benchmark_project:
+            print(
+                json.dumps(
+                    seed_benchmark_project(
+                        conn,
+                        chat_sessions=args.chat_sessions,
+                        llm_api_base=args.llm_api_base,
+                    )
+                )
+            )
+        elif os.path.exists(SEED_SQL_PATH):
+            seed_sql(conn)
+        else:
+            print(f"No seed file found at {SEED_SQL_PATH}, skipping")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--benchmark-project", action="store_true")
+    parser.add_argument("--chat-sessions", type=int, default=100)
+    parser.add_argument("--llm-api-base")
+    main(parser.parse_args())
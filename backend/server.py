@@ -2,19 +2,37 @@
 import os
 import pytz
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.responses import Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from utils.logger import logger
+from base.metrics import PrometheusMiddleware
+from base.database import query_profiler
+from base.query_profiler import QueryProfilerMiddleware, query_profiler_auth
+from settings import Settings
 from api import cli, web, dev, web_auth
+from modules.tokenizer import tokenizer_service, TOKENIZER_PRELOAD_MODELS
+from base.websocket_connection import websocket_manager
 
 load_dotenv()
 
 app = FastAPI()
 
 
+@app.on_event("startup")
+async def startup():
+    await tokenizer_service.preload(TOKENIZER_PRELOAD_MODELS)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    tokenizer_service.shutdown()
+    await websocket_manager.shutdown()
+
+
 frontend_url = os.getenv("FRONTEND_PUBLIC_URL", "http://localhost:3000")
 # origins = [frontend_url]
 origins = ["*"]
@@ -49,6 +67,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(PrometheusMiddleware)
+if query_profiler is not None:
+    app.add_middleware(QueryProfilerMiddleware, profiler=query_profiler)
 
 
 # @app.middleware("http")
@@ -82,3 +103,24 @@ load_dotenv()
 def health():
     """Health check endpoint."""
     return Response(status_code=200)
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics endpoint."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+query_profiler_token = Settings().QUERY_PROFILER_TOKEN
+if query_profiler is not None and query_profiler_token:
+    profiler_auth = [Depends(query_profiler_auth(query_profiler_token))]
+
+    @app.get("/debug/query_profile", dependencies=profiler_auth)
+    def query_profile(limit: int = 10):
+        """Worst query offenders (N+1 candidates, slow queries) per route."""
+        return JSONResponse(content=query_profiler.report(limit=limit))
+
+    @app.delete("/debug/query_profile", dependencies=profiler_auth)
+    def reset_query_profile():
+        query_profiler.reset()
+        return Response(status_code=200)
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,6 +13,12 @@ class Settings(BaseModel):
     POSTGRES_HOST: str = os.environ.get("POSTGRES_HOST")
     POSTGRES_PORT: str = os.environ.get("POSTGRES_PORT", 5432)
     TESTMODE: bool = os.environ.get("TESTMODE", False)
+    QUERY_PROFILER: bool = os.environ.get("QUERY_PROFILER", False)
+    QUERY_PROFILER_SLOW_MS: float = os.environ.get("QUERY_PROFILER_SLOW_MS", 100)
+    QUERY_PROFILER_N_PLUS_ONE_THRESHOLD: int = os.environ.get(
+        "QUERY_PROFILER_N_PLUS_ONE_THRESHOLD", 5
+    )
+    QUERY_PROFILER_TOKEN: Optional[str] = os.environ.get("QUERY_PROFILER_TOKEN")
 
 
 # from pydantic import BaseSettings
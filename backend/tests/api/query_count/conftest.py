@@ -0,0 +1,241 @@
+"""Fixtures of the query-count regression tests.
+
+These tests run against a real Postgres, configured by the POSTGRES_* env vars.
+The database is migrated to head and seeded, so use a disposable one.
+Opt in with QUERY_COUNT_TESTS=true.
+"""
+import os
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+import jwt
+import pytest
+import pytest_asyncio
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import event
+
+from base.database import engine, get_session_context
+from db_models import *
+
+# number of rows per table seeded for a project
+DATA_SIZES = [1, 10, 50]
+
+
+@contextmanager
+def _count_statements():
+    """Collect SQL statements sent to the database while in the block."""
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def count_statements():
+    return _count_statements
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def client(migrated_database):
+    os.environ.setdefault("NEXTAUTH_SECRET", "query-count-tests")
+    from server import app
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        yield client
+    await engine.dispose()
+
+
+async def seed_project(size: int) -> Dict[str, Any]:
+    """Seed an organization with `size` users, and a project with `size` rows of everything."""
+    suffix = uuid.uuid4().hex
+    organization_id = f"org_{suffix}"
+    user_ids = [f"user_{suffix}_{i}" for i in range(size)]
+    project_uuid = uuid.uuid4()
+    function_model_uuids = [uuid.uuid4() for _ in range(size)]
+    # versions of the first function model
+    version_uuids = [uuid.uuid4() for _ in range(size)]
+    chat_model_uuid = uuid.uuid4()
+    chat_model_version_uuid = uuid.uuid4()
+    chat_session_uuid = uuid.uuid4()
+
+    async with get_session_context() as session:
+        session.add(
+            Organization(organization_id=organization_id, name=suffix, slug=suffix)
+        )
+        session.add_all(
+            [
+                User(user_id=user_id, email=f"{user_id}@example.com")
+                for user_id in user_ids
+            ]
+        )
+        await session.flush()
+        session.add_all(
+            [
+                UsersOrganizations(user_id=user_id, organization_id=organization_id)
+                for user_id in user_ids
+            ]
+        )
+        session.add(CliAccess(user_id=user_ids[0], api_key=f"cli_access_key_{suffix}"))
+        await session.flush()
+        session.add(
+            Project(
+                uuid=project_uuid,
+                name=suffix,
+                api_key=f"api_key_{suffix}",
+                cli_access_key=f"cli_access_key_{suffix}",
+                version=1,
+                organization_id=organization_id,
+            )
+        )
+        await session.flush()
+        session.add_all(
+            [
+                FunctionModel(
+                    uuid=function_model_uuid,
+                    name=f"function_model_{i}",
+                    project_uuid=project_uuid,
+                )
+                for i, function_model_uuid in enumerate(function_model_uuids)
+            ]
+            + [
+                ChatModel(uuid=chat_model_uuid, name="chat_model", project_uuid=project_uuid),
+                *[
+                    SampleInput(
+                        name=f"sample_{i}",
+                        content={"question": f"question {i}"},
+                        input_keys=["question"],
+                        project_uuid=project_uuid,
+                    )
+                    for i in range(size)
+                ],
+                *[
+                    FunctionSchema(
+                        name=f"function_schema_{i}",
+                        description=f"function schema {i}",
+                        parameters={"type": "object", "properties": {}},
+                        project_uuid=project_uuid,
+                    )
+                    for i in range(size)
+                ],
+            ]
+        )
+        await session.flush()
+        session.add_all(
+            [
+                FunctionModelVersion(
+                    uuid=version_uuid,
+                    version=i + 1,
+                    model="gpt-3.5-turbo",
+                    is_published=i == 0,
+                    function_model_uuid=function_model_uuids[0],
+                    created_by=user_ids[i],
+                )
+                for i, version_uuid in enumerate(version_uuids)
+            ]
+            + [
+                # a published version for every other function model
+                FunctionModelVersion(
+                    version=1,
+                    model="gpt-3.5-turbo",
+                    is_published=True,
+                    function_model_uuid=function_model_uuid,
+                    created_by=user_ids[0],
+                )
+                for function_model_uuid in function_model_uuids[1:]
+            ]
+            + [
+                ChatModelVersion(
+                    uuid=chat_model_version_uuid,
+                    version=1,
+                    model="gpt-3.5-turbo",
+                    system_prompt="You are a helpful assistant.",
+                    is_published=True,
+                    chat_model_uuid=chat_model_uuid,
+                )
+            ]
+        )
+        await session.flush()
+        session.add_all(
+            [
+                Prompt(role=role, step=step, content=f"{role} prompt", version_uuid=version_uuid)
+                for version_uuid in version_uuids
+                for step, role in enumerate(["system", "user"], start=1)
+            ]
+            + [
+                RunLog(
+                    inputs={"question": f"question {i}"},
+                    raw_output=f"answer {i}",
+                    run_from_deployment=True,
+                    version_uuid=version_uuids[i % len(version_uuids)],
+                    project_uuid=project_uuid,
+                )
+                for i in range(size)
+            ]
+            + [
+                ChatSession(
+                    uuid=chat_session_uuid,
+                    version_uuid=chat_model_version_uuid,
+                    run_from_deployment=True,
+                )
+            ]
+        )
+        await session.flush()
+        session.add_all(
+            [
+                ChatMessage(
+                    role="user" if i % 2 == 0 else "assistant",
+                    content=f"message {i}",
+                    session_uuid=chat_session_uuid,
+                )
+                for i in range(size)
+            ]
+        )
+        await session.commit()
+
+    return {
+        "size": size,
+        "user_id": user_ids[0],
+        "project_uuid": str(project_uuid),
+        "api_key": f"api_key_{suffix}",
+        "cli_access_key": f"cli_access_key_{suffix}",
+        "function_model_name": "function_model_0",
+        "function_model_uuid": str(function_model_uuids[0]),
+        "function_model_version_uuid": str(version_uuids[0]),
+        "chat_model_version_uuid": str(chat_model_version_uuid),
+        "chat_session_uuid": str(chat_session_uuid),
+    }
+
+
+@pytest_asyncio.fixture(
+    scope="session", loop_scope="session", params=DATA_SIZES, ids=lambda size: f"size={size}"
+)
+async def seeded_project(request, client) -> Dict[str, Any]:
+    return await seed_project(request.param)
+
+
+@pytest.fixture
+def cli_headers(seeded_project) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {seeded_project['api_key']}"}
+
+
+@pytest.fixture
+def web_headers(seeded_project) -> Dict[str, str]:
+    from utils.security import self_hosted
+
+    if not self_hosted:
+        pytest.skip("web endpoints are authenticated with NEXTAUTH_SECRET only when self-hosted")
+    token = jwt.encode(
+        {"user_id": seeded_project["user_id"]},
+        os.environ["NEXTAUTH_SECRET"],
+        algorithm="HS512",
+    )
+    return {"Authorization": f"Bearer {token}"}
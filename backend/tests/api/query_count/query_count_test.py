@@ -0,0 +1,1083 @@
+"""Upper bounds on SQL statements per request of hot endpoints.
+
+Each test runs at every size in DATA_SIZES with the same bound,
+so a query per row (N+1) fails the test once the data grows.
+"""
+import os
+import json
+import uuid
+import asyncio
+
+import pytest
+from sqlalchemy import delete, select
+
+from base.database import get_session_context
+from db_models import (
+    ChatLog,
+    EvalMetric,
+    FunctionModel,
+    RunLog,
+    RunLogScore,
+    UnitLog,
+    UnitLogRunLog,
+    UnitLogScore,
+)
+from base.websocket_connection import ServerTask, websocket_manager
+
+pytestmark = [
+    pytest.mark.skipif(
+        os.environ.get("QUERY_COUNT_TESTS", "false").lower() != "true",
+        reason="set QUERY_COUNT_TESTS=true to run query-count tests against Postgres",
+    ),
+    pytest.mark.asyncio(loop_scope="session"),
+]
+
+# endpoint -> max SQL statements per request, independent of data size
+MAX_STATEMENTS = {
+    "check_update": 5,
+    "fetch_function_model_version": 4,
+    "save_run_log": 2,
+    # project, run logs, metrics, new metrics, scores
+    "save_run_log_scores": 5,
+    "create_unit_log": 2,
+    # project, versions, new unit, new version, logs, run logs, connections, metrics,
+    # new metrics, scores
+    "save_unit_log_batch": 10,
+    "save_chat_log": 4,
+    "save_chat_log_new_session": 6,
+    "fetch_run_logs": 2,
+    "fetch_function_model_versions_with_user": 1,
+    "sync_code": 13,
+    # code inventory of the sync, deployed function models
+    "list_function_models": 1,
+}
+
+
+def api_response(content: str):
+    return {
+        "id": "chatcmpl-query-count",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-3.5-turbo",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        "_response_ms": 100,
+    }
+
+
+def assert_statements(name: str, statements):
+    assert len(statements) <= MAX_STATEMENTS[name], (
+        f"{name} executed {len(statements)} statements "
+        f"(max {MAX_STATEMENTS[name]}):\n" + "\n".join(statements)
+    )
+
+
+async def test_check_update(client, seeded_project, cli_headers, count_statements):
+    with count_statements() as statements:
+        response = await client.get(
+            "/api/cli/check_update", params={"cached_version": 0}, headers=cli_headers
+        )
+    assert response.status_code == 200
+    project_status = response.json()["project_status"]
+    assert len(project_status["function_models"]) == seeded_project["size"]
+    assert_statements("check_update", statements)
+
+
+async def test_fetch_function_model_version(
+    client, seeded_project, cli_headers, count_statements
+):
+    with count_statements() as statements:
+        response = await client.get(
+            "/api/cli/function_model_versions",
+            params={"function_model_name": seeded_project["function_model_name"]},
+            headers=cli_headers,
+        )
+    assert response.status_code == 200
+    assert_statements("fetch_function_model_version", statements)
+
+
+async def test_save_run_log(client, seeded_project, cli_headers, count_statements):
+    with count_statements() as statements:
+        response = await client.post(
+            "/api/cli/run_log",
+            params={"version_uuid": seeded_project["function_model_version_uuid"]},
+            json={
+                "uuid": str(uuid.uuid4()),
+                "api_response": api_response("answer"),
+                "inputs": {"question": "question"},
+                "parsed_outputs": {},
+                "metadata": {},
+            },
+            headers=cli_headers,
+        )
+    assert response.status_code == 200
+    assert_statements("save_run_log", statements)
+
+
+async def test_save_run_log_scores(
+    client, seeded_project, cli_headers, count_statements
+):
+    async with get_session_context() as session:
+        run_log_uuids = (
+            await session.scalars(
+                select(RunLog.uuid).where(
+                    RunLog.project_uuid == seeded_project["project_uuid"]
+                )
+            )
+        ).all()
+    metric = f"metric_{uuid.uuid4().hex}"
+    body = [
+        {"run_log_uuid": str(run_log_uuid), "scores": {metric: 0.5, "accuracy": 1}}
+        for run_log_uuid in run_log_uuids
+    ]
+    with count_statements() as statements:
+        response = await client.post(
+            "/api/cli/run_log_scores", json=body, headers=cli_headers
+        )
+    assert response.status_code == 200
+    assert_statements("save_run_log_scores", statements)
+
+    # scores are overwritten
+    body[0]["scores"] = {metric: 0.25}
+    response = await client.post(
+        "/api/cli/run_log_scores", json=body[:1], headers=cli_headers
+    )
+    assert response.status_code == 200
+    async with get_session_context() as session:
+        values = (
+            await session.execute(
+                select(RunLogScore.run_log_uuid, RunLogScore.value)
+                .join(EvalMetric, EvalMetric.uuid == RunLogScore.eval_metric_uuid)
+                .where(RunLogScore.run_log_uuid.in_(run_log_uuids))
+                .where(EvalMetric.name == metric)
+            )
+        ).all()
+    assert dict(values) == {
+        run_log_uuid: 0.25 if index == 0 else 0.5
+        for index, run_log_uuid in enumerate(run_log_uuids)
+    }
+
+
+async def test_save_run_log_scores_of_other_project(
+    client, seeded_project, cli_headers
+):
+    response = await client.post(
+        "/api/cli/run_log_scores",
+        json=[{"run_log_uuid": str(uuid.uuid4()), "scores": {"accuracy": 1}}],
+        headers=cli_headers,
+    )
+    assert response.status_code == 404
+
+
+async def test_create_unit_log(client, seeded_project, cli_headers, count_statements):
+    body = {"name": f"unit_{uuid.uuid4().hex}", "version": 1}
+    # the first log creates the unit version, the second reads & caches it
+    for _ in range(2):
+        response = await client.post(
+            "/api/cli/unit/log", json=body, headers=cli_headers
+        )
+        assert response.status_code == 200
+    version_uuid = response.json()["version_uuid"]
+
+    log_uuid = str(uuid.uuid4())
+    with count_statements() as statements:
+        response = await client.post(
+            "/api/cli/unit/log", json={**body, "log_uuid": log_uuid}, headers=cli_headers
+        )
+    assert response.status_code == 200
+    assert response.json()["version_uuid"] == version_uuid
+    assert response.json()["log_uuid"] == log_uuid
+    assert_statements("create_unit_log", statements)
+
+    # retrying with the same log_uuid doesn't duplicate the log
+    response = await client.post(
+        "/api/cli/unit/log", json={**body, "log_uuid": log_uuid}, headers=cli_headers
+    )
+    assert response.status_code == 200
+    async with get_session_context() as session:
+        log_uuids = (
+            await session.scalars(
+                select(UnitLog.uuid).where(UnitLog.version_uuid == version_uuid)
+            )
+        ).all()
+    assert len(log_uuids) == 3
+
+
+async def test_save_unit_log_batch(
+    client, seeded_project, cli_headers, count_statements
+):
+    async with get_session_context() as session:
+        run_log_uuids = (
+            await session.scalars(
+                select(RunLog.uuid).where(
+                    RunLog.project_uuid == seeded_project["project_uuid"]
+                )
+            )
+        ).all()
+    name = f"unit_{uuid.uuid4().hex}"
+    metric = f"metric_{uuid.uuid4().hex}"
+    log_uuids = [str(uuid.uuid4()) for _ in run_log_uuids]
+    body = {
+        "logs": [
+            {"name": name, "version": 1, "log_uuid": log_uuid} for log_uuid in log_uuids
+        ],
+        "connections": [
+            {"unit_log_uuid": log_uuid, "run_log_uuid": str(run_log_uuid)}
+            for log_uuid, run_log_uuid in zip(log_uuids, run_log_uuids)
+        ],
+        "scores": [
+            {"unit_log_uuid": log_uuid, "scores": {metric: 0.5}}
+            for log_uuid in log_uuids
+        ],
+    }
+    with count_statements() as statements:
+        response = await client.post(
+            "/api/cli/unit/batch", json=body, headers=cli_headers
+        )
+    assert response.status_code == 200
+    assert [log["log_uuid"] for log in response.json()["logs"]] == log_uuids
+    assert_statements("save_unit_log_batch", statements)
+
+    async with get_session_context() as session:
+        connections = (
+            await session.execute(
+                select(UnitLogRunLog.unit_log_uuid, UnitLogRunLog.run_log_uuid).where(
+                    UnitLogRunLog.unit_log_uuid.in_(log_uuids)
+                )
+            )
+        ).all()
+        values = (
+            await session.scalars(
+                select(UnitLogScore.value).where(
+                    UnitLogScore.unit_log_uuid.in_(log_uuids)
+                )
+            )
+        ).all()
+    assert {(str(log), run_log) for log, run_log in connections} == set(
+        zip(log_uuids, run_log_uuids)
+    )
+    assert values == [0.5] * len(log_uuids)
+
+
+async def test_unit_logs_of_another_project(client, seeded_project, cli_headers):
+    from .conftest import seed_project
+
+    other_project = await seed_project(1)
+    other_headers = {"Authorization": f"Bearer {other_project['api_key']}"}
+    response = await client.post(
+        "/api/cli/unit/log", json={"name": "unit", "version": 1}, headers=other_headers
+    )
+    assert response.status_code == 200
+    other_log_uuid = response.json()["log_uuid"]
+    async with get_session_context() as session:
+        other_run_log_uuid = (
+            await session.scalars(
+                select(RunLog.uuid).where(
+                    RunLog.project_uuid == other_project["project_uuid"]
+                )
+            )
+        ).first()
+
+    response = await client.post(
+        "/api/cli/unit/log",
+        json={"name": "unit", "version": 1, "log_uuid": "not-a-uuid"},
+        headers=cli_headers,
+    )
+    assert response.status_code == 422
+    response = await client.post(
+        "/api/cli/unit/log",
+        json={"name": "unit", "version": 1, "log_uuid": other_log_uuid},
+        headers=cli_headers,
+    )
+    assert response.status_code == 409
+
+    response = await client.post(
+        "/api/cli/unit/log", json={"name": "unit", "version": 1}, headers=cli_headers
+    )
+    log_uuid = response.json()["log_uuid"]
+    response = await client.post(
+        "/api/cli/unit/connect",
+        json={"unit_log_uuid": log_uuid, "run_log_uuid": str(other_run_log_uuid)},
+        headers=cli_headers,
+    )
+    assert response.status_code == 404
+    response = await client.post(
+        "/api/cli/unit/score",
+        json={"unit_log_uuid": other_log_uuid, "scores": {"accuracy": 1}},
+        headers=cli_headers,
+    )
+    assert response.status_code == 404
+    async with get_session_context() as session:
+        connections = (
+            await session.scalars(
+                select(UnitLogRunLog.run_log_uuid).where(
+                    UnitLogRunLog.unit_log_uuid == log_uuid
+                )
+            )
+        ).all()
+        scores = (
+            await session.scalars(
+                select(UnitLogScore.value).where(
+                    UnitLogScore.unit_log_uuid == other_log_uuid
+                )
+            )
+        ).all()
+    assert (connections, scores) == ([], [])
+
+
+async def test_connect_unit_log_to_missing_run_log(client, seeded_project, cli_headers):
+    response = await client.post(
+        "/api/cli/unit/log", json={"name": "unit", "version": 1}, headers=cli_headers
+    )
+    assert response.status_code == 200
+    response = await client.post(
+        "/api/cli/unit/connect",
+        json={
+            "unit_log_uuid": response.json()["log_uuid"],
+            "run_log_uuid": str(uuid.uuid4()),
+        },
+        headers=cli_headers,
+    )
+    assert response.status_code == 404
+
+
+async def test_save_chat_log(client, seeded_project, cli_headers, count_statements):
+    messages = [
+        {"uuid": str(uuid.uuid4()), "message": {"role": "user", "content": "Hi"}},
+        {
+            "uuid": str(uuid.uuid4()),
+            "message": {"role": "assistant", "content": "Hello!"},
+            "api_response": api_response("Hello!"),
+        },
+    ]
+    with count_statements() as statements:
+        response = await client.post(
+            "/api/cli/chat_log",
+            params={"session_uuid": seeded_project["chat_session_uuid"]},
+            json=messages,
+            headers=cli_headers,
+        )
+    assert response.status_code == 200
+    assert_statements("save_chat_log", statements)
+
+
+async def test_save_chat_log_new_session(
+    client, seeded_project, cli_headers, count_statements
+):
+    session_uuid = str(uuid.uuid4())
+    messages = [
+        {"uuid": str(uuid.uuid4()), "message": {"role": "user", "content": "Hi"}},
+        {
+            "uuid": str(uuid.uuid4()),
+            "message": {"role": "assistant", "content": "Hello!"},
+            "api_response": api_response("Hello!"),
+        },
+    ]
+    with count_statements() as statements:
+        response = await client.post(
+            "/api/cli/chat_log",
+            params={
+                "session_uuid": session_uuid,
+                "version_uuid": seeded_project["chat_model_version_uuid"],
+            },
+            json=messages,
+            headers=cli_headers,
+        )
+    assert response.status_code == 200
+    assert_statements("save_chat_log_new_session", statements)
+
+    async with get_session_context() as session:
+        chat_log = (
+            await session.execute(
+                select(ChatLog).where(ChatLog.session_uuid == session_uuid)
+            )
+        ).scalar_one()
+    assert str(chat_log.user_message_uuid) == messages[0]["uuid"]
+    assert str(chat_log.assistant_message_uuid) == messages[1]["uuid"]
+
+
+async def test_fetch_run_logs(client, seeded_project, web_headers, count_statements):
+    with count_statements() as statements:
+        response = await client.get(
+            "/api/web/run_logs/project",
+            params={
+                "project_uuid": seeded_project["project_uuid"],
+                "page": 1,
+                "rows_per_page": 50,
+            },
+            headers=web_headers,
+        )
+    assert response.status_code == 200
+    assert len(response.json()) >= seeded_project["size"]
+    assert_statements("fetch_run_logs", statements)
+
+
+async def test_fetch_function_model_versions_with_user(
+    client, seeded_project, web_headers, count_statements
+):
+    with count_statements() as statements:
+        response = await client.get(
+            "/api/web/function_model_versions",
+            params={"function_model_uuid": seeded_project["function_model_uuid"]},
+            headers=web_headers,
+        )
+    assert response.status_code == 200
+    versions = response.json()
+    assert len(versions) == seeded_project["size"]
+    assert all(version["user"]["email"] for version in versions)
+    assert_statements("fetch_function_model_versions_with_user", statements)
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data: str):
+        self.sent.append(json.loads(data))
+
+
+async def test_sync_code(
+    client, seeded_project, web_headers, count_statements, monkeypatch
+):
+    size = seeded_project["size"]
+    token = seeded_project["cli_access_key"]
+    websocket = RecordingWebSocket()
+    websocket_manager.connected_locals[token] = websocket
+    suffix = uuid.uuid4().hex
+    # every existing instance changed, and as many new ones
+    data = {
+        "type": ServerTask.SYNC_CODE,
+        "correlation_id": suffix,
+        "new_function_model": [f"function_model_{i}" for i in range(size)]
+        + [f"new_function_model_{suffix}_{i}" for i in range(size)],
+        "new_chat_model": ["chat_model"]
+        + [f"new_chat_model_{suffix}_{i}" for i in range(size)],
+        "new_samples": [
+            {"name": f"sample_{i}", "content": {"question": f"changed {i}"}}
+            for i in range(size)
+        ]
+        + [
+            {"name": f"new_sample_{suffix}_{i}", "content": {"question": "new"}}
+            for i in range(size)
+        ],
+        "new_schemas": [
+            {
+                "name": name,
+                "description": f"changed {name}",
+                "parameters": {"type": "object", "properties": {}},
+            }
+            for name in [f"function_schema_{i}" for i in range(size)]
+            + [f"new_function_schema_{suffix}_{i}" for i in range(size)]
+        ],
+    }
+    try:
+        with count_statements() as statements:
+            await websocket_manager.task_handler(token, data)
+
+        with count_statements() as list_statements:
+            response = await client.get(
+                "/api/dev/list_function_models",
+                params={"project_uuid": seeded_project["project_uuid"]},
+                headers=web_headers,
+            )
+
+        async def list_code_function_models(cli_access_key, task):
+            # the CLI lists the deployed function models, marked if they are in its code
+            async with get_session_context() as session:
+                deployed = (
+                    await session.execute(
+                        select(FunctionModel.uuid, FunctionModel.name).where(
+                            FunctionModel.project_uuid
+                            == seeded_project["project_uuid"]
+                        )
+                    )
+                ).all()
+            return {
+                "correlation_id": suffix,
+                "function_models": [
+                    {
+                        "uuid": str(function_model_uuid),
+                        "name": name,
+                        "used_in_code": name in data["new_function_model"],
+                        "is_deployed": True,
+                    }
+                    for function_model_uuid, name in deployed
+                ],
+            }
+
+        monkeypatch.setattr(websocket_manager, "request", list_code_function_models)
+        refreshed = await client.get(
+            "/api/dev/list_function_models",
+            params={"project_uuid": seeded_project["project_uuid"], "refresh": True},
+            headers=web_headers,
+        )
+    finally:
+        websocket_manager.connected_locals.pop(token, None)
+        websocket_manager.connected_projects.pop(token, None)
+
+    assert websocket.sent == [
+        {"type": "SYNC_CODE", "status": "completed", "correlation_id": suffix}
+    ]
+    assert_statements("sync_code", statements)
+    assert response.status_code == 200
+    assert response.json()["synced_at"]
+    assert_statements("list_function_models", list_statements)
+    # same items as requested from the CLI
+    assert refreshed.status_code == 200
+    by_name = lambda items: sorted(items, key=lambda item: item["name"])
+    assert by_name(response.json()["function_models"]) == by_name(
+        refreshed.json()["function_models"]
+    )
+    assert {
+        item["name"] for item in response.json()["function_models"]
+    } >= set(data["new_function_model"])
+
+
+class FakeRouter:
+    def __init__(self, content: str):
+        self.content = content
+        self.calls = 0
+
+    async def acompletion(self, model, messages):
+        from litellm import ModelResponse
+
+        self.calls += 1
+        return ModelResponse(**api_response(self.content))
+
+
+async def seed_batch_run(project_uuid, version_uuid, ground_truths):
+    """A running batch run of version_uuid over a new dataset, one sample input per
+    ground truth. Returns the batch run, dataset, sample input & metric uuids."""
+    from db_models import BatchRun, Dataset, DatasetSampleInput, SampleInput
+
+    batch_run_uuid = uuid.uuid4()
+    sample_input_uuids = [uuid.uuid4() for _ in ground_truths]
+    async with get_session_context() as session:
+        metric = (
+            await session.execute(
+                select(EvalMetric)
+                .where(EvalMetric.project_uuid == project_uuid)
+                .where(EvalMetric.name == "gt_exact_match")
+            )
+        ).scalar_one_or_none()
+        if metric is None:
+            metric = EvalMetric(
+                uuid=uuid.uuid4(), project_uuid=project_uuid, name="gt_exact_match"
+            )
+            session.add(metric)
+            await session.flush()
+        dataset = Dataset(
+            uuid=uuid.uuid4(),
+            name=f"dataset_{batch_run_uuid.hex}",
+            project_uuid=project_uuid,
+            eval_metric_uuid=metric.uuid,
+        )
+        session.add_all(
+            [dataset]
+            + [
+                SampleInput(
+                    uuid=sample_input_uuid,
+                    content={"question": f"batch {i}"},
+                    input_keys=["question"],
+                    ground_truth=ground_truth,
+                    project_uuid=project_uuid,
+                )
+                for i, (sample_input_uuid, ground_truth) in enumerate(
+                    zip(sample_input_uuids, ground_truths)
+                )
+            ]
+        )
+        await session.flush()
+        session.add_all(
+            [
+                DatasetSampleInput(
+                    dataset_uuid=dataset.uuid, sample_input_uuid=sample_input_uuid
+                )
+                for sample_input_uuid in sample_input_uuids
+            ]
+            + [
+                BatchRun(
+                    uuid=batch_run_uuid,
+                    dataset_uuid=dataset.uuid,
+                    function_model_version_uuid=version_uuid,
+                    status="running",
+                )
+            ]
+        )
+        await session.commit()
+    return batch_run_uuid, dataset.uuid, sample_input_uuids, metric.uuid
+
+
+async def test_batch_run_resumes_from_checkpoints(seeded_project, monkeypatch):
+    from types import SimpleNamespace
+
+    from api.common.models import FunctionModelBatchRunConfig
+    from api.web.models.organization import LLMProviderArgs
+    from api.web.routers import web_batch
+    from db_models import BatchRun
+
+    project_uuid = seeded_project["project_uuid"]
+    version_uuid = seeded_project["function_model_version_uuid"]
+    batch_run_uuid, dataset_uuid, sample_input_uuids, metric_uuid = await seed_batch_run(
+        project_uuid, version_uuid, ["answer", "answer", "other"]
+    )
+    async with get_session_context() as session:
+        # the first sample input was run before the batch run was interrupted
+        checkpoint_uuid = uuid.uuid4()
+        session.add(
+            RunLog(
+                uuid=checkpoint_uuid,
+                inputs={"question": "batch 0"},
+                raw_output="answer",
+                run_from_deployment=False,
+                version_uuid=version_uuid,
+                project_uuid=project_uuid,
+                batch_run_uuid=batch_run_uuid,
+                sample_input_uuid=sample_input_uuids[0],
+            )
+        )
+        await session.flush()
+        session.add(
+            RunLogScore(run_log_uuid=checkpoint_uuid, eval_metric_uuid=metric_uuid, value=1)
+        )
+        await session.commit()
+
+    router = FakeRouter("answer")
+
+    async def get_client(session, organization_id, provider):
+        return SimpleNamespace(
+            router=lambda model: router, params={}, provider_args=LLMProviderArgs()
+        )
+
+    monkeypatch.setattr(web_batch.llm_client_pool, "get", get_client)
+    batch_run_config = FunctionModelBatchRunConfig(
+        project_uuid=project_uuid,
+        function_model_version_uuid=version_uuid,
+        dataset_uuid=str(dataset_uuid),
+        use_cache=False,
+    )
+    await web_batch.function_model_batch_run_background_task(
+        batch_run_config, str(batch_run_uuid)
+    )
+    resumed_calls = router.calls
+    # a job claimed by another worker while it still runs, run twice at once
+    async with get_session_context() as session:
+        await session.execute(
+            delete(RunLog)
+            .where(RunLog.batch_run_uuid == batch_run_uuid)
+            .where(RunLog.sample_input_uuid != sample_input_uuids[0])
+        )
+        await session.commit()
+    await asyncio.gather(
+        *[
+            web_batch.function_model_batch_run_background_task(
+                batch_run_config, str(batch_run_uuid)
+            )
+            for _ in range(2)
+        ]
+    )
+
+    async with get_session_context() as session:
+        batch_run = (
+            await session.execute(select(BatchRun).where(BatchRun.uuid == batch_run_uuid))
+        ).scalar_one()
+        run_logs = (
+            (
+                await session.execute(
+                    select(RunLog).where(RunLog.batch_run_uuid == batch_run_uuid)
+                )
+            )
+            .scalars()
+            .all()
+        )
+
+    # only the sample inputs not run yet
+    assert resumed_calls == 2
+    # one checkpoint per sample input
+    assert sorted(run_log.sample_input_uuid for run_log in run_logs) == sorted(
+        sample_input_uuids
+    )
+    assert batch_run.status == "completed"
+    assert batch_run.score == pytest.approx(2 / 3)
+
+
+async def test_cloud_and_batch_runs_share_no_cache_entries(
+    seeded_project, monkeypatch, tmp_path
+):
+    from types import SimpleNamespace
+
+    from litellm import ModelResponse
+    from promptmodel.types.response import LLMStreamResponse
+
+    import modules.llm_cache
+    from api.common.models import FunctionModelBatchRunConfig, FunctionModelRunConfig
+    from api.web.models.organization import LLMProviderArgs
+    from api.web.routers import web, web_batch
+    from modules.llm_cache import DiskLLMResponseCache
+
+    project_uuid = seeded_project["project_uuid"]
+    version_uuid = seeded_project["function_model_version_uuid"]
+    cache = DiskLLMResponseCache(ttl=3600, max_bytes=1024 * 1024, directory=str(tmp_path))
+    for module in (modules.llm_cache, web, web_batch):
+        monkeypatch.setattr(module, "llm_response_cache", cache)
+
+    router = FakeRouter("answer")
+
+    async def get_client(session, organization_id, provider):
+        return SimpleNamespace(
+            router=lambda model: router, params={}, provider_args=LLMProviderArgs()
+        )
+
+    class FakeLLMDev:
+        calls = 0
+
+        async def dev_run(self, **kwargs):
+            FakeLLMDev.calls += 1
+            yield LLMStreamResponse(raw_output="answer")
+            yield LLMStreamResponse(api_response=ModelResponse(**api_response("answer")))
+
+    async def run_batch():
+        batch_run_uuid, dataset_uuid, _, _ = await seed_batch_run(
+            project_uuid, version_uuid, ["answer"]
+        )
+        await web_batch.function_model_batch_run_background_task(
+            FunctionModelBatchRunConfig(
+                project_uuid=project_uuid,
+                function_model_version_uuid=version_uuid,
+                dataset_uuid=str(dataset_uuid),
+            ),
+            str(batch_run_uuid),
+        )
+        async with get_session_context() as session:
+            return (
+                await session.execute(
+                    select(RunLog.raw_output).where(RunLog.batch_run_uuid == batch_run_uuid)
+                )
+            ).scalar_one()
+
+    async def run_cloud():
+        # the same messages as the batch run of the version (its prompts have no inputs)
+        run_config = FunctionModelRunConfig(
+            prompts=[
+                {"role": role, "step": step, "content": f"{role} prompt"}
+                for step, role in enumerate(["system", "user"], start=1)
+            ],
+            model="gpt-3.5-turbo",
+        )
+        return [
+            chunk
+            async for chunk in web.run_cloud_function_model(
+                project_uuid, run_config, LLMProviderArgs(), llm_dev=FakeLLMDev()
+            )
+        ]
+
+    monkeypatch.setattr(web_batch.llm_client_pool, "get", get_client)
+    # a batch run caches its response, a cloud run of the same request doesn't read it
+    assert await run_batch() == "answer"
+    cloud_chunks = await run_cloud()
+    assert cloud_chunks[-1] == {"status": "completed"}
+    assert {"status": "running", "raw_output": "answer"} in cloud_chunks
+    assert (router.calls, FakeLLMDev.calls) == (1, 1)
+    # each reads its own entry
+    assert await run_batch() == "answer"
+    assert {"status": "running", "raw_output": "answer"} in await run_cloud()
+    assert (router.calls, FakeLLMDev.calls) == (1, 1)
+
+
+def checked_out_connections() -> int:
+    from base.database import engine
+
+    return engine.sync_engine.pool.checkedout()
+
+
+STREAM_BODIES = {
+    "function_model": {
+        "prompts": [{"role": "user", "step": 1, "content": "Hi"}],
+        "model": "gpt-3.5-turbo",
+    },
+    "chat_model": {
+        "chat_model_uuid": str(uuid.uuid4()),
+        "system_prompt": "You are a helpful assistant.",
+        "user_input": "Hi",
+        "model": "gpt-3.5-turbo",
+    },
+}
+
+
+@pytest.mark.parametrize(
+    "path, module, generator, body",
+    [
+        (
+            "/api/web/run_function_model",
+            "api.web.routers.web",
+            "run_cloud_function_model",
+            "function_model",
+        ),
+        (
+            "/api/web/run_chat_model",
+            "api.web.routers.web",
+            "run_cloud_chat_model",
+            "chat_model",
+        ),
+        (
+            "/api/dev/run_function_model",
+            "api.dev.routers.dev",
+            "run_local_function_model_generator",
+            "function_model",
+        ),
+        (
+            "/api/dev/run_chat_model",
+            "api.dev.routers.dev_chat",
+            "run_local_chat_model_generator",
+            "chat_model",
+        ),
+    ],
+)
+async def test_stream_releases_request_session(
+    client, seeded_project, web_headers, monkeypatch, path, module, generator, body
+):
+    from types import SimpleNamespace
+    from importlib import import_module
+
+    from api.web.models.organization import LLMProviderArgs
+
+    router_module = import_module(module)
+    connections_at_first_chunk = []
+
+    async def stream(*args, **kwargs):
+        connections_at_first_chunk.append(checked_out_connections())
+        yield json.dumps({"status": "completed"})
+
+    async def get_client(session, organization_id, provider):
+        return SimpleNamespace(
+            provider_args=LLMProviderArgs(), llm_dev=None, params={}
+        )
+
+    monkeypatch.setattr(router_module, generator, stream)
+    if hasattr(router_module, "llm_client_pool"):
+        monkeypatch.setattr(router_module.llm_client_pool, "get", get_client)
+    response = await client.post(
+        path,
+        params={"project_uuid": seeded_project["project_uuid"]},
+        json=STREAM_BODIES[body],
+        headers=web_headers,
+    )
+
+    assert response.status_code == 200
+    assert "completed" in response.text
+    # the request session was closed before streaming
+    assert connections_at_first_chunk == [0]
+
+
+async def test_local_generators_release_sessions_before_streaming(
+    seeded_project, monkeypatch
+):
+    from datetime import datetime, timezone
+
+    from api.common.models import ChatModelRunConfig, FunctionModelRunConfig
+    from db_models import ChatModelVersion
+    from modules.websocket import run_model_generators
+
+    async def stream(cli_access_key, task, message):
+        # the local's response is streamed with no DB connection held
+        connections_while_streaming.append(checked_out_connections())
+        yield {"status": "failed", "log": "stopped by the test"}
+
+    monkeypatch.setattr(run_model_generators.websocket_manager, "stream", stream)
+    async with get_session_context() as session:
+        chat_model_uuid = (
+            await session.execute(
+                select(ChatModelVersion.chat_model_uuid).where(
+                    ChatModelVersion.uuid == seeded_project["chat_model_version_uuid"]
+                )
+            )
+        ).scalar_one()
+    project = {"uuid": seeded_project["project_uuid"], "version": 1}
+    generators = [
+        run_model_generators.run_local_function_model_generator(
+            project,
+            seeded_project["cli_access_key"],
+            FunctionModelRunConfig(
+                prompts=[{"role": "user", "step": 1, "content": "Hi"}],
+                functions=["function_schema_0"],
+            ),
+        ),
+        run_model_generators.run_local_chat_model_generator(
+            project,
+            datetime.now(timezone.utc),
+            seeded_project["cli_access_key"],
+            ChatModelRunConfig(
+                chat_model_uuid=str(chat_model_uuid),
+                system_prompt="You are a helpful assistant.",
+                user_input="Hi",
+                version_uuid=seeded_project["chat_model_version_uuid"],
+                session_uuid=seeded_project["chat_session_uuid"],
+            ),
+        ),
+    ]
+    for generator in generators:
+        connections_at_chunks = []
+        connections_while_streaming = []
+        async for chunk in generator:
+            connections_at_chunks.append(checked_out_connections())
+        assert connections_while_streaming == [0]
+        assert set(connections_at_chunks) == {0}
+
+
+async def run_new_chat(seeded_project, monkeypatch, runner, outcome):
+    """Chunks of a chat run creating a version & session, that completes, fails or is
+    closed by the client after its first chunk."""
+    from datetime import datetime, timezone
+
+    from promptmodel.types.response import LLMStreamResponse
+
+    from api.common.models import ChatModelRunConfig
+    from api.web.models.organization import LLMProviderArgs
+    from api.web.routers import web
+    from db_models import ChatModelVersion
+    from modules.types import LocalTaskErrorType
+    from modules.websocket import run_model_generators
+
+    class FakeLLMDev:
+        async def dev_chat(self, **kwargs):
+            if outcome == "failed":
+                raise ValueError("provider error")
+            yield LLMStreamResponse(raw_output="Hello")
+
+    async def stream(cli_access_key, task, message):
+        yield {"status": "running", "raw_output": "Hello"}
+        if outcome == "failed":
+            yield {
+                "status": "failed",
+                "error_type": LocalTaskErrorType.SERVICE_ERROR.value,
+                "log": "local error",
+            }
+        else:
+            yield {"status": "completed"}
+
+    monkeypatch.setattr(run_model_generators.websocket_manager, "stream", stream)
+    async with get_session_context() as session:
+        chat_model_uuid = (
+            await session.execute(
+                select(ChatModelVersion.chat_model_uuid).where(
+                    ChatModelVersion.uuid == seeded_project["chat_model_version_uuid"]
+                )
+            )
+        ).scalar_one()
+    chat_config = ChatModelRunConfig(
+        chat_model_uuid=str(chat_model_uuid),
+        system_prompt="You are a helpful assistant.",
+        user_input="Hi",
+        from_version=1,
+    )
+    if runner == "cloud":
+        generator = web.run_cloud_chat_model(
+            seeded_project["project_uuid"],
+            chat_config,
+            LLMProviderArgs(),
+            llm_dev=FakeLLMDev(),
+        )
+    else:
+        generator = run_model_generators.run_local_chat_model_generator(
+            {"uuid": seeded_project["project_uuid"], "version": 1},
+            datetime.now(timezone.utc),
+            seeded_project["cli_access_key"],
+            chat_config,
+        )
+
+    chunks = []
+    try:
+        async for chunk in generator:
+            chunks.append(json.loads(chunk) if isinstance(chunk, str) else chunk)
+            if outcome == "closed" and "chat_session_uuid" in chunks[-1]:
+                await generator.aclose()
+                break
+    except ValueError:
+        pass
+    return chunks
+
+
+@pytest.mark.parametrize("runner", ["cloud", "local"])
+@pytest.mark.parametrize("outcome", ["completed", "failed", "closed"])
+async def test_chat_run_saves_new_version_only_if_it_succeeds(
+    seeded_project, monkeypatch, runner, outcome
+):
+    from db_models import ChatModelVersion, ChatSession, ProjectChangelog
+
+    chunks = await run_new_chat(seeded_project, monkeypatch, runner, outcome)
+    version_uuid = next(
+        chunk["chat_model_version_uuid"]
+        for chunk in chunks
+        if "chat_model_version_uuid" in chunk
+    )
+    session_uuid = next(
+        chunk["chat_session_uuid"] for chunk in chunks if "chat_session_uuid" in chunk
+    )
+
+    async with get_session_context() as session:
+        versions = (
+            await session.execute(
+                select(ChatModelVersion.uuid).where(ChatModelVersion.uuid == version_uuid)
+            )
+        ).all()
+        sessions = (
+            await session.execute(
+                select(ChatSession.uuid).where(ChatSession.uuid == session_uuid)
+            )
+        ).all()
+        changelogs = (
+            await session.execute(
+                select(ProjectChangelog.logs).where(
+                    ProjectChangelog.project_uuid == seeded_project["project_uuid"]
+                )
+            )
+        ).scalars().all()
+    changed = [
+        log
+        for logs in changelogs
+        for log in logs
+        if version_uuid in log.get("identifier", [])
+    ]
+
+    saved = outcome == "completed"
+    assert (len(versions), len(sessions)) == ((1, 1) if saved else (0, 0))
+    # the version is logged in the project changelog only if it was saved
+    assert len(changed) == (1 if saved else 0)
+
+
+async def test_upload_jsonl_with_number_columns(client, seeded_project, web_headers):
+    from db_models import DatasetSampleInput, SampleInput
+
+    _, dataset_uuid, _, _ = await seed_batch_run(
+        seeded_project["project_uuid"],
+        seeded_project["function_model_version_uuid"],
+        ["answer"],
+    )
+    data = '{"name": 1, "question": "What?", "ground_truth": 42}\n{"question": "Why?"}\n'
+    response = await client.post(
+        f"/api/web/sample_inputs/dataset/{dataset_uuid}/upload",
+        files={"file": ("samples.jsonl", data.encode(), "application/x-ndjson")},
+        headers=web_headers,
+    )
+
+    # the progress chunks end with the result
+    assert response.text.endswith(json.dumps({"status": "completed", "count": 2}))
+    async with get_session_context() as session:
+        uploaded = (
+            await session.execute(
+                select(SampleInput.name, SampleInput.ground_truth)
+                .join(
+                    DatasetSampleInput,
+                    DatasetSampleInput.sample_input_uuid == SampleInput.uuid,
+                )
+                .where(DatasetSampleInput.dataset_uuid == dataset_uuid)
+                .where(SampleInput.content["question"].astext.in_(["What?", "Why?"]))
+            )
+        ).all()
+    assert sorted(uploaded, key=str) == sorted([("1", "42"), (None, None)], key=str)
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from base.metrics import PrometheusMiddleware
+
+
+def make_app() -> FastAPI:
+    inner = APIRouter()
+
+    @inner.get("/items/{item_id}")
+    def stream_item(item_id: str):
+        def chunks():
+            yield "a"
+            yield "b"
+
+        return StreamingResponse(chunks())
+
+    outer = APIRouter()
+    outer.include_router(inner, prefix="/v1")
+    app = FastAPI()
+    app.include_router(outer, prefix="/metrics_test")
+    app.add_middleware(PrometheusMiddleware)
+    return app
+
+
+def test_streaming_request_is_labeled_by_route_template():
+    route = "/metrics_test/v1/items/{item_id}"
+    labels = {"method": "GET", "route": route, "status": "200"}
+    before = (
+        REGISTRY.get_sample_value("http_request_duration_seconds_count", labels) or 0
+    )
+
+    client = TestClient(make_app())
+    assert client.get("/metrics_test/v1/items/1").text == "ab"
+    assert client.get("/metrics_test/v1/items/2").text == "ab"
+
+    assert (
+        REGISTRY.get_sample_value("http_request_duration_seconds_count", labels)
+        == before + 2
+    )
+    assert (
+        REGISTRY.get_sample_value("streaming_responses_active", {"route": route})
+        == 0
+    )
+    assert (
+        REGISTRY.get_sample_value("db_queries_per_request_count", {"route": route})
+        == 2
+    )
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from base.query_profiler import (
+    QueryProfiler,
+    RequestQueryLog,
+    query_profiler_auth,
+    statement_shape,
+)
+
+
+def test_statement_shape_ignores_values():
+    assert statement_shape(
+        "SELECT users.id FROM users\n  WHERE users.id = $1"
+    ) == statement_shape("SELECT users.id FROM users WHERE users.id = $2")
+    assert statement_shape(
+        "SELECT * FROM run_log WHERE uuid IN ($1, $2, $3) LIMIT 10"
+    ) == statement_shape("SELECT * FROM run_log WHERE uuid IN ($1) LIMIT 20")
+
+
+def test_n_plus_one_and_slow_queries_are_flagged():
+    profiler = QueryProfiler(slow_query_ms=50, n_plus_one_threshold=3)
+    query_log = RequestQueryLog()
+    query_log.statements.append(("SELECT * FROM function_model_version", 0.06))
+    for i in range(5):
+        query_log.statements.append((f"SELECT * FROM users WHERE id = ${i + 1}", 0.001))
+
+    profiler.record("/versions", query_log)
+    report = profiler.report()
+
+    assert report["/versions"]["requests"] == 1
+    worst, second = report["/versions"]["shapes"]
+    assert worst["shape"] == "SELECT * FROM users WHERE id = ?"
+    assert worst["executions"] == 5
+    assert worst["n_plus_one_requests"] == 1
+    assert second["slow_executions"] == 1
+    assert second["n_plus_one_requests"] == 0
+
+
+def test_query_profile_requires_token():
+    check = query_profiler_auth("secret")
+
+    asyncio.run(check("Bearer secret"))
+    for authorization in [None, "", "secret", "Bearer other", "Bearer "]:
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(check(authorization))
+        assert error.value.status_code == 401
@@ -0,0 +1,136 @@
+import json
+import asyncio
+
+from base.websocket_connection import ConnectionManager, ServerTask
+
+
+class FakeWebSocket:
+    def __init__(self, messages):
+        self.messages = asyncio.Queue()
+        for message in messages:
+            self.messages.put_nowait(json.dumps(message))
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        message = await self.messages.get()
+        if message is None:
+            raise RuntimeError("closed")
+        return message
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def manager_with_local(monkeypatch, token, websocket, handled, release):
+    manager = ConnectionManager()
+
+    async def set_local_online_status(token, online):
+        pass
+
+    async def task_handler(token, data):
+        handled.append(data["correlation_id"])
+        await release.wait()
+
+    monkeypatch.setattr(manager, "_set_local_online_status", set_local_online_status)
+    monkeypatch.setattr(manager, "task_handler", task_handler)
+    manager.connected_locals[token] = websocket
+    manager._start_server_task_worker(token)
+    return manager
+
+
+def test_server_task_does_not_block_responses(monkeypatch):
+    async def run():
+        handled = []
+        release = asyncio.Event()
+        websocket = FakeWebSocket(
+            [
+                {"type": ServerTask.SYNC_CODE, "correlation_id": "sync"},
+                {"correlation_id": "request", "status": "completed"},
+            ]
+        )
+        manager = manager_with_local(monkeypatch, "token", websocket, handled, release)
+        manager.pending_requests["request"] = asyncio.Event()
+        reader = asyncio.create_task(manager.websocket_reader(websocket, "token"))
+
+        # the response is routed while SYNC_CODE is still running
+        await asyncio.wait_for(manager.pending_requests["request"].wait(), timeout=1)
+        assert handled == ["sync"]
+        assert (await manager.responses["request"].get())["status"] == "completed"
+
+        release.set()
+        websocket.messages.put_nowait(None)
+        await reader
+        assert "token" not in manager.server_task_workers
+
+    asyncio.run(run())
+
+
+def test_server_tasks_run_in_order_and_are_bounded(monkeypatch):
+    monkeypatch.setattr(
+        "base.websocket_connection.WEBSOCKET_SERVER_TASK_QUEUE_SIZE", 2
+    )
+
+    async def run():
+        handled = []
+        release = asyncio.Event()
+        websocket = FakeWebSocket([])
+        manager = manager_with_local(monkeypatch, "token", websocket, handled, release)
+        reader = asyncio.create_task(manager.websocket_reader(websocket, "token"))
+        for index in range(4):
+            websocket.messages.put_nowait(
+                json.dumps({"type": ServerTask.SYNC_CODE, "correlation_id": str(index)})
+            )
+            while index == 0 and not handled:
+                await asyncio.sleep(0.01)
+        while websocket.messages.qsize() or not websocket.sent:
+            await asyncio.sleep(0.01)
+
+        # 0 is running, 1 & 2 are queued, 3 is rejected
+        assert websocket.sent == [
+            {
+                "type": ServerTask.SYNC_CODE,
+                "status": "failed",
+                "correlation_id": "3",
+                "log": "Too many tasks queued",
+            }
+        ]
+        release.set()
+        await asyncio.wait_for(manager.server_task_queues["token"].join(), timeout=1)
+        assert handled == ["0", "1", "2"]
+
+        websocket.messages.put_nowait(None)
+        await reader
+
+    asyncio.run(run())
+
+
+def test_reconnect_keeps_server_task_worker(monkeypatch):
+    async def run():
+        handled = []
+        release = asyncio.Event()
+        release.set()
+        old_websocket, new_websocket = FakeWebSocket([]), FakeWebSocket([])
+        manager = manager_with_local(monkeypatch, "token", old_websocket, handled, release)
+        old_reader = asyncio.create_task(manager.websocket_reader(old_websocket, "token"))
+        # the local reconnects with the same token before its old connection closed
+        new_reader = await manager.connect(new_websocket, "token")
+        old_websocket.messages.put_nowait(None)
+        await old_reader
+
+        assert manager.connected_locals["token"] is new_websocket
+        new_websocket.messages.put_nowait(
+            json.dumps({"type": ServerTask.SYNC_CODE, "correlation_id": "sync"})
+        )
+        while not handled:
+            await asyncio.sleep(0.01)
+        assert handled == ["sync"]
+
+        new_websocket.messages.put_nowait(None)
+        await new_reader
+        assert "token" not in manager.connected_locals
+        assert "token" not in manager.server_task_workers
+
+    asyncio.run(run())
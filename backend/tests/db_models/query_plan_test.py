@@ -0,0 +1,217 @@
+"""EXPLAIN-based regression tests of hot queries.
+
+Each query is planned with sequential scans disabled. The planner still picks a
+sequential scan if no index can serve the query, so the result depends on the indexes
+and not on how much data is seeded. Likewise, queries whose order should come from an
+index are planned with sorts disabled, and must not need a Sort.
+
+Runs against the Postgres configured by the POSTGRES_* env vars, migrated to head.
+Opt in with QUERY_PLAN_TESTS=true.
+"""
+import os
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import asc, desc, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import Select
+
+from base.database import engine, get_session_context
+from db_models import *
+
+pytestmark = [
+    pytest.mark.skipif(
+        os.environ.get("QUERY_PLAN_TESTS", "false").lower() != "true",
+        reason="set QUERY_PLAN_TESTS=true to run query plan tests against Postgres",
+    ),
+    pytest.mark.asyncio(loop_scope="session"),
+]
+
+INDEX_SCANS = {"Index Scan", "Index Only Scan", "Bitmap Heap Scan"}
+
+PROJECT_UUID = uuid.uuid4()
+FUNCTION_MODEL_UUID = uuid.uuid4()
+VERSION_UUID = uuid.uuid4()
+BATCH_RUN_UUID = uuid.uuid4()
+SESSION_UUID = uuid.uuid4()
+
+
+class HotQuery(NamedTuple):
+    statement: Callable[[], Select]
+    # tables that must be read through an index
+    tables: List[str]
+    # the index must provide ORDER BY
+    ordered: bool = False
+    # where another index matches on non-leading columns only, the index that must be used
+    index: Optional[str] = None
+
+
+HOT_QUERIES: Dict[str, HotQuery] = {
+    "project_by_api_key": HotQuery(
+        lambda: select(Project).where(Project.api_key == "api_key"), ["project"]
+    ),
+    "project_by_cli_access_key": HotQuery(
+        lambda: select(Project.cli_access_key, Project.version, Project.uuid).where(
+            Project.cli_access_key == "cli_access_key"
+        ),
+        ["project"],
+    ),
+    "function_model_by_name": HotQuery(
+        lambda: select(FunctionModel)
+        .where(FunctionModel.project_uuid == PROJECT_UUID)
+        .where(FunctionModel.name == "function_model"),
+        ["function_model"],
+    ),
+    "function_model_versions": HotQuery(
+        lambda: select(FunctionModelVersion)
+        .where(FunctionModelVersion.function_model_uuid == FUNCTION_MODEL_UUID)
+        .order_by(desc(FunctionModelVersion.version)),
+        ["function_model_version"],
+        ordered=True,
+    ),
+    "prompts_of_version": HotQuery(
+        lambda: select(Prompt)
+        .where(Prompt.version_uuid == VERSION_UUID)
+        .order_by(asc(Prompt.step)),
+        ["prompt"],
+        ordered=True,
+    ),
+    "run_logs_of_version": HotQuery(
+        lambda: select(RunLog)
+        .where(RunLog.version_uuid == VERSION_UUID)
+        .order_by(desc(RunLog.created_at)),
+        ["run_log"],
+        ordered=True,
+    ),
+    "run_logs_of_project": HotQuery(
+        lambda: select(RunLog)
+        .where(RunLog.project_uuid == PROJECT_UUID)
+        .order_by(desc(RunLog.created_at))
+        .limit(50),
+        ["run_log"],
+        ordered=True,
+    ),
+    "run_logs_of_batch_run": HotQuery(
+        lambda: select(RunLog)
+        .where(RunLog.batch_run_uuid == BATCH_RUN_UUID)
+        .order_by(desc(RunLog.created_at)),
+        ["run_log"],
+    ),
+    "deployment_run_log_view": HotQuery(
+        lambda: select(DeploymentRunLogView)
+        .where(DeploymentRunLogView.project_uuid == PROJECT_UUID)
+        .order_by(desc(DeploymentRunLogView.created_at))
+        .limit(50),
+        ["run_log", "function_model_version", "function_model"],
+    ),
+    "run_logs_count": HotQuery(
+        lambda: select(RunLogsCount.run_logs_count).where(
+            RunLogsCount.project_uuid == PROJECT_UUID
+        ),
+        ["run_log", "function_model_version", "function_model"],
+    ),
+    "chat_history": HotQuery(
+        lambda: select(
+            ChatMessage.role,
+            ChatMessage.name,
+            ChatMessage.content,
+            ChatMessage.tool_calls,
+            ChatMessage.function_call,
+        )
+        .where(ChatMessage.session_uuid == SESSION_UUID)
+        .order_by(asc(ChatMessage.created_at)),
+        ["chat_message"],
+        ordered=True,
+    ),
+    "last_user_message": HotQuery(
+        lambda: select(ChatMessage)
+        .where(ChatMessage.session_uuid == SESSION_UUID)
+        .where(ChatMessage.role.in_(["user", "function"]))
+        .order_by(desc(ChatMessage.created_at))
+        .limit(1),
+        ["chat_message"],
+        ordered=True,
+    ),
+    "chat_logs_count": HotQuery(
+        lambda: select(ChatLogsCount.chat_logs_count).where(
+            ChatLogsCount.project_uuid == PROJECT_UUID
+        ),
+        ["chat_log"],
+    ),
+    "chat_model_by_name": HotQuery(
+        lambda: select(ChatModel)
+        .where(ChatModel.project_uuid == PROJECT_UUID)
+        .where(ChatModel.name == "chat_model"),
+        ["chat_model"],
+    ),
+    "function_schemas_by_name": HotQuery(
+        lambda: select(
+            FunctionSchema.name,
+            FunctionSchema.description,
+            FunctionSchema.parameters,
+            FunctionSchema.mock_response,
+        )
+        .where(FunctionSchema.project_uuid == PROJECT_UUID)
+        .where(FunctionSchema.name.in_(["get_weather", "search"])),
+        ["function_schema"],
+    ),
+    "eval_metrics_of_function_model": HotQuery(
+        lambda: select(EvalMetric)
+        .where(EvalMetric.function_model_uuid == FUNCTION_MODEL_UUID)
+        .where(EvalMetric.name.in_(["accuracy", "gt_exact_match"])),
+        ["eval_metric"],
+        index="ix_eval_metric_function_model_uuid_name",
+    ),
+}
+
+
+def plan_nodes(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+@pytest_asyncio.fixture(scope="module", loop_scope="session")
+async def explain(migrated_database):
+    async def _explain(statement: Select, ordered: bool = False) -> Dict[str, Any]:
+        sql = statement.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+        async with get_session_context() as session:
+            await session.execute(text("SET LOCAL enable_seqscan = off"))
+            if ordered:
+                await session.execute(text("SET LOCAL enable_sort = off"))
+            result = await session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+            return result.scalar_one()[0]["Plan"]
+
+    yield _explain
+    await engine.dispose()
+
+
+@pytest.mark.parametrize("name", list(HOT_QUERIES))
+async def test_hot_query_uses_indexes(explain, name):
+    query = HOT_QUERIES[name]
+    plan = await explain(query.statement(), query.ordered)
+    nodes = list(plan_nodes(plan))
+
+    scans = [node for node in nodes if node.get("Relation Name") in query.tables]
+    assert {node["Relation Name"] for node in scans} == set(query.tables)
+    for node in scans:
+        assert node["Node Type"] in INDEX_SCANS, (
+            f"{name} reads {node['Relation Name']} with a {node['Node Type']}:\n{plan}"
+        )
+        if node["Node Type"] != "Bitmap Heap Scan":
+            # a full index scan isn't better than a sequential scan
+            assert "Index Cond" in node, (
+                f"{name} scans all of {node['Index Name']}:\n{plan}"
+            )
+    if query.index is not None:
+        assert query.index in {node.get("Index Name") for node in nodes}, (
+            f"{name} doesn't use {query.index}:\n{plan}"
+        )
+    if query.ordered:
+        assert not [node for node in nodes if node["Node Type"] == "Sort"], (
+            f"{name} sorts instead of reading in index order:\n{plan}"
+        )
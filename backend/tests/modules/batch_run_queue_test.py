@@ -0,0 +1,111 @@
+import json
+import asyncio
+
+from modules.batch_run_queue import BatchRunQueue
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def xack(self, stream, group, entry_id):
+        self.redis.acked.append(entry_id)
+
+    def xdel(self, stream, entry_id):
+        pass
+
+    async def execute(self):
+        return []
+
+
+class FakeRedis:
+    """Pending entries with their delivery counts."""
+
+    def __init__(self, times_delivered, owned=()):
+        self.times_delivered = times_delivered
+        self.owned = list(owned)
+        self.acked = []
+
+    async def xpending_range(self, stream, group, min, max, count):
+        return [{"message_id": min, "times_delivered": self.times_delivered}]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def eval(self, script, numkeys, stream, group, consumer, *entry_ids):
+        # RENEW_SCRIPT: entries still pending for the consumer
+        return [entry_id for entry_id in entry_ids if entry_id in self.owned]
+
+
+def run_job(times_delivered, handler):
+    queue = BatchRunQueue(stream="jobs", lease=60, max_attempts=3, concurrency=1)
+    queue.redis = FakeRedis(times_delivered)
+    handled, dropped = [], []
+
+    async def on_dropped(job):
+        dropped.append(job)
+
+    async def run():
+        entry_id = b"1-0"
+        queue.active[entry_id] = asyncio.current_task()
+        await queue._run_job(
+            entry_id,
+            {b"job": json.dumps({"batch_run_uuid": "batch_run"}).encode()},
+            lambda job: handler(job, handled),
+            on_dropped,
+        )
+
+    asyncio.run(run())
+    return queue, handled, dropped
+
+
+async def complete(job, handled):
+    handled.append(job)
+
+
+async def fail(job, handled):
+    handled.append(job)
+    raise ValueError("provider error")
+
+
+def test_batch_run_queue_completes_job():
+    queue, handled, dropped = run_job(1, complete)
+    assert handled == [{"batch_run_uuid": "batch_run"}]
+    assert (queue.redis.acked, dropped, queue.active) == ([b"1-0"], [], {})
+
+
+def test_batch_run_queue_keeps_failed_job_pending():
+    queue, handled, dropped = run_job(2, fail)
+    assert handled == [{"batch_run_uuid": "batch_run"}]
+    # claimed again after its lease
+    assert (queue.redis.acked, dropped, queue.active) == ([], [], {})
+
+
+def test_batch_run_queue_drops_job_after_max_attempts():
+    queue, handled, dropped = run_job(4, complete)
+    assert handled == []
+    assert dropped == [{"batch_run_uuid": "batch_run"}]
+    assert queue.redis.acked == [b"1-0"]
+
+
+def test_batch_run_queue_stops_jobs_claimed_by_another_worker():
+    queue = BatchRunQueue(stream="jobs", lease=60, max_attempts=3, concurrency=2)
+    queue.redis = FakeRedis(1, owned=[b"1-0"])
+
+    async def run():
+        owned = asyncio.create_task(asyncio.sleep(1))
+        lost = asyncio.create_task(asyncio.sleep(1))
+        queue.active = {b"1-0": owned, b"2-0": lost}
+        await queue._renew("worker")
+        await asyncio.sleep(0)
+        cancelled = (owned.cancelled(), lost.cancelled())
+        owned.cancel()
+        return cancelled
+
+    assert asyncio.run(run()) == (False, True)
@@ -0,0 +1,95 @@
+import asyncio
+
+from modules.chat_history import MemoryChatHistoryCache, window_chat_history
+
+
+def message(role, content, token_count=None):
+    return {"role": role, "content": content, "token_count": token_count}
+
+
+HISTORY = [
+    message("user", "a", 10),
+    message("assistant", "b", 20),
+    message("user", "c", 30),
+    message("assistant", None, 5),
+    message("function", "d", 40),
+    message("assistant", "e", 50),
+]
+
+
+def test_window_last_messages():
+    window = asyncio.run(window_chat_history(HISTORY, "gpt-4", max_messages=3))
+    assert window == HISTORY[3:]
+
+    assert asyncio.run(window_chat_history(HISTORY, "gpt-4", max_messages=0)) == []
+    assert asyncio.run(window_chat_history(HISTORY, "gpt-4")) == HISTORY
+
+
+def test_window_token_budget():
+    window = asyncio.run(window_chat_history(HISTORY, "gpt-4", max_tokens=125))
+    assert window == HISTORY[2:]
+
+    # the newest message alone is over budget
+    assert asyncio.run(window_chat_history(HISTORY, "gpt-4", max_tokens=49)) == []
+
+
+def test_window_drops_function_response_without_call():
+    window = asyncio.run(window_chat_history(HISTORY, "gpt-4", max_tokens=90))
+    assert window == HISTORY[5:]
+
+
+def test_window_counts_missing_token_counts():
+    history = [message("user", "hello world " * 10), message("assistant", "hi", 1)]
+
+    window = asyncio.run(window_chat_history(history, "gpt-4", max_tokens=5))
+    assert window == history[1:]
+    window = asyncio.run(window_chat_history(history, "gpt-4", max_tokens=100))
+    assert window == history
+
+
+def test_memory_cache_appends_only_cached_sessions():
+    cache = MemoryChatHistoryCache(ttl=3600, max_sessions=2)
+
+    async def run():
+        await cache.append("uncached", [message("user", "a")])
+        await cache.set("session", HISTORY[:2])
+        await cache.append("session", HISTORY[2:])
+        return (
+            await cache.get("uncached"),
+            await cache.get("session"),
+            await cache.get("session", last=2),
+        )
+
+    uncached, history, last = asyncio.run(run())
+    assert uncached is None
+    assert history == HISTORY
+    assert last == HISTORY[4:]
+
+
+def test_memory_cache_evicts_least_recently_used_sessions():
+    cache = MemoryChatHistoryCache(ttl=3600, max_sessions=2)
+
+    async def run():
+        await cache.set("first", HISTORY[:1])
+        await cache.set("second", HISTORY[:1])
+        await cache.get("first")
+        await cache.set("third", HISTORY[:1])
+        return [await cache.get(key) for key in ["first", "second", "third"]]
+
+    assert asyncio.run(run()) == [HISTORY[:1], None, HISTORY[:1]]
+
+
+def test_cache_append_error_drops_cached_history():
+    class FailingAppendCache(MemoryChatHistoryCache):
+        async def _append(self, session_uuid, messages):
+            raise ConnectionError("store unreachable")
+
+    cache = FailingAppendCache(ttl=60, max_sessions=10)
+
+    async def run():
+        await cache.set("session", HISTORY[:2])
+        # logged, not raised
+        await cache.append("session", HISTORY[2:3])
+        return await cache.get("session")
+
+    assert asyncio.run(run()) is None
@@ -0,0 +1,108 @@
+import asyncio
+
+import modules.code_inventory
+from modules.code_inventory import (
+    MemoryCodeInventoryCache,
+    code_inventory_from_sync,
+    code_inventory_items,
+    get_code_inventory,
+)
+
+SYNC_CODE = {
+    "type": "SYNC_CODE",
+    "new_function_model": ["summarize", "translate"],
+    "new_chat_model": ["assistant"],
+    "new_samples": [{"name": "sample", "content": {"text": "hi"}}],
+    "new_schemas": [{"name": "get_weather", "description": "", "parameters": {}}],
+}
+
+
+def test_code_inventory_from_sync():
+    inventory = code_inventory_from_sync(SYNC_CODE)
+    assert inventory["function_models"] == ["summarize", "translate"]
+    assert inventory["chat_models"] == ["assistant"]
+    assert inventory["functions"] == ["get_weather"]
+    assert inventory["synced_at"]
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def mappings(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    """Deployed instances of the project."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = 0
+
+    async def execute(self, statement):
+        self.statements += 1
+        return FakeResult(self.rows)
+
+
+def test_code_inventory_items():
+    deployed = [
+        {"uuid": "uuid-summarize", "name": "summarize"},
+        {"uuid": "uuid-old", "name": "old"},
+    ]
+    assert code_inventory_items(["summarize", "translate"], deployed) == [
+        {
+            "uuid": "uuid-summarize",
+            "name": "summarize",
+            "used_in_code": True,
+            "is_deployed": True,
+        },
+        {"uuid": "uuid-old", "name": "old", "used_in_code": False, "is_deployed": True},
+        {"uuid": None, "name": "translate", "used_in_code": True, "is_deployed": False},
+    ]
+
+
+def test_get_code_inventory(monkeypatch):
+    cache = MemoryCodeInventoryCache(ttl=60)
+    monkeypatch.setattr(modules.code_inventory, "code_inventory_cache", cache)
+    inventory = code_inventory_from_sync(SYNC_CODE)
+    session = FakeSession([{"uuid": "uuid-assistant", "name": "assistant"}])
+
+    async def run():
+        missing = await get_code_inventory(session, "project", "chat_models")
+        await cache.set("project", inventory)
+        chat_models = await get_code_inventory(session, "project", "chat_models")
+        await cache.delete("project")
+        deleted = await get_code_inventory(session, "project", "chat_models")
+        return missing, chat_models, deleted
+
+    missing, chat_models, deleted = asyncio.run(run())
+    assert missing is None
+    assert chat_models == {
+        "chat_models": [
+            {
+                "uuid": "uuid-assistant",
+                "name": "assistant",
+                "used_in_code": True,
+                "is_deployed": True,
+            }
+        ],
+        "synced_at": inventory["synced_at"],
+    }
+    assert deleted is None
+    # only listings served from a snapshot read the deployed instances
+    assert session.statements == 1
+
+
+def test_memory_cache_expires():
+    cache = MemoryCodeInventoryCache(ttl=0)
+
+    async def run():
+        await cache.set("project", code_inventory_from_sync(SYNC_CODE))
+        await asyncio.sleep(0.01)
+        return await cache.get("project")
+
+    assert asyncio.run(run()) is None
@@ -0,0 +1,50 @@
+import math
+
+import numpy as np
+import litellm
+
+from modules.cost_engine import PriceTable, completion_cost
+
+MODEL_COST = {
+    "model-a": {"input_cost_per_token": 1e-06, "output_cost_per_token": 2e-06},
+    "model-b": {"input_cost_per_token": 3e-06, "output_cost_per_token": 4e-06},
+    "image-model": {"output_cost_per_pixel": 1e-06},
+}
+
+
+def test_single_cost():
+    table = PriceTable(MODEL_COST)
+
+    assert math.isclose(table.cost("model-a", 100, 10), 100 * 1e-06 + 10 * 2e-06)
+    assert math.isclose(table.cost("provider/model-b", 10, None), 10 * 3e-06)
+    assert table.cost("image-model", 10, 10) is None
+    assert table.cost("unknown", 10, 10) is None
+
+
+def test_bulk_costs_match_single_costs():
+    table = PriceTable(MODEL_COST)
+    models = ["model-a", "model-b", "unknown", None, "model-a"]
+    prompt_tokens = [100, 200, 300, 10, None]
+    completion_tokens = [10, 20, 30, 1, 5]
+
+    costs = table.costs(models, prompt_tokens, completion_tokens)
+
+    for model, prompt, completion, cost in zip(
+        models, prompt_tokens, completion_tokens, costs
+    ):
+        expected = table.cost(model, prompt, completion)
+        if expected is None:
+            assert np.isnan(cost)
+        else:
+            assert math.isclose(cost, expected)
+
+
+def test_completion_cost_matches_litellm():
+    response = litellm.ModelResponse(
+        model="gpt-4",
+        usage=litellm.Usage(prompt_tokens=120, completion_tokens=30, total_tokens=150),
+    )
+    assert math.isclose(completion_cost(response), litellm.completion_cost(response))
+    assert math.isclose(
+        completion_cost(response.model_dump()), litellm.completion_cost(response)
+    )
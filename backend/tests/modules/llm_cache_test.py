@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+import modules.llm_cache
+from modules.llm_cache import (
+    DiskLLMResponseCache,
+    make_llm_cache_key,
+    make_run_cache_key,
+    use_llm_cache,
+)
+
+
+def test_cache_key_is_canonical():
+    messages = [{"role": "user", "content": "hi"}]
+    key = make_llm_cache_key("project", model="gpt-4", messages=messages, a=1, b=2)
+
+    assert key == make_llm_cache_key(
+        "project", model="gpt-4", messages=messages, b=2, a=1, c=None
+    )
+    assert key != make_llm_cache_key("other", model="gpt-4", messages=messages, a=1, b=2)
+    assert key != make_llm_cache_key("project", model="gpt-4", messages=messages, a=1)
+
+
+def test_run_cache_key_includes_provider_endpoint():
+    messages = [{"role": "user", "content": "hi"}]
+    provider_args = SimpleNamespace(api_base="https://old", api_version=None)
+    key = make_run_cache_key("project", "batch", "gpt-4", messages, provider_args)
+
+    assert key == make_llm_cache_key(
+        "project", model="gpt-4", messages=messages, kind="batch", api_base="https://old"
+    )
+    provider_args.api_base = "https://new"
+    assert key != make_run_cache_key("project", "batch", "gpt-4", messages, provider_args)
+
+
+def test_run_cache_key_includes_payload_kind():
+    messages = [{"role": "user", "content": "hi"}]
+    provider_args = SimpleNamespace(api_base=None, api_version=None)
+
+    assert make_run_cache_key(
+        "project", "cloud_function", "gpt-4", messages, provider_args
+    ) != make_run_cache_key("project", "batch", "gpt-4", messages, provider_args)
+
+
+def test_use_llm_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(modules.llm_cache, "llm_response_cache", None)
+    assert not use_llm_cache(True)
+
+    monkeypatch.setattr(
+        modules.llm_cache,
+        "llm_response_cache",
+        DiskLLMResponseCache(ttl=3600, max_bytes=100, directory=str(tmp_path)),
+    )
+    assert use_llm_cache(True)
+    assert use_llm_cache(None)
+    assert not use_llm_cache(False)
+
+
+def test_disk_cache_evicts_oldest_entries(tmp_path):
+    cache = DiskLLMResponseCache(ttl=3600, max_bytes=100, directory=str(tmp_path))
+
+    async def run():
+        await cache.set("first", {"value": "x" * 60})
+        await cache.set("second", {"value": "y" * 60})
+        return await cache.get("first"), await cache.get("second")
+
+    first, second = asyncio.run(run())
+    assert first is None
+    assert second == {"value": "y" * 60}
@@ -0,0 +1,81 @@
+import asyncio
+from types import SimpleNamespace
+
+from modules.llm_clients import LLMClientPool, provider_args_from_env_vars
+
+
+class FakeSession:
+    """Returns the config of the provider, counting the queries."""
+
+    def __init__(self, config=None):
+        self.config = config
+        self.queries = 0
+
+    async def execute(self, query):
+        self.queries += 1
+        return SimpleNamespace(scalar_one_or_none=lambda: self.config)
+
+
+def make_config(api_key="key", params=None):
+    return SimpleNamespace(env_vars={"OPENAI_API_KEY": api_key}, params=params)
+
+
+def test_provider_args_from_env_vars():
+    provider_args = provider_args_from_env_vars(
+        {"AZURE_API_KEY": "key", "AZURE_API_BASE": "base", "AZURE_API_VERSION": "v1"}
+    )
+    assert provider_args.model_dump() == {
+        "api_key": "key",
+        "api_base": "base",
+        "api_version": "v1",
+    }
+
+
+def test_llm_client_pool_caches_config():
+    pool = LLMClientPool(max_size=10, config_ttl=60)
+    session = FakeSession(make_config())
+
+    async def run():
+        client = await pool.get(session, "org", "openai")
+        return client, await pool.get(session, "org", "openai")
+
+    client, cached_client = asyncio.run(run())
+    assert client is cached_client
+    assert client.provider_args.api_key == "key"
+    assert session.queries == 1
+    assert client.router("gpt-4o") is client.router("gpt-4o")
+
+
+def test_llm_client_pool_invalidate():
+    pool = LLMClientPool(max_size=10, config_ttl=60)
+    session = FakeSession(make_config())
+
+    async def run():
+        client = await pool.get(session, "org", "openai")
+        # unchanged config, read again
+        pool.configs.clear()
+        same_client = await pool.get(session, "org", "openai")
+        session.config = make_config("new_key")
+        pool.invalidate("org", "openai")
+        return client, same_client, await pool.get(session, "org", "openai")
+
+    client, same_client, new_client = asyncio.run(run())
+    assert client is same_client
+    assert new_client is not client
+    assert new_client.provider_args.api_key == "new_key"
+    assert session.queries == 3
+    assert len(pool.clients) == 1
+
+
+def test_llm_client_pool_not_found_and_eviction():
+    pool = LLMClientPool(max_size=1, config_ttl=60)
+
+    async def run():
+        missing = await pool.get(FakeSession(), "org", "openai")
+        await pool.get(FakeSession(make_config()), "org", "openai")
+        await pool.get(FakeSession(make_config()), "org", "anthropic")
+        return missing
+
+    assert asyncio.run(run()) is None
+    assert [key[:2] for key in pool.clients] == [("org", "anthropic")]
+    assert list(pool.configs) == [("org", "anthropic")]
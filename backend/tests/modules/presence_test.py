@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+import modules.presence
+from modules.presence import MemoryCliPresence, apply_cli_presence
+
+
+def test_memory_presence_connect_disconnect():
+    presence = MemoryCliPresence(ttl=60)
+
+    async def run():
+        await presence.connect("project", "token")
+        # a reconnect with another token takes over the presence
+        await presence.connect("project", "new_token")
+        await presence.disconnect("project", "token")
+        still_online = await presence.is_online("project")
+        await presence.disconnect("project", "new_token")
+        return still_online, await presence.is_online("project")
+
+    assert asyncio.run(run()) == (True, False)
+
+
+def test_memory_presence_expires_without_heartbeat():
+    presence = MemoryCliPresence(ttl=0)
+
+    async def run():
+        await presence.connect("project", "token")
+        await asyncio.sleep(0.01)
+        expired = await presence.online(["project"])
+        # the heartbeat of a connected CLI makes it present again
+        presence.ttl = 60
+        await presence.heartbeat({"project": "token"})
+        return expired, await presence.online(["project", "other"])
+
+    assert asyncio.run(run()) == (set(), {"project"})
+
+
+def test_apply_cli_presence(monkeypatch):
+    presence = MemoryCliPresence(ttl=60)
+    monkeypatch.setattr(modules.presence, "cli_presence", presence)
+    projects = [
+        SimpleNamespace(uuid="online", online=False),
+        SimpleNamespace(uuid="offline", online=True),
+    ]
+    function_models = [
+        SimpleNamespace(project_uuid="online", online=True),
+        SimpleNamespace(project_uuid="online", online=False),
+        SimpleNamespace(project_uuid="offline", online=True),
+    ]
+
+    async def run():
+        await presence.connect("online", "token")
+        await apply_cli_presence(projects, project_uuid_attribute="uuid")
+        await apply_cli_presence(function_models)
+
+    asyncio.run(run())
+    assert [project.online for project in projects] == [True, False]
+    assert [function_model.online for function_model in function_models] == [
+        True,
+        False,
+        False,
+    ]
+
+
+def test_presence_store_errors_read_offline():
+    class UnreachablePresence(MemoryCliPresence):
+        async def _online(self, project_uuids):
+            raise ConnectionError("store unreachable")
+
+    presence = UnreachablePresence(ttl=60)
+
+    async def run():
+        await presence.connect("project", "token")
+        return await presence.online(["project"]), await presence.online(["project"])
+
+    online, again = asyncio.run(run())
+    # a new fallback set per error
+    assert online == set() and online is not again
@@ -0,0 +1,120 @@
+import time
+import asyncio
+
+import pytest
+
+import modules.rate_limiter
+from modules.rate_limiter import (
+    LLMRateLimit,
+    LLMRateLimitTimeout,
+    MemoryLLMRateLimiter,
+    RateLimitLane,
+    llm_rate_limit,
+    take_from_buckets,
+)
+
+
+def test_take_from_buckets_refills_over_time():
+    state = {}
+    # 60 rpm: one request per second
+    assert take_from_buckets(state, 0, rpm=60, tpm=0, tokens=0, reserve=0) == 0
+    state["requests"] = 0
+    assert take_from_buckets(state, 0, rpm=60, tpm=0, tokens=0, reserve=0) == 1
+    assert take_from_buckets(state, 1, rpm=60, tpm=0, tokens=0, reserve=0) == 0
+
+
+def test_take_from_buckets_leaves_reserve():
+    # 600 tpm: 10 tokens per second, batch calls leave 100 tokens
+    state = {}
+    assert take_from_buckets(state, 0, rpm=0, tpm=600, tokens=500, reserve=1 / 6) == 0
+    assert take_from_buckets(state, 0, rpm=0, tpm=600, tokens=50, reserve=1 / 6) == 5
+    # interactive calls use the reserve
+    assert take_from_buckets(state, 0, rpm=0, tpm=600, tokens=50, reserve=0) == 0
+
+
+def test_take_from_buckets_caps_large_calls():
+    state = {}
+    assert take_from_buckets(state, 0, rpm=0, tpm=100, tokens=1000, reserve=0) == 0
+    assert state["tokens"] == 0
+
+
+def test_memory_rate_limiter_interactive_timeout():
+    limiter = MemoryLLMRateLimiter(interactive_reserve=0, max_wait=0.5)
+    limit = LLMRateLimit("org", "openai", rpm=1, tpm=0)
+
+    async def run():
+        await limiter.acquire(limit, 0, RateLimitLane.INTERACTIVE)
+        await limiter.acquire(limit, 0, RateLimitLane.INTERACTIVE)
+
+    with pytest.raises(LLMRateLimitTimeout):
+        asyncio.run(run())
+    assert not limiter.interactive_waiting
+
+
+def test_memory_rate_limiter_interactive_before_batch():
+    limiter = MemoryLLMRateLimiter(interactive_reserve=0, max_wait=5)
+    # one request per 0.1 second
+    limit = LLMRateLimit("org", "openai", rpm=600, tpm=0)
+    limiter.buckets[limit.key] = {"requests": 0, "tokens": 0, "ts": time.monotonic()}
+    order = []
+
+    async def call(name, lane):
+        await limiter.acquire(limit, 0, lane)
+        order.append(name)
+
+    async def run():
+        batch = asyncio.create_task(call("batch", RateLimitLane.BATCH))
+        await asyncio.sleep(0)
+        await call("interactive", RateLimitLane.INTERACTIVE)
+        await batch
+
+    asyncio.run(run())
+    assert order == ["interactive", "batch"]
+
+
+def test_memory_rate_limiter_settle():
+    limiter = MemoryLLMRateLimiter(interactive_reserve=0, max_wait=0)
+    limit = LLMRateLimit("org", "openai", rpm=0, tpm=1000)
+
+    async def run():
+        await limiter.acquire(limit, 100, RateLimitLane.INTERACTIVE)
+        # the call used 300 tokens more than estimated
+        await limiter.settle(limit, 100, 400)
+
+    asyncio.run(run())
+    assert limiter.buckets[limit.key]["tokens"] == 600
+
+
+class FailingLLMRateLimiter(MemoryLLMRateLimiter):
+    async def _take(self, limit, tokens, reserve):
+        raise ConnectionError("limiter unreachable")
+
+    async def _settle(self, limit, extra_tokens):
+        raise ConnectionError("limiter unreachable")
+
+
+def test_rate_limiter_errors_let_calls_through():
+    limiter = FailingLLMRateLimiter(interactive_reserve=0, max_wait=0)
+    limit = LLMRateLimit("org", "openai", rpm=1, tpm=10)
+
+    async def run():
+        await limiter.acquire(limit, 100, RateLimitLane.INTERACTIVE)
+        await limiter.settle(limit, 100, 400)
+
+    asyncio.run(run())
+
+
+def test_llm_rate_limit(monkeypatch):
+    monkeypatch.setattr(modules.rate_limiter, "llm_rate_limiter", None)
+    assert llm_rate_limit("org", "openai", {"rpm": "60"}) is None
+
+    monkeypatch.setattr(
+        modules.rate_limiter,
+        "llm_rate_limiter",
+        MemoryLLMRateLimiter(interactive_reserve=0, max_wait=0),
+    )
+    monkeypatch.setattr(modules.rate_limiter, "LLM_RATE_LIMIT_TPM", 1000)
+    limit = llm_rate_limit("org", "openai", {"rpm": "60"})
+    assert (limit.key, limit.rpm, limit.tpm) == ("org:openai", 60, 1000)
+    monkeypatch.setattr(modules.rate_limiter, "LLM_RATE_LIMIT_TPM", 0)
+    assert llm_rate_limit("org", "openai", {}) is None
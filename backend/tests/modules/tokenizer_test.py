@@ -0,0 +1,46 @@
+import asyncio
+
+from litellm import token_counter
+
+import modules.tokenizer
+from modules.tokenizer import TokenizerService
+
+
+def test_count_tokens_batch_matches_litellm():
+    service = TokenizerService(max_workers=1)
+    texts = ["hello world", "Tokenizers are loaded once per model.", None]
+
+    counts = asyncio.run(service.count_tokens_batch("gpt-4", texts))
+
+    assert counts == [
+        token_counter(model="gpt-4", text=texts[0]),
+        token_counter(model="gpt-4", text=texts[1]),
+        0,
+    ]
+    service.shutdown()
+
+
+def test_tokenizers_are_cached_per_model():
+    service = TokenizerService(max_workers=1)
+    asyncio.run(service.preload(["gpt-4"]))
+
+    assert service.get_tokenizer("gpt-4") is service.get_tokenizer("gpt-4")
+    service.shutdown()
+
+
+def test_litellm_selects_tokenizers_ahead():
+    # private litellm API, without it each count selects (and may load) the tokenizer again
+    assert modules.tokenizer._select_tokenizer is not None, (
+        "litellm.utils._select_tokenizer is gone, update TokenizerService.get_tokenizer"
+    )
+
+
+def test_count_tokens_without_select_tokenizer(monkeypatch):
+    monkeypatch.setattr(modules.tokenizer, "_select_tokenizer", None)
+    service = TokenizerService(max_workers=1)
+
+    assert service.get_tokenizer("gpt-4") is None
+    assert asyncio.run(service.count_tokens("gpt-4", "hello world")) == token_counter(
+        model="gpt-4", text="hello world"
+    )
+    service.shutdown()
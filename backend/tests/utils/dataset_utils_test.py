@@ -0,0 +1,134 @@
+import io
+
+import pytest
+
+from utils.dataset_utils import (
+    detect_sample_input_file_format,
+    iter_sample_input_batches,
+)
+
+
+def parse(data: str, file_format: str, batch_size: int = 1000):
+    return list(
+        iter_sample_input_batches(
+            io.BytesIO(data.encode("utf-8")), file_format, batch_size=batch_size
+        )
+    )
+
+
+def test_detect_sample_input_file_format():
+    assert detect_sample_input_file_format("samples.csv") == "csv"
+    assert detect_sample_input_file_format("samples.JSONL") == "jsonl"
+    assert detect_sample_input_file_format("samples.ndjson") == "jsonl"
+    assert detect_sample_input_file_format("samples.txt") is None
+    assert detect_sample_input_file_format(None) is None
+    # an explicit format wins over the extension
+    assert detect_sample_input_file_format("samples.txt", "CSV") == "csv"
+    assert detect_sample_input_file_format("samples.csv", "xlsx") is None
+
+
+def test_csv_reserved_columns():
+    (batch,) = parse(
+        "name,question,ground_truth\nfirst,What?,Answer\n,Why?,\n", "csv"
+    )
+    assert batch == [
+        {
+            "name": "first",
+            "content": {"question": "What?"},
+            "input_keys": ["question"],
+            "ground_truth": "Answer",
+        },
+        # empty reserved columns are None
+        {
+            "name": None,
+            "content": {"question": "Why?"},
+            "input_keys": ["question"],
+            "ground_truth": None,
+        },
+    ]
+
+
+def test_csv_with_bom():
+    (batch,) = parse("\ufeffquestion,context\nWhat?,Docs\n", "csv")
+    assert batch[0]["content"] == {"question": "What?", "context": "Docs"}
+
+
+def test_csv_rejects_extra_fields():
+    with pytest.raises(ValueError, match="Line 3 has more fields than the header"):
+        parse("question,context\nWhat?,Docs\nWhy?,Docs,extra\n", "csv")
+
+
+def test_jsonl_content_and_input_keys():
+    (batch,) = parse(
+        '{"name": "flat", "question": "What?", "ground_truth": "Answer"}\n'
+        "\n"
+        '{"content": {"question": "Why?", "context": "Docs"}, "input_keys": ["question"]}\n'
+        '{"content": {"question": "How?"}}\n',
+        "jsonl",
+    )
+    assert batch == [
+        {
+            "name": "flat",
+            "content": {"question": "What?"},
+            "input_keys": ["question"],
+            "ground_truth": "Answer",
+        },
+        {
+            "name": None,
+            "content": {"question": "Why?", "context": "Docs"},
+            "input_keys": ["question"],
+            "ground_truth": None,
+        },
+        # input_keys default to the keys of content
+        {
+            "name": None,
+            "content": {"question": "How?"},
+            "input_keys": ["question"],
+            "ground_truth": None,
+        },
+    ]
+
+
+def test_jsonl_with_bom():
+    (batch,) = parse('\ufeff{"question": "What?"}\n', "jsonl")
+    assert batch[0]["content"] == {"question": "What?"}
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        ('{"question": "What?"}\n{"question": \n', "Invalid JSON in line 2"),
+        ('{"question": "What?"}\n["What?"]\n', "Line 2 is not a JSON object"),
+        ('{"name": "only reserved", "ground_truth": "Answer"}\n', "no input variables"),
+    ],
+)
+def test_jsonl_rejects_invalid_lines(data, error):
+    with pytest.raises(ValueError, match=error):
+        parse(data, "jsonl")
+
+
+def test_batches():
+    data = "question\n" + "".join(f"question {i}\n" for i in range(5))
+    batches = parse(data, "csv", batch_size=2)
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert batches[2][0]["content"] == {"question": "question 4"}
+
+
+def test_jsonl_reserved_columns_are_text():
+    (batch,) = parse(
+        '{"name": 1, "question": "What?", "ground_truth": 42}\n'
+        '{"question": "Why?", "ground_truth": 0}\n'
+        '{"content": {"question": "How?"}, "input_keys": ["question"], "ground_truth": true}\n',
+        "jsonl",
+    )
+    # stored as TEXT, a number ground truth is kept as its JSON
+    assert [(row["name"], row["ground_truth"]) for row in batch] == [
+        ("1", "42"),
+        (None, "0"),
+        (None, "true"),
+    ]
+
+
+def test_jsonl_rejects_input_keys_not_list():
+    with pytest.raises(ValueError, match="input_keys must be a list"):
+        parse('{"content": {"question": "What?"}, "input_keys": "question"}\n', "jsonl")
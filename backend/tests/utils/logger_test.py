@@ -0,0 +1,115 @@
+import io
+import json
+
+from utils.logger import Logger, LogPipeline, _snapshot
+
+
+def make_logger(**kwargs):
+    stream = io.StringIO()
+    pipeline = LogPipeline(stream=stream, **kwargs)
+    return Logger(pipeline=pipeline), pipeline, stream
+
+
+def test_existing_call_sites_keep_working():
+    logger, pipeline, stream = make_logger()
+
+    logger.debug("debug message")
+    logger.success("success", "with arg")
+    logger.info({"key": "value"})
+    logger.error(ValueError("error"))
+    logger.flush()
+    pipeline.close()
+
+    output = stream.getvalue()
+    assert "[DEBUG] debug message" in output
+    assert "[SUCCESS] success with arg" in output
+    assert '"key": "value"' in output
+    assert "[ERROR] error" in output
+
+
+def test_json_output_with_fields_and_truncation():
+    logger, pipeline, stream = make_logger(format="json", max_length=10)
+
+    logger.get_child("websocket.send").success(
+        "Sent message", token="abc", payload={"prompt": "x" * 100}
+    )
+    logger.flush()
+    pipeline.close()
+
+    record = json.loads(stream.getvalue())
+    assert record["level"] == "success"
+    assert record["logger"] == "websocket.send"
+    assert record["message"] == "Sent messa... (2 chars truncated)"
+    assert record["token"] == "abc"
+    assert record["payload"].startswith('{"prompt"')
+    assert record["payload"].endswith("chars truncated)")
+
+
+def test_level_and_sampling():
+    logger, pipeline, stream = make_logger(
+        level="info", sampling={"websocket": 0.0, "websocket.send": 1.0}
+    )
+
+    logger.debug("below level")
+    logger.get_child("websocket.receive").info("sampled out")
+    logger.get_child("websocket.receive").error("errors are never sampled")
+    logger.get_child("websocket.send").info("kept")
+    logger.flush()
+    pipeline.close()
+
+    output = stream.getvalue()
+    assert "below level" not in output
+    assert "sampled out" not in output
+    assert "errors are never sampled" in output
+    assert "kept" in output
+
+
+def test_records_are_snapshotted_when_logged():
+    logger, pipeline, stream = make_logger(format="json")
+    payload = {"status": "before"}
+
+    # the writer thread may format the record after the payload changed
+    logger.info("Payload", payload, payload=payload)
+    payload["status"] = "after"
+    logger.flush()
+    pipeline.close()
+
+    record = json.loads(stream.getvalue())
+    assert record["message"] == 'Payload {"status": "before"}'
+    assert record["payload"] == '{"status": "before"}'
+
+
+def test_snapshot_of_large_payload_is_bounded():
+    payload = {"rows": [{"id": i, "text": "x" * 10} for i in range(100000)]}
+
+    # copied on the logging thread only up to max_length characters
+    snapshot = _snapshot(payload, 100)
+    assert len(snapshot["rows"]) < 10
+    assert snapshot["rows"][-1].endswith("more items)")
+    assert snapshot["rows"][0] == {"id": 0, "text": "x" * 10}
+
+    logger, pipeline, stream = make_logger(format="json", max_length=100)
+    logger.info("Rows", rows=payload)
+    logger.flush()
+    pipeline.close()
+
+    record = json.loads(stream.getvalue())
+    assert record["rows"].startswith('{"rows": [{"id": 0')
+    assert record["rows"].endswith("chars truncated)")
+
+
+def test_dropped_records_are_counted():
+    logger, pipeline, stream = make_logger(queue_size=1)
+    pipeline.close()
+
+    logger.info("queued")
+    logger.info("dropped")
+    logger.info("dropped")
+    assert pipeline._take_dropped() == 2
+    assert pipeline._take_dropped() == 0
+
+
+def test_logger_defaults_to_shared_pipeline():
+    from utils.logger import log_pipeline
+
+    assert Logger("worker").pipeline is log_pipeline
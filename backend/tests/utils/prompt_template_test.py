@@ -0,0 +1,66 @@
+import pytest
+
+from utils.prompt_template import (
+    TemplateSyntax,
+    compile_prompt_template,
+    get_template_variables,
+)
+
+
+def test_fstring_template_matches_str_format():
+    content = "Hello {name}, {{escaped}} {name} is {age} years old."
+    template = compile_prompt_template(content, TemplateSyntax.FSTRING)
+
+    assert template.variables == ("name", "age")
+    inputs = {"name": "Ann", "age": 3}
+    assert template.render(inputs) == content.format(**inputs)
+
+
+def test_fstring_template_with_format_spec():
+    content = "{value:>5}|{value!r}"
+    template = compile_prompt_template(content, TemplateSyntax.FSTRING)
+
+    assert template.variables == ("value",)
+    assert template.render({"value": "a"}) == content.format(value="a")
+
+
+def test_fstring_template_unbalanced_braces():
+    with pytest.raises(ValueError):
+        compile_prompt_template("broken } brace", TemplateSyntax.FSTRING)
+
+
+def test_double_brace_template_keeps_single_braces():
+    content = 'Return JSON like {"answer": ...} for {{question}} ({{question}})'
+    template = compile_prompt_template(content, TemplateSyntax.DOUBLE_BRACE)
+
+    assert template.variables == ("question",)
+    assert (
+        template.render({"question": "why?"})
+        == 'Return JSON like {"answer": ...} for why? (why?)'
+    )
+
+
+def test_missing_variables():
+    template = compile_prompt_template("{{a}} {{b}}", TemplateSyntax.DOUBLE_BRACE)
+
+    assert template.missing_variables({"a": 1}) == ["b"]
+    with pytest.raises(KeyError):
+        template.render({"a": 1})
+
+
+def test_templates_are_cached_by_content():
+    first = compile_prompt_template("{{x}}", TemplateSyntax.DOUBLE_BRACE)
+    second = compile_prompt_template("{{x}}", TemplateSyntax.DOUBLE_BRACE)
+    other_syntax = compile_prompt_template("{{x}}", TemplateSyntax.FSTRING)
+
+    assert first is second
+    assert first is not other_syntax
+    assert other_syntax.variables == ()
+
+
+def test_get_template_variables_keeps_order():
+    templates = [
+        compile_prompt_template("{b} {a}", TemplateSyntax.FSTRING),
+        compile_prompt_template("{a} {c}", TemplateSyntax.FSTRING),
+    ]
+    assert get_template_variables(templates) == ["b", "a", "c"]
@@ -0,0 +1,106 @@
+"""Incremental parsers for dataset uploads"""
+import csv
+import codecs
+import json
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+SAMPLE_INPUT_FILE_FORMATS = ["csv", "jsonl"]
+
+# Columns with special meaning in uploaded files. All other columns are input variables.
+RESERVED_SAMPLE_INPUT_KEYS = ["name", "ground_truth"]
+
+
+def detect_sample_input_file_format(
+    filename: Optional[str], file_format: Optional[str] = None
+) -> Optional[str]:
+    """Resolve the upload format from an explicit value or the file extension."""
+    if file_format:
+        file_format = file_format.lower()
+        return file_format if file_format in SAMPLE_INPUT_FILE_FORMATS else None
+    if not filename:
+        return None
+    extension = filename.rsplit(".", 1)[-1].lower()
+    if extension == "csv":
+        return "csv"
+    if extension in ["jsonl", "ndjson"]:
+        return "jsonl"
+    return None
+
+
+def _to_text(value: Any) -> Optional[str]:
+    """Text of a reserved column, stored as TEXT: None if empty, JSON of other values
+    (e.g. a number ground truth of a JSONL file)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _to_sample_input(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a parsed row into a sample input dict."""
+    if isinstance(row.get("content"), dict):
+        content = row["content"]
+        input_keys = row.get("input_keys") or list(content.keys())
+        if not isinstance(input_keys, list):
+            raise ValueError("input_keys must be a list")
+        input_keys = [str(key) for key in input_keys]
+    else:
+        content = {
+            key: value
+            for key, value in row.items()
+            if key not in RESERVED_SAMPLE_INPUT_KEYS
+        }
+        input_keys = list(content.keys())
+
+    if len(content) == 0:
+        raise ValueError("Sample input has no input variables")
+
+    return {
+        "name": _to_text(row.get("name")),
+        "content": content,
+        "input_keys": input_keys,
+        "ground_truth": _to_text(row.get("ground_truth")),
+    }
+
+
+def _iter_rows(file: BinaryIO, file_format: str) -> Iterator[Dict[str, Any]]:
+    text_file = codecs.getreader("utf-8-sig")(file)
+    if file_format == "csv":
+        reader = csv.DictReader(text_file)
+        for row in reader:
+            # DictReader puts the fields past the header under None
+            if None in row:
+                raise ValueError(
+                    f"Line {reader.line_num} has more fields than the header"
+                )
+            yield row
+    else:
+        for line_number, line in enumerate(text_file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ValueError(f"Invalid JSON in line {line_number}: {error}")
+            if not isinstance(row, dict):
+                raise ValueError(f"Line {line_number} is not a JSON object")
+            yield row
+
+
+def iter_sample_input_batches(
+    file: BinaryIO, file_format: str, batch_size: int = 1000
+) -> Iterator[List[Dict[str, Any]]]:
+    """Parse a CSV/JSONL file lazily and yield sample inputs in batches of batch_size.
+
+    Reads the file synchronously, advance it off the event loop (e.g. asyncio.to_thread).
+    """
+    batch: List[Dict[str, Any]] = []
+    for row in _iter_rows(file, file_format):
+        batch.append(_to_sample_input(row))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
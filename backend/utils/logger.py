@@ -1,42 +1,308 @@
-"""Logger module"""
-import shutil
+"""Logger module
+
+Log records are put in a queue and formatted & written by a background thread,
+so logging never blocks the event loop with stdout writes or JSON formatting. Logged
+containers are copied when logged, so the record doesn't change with the logged objects.
+The copy stops at about LOG_MAX_LENGTH characters, so logging a large payload costs about
+as much as the part of it that is written.
+
+Env vars:
+    LOG_LEVEL: debug | info | success | error (default debug)
+    LOG_FORMAT: text | json (default text)
+    LOG_MAX_LENGTH: messages & fields longer than this are truncated (default 4000, 0 to disable)
+    LOG_SAMPLING: sampling rates per logger name, e.g. "websocket.receive=0.01,websocket=0.1".
+        The longest matching name prefix is used. Errors are never sampled.
+    LOG_QUEUE_SIZE: records dropped while the queue is full (default 10000)
+"""
+import os
+import sys
 import json
+import math
+import queue
+import atexit
+import random
+import threading
 import termcolor
-from typing import Any
+from dotenv import load_dotenv
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, TextIO, Tuple
 
-terminal_width = shutil.get_terminal_size((80, 20)).columns
+load_dotenv()
 
+LEVELS = {"debug": 10, "info": 20, "success": 25, "error": 40}
+LEVEL_COLORS = {"debug": "yellow", "info": "blue", "success": "green", "error": "red"}
+# nesting levels of a logged container copied, deeper ones are logged as "..."
+SNAPSHOT_MAX_DEPTH = 32
 
-class Logger:
-    def debug(self, msg: Any, *args):
-        print(
-            termcolor.colored(
-                "[DEBUG]" + "-" * (int(terminal_width * 0.9) - 1), "yellow"
-            )
+
+def _parse_sampling(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        name, rate = item.split("=", 1)
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def _truncate(text: str, max_length: int) -> str:
+    if max_length and len(text) > max_length:
+        return f"{text[:max_length]}... ({len(text) - max_length} chars truncated)"
+    return text
+
+
+def _to_text(value: Any, indent: Optional[int] = None) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        try:
+            return json.dumps(value, indent=indent, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            pass
+    return str(value)
+
+
+def _snapshot(value: Any, max_length: int) -> Any:
+    """Value to queue for a logged value, taken on the logging thread.
+
+    Scalars & strings as is, containers copied (tuples & sets as lists), anything else as
+    its str. Copying stops once the strings & scalars copied count max_length characters,
+    the items left are replaced by a "... (N more items)" marker: they would be truncated
+    from the formatted record anyway.
+    """
+    left = max_length if max_length else math.inf
+
+    def copy(value: Any, depth: int) -> Any:
+        nonlocal left
+        if value is None or isinstance(value, (bool, int, float)):
+            left -= 1
+            return value
+        if isinstance(value, str):
+            left -= len(value)
+            return value
+        if not isinstance(value, (dict, list, tuple, set, frozenset)):
+            text = str(value)
+            left -= len(text)
+            return text
+        if depth >= SNAPSHOT_MAX_DEPTH:
+            left -= 3
+            return "..."
+        is_dict = isinstance(value, dict)
+        copied: Any = {} if is_dict else []
+        for index, item in enumerate(value.items() if is_dict else value):
+            if left <= 0:
+                marker = f"... ({len(value) - index} more items)"
+                if is_dict:
+                    copied["..."] = marker
+                else:
+                    copied.append(marker)
+                break
+            if is_dict:
+                key, item = item
+                left -= len(str(key))
+                copied[key] = copy(item, depth + 1)
+            else:
+                copied.append(copy(item, depth + 1))
+        return copied
+
+    return copy(value, 0)
+
+
+class LogPipeline:
+    """Queue and background writer thread shared by all loggers."""
+
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        level: str = "debug",
+        format: str = "text",
+        max_length: int = 4000,
+        sampling: Optional[Dict[str, float]] = None,
+        queue_size: int = 10000,
+    ):
+        self.stream = stream
+        self.level = LEVELS.get(level.lower(), LEVELS["debug"])
+        self.format = format.lower()
+        self.max_length = max_length
+        self.sampling = sampling or {}
+        self.dropped = 0
+        # dropped is counted on logging threads, and reset by the writer thread
+        self._dropped_lock = threading.Lock()
+        self._sample_rates: Dict[str, float] = {}
+        self._queue: "queue.Queue[Optional[Tuple]]" = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
         )
-        print(str(msg) + str(*args))
-        print(
-            termcolor.colored(
-                "  " + "-" * (int(terminal_width * 0.9) + 3) + "\n", "yellow"
+        self._thread.start()
+
+    def sample_rate(self, name: str) -> float:
+        if name not in self._sample_rates:
+            matches = [
+                prefix
+                for prefix in self.sampling
+                if name == prefix or name.startswith(prefix + ".")
+            ]
+            self._sample_rates[name] = (
+                self.sampling[max(matches, key=len)] if matches else 1.0
             )
+        return self._sample_rates[name]
+
+    def emit(
+        self, name: str, level: str, msg: Any, args: Tuple, fields: Dict[str, Any]
+    ):
+        """Filter by level & sampling, snapshot, and enqueue. Formatting happens on the
+        writer thread."""
+        if LEVELS[level] < self.level:
+            return
+        if level != "error":
+            rate = self.sample_rate(name)
+            if rate < 1.0 and random.random() >= rate:
+                return
+        record = (
+            datetime.now(timezone.utc),
+            name,
+            level,
+            _snapshot(msg, self.max_length),
+            tuple(_snapshot(arg, self.max_length) for arg in args),
+            {key: _snapshot(value, self.max_length) for key, value in fields.items()},
         )
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
 
-    def success(self, msg: Any, *args):
-        print(termcolor.colored("[SUCCESS] " + str(msg) + str(*args), "green"))
+    def _take_dropped(self) -> int:
+        """Records dropped since the last call."""
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
 
-    def info(self, msg: Any, *args):
-        if any(isinstance(arg, dict) for arg in args) or isinstance(msg, dict):
-            print(
-                termcolor.colored(
-                    "[INFO] " + json.dumps(msg, *args, indent=4, ensure_ascii=False),
-                    "blue",
-                )
-            )
+    def flush(self, timeout: Optional[float] = None):
+        """Wait until queued records are written."""
+        if timeout is None:
+            self._queue.join()
+            return
+        done = threading.Event()
+
+        def wait():
+            self._queue.join()
+            done.set()
+
+        threading.Thread(target=wait, daemon=True).start()
+        done.wait(timeout)
+
+    def format_record(self, record: Tuple) -> str:
+        timestamp, name, level, msg, args, fields = record
+        if self.format == "json":
+            data = {
+                "timestamp": timestamp.isoformat(),
+                "level": level,
+                "logger": name,
+                "message": _truncate(
+                    " ".join(_to_text(part) for part in (msg, *args)), self.max_length
+                ),
+            }
+            for key, value in fields.items():
+                if key in data:
+                    key = f"field_{key}"
+                if isinstance(value, (int, float, bool)) or value is None:
+                    data[key] = value
+                else:
+                    data[key] = _truncate(_to_text(value), self.max_length)
+            dropped = self._take_dropped()
+            if dropped:
+                data["dropped"] = dropped
+            return json.dumps(data, ensure_ascii=False, default=str)
+
+        if level == "info" and isinstance(msg, dict) and not args:
+            text = _to_text(msg, indent=4)
         else:
-            print(termcolor.colored("[INFO] " + str(msg) + str(*args), "blue"))
+            text = " ".join(_to_text(part) for part in (msg, *args))
+        for key, value in fields.items():
+            text += f"\n  - {key}: {_to_text(value)}"
+        line = f"[{level.upper()}] {_truncate(text, self.max_length)}"
+        dropped = self._take_dropped()
+        if dropped:
+            line += f"\n({dropped} log records dropped)"
+        return termcolor.colored(line, LEVEL_COLORS[level])
+
+    def _write(self, records: List[Tuple]):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format_record(record))
+            except Exception as error:
+                lines.append(f"[ERROR] Failed to format log record: {error}")
+        stream = self.stream or sys.stdout
+        try:
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+        except Exception:
+            pass
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            records = [record]
+            # write everything already queued in one go
+            while len(records) < 1000:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in records
+            records = [record for record in records if record is not None]
+            if records:
+                self._write(records)
+            for _ in range(len(records) + (1 if stop else 0)):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def close(self, timeout: float = 2.0):
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+
+class Logger:
+    """msg, args and keyword fields are copied when logged (see _snapshot), and formatted on
+    the writer thread. Logs to log_pipeline unless given another pipeline."""
+
+    def __init__(self, name: str = "app", pipeline: Optional[LogPipeline] = None):
+        self.name = name
+        self.pipeline = pipeline if pipeline is not None else log_pipeline
+
+    def get_child(self, name: str) -> "Logger":
+        """Logger for a code path, e.g. logger.get_child("websocket.receive"). Sampling is configured by name."""
+        return Logger(f"{self.name}.{name}" if self.name != "app" else name, self.pipeline)
+
+    def debug(self, msg: Any, *args, **fields):
+        self.pipeline.emit(self.name, "debug", msg, args, fields)
+
+    def success(self, msg: Any, *args, **fields):
+        self.pipeline.emit(self.name, "success", msg, args, fields)
+
+    def info(self, msg: Any, *args, **fields):
+        self.pipeline.emit(self.name, "info", msg, args, fields)
+
+    def error(self, msg: Any, *args, **fields):
+        self.pipeline.emit(self.name, "error", msg, args, fields)
+
+    def flush(self, timeout: Optional[float] = None):
+        self.pipeline.flush(timeout)
 
-    def error(self, msg: Any, *args):
-        print(termcolor.colored("[Error] " + str(msg) + str(*args), "red"))
 
+log_pipeline = LogPipeline(
+    level=os.environ.get("LOG_LEVEL", "debug"),
+    format=os.environ.get("LOG_FORMAT", "text"),
+    max_length=int(os.environ.get("LOG_MAX_LENGTH", 4000)),
+    sampling=_parse_sampling(os.environ.get("LOG_SAMPLING", "")),
+    queue_size=int(os.environ.get("LOG_QUEUE_SIZE", 10000)),
+)
+atexit.register(log_pipeline.close)
 
-logger = Logger()
+logger = Logger(pipeline=log_pipeline)
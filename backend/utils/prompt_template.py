@@ -0,0 +1,123 @@
+"""Compiled prompt templates.
+
+Prompts are parsed once into literal/variable segments and cached by content,
+so variable extraction and rendering don't re-run regex passes for every run or sample.
+"""
+import re
+from enum import Enum
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# {{variable}} in prompts written in the web dashboard
+DOUBLE_BRACE_PATTERN = re.compile(r"(?<!\\)\{\{([^}]+)\}\}(?<!\\})")
+
+_formatter = Formatter()
+
+
+class TemplateSyntax(str, Enum):
+    FSTRING = "fstring"  # {variable}, {{ and }} are escapes. Used by local (promptmodel SDK) runs
+    DOUBLE_BRACE = "double_brace"  # {{variable}}, other braces are literal. Used by cloud & batch runs
+
+
+class CompiledPromptTemplate:
+    """Parsed prompt template with its variable set and a fast renderer."""
+
+    __slots__ = ("content", "variables", "_segments", "_format_string")
+
+    def __init__(
+        self,
+        content: str,
+        variables: Tuple[str, ...],
+        segments: Tuple[Tuple[str, Optional[str]], ...],
+        format_string: Optional[str] = None,
+    ):
+        self.content = content
+        # variable names in order of first appearance
+        self.variables = variables
+        # (literal, variable name or None)
+        self._segments = segments
+        # set when the template uses format features (conversion, format spec, attribute access)
+        self._format_string = format_string
+
+    def missing_variables(self, inputs: Optional[Dict[str, Any]]) -> List[str]:
+        inputs = inputs or {}
+        return [variable for variable in self.variables if variable not in inputs]
+
+    def render(self, inputs: Dict[str, Any]) -> str:
+        """Render the template. Raises KeyError on a missing variable, like str.format."""
+        if self._format_string is not None:
+            return self._format_string.format(**inputs)
+        return "".join(
+            literal if name is None else literal + str(inputs[name])
+            for literal, name in self._segments
+        )
+
+
+def _compile_fstring(content: str) -> CompiledPromptTemplate:
+    segments = []
+    variables = []
+    needs_format = False
+    for literal, field_name, format_spec, conversion in _formatter.parse(content):
+        if field_name is None:
+            segments.append((literal, None))
+            continue
+        name = re.split(r"[.\[]", field_name, maxsplit=1)[0]
+        if name != field_name or format_spec or conversion or not name:
+            needs_format = True
+        if name not in variables:
+            variables.append(name)
+        segments.append((literal, name))
+
+    return CompiledPromptTemplate(
+        content=content,
+        variables=tuple(variables),
+        segments=tuple(segments),
+        format_string=content if needs_format else None,
+    )
+
+
+def _compile_double_brace(content: str) -> CompiledPromptTemplate:
+    # re.split alternates literal text and captured variable names
+    parts = DOUBLE_BRACE_PATTERN.split(content)
+    segments = []
+    variables = []
+    for i in range(0, len(parts) - 1, 2):
+        name = parts[i + 1]
+        if name not in variables:
+            variables.append(name)
+        segments.append((parts[i], name))
+    segments.append((parts[-1], None))
+
+    return CompiledPromptTemplate(
+        content=content,
+        variables=tuple(variables),
+        segments=tuple(segments),
+    )
+
+
+@lru_cache(maxsize=4096)
+def compile_prompt_template(
+    content: str, syntax: TemplateSyntax = TemplateSyntax.FSTRING
+) -> CompiledPromptTemplate:
+    """Compile prompt content. Results are cached by (content, syntax).
+
+    Raises ValueError if an FSTRING template has unbalanced braces.
+    """
+    if syntax == TemplateSyntax.DOUBLE_BRACE:
+        return _compile_double_brace(content)
+    return _compile_fstring(content)
+
+
+def compile_prompt_templates(
+    contents: Sequence[str], syntax: TemplateSyntax = TemplateSyntax.FSTRING
+) -> List[CompiledPromptTemplate]:
+    return [compile_prompt_template(content, syntax) for content in contents]
+
+
+def get_template_variables(templates: Sequence[CompiledPromptTemplate]) -> List[str]:
+    """Union of template variables, in order of first appearance."""
+    variables: Dict[str, None] = {}
+    for template in templates:
+        variables.update(dict.fromkeys(template.variables))
+    return list(variables)
@@ -0,0 +1,42 @@
+"""Helpers of optional stores with pluggable backends (caches, presence, rate limits).
+
+Such stores are best-effort, their public methods are wrapped with store_errors: an error
+of the backend (e.g. Redis unreachable) is logged, and the method returns a fallback value
+(a miss, nothing to do, a call let through) instead of failing the request it serves.
+The backend is picked by an env var with select_backend.
+"""
+import functools
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from utils.logger import logger
+
+T = TypeVar("T")
+
+
+def store_errors(action: str, default: Any = None):
+    """Log errors of a store method as "Error {action}", and return default instead.
+
+    A callable default (e.g. set) is called for a new fallback value per error.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await method(*args, **kwargs)
+            except Exception as error:
+                logger.error(f"Error {action}: {error}")
+                return default() if callable(default) else default
+
+        return wrapper
+
+    return decorator
+
+
+def select_backend(
+    name: str, backends: Dict[str, Callable[[], T]], default: Optional[str] = None
+) -> Optional[T]:
+    """Create the backend called name, or the default one. None if there is neither
+    (the store is disabled)."""
+    factory = backends.get(name.lower()) or backends.get(default)
+    return factory() if factory is not None else None
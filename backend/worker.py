@@ -0,0 +1,73 @@
+"""Weavelapps batch run worker entry point.
+
+Runs the batch runs enqueued by the web server with BATCH_RUN_QUEUE=redis. Run as many
+workers as needed, on any hosts sharing the Redis & the database:
+
+    python worker.py
+
+Env vars:
+    BATCH_RUN_WORKER_NAME: consumer name, unique per worker (default hostname-pid)
+    BATCH_RUN_WORKER_METRICS_PORT: port of the Prometheus metrics (not served if unset)
+"""
+import os
+import signal
+import socket
+import asyncio
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+from prometheus_client import start_http_server
+
+from utils.logger import logger
+from base.database import engine
+from modules.batch_run_queue import batch_run_queue
+from modules.tokenizer import tokenizer_service, TOKENIZER_PRELOAD_MODELS
+from api.common.models import FunctionModelBatchRunConfig
+from api.web.routers.web_batch import (
+    function_model_batch_run_background_task,
+    mark_batch_run_failed,
+)
+
+load_dotenv()
+
+
+async def run_job(job: Dict[str, Any]) -> None:
+    await function_model_batch_run_background_task(
+        FunctionModelBatchRunConfig(**job["batch_run_config"]), job["batch_run_uuid"]
+    )
+
+
+async def drop_job(job: Dict[str, Any]) -> None:
+    await mark_batch_run_failed(job["batch_run_uuid"])
+
+
+async def main() -> None:
+    if batch_run_queue is None:
+        raise SystemExit("Batch run workers need BATCH_RUN_QUEUE=redis")
+
+    consumer = os.environ.get(
+        "BATCH_RUN_WORKER_NAME", f"{socket.gethostname()}-{os.getpid()}"
+    )
+    metrics_port = os.environ.get("BATCH_RUN_WORKER_METRICS_PORT")
+    if metrics_port:
+        start_http_server(int(metrics_port))
+    await tokenizer_service.preload(TOKENIZER_PRELOAD_MODELS)
+
+    worker = asyncio.create_task(batch_run_queue.run_worker(consumer, run_job, drop_job))
+    # on deploys, stop taking jobs, running jobs resume on another worker after their lease
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.cancel)
+
+    logger.info(f"Batch run worker {consumer} started")
+    try:
+        await worker
+    except asyncio.CancelledError:
+        logger.info(f"Batch run worker {consumer} stopped")
+    finally:
+        tokenizer_service.shutdown()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())